@@ -1,55 +1,169 @@
-from flask import Flask, jsonify, request, make_response
-import redis
+from flask import Blueprint, Flask, Response, current_app, jsonify, request, make_response, stream_with_context
+from werkzeug.local import LocalProxy
+from collections import Counter
+import functools
+import json
+import threading
+import time
 import yaml
-from pymongo import MongoClient
-from pymongo.errors import ServerSelectionTimeoutError
+from pymongo.errors import PyMongoError
+from redis.exceptions import RedisError
 
 from utils import dbutils
 from utils import stats_utils
 from utils import logging_utils
 from utils import redis_utils
+from utils import connection_utils
+from utils import index_utils
+from utils import bulk_utils
+from utils import roundtrip_utils
+from utils import entity_cache
+from utils import stats_cache
+from utils import change_stream_utils
+from utils import listing_utils
+from utils import export_utils
+from utils import write_behind_utils
+from utils import metrics_utils
+from utils import profiling_utils
+from utils import api_utils
 import logging
 
-# create flask app
-app = Flask(__name__)
-
-# load configuration
-config = yaml.load(open('config.yml'), Loader=yaml.Loader)
+# api routes, registered on the app by create_app
+api = Blueprint('api', __name__)
 
 # instantiate logger
 logger = logging.getLogger(__name__)
 
-# create mongo client
-mongo_client = MongoClient(**config['mongo'])
-
-# setup caching structures
-redis_client = redis.Redis(host=config['redis']['host'], port=config['redis']['port'])
-redis_utils.setup_caching_struct(redis_client)
-
-
-@app.route('/', methods=['GET'])
-def main_page():
-    # test connection to redis
-    r = redis.Redis(host=config['redis']['host'], port=config['redis']['port'])
+# configuration and clients of the current app and worker process. the clients are
+# created on first use in every worker (see connection_utils), never at import time.
+config = LocalProxy(lambda: current_app.config['SCHOOL'])
+mongo_client = LocalProxy(lambda: connection_utils.get_mongo_client(current_app.config['SCHOOL']))
+redis_client = LocalProxy(lambda: connection_utils.get_redis_client(current_app.config['SCHOOL']))
+
+# seconds between attempts to bootstrap the db and caches while they are unreachable
+BOOTSTRAP_RETRY_INTERVAL = 5
+
+
+def load_config(path: str = 'config.yml'):
+    return yaml.load(open(path), Loader=yaml.Loader)
+
+
+def bootstrap(app_config: dict):
+    """
+    create the db indexes and the leaderboards if they are missing, retrying
+    until mongo and redis are reachable. runs in a background thread of every worker
+    so startup never blocks on them.
+    """
+    while True:
+        try:
+            mongo = connection_utils.get_mongo_client(app_config)
+            index_utils.ensure_indexes(mongo)
+            redis_utils.setup_caching_struct(connection_utils.get_redis_client(app_config),
+                                             stats_utils.get_all_averages(mongo))
+            logger.info("bootstrapped db indexes and caches.")
+            return
+        except (PyMongoError, RedisError) as e:
+            logger.info("bootstrap failed, retrying in %s seconds. error: %s", BOOTSTRAP_RETRY_INTERVAL, e)
+            time.sleep(BOOTSTRAP_RETRY_INTERVAL)
+
+
+def create_app(config_path: str = 'config.yml'):
+    """
+    application factory. the clients are created lazily per worker process, so the
+    app can be served by a pre-fork server (see gunicorn.conf.py).
+    """
+    app = Flask(__name__)
+    app.config['SCHOOL'] = load_config(config_path)
+    logging_utils.configure(**app.config['SCHOOL']['logging'])
+    entity_cache.configure(**app.config['SCHOOL']['entity_cache'])
+    stats_cache.configure(**app.config['SCHOOL']['stats_cache'])
+    change_stream_utils.configure(app.config['SCHOOL']['change_streams']['enabled'])
+    profiling_utils.configure(**app.config['SCHOOL']['profiling'])
+    if profiling_utils.enabled():
+        profiling_utils.instrument(dbutils, stats_utils, redis_utils)
+        threading.Thread(target=profiling_utils.report_slow_requests, name='slow-requests', daemon=True).start()
+    app.register_blueprint(api)
+    threading.Thread(target=bootstrap, args=(app.config['SCHOOL'],), name='bootstrap', daemon=True).start()
+    if stats_cache.enabled():
+        threading.Thread(target=stats_cache.listen, args=(connection_utils.get_redis_client(app.config['SCHOOL']),),
+                         name='stats-cache', daemon=True).start()
+    if app.config['SCHOOL']['warmer']['enabled']:
+        threading.Thread(target=warm_caches, args=(app,), name='warmer', daemon=True).start()
+    return app
+
+
+@api.before_app_request
+def count_round_trips():
+    roundtrip_utils.start_counting()
+    entity_cache.start_request()
+    if config['metrics']['enabled']:
+        metrics_utils.start_request()
+    if profiling_utils.enabled():
+        profiling_utils.start_request(request.headers, request.args)
+
+
+@api.after_app_request
+def report_round_trips(response):
+    # a streamed response reports the round trips made before it started streaming
+    round_trips = roundtrip_utils.round_trips()
+    response.headers[roundtrip_utils.ROUND_TRIPS_HEADER] = str(round_trips)
+    logger.info("%s %s status: %s, db round trips: %s", request.method, request.path, response.status_code, round_trips)
+    if config['metrics']['enabled']:
+        metrics_utils.observe_request(request.url_rule, request.method, response.status_code)
+    if profiling_utils.enabled():
+        report_profile(response)
+    return response
+
+
+def report_profile(response):
+    """
+    summarize the spans of a traced request in its Server-Timing header, and write a
+    slow request to the slow log with the plan of its slowest query, from the reporter thread.
+    """
+    profile = profiling_utils.finish_request()
+    if profile is None:
+        return
+    if profile.traced:
+        response.headers[profiling_utils.SERVER_TIMING_HEADER] = profiling_utils.server_timing(profile)
+    if profiling_utils.is_slow(profile):
+        profiling_utils.queue_slow_request(profile, request.method, request.path, response.status_code, mongo_client)
+    return
+
+
+def respond(result: tuple):
+    """
+    the json response of a (body, status) shaped by api_utils.
+    """
+    body, status = result
+    return make_response(jsonify(body), status)
+
+
+@api.route('/healthz', methods=['GET'])
+def liveness():
+    # the process is up and serving requests, no io is done
+    return make_response(jsonify({'status': 'ok'}), 200)
+
+
+@api.route('/', methods=['GET'])
+@api.route('/readyz', methods=['GET'])
+def readiness():
+    # ready only if both mongo and redis answer a ping
+    status = {}
     try:
-        ret = r.mset({'test': 'checking redis, if this returns, success!'})
-    except ConnectionError:
-        ret = False
-    r.close()
-
-    # test connection to mongodb
+        mongo_client.admin.command('ping')
+        status['mongo'] = 'on'
+    except PyMongoError:
+        status['mongo'] = 'error'
     try:
-        # The ismaster command is cheap and does not require auth.
-        mongo_client.admin.command('ismaster')
-        status = True
-    except ConnectionError:
-        status = False
-
-    # return html showing status of mongo and redis
-    return f"<b>redis</b>: {'on' if ret else 'error'}<br><b>mongo:</b> {'on' if status else 'error'}"
+        redis_client.ping()
+        status['redis'] = 'on'
+    except RedisError:
+        status['redis'] = 'error'
+    ready = all(v == 'on' for v in status.values())
+    return make_response(jsonify(status), 200 if ready else 503)
 
 
-@app.route('/students', methods=['POST'])
+@api.route('/students', methods=['POST'])
 def create_student():
     # unpack student params from request
     id_num, first_name, last_name, email = dbutils.unpack_student_create_params(request)
@@ -57,35 +171,52 @@ def create_student():
     # validate params
     is_valid = dbutils.validate_student_creation_params(id_num, first_name, last_name, email)
     if not is_valid:
-        return make_response(jsonify({'error': 'invalid data was given for creating a student.'}), 404)
+        return respond(api_utils.invalid_student())
 
-    # create the student
+    # create the student, a student without grades can't affect any cached statistic
     new_student = dbutils.create_student(id_num, first_name, last_name, email, mongo_client)
-    if new_student is None:
-        return make_response(jsonify({'error': 'given id for student already exists.'}, 404))
-    else:
-        logger.info(f"creating student: {id_num}, invalidating caches.")
-        redis_utils.invalidate_all_caches(redis_client)
-        return make_response(jsonify({'new_student_id': id_num}), 200)
+    if new_student is not None:
+        logger.info("creating student: %s.", id_num)
+    return respond(api_utils.student_created(id_num, new_student))
 
 
-@app.route('/students', methods=['GET'])
+@api.route('/students', methods=['GET'])
 def get_student():
-    # unpack student id from body
-    id_num = int(request.args.get('id_number', None))
+    # a batch lookup of the given ids
+    if 'ids' in request.args:
+        ids = dbutils.unpack_id_list(request.args['ids'], config['multi_get']['max_ids'])
+        return batch_response(ids, lambda ids: dbutils.get_students(ids, mongo_client, redis_client))
+
+    # unpack student id from body, list the students if it isn't given
+    id_num = request.args.get('id_number', None)
     if id_num is None:
-        return make_response(jsonify({'error': 'student id was not given in url.'}), 404)
+        return list_response('students')
+    id_num = api_utils.unpack_url_id(id_num)
+    if id_num is None:
+        return respond(api_utils.invalid_url_id('id_number'))
 
     # get student from db
-    requested_student = dbutils.get_student(id_num, mongo_client)
-    if requested_student:
-        requested_student['_id'] = str(requested_student['_id'])
-        return make_response(jsonify(requested_student), 200)
-    else:
-        return make_response(jsonify({'error': f'student with given id: {id_num} was not found.'}), 404)
+    requested_student = dbutils.get_student(id_num, mongo_client, redis_client)
+    return respond(api_utils.student_found(id_num, requested_student))
+
+
+def batch_response(ids, get_many):
+    if ids is None:
+        return respond(api_utils.invalid_ids(config['multi_get']['max_ids']))
+    return respond((api_utils.batch_results(ids, get_many(ids)), 200))
 
 
-@app.route('/students', methods=['PUT'])
+def list_response(collection: str):
+    """
+    a page of the listing of a collection, see listing_utils.
+    """
+    params = listing_utils.unpack_listing_params(collection, request.args, **config['listing'])
+    if params is None:
+        return respond(api_utils.invalid_listing(collection))
+    return respond((listing_utils.list_page(collection, **params, client=mongo_client), 200))
+
+
+@api.route('/students', methods=['PUT'])
 def update_student():
     # unpack student params from request
     id_num, new_params = dbutils.unpack_student_modify_params(request)
@@ -93,36 +224,34 @@ def update_student():
     # validate params
     is_valid = dbutils.validate_student_modification_params(id_num, new_params, mongo_client)
     if not is_valid:
-        return make_response(jsonify({'error': 'invalid data was given for creating a student.'}), 404)
+        return respond(api_utils.invalid_student())
 
     # update the student
-    updated_student = dbutils.update_student(id_num, new_params, mongo_client)
+    updated_student = dbutils.update_student(id_num, new_params, mongo_client, redis_client, config['cascade']['transactions'])
     if updated_student:
-        updated_student['_id'] = str(updated_student['_id'])
-        redis_utils.invalidate_all_caches(redis_client)
-        logger.info(f"updating student: {id_num}, invalidating cache.")
-        return make_response(jsonify(updated_student), 200)
-    else:
-        return make_response(jsonify({'error': f'student with given id: {id_num} was not found.'}), 404)
+        if not change_stream_utils.enabled():
+            redis_utils.invalidate_dependents(redis_client, students=[id_num, updated_student['id_number']])
+        logger.info("updating student: %s, invalidating dependent caches.", id_num)
+    return respond(api_utils.student_updated(id_num, updated_student))
 
 
-@app.route('/students', methods=['DELETE'])
+@api.route('/students', methods=['DELETE'])
 def delete_student():
-    id_num = request.json.get('id_number', None)
-    if id_num is None:  # attempting id doesn't exist
-        return make_response(jsonify({'error': 'student id was not given'}), 404)
+    ids = api_utils.unpack_ids(request.json, 'id_number')
+    if ids is None:  # attempting id doesn't exist
+        return respond(api_utils.student_id_not_given())
+    id_num, = ids
 
     # delete the student, his grades and his enrollment.
-    deleted = dbutils.delete_student(id_num, mongo_client)
+    deleted = dbutils.delete_student(id_num, mongo_client, redis_client, config['cascade']['transactions'])
     if deleted:
-        redis_utils.invalidate_all_caches(redis_client)
-        logger.info(f"deleting student: {id_num}, invalidating cache.")
-        return make_response(jsonify({'deleted_student_id:': id_num}), 200)
-    else:
-        return make_response(jsonify({'error': f'student with given id: {id_num} was not found.'}), 404)
+        if not change_stream_utils.enabled():
+            redis_utils.invalidate_dependents(redis_client, students=[id_num])
+        logger.info("deleting student: %s, invalidating dependent caches.", id_num)
+    return respond(api_utils.student_deleted(id_num, deleted))
 
 
-@app.route('/courses', methods=['POST'])
+@api.route('/courses', methods=['POST'])
 def create_course():
     # unpack params
     course_id, name, students = dbutils.unpack_course_creation_params(request)
@@ -130,33 +259,39 @@ def create_course():
     # validate params
     is_valid = dbutils.validate_course_creation_params(course_id, name, students, mongo_client)
     if not is_valid:
-        return make_response(jsonify({'error': 'invalid data was given for creating a course'}), 404)
+        return respond(api_utils.invalid_course())
 
     # create course
     new_course = dbutils.create_course(course_id, name, students, mongo_client)
-    if new_course is None:
-        return make_response(jsonify({'error': 'given id for course already exists'}), 404)
-    else:
-        logger.info(f"created new course: {new_course['course_id']}")
-        return make_response(jsonify({'new_course_id': new_course['course_id']}))
+    if new_course is not None:
+        logger.info("created new course: %s", new_course['course_id'])
+    return respond(api_utils.course_created(new_course))
 
 
-@app.route('/courses', methods=['GET'])
+@api.route('/courses', methods=['GET'])
 def get_course():
-    # unpack student id from body
-    course_id = int(request.args.get('course_id', None))
+    if 'ids' in request.args:
+        ids = dbutils.unpack_id_list(request.args['ids'], config['multi_get']['max_ids'])
+        return batch_response(ids, lambda ids: dbutils.get_courses(ids, mongo_client, redis_client))
+
+    # unpack course id from body, list the courses if it isn't given
+    course_id = request.args.get('course_id', None)
     if course_id is None:
-        return make_response(jsonify({'error': 'course id was not given in url'}), 404)
+        return list_response('courses')
+    course_id = api_utils.unpack_url_id(course_id)
+    if course_id is None:
+        return respond(api_utils.invalid_url_id('course_id'))
+
+    page = api_utils.unpack_students_page(request.args, **config['enrollment'])
+    if page is None:
+        return respond(api_utils.invalid_students_page())
 
-    requested_course = dbutils.get_course(course_id, mongo_client)
-    if requested_course:
-        requested_course['_id'] = str(requested_course['_id'])
-        return make_response(jsonify(requested_course), 200)
-    else:
-        return make_response(jsonify({'error': f'course with id {course_id} was not found.'}), 404)
+    requested_course = dbutils.get_course(course_id, mongo_client, redis_client)
+    students = dbutils.get_course_students(course_id, mongo_client, page[0], page[1] + 1) if requested_course else None
+    return respond(api_utils.course_found(course_id, requested_course, students, page[1]))
 
 
-@app.route('/courses', methods=['PUT'])
+@api.route('/courses', methods=['PUT'])
 def update_course():
     # unpack params
     course_id, new_params = dbutils.unpack_course_modification_params(request)
@@ -164,36 +299,62 @@ def update_course():
     # validate params
     is_valid = dbutils.validate_course_modification_params(course_id, new_params, mongo_client)
     if not is_valid:
-        return make_response(jsonify({'error': 'invalid data was given for creating a course'}), 404)
+        return respond(api_utils.invalid_course())
 
     # update course
-    updated_course = dbutils.update_course(course_id, new_params, mongo_client)
+    updated_course = dbutils.update_course(course_id, new_params, mongo_client, redis_client, config['cascade']['transactions'])
     if updated_course:
-        updated_course['_id'] = str(updated_course['_id'])
-        redis_utils.invalidate_all_caches(redis_client)
-        logger.info(f"updating course: {course_id}, invalidating cache.")
-        return make_response(jsonify(updated_course), 200)
-    else:
-        return make_response(jsonify({'error': f'course with id {course_id} was not found.'}), 404)
+        if not change_stream_utils.enabled():
+            redis_utils.invalidate_dependents(redis_client, courses=[course_id])
+        logger.info("updating course: %s, invalidating dependent caches.", course_id)
+    return respond(api_utils.course_updated(course_id, updated_course))
 
 
-@app.route('/courses', methods=['DELETE'])
+@api.route('/courses', methods=['DELETE'])
 def delete_course():
     # unpack course id from request
-    course_id = request.json.get('course_id', None)
-    if course_id is None:
-        return make_response(jsonify({'error': 'course id was not given'}), 404)
+    ids = api_utils.unpack_ids(request.json, 'course_id')
+    if ids is None:
+        return respond(api_utils.course_id_not_given())
+    course_id, = ids
 
-    deleted = dbutils.delete_course(course_id, mongo_client)
+    deleted = dbutils.delete_course(course_id, mongo_client, redis_client, config['cascade']['transactions'])
     if deleted:
-        redis_utils.invalidate_all_caches(redis_client)
-        logger.info(f"deleting course: {course_id}, invalidating cache.")
-        return make_response(jsonify({'deleted_course_id': course_id}))
-    else:
-        return make_response(jsonify({'error': f'course with id {course_id} was not found.'}), 404)
+        if not change_stream_utils.enabled():
+            redis_utils.invalidate_dependents(redis_client, courses=[course_id])
+        logger.info("deleting course: %s, invalidating dependent caches.", course_id)
+    return respond(api_utils.course_deleted(course_id, deleted))
+
+
+@api.route('/courses/<int:course_id>/students', methods=['POST'])
+def enroll_student(course_id):
+    student_id = dbutils.unpack_enrollment_params(request)
+    if not dbutils.validate_enrollment_params(course_id, student_id, mongo_client):
+        return respond(api_utils.invalid_enrollment())
+
+    enrolled = dbutils.enroll_student(course_id, student_id, mongo_client)
+    if enrolled:
+        if not change_stream_utils.enabled():
+            redis_utils.invalidate_dependents(redis_client, courses=[course_id])
+        logger.info("enrolled student: %s in course: %s, invalidating dependent caches.", student_id, course_id)
+    return respond(api_utils.student_enrolled(course_id, student_id, enrolled))
 
 
-@app.route('/grades', methods=['POST'])
+@api.route('/courses/<int:course_id>/students', methods=['DELETE'])
+def unenroll_student(course_id):
+    student_id = dbutils.unpack_enrollment_params(request)
+    if not isinstance(student_id, int):
+        return respond(api_utils.student_id_not_given())
+
+    unenrolled = dbutils.unenroll_student(course_id, student_id, mongo_client, redis_client, config['cascade']['transactions'])
+    if unenrolled:
+        if not change_stream_utils.enabled():
+            redis_utils.invalidate_dependents(redis_client, courses=[course_id])
+        logger.info("unenrolled student: %s from course: %s, invalidating dependent caches.", student_id, course_id)
+    return respond(api_utils.student_unenrolled(course_id, student_id, unenrolled))
+
+
+@api.route('/grades', methods=['POST'])
 def create_grade():
     # unpack
     student_id, course_id, grade = dbutils.unpack_grade_creation_params(request)
@@ -201,36 +362,48 @@ def create_grade():
     # validate params
     is_valid = dbutils.validate_grade_creation_params(student_id, course_id, grade, mongo_client)
     if not is_valid:
-        return make_response(jsonify({'error': 'invalid data was given for creating a grade.'}), 404)
+        return respond(api_utils.invalid_grade())
+
+    # in write-behind mode the grade is queued, and inserted by the consumers in batches
+    if config['write_behind']['enabled']:
+        grade_doc = {'student_id': student_id, 'course_id': course_id, 'grade': grade}
+        ticket = write_behind_utils.enqueue_grade(grade_doc, redis_client, config['write_behind']['ticket_ttl'])
+        return respond(api_utils.grade_queued(ticket, write_behind_utils.QUEUED))
+
+    # create the grade, the leaderboards are patched by the write, cached leaders are checked against them
+    new_grade = dbutils.create_grade(student_id, course_id, grade, mongo_client, redis_client, config['cascade']['transactions'])
+    if new_grade is not None:
+        logger.info("new grade was created, sid: %s, cid: %s.", student_id, course_id)
+    return respond(api_utils.grade_created(student_id, course_id, new_grade))
+
 
-    # create the student
-    new_grade = dbutils.create_grade(student_id, course_id, grade, mongo_client)
-    if new_grade is None:
-        return make_response(jsonify({'error': 'given id for grade already exists.'}, 404))
-    else:
-        redis_utils.invalidate_all_caches(redis_client)
-        logger.info(f"new grade was created, sid: {student_id}, cid: {course_id}. invalidating cache.")
-        return make_response(jsonify({'new_grade_student_id': student_id, 'new_grade_course_id': course_id}), 200)
+@api.route('/grades/tickets/<ticket>', methods=['GET'])
+def get_grade_ticket(ticket):
+    # the status of a grade queued in write-behind mode
+    return respond(api_utils.ticket_found(ticket, write_behind_utils.get_ticket(ticket, redis_client)))
 
 
-@app.route('/grades', methods=['GET'])
+@api.route('/grades', methods=['GET'])
 def get_grade():
-    # unpack grade identifiers
-    course_id = int(request.args.get('course_id', None))
-    student_id = int(request.args.get('student_id', None))
+    if 'pairs' in request.args:
+        pairs = dbutils.unpack_grade_pairs(request.args['pairs'], config['multi_get']['max_ids'])
+        return batch_response(pairs, lambda pairs: dbutils.get_grades(pairs, mongo_client, redis_client))
+
+    # unpack grade identifiers, list the grades of the course or the student if either isn't given
+    course_id = request.args.get('course_id', None)
+    student_id = request.args.get('student_id', None)
+    if course_id is None or student_id is None:
+        return list_response('grades')
+    course_id, student_id = api_utils.unpack_url_id(course_id), api_utils.unpack_url_id(student_id)
     if course_id is None or student_id is None:
-        return make_response(jsonify({'error': 'course and student id were not given in url.'}), 404)
+        return respond(api_utils.invalid_url_id('course_id or student_id'))
 
     # get the grade
-    requested_grade = dbutils.get_grade(student_id, course_id, mongo_client)
-    if requested_grade:
-        requested_grade['_id'] = str(requested_grade['_id'])
-        return make_response(jsonify(requested_grade), 200)
-    else:
-        return make_response(jsonify({'error': f'grade with student id {student_id} and course id {course_id} was not found.'}), 404)
+    requested_grade = dbutils.get_grade(student_id, course_id, mongo_client, redis_client)
+    return respond(api_utils.grade_found(student_id, course_id, requested_grade))
 
 
-@app.route('/grades', methods=['PUT'])
+@api.route('/grades', methods=['PUT'])
 def update_grade():
     # unpack params
     current_sid, current_cid, new_params = dbutils.unpack_grade_modification_params(request)
@@ -238,80 +411,305 @@ def update_grade():
     # validate params
     is_valid = dbutils.validate_grade_modification_params(current_sid, current_cid, new_params, mongo_client)
     if not is_valid:
-        return make_response(jsonify({'error': 'invalid data was given for updating a grade.'}), 404)
+        return respond(api_utils.invalid_grade_update())
 
     # update grade
-    updated_grade = dbutils.update_grade(current_sid, current_sid, new_params, mongo_client)
+    updated_grade = dbutils.update_grade(current_sid, current_cid, new_params, mongo_client, redis_client, config['cascade']['transactions'])
     if updated_grade:
-        updated_grade['_id'] = str(updated_grade['_id'])
-        redis_utils.invalidate_all_caches(redis_client)
-        logger.info(f"updating grade, invalidating cache. sid: {updated_grade['student_id']}, cid: {updated_grade['course_id']}")
-        return make_response(jsonify(updated_grade), 200)
-    else:
-        return make_response(jsonify({'error': f'grade with sid: {current_sid} and cid: {current_cid} was not found.'}), 404)
+        logger.info("updating grade. sid: %s, cid: %s", updated_grade['student_id'], updated_grade['course_id'])
+    return respond(api_utils.grade_updated(current_sid, current_cid, updated_grade))
 
 
-@app.route('/grades', methods=['DELETE'])
+@api.route('/grades', methods=['DELETE'])
 def delete_grade():
     # unpack student and course id
-    student_id = request.json.get('student_id', None)
-    course_id = request.json.get('course_id', None)
-    if student_id is None or course_id is None:
-        return make_response(jsonify({'error': 'student and course ids were not given.'}))
+    ids = api_utils.unpack_ids(request.json, 'student_id', 'course_id')
+    if ids is None:
+        return respond(api_utils.grade_ids_not_given())
+    student_id, course_id = ids
 
     # delete the grade
-    deleted = dbutils.delete_grade(student_id, course_id, mongo_client)
+    deleted = dbutils.delete_grade(student_id, course_id, mongo_client, redis_client, config['cascade']['transactions'])
     if deleted:
-        # invalidate cache
-        redis_utils.invalidate_all_caches(redis_client)
-        logger.info(f"deleting grade, sid: {student_id}, cid: {course_id}, invalidating cache.")
-        return make_response(jsonify({'deleted_grade_sid': student_id, 'deleted_grade_cid': course_id}), 200)
-    else:
-        return make_response(jsonify({'error': f'grade with sid: {student_id} and cid: {course_id} was not found.'}), 404)
+        logger.info("deleting grade, sid: %s, cid: %s.", student_id, course_id)
+    return respond(api_utils.grade_deleted(student_id, course_id, deleted))
+
+
+def bulk_response(insert_chunk):
+    """
+    run insert_chunk over the items of a bulk request, chunk by chunk. a json array
+    body gets a json response with the results of all items. an ndjson body is read
+    as a stream, and gets an ndjson response with a result line per item as its
+    chunk is written, followed by a summary line.
+    """
+    chunk_size = config['bulk']['chunk_size']
+    if request.mimetype == bulk_utils.NDJSON:
+        def generate():
+            counts, index = Counter(), 0
+            for chunk in bulk_utils.chunks(bulk_utils.parse_ndjson(request.stream), chunk_size):
+                for result in insert_chunk(chunk):
+                    counts[result['status']] += 1
+                    yield json.dumps({'index': index, **result}) + '\n'
+                    index += 1
+            yield json.dumps({'summary': counts}) + '\n'
+        return Response(stream_with_context(generate()), mimetype=bulk_utils.NDJSON)
+
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        return respond(api_utils.invalid_bulk())
+    results = [result for chunk in bulk_utils.chunks(items, chunk_size) for result in insert_chunk(chunk)]
+    return respond((api_utils.bulk_results(results), 200))
+
+
+@api.route('/students/bulk', methods=['POST'])
+def create_students():
+    return bulk_response(lambda chunk: bulk_utils.insert_students(chunk, mongo_client))
+
+
+@api.route('/courses/bulk', methods=['POST'])
+def create_courses():
+    return bulk_response(lambda chunk: bulk_utils.insert_courses(chunk, mongo_client))
+
+
+@api.route('/grades/bulk', methods=['POST'])
+def create_grades():
+    # the leaderboards are patched once per chunk, cached leaders are checked against them
+    return bulk_response(lambda chunk: bulk_utils.insert_grades(chunk, mongo_client, redis_client))
+
+
+@api.route('/export/<collection>', methods=['GET'])
+def export_collection(collection):
+    """
+    stream a collection (students, courses, grades or enrollments) as ndjson or csv,
+    gzipped if the client accepts it.
+    """
+    params = export_utils.unpack_export_params(collection, request.args)
+    if params is None:
+        return respond(api_utils.invalid_export(collection))
+    compress = 'gzip' in request.accept_encodings
+    data = export_utils.export(collection, **params, compress=compress, client=mongo_client, **config['export'])
+    return Response(stream_with_context(data), mimetype=export_utils.CONTENT_TYPES[params['fmt']],
+                    headers=api_utils.export_headers(collection, params['fmt'], compress))
+
+
+def cached_stats(view):
+    """
+    serve a statistics endpoint from the stats cache of the worker. fresh successful
+    responses are cached until the statistics generation changes.
+    """
+    @functools.wraps(view)
+    def cached_view(**view_args):
+        body = stats_cache.lookup(request.full_path)
+        if body is not None:
+            return Response(body, 200, mimetype='application/json')
+        # read before computing, so a response that raced a change is never cached as current
+        generation = stats_cache.generation()
+        response = view(**view_args)
+        if response.status_code == 200 and 'Warning' not in response.headers:
+            stats_cache.store(request.full_path, generation, response.get_data())
+        return response
+    return cached_view
+
+
+def stats_response(document, staleness):
+    """
+    build the response of a statistics endpoint, marking documents served stale
+    while they are recomputed.
+    """
+    response = make_response(jsonify(document), 200)
+    if staleness is not None:
+        response.headers['Warning'] = '110 - "Response is Stale"'
+        response.headers['Age'] = str(int(staleness))
+    return response
+
+
+def rebuild_lost_leaderboards(get_leader_id):
+    """
+    called when a leaderboard is empty. rebuilds the leaderboards from the grade
+    aggregates if they have grades (redis lost its data), with a single worker
+    rebuilding at a time. returns False if there are no grades at all.
+    """
+    if get_leader_id(mongo_client) is None:
+        return False
+    token = redis_utils.acquire_lock('leaderboards', config['cache']['lock_timeout'], redis_client)
+    if token is not None:
+        try:
+            logger.info("leaderboards are missing, rebuilding them.")
+            redis_utils.build_leaderboards(stats_utils.get_all_averages(mongo_client), redis_client)
+        finally:
+            redis_utils.release_lock('leaderboards', token, redis_client)
+    return True
+
+
+def load_student(student_id):
+    student = dbutils.get_student(student_id, mongo_client, redis_client, local=False)
+    student['_id'] = str(student['_id'])
+    return student
+
+
+def load_course(course_id):
+    # the cached course lists its first page of students, and depends on them
+    course = dbutils.get_course(course_id, mongo_client, redis_client, local=False)
+    course['_id'] = str(course['_id'])
+    page_size = config['enrollment']['page_size']
+    return api_utils.add_students_page(course, dbutils.get_course_students(course_id, mongo_client, limit=page_size + 1), page_size)
+
+
+def refresh_leaders():
+    """
+    run a scheduled refresh of the cached leaders, if this worker claims it. returns
+    the number of leaders recomputed, None if the refresh wasn't claimed.
+    """
+    if not redis_utils.claim_refresh(redis_client):
+        return None
+    start = time.perf_counter()
+    lock_timeout = config['cache']['lock_timeout']
+    recomputes = (redis_utils.refresh_best_student(load_student, redis_client, lock_timeout) +
+                  redis_utils.refresh_easiest_course(load_course, redis_client, lock_timeout))
+    redis_utils.record_refresh(recomputes, time.perf_counter() - start, redis_client)
+    return recomputes
+
+
+def warm_caches(app: Flask):
+    """
+    recompute invalidated statistics in the background, so readers rarely find them
+    stale. every write schedules a refresh (see redis_utils), which one worker claims
+    every window seconds, so a burst of writes costs a single recompute. runs in a
+    daemon thread of every worker. the scheduled refresh is only checked after the
+    stats cache saw the statistics change, or every window if it isn't subscribed.
+    """
+    seen = None
+    with app.app_context():
+        while True:
+            time.sleep(config['warmer']['window'])
+            generation = stats_cache.generation()
+            if generation is not None and generation == seen:
+                continue
+            try:
+                refresh_leaders()
+                seen = generation
+            except Exception as e:
+                # keep warming, a failed refresh leaves the recompute to the readers
+                logger.info("cache refresh failed. error: %s", e)
+
+
+@api.route('/best_student', methods=['GET'])
+@cached_stats
+def get_best_student():
+    # get the best student from the cache, recomputing it if needed
+    best_student, staleness = redis_utils.get_best_student(load_student, redis_client, **config['cache'])
 
+    # the leaderboard is empty, make sure it wasn't lost before reporting no grades
+    if best_student is None:
+        if not rebuild_lost_leaderboards(stats_utils.get_best_student_id):
+            logger.info("attempting to get best student with no grades saved.")
+            return respond(api_utils.no_grades())
+        best_student, staleness = load_student(stats_utils.get_best_student_id(mongo_client)), None
+    return stats_response(best_student, staleness)
 
-@app.route('/best_student', methods=['GET'])
-def get_best_student():
-    # check if best student is cached
-    cached_student = redis_utils.get_best_student_from_cache(redis_client)
-    if cached_student:
-        logger.info("returning best student from cache.")
-        return make_response(jsonify(cached_student))
 
-    # if cache is invalid, get from db
-    best_student_id = stats_utils.get_best_student_id(mongo_client)
-    if best_student_id is None:
-        logger.info(f"attempting to get best student with no grades saved.")
-        return make_response(jsonify({'error': 'no grades are listed in the system.'}), 404)
+@api.route('/easiest_course', methods=['GET'])
+@cached_stats
+def get_easiest_course():
+    # get the easiest course from the cache, recomputing it if needed
+    easiest_course, staleness = redis_utils.get_easiest_course(load_course, redis_client, **config['cache'])
+
+    # the leaderboard is empty, make sure it wasn't lost before reporting no grades
+    if easiest_course is None:
+        if not rebuild_lost_leaderboards(stats_utils.get_easiest_course_id):
+            logger.info("attempting to get easiest course with no grades saved.")
+            return respond(api_utils.no_grades())
+        easiest_course, staleness = load_course(stats_utils.get_easiest_course_id(mongo_client)), None
+    return stats_response(easiest_course, staleness)
+
+
+@api.route('/best_students', methods=['GET'])
+@cached_stats
+def get_best_students():
+    n = api_utils.unpack_leaderboard_size(request.args, **config['leaderboard'])
+    if n is None:
+        return respond(api_utils.invalid_leaderboard_size(config['leaderboard']['max_size']))
+    return respond((redis_utils.get_top_students(n, redis_client), 200))
+
+
+@api.route('/easiest_courses', methods=['GET'])
+@cached_stats
+def get_easiest_courses():
+    n = api_utils.unpack_leaderboard_size(request.args, **config['leaderboard'])
+    if n is None:
+        return respond(api_utils.invalid_leaderboard_size(config['leaderboard']['max_size']))
+    return respond((redis_utils.get_top_courses(n, redis_client), 200))
+
+
+@api.route('/students/rank', methods=['GET'])
+@cached_stats
+def get_student_rank():
+    id_num = request.args.get('id_number', None)
+    if id_num is None:
+        return respond(api_utils.rank_id_not_given('student'))
+    id_num = api_utils.unpack_url_id(id_num)
+    if id_num is None:
+        return respond(api_utils.invalid_url_id('id_number'))
+
+    rank = redis_utils.get_student_rank(id_num, redis_client)
+    return respond(api_utils.rank_found('student_id', 'student', id_num, rank))
+
 
-    # get student
-    best_student = dbutils.get_student(best_student_id, mongo_client)
-    best_student['_id'] = str(best_student['_id'])
+@api.route('/courses/rank', methods=['GET'])
+@cached_stats
+def get_course_rank():
+    course_id = request.args.get('course_id', None)
+    if course_id is None:
+        return respond(api_utils.rank_id_not_given('course'))
+    course_id = api_utils.unpack_url_id(course_id)
+    if course_id is None:
+        return respond(api_utils.invalid_url_id('course_id'))
 
-    # update cache
-    redis_utils.update_best_student_cache(best_student, redis_client)
-    return make_response(jsonify(best_student), 200)
+    rank = redis_utils.get_course_rank(course_id, redis_client)
+    return respond(api_utils.rank_found('course_id', 'course', course_id, rank))
 
 
-@app.route('/easiest_course', methods=['GET'])
-def get_easiest_course():
-    # check if course is cached
-    cached_course = redis_utils.get_easiest_course_from_cache(redis_client)
-    if cached_course:
-        logger.info("returning easiest course from cache.")
-        return make_response(jsonify(cached_course))
-
-    # if cache is invalid, get from db
-    easiest_course_id = stats_utils.get_easiest_course_id(mongo_client)
-    if easiest_course_id is None:
-        logger.info(f"attempting to get easiest course with no grades saved.")
-        return make_response(jsonify({'error': 'no grades are listed in the system.'}))
-
-    # get course info
-    easiest_course = dbutils.get_course(easiest_course_id, mongo_client)
-    easiest_course['_id'] = str(easiest_course['_id'])
-    redis_utils.update_easiest_course_cache(easiest_course, redis_client)
-    return make_response(jsonify(easiest_course), 200)
-
-
-app.run(debug=config['app']['debug'], host="0.0.0.0", port=config['app']['port'])
+@api.route('/students/<int:student_id>/transcript', methods=['GET'])
+@cached_stats
+def get_transcript(student_id):
+    transcript = redis_utils.get_transcript(student_id, lambda: dbutils.get_transcript(student_id, mongo_client),
+                                            redis_client, config['transcript']['ttl'])
+    return respond(api_utils.transcript_found(student_id, transcript))
+
+
+@api.route('/courses/<int:course_id>/stats', methods=['GET'])
+@cached_stats
+def get_course_distribution(course_id):
+    settings = config['course_stats']
+
+    def compute():
+        return stats_utils.get_course_distribution(course_id, settings['percentiles'], settings['histogram_bins'], mongo_client)
+
+    distribution = redis_utils.get_course_distribution(course_id, compute, redis_client, settings['ttl'])
+    return respond(api_utils.distribution_found(course_id, distribution))
+
+
+@api.route('/cache_stats', methods=['GET'])
+def get_cache_stats():
+    # the counters of the redis cache and the warmer, and of the stats cache of the worker that served the request
+    return make_response(jsonify({**redis_utils.get_cache_stats(redis_client), 'local': stats_cache.get_stats()}), 200)
+
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    # the metrics of all the worker processes, in the prometheus text format
+    if not config['metrics']['enabled']:
+        return respond(api_utils.error('metrics are disabled.'))
+    return Response(metrics_utils.render(redis_utils.get_cache_stats(redis_client)), content_type=metrics_utils.CONTENT_TYPE)
+
+
+@api.route('/entity_cache_stats', methods=['GET'])
+def get_entity_cache_stats():
+    # the counters of the worker process that served the request
+    return make_response(jsonify(entity_cache.get_stats()), 200)
+
+
+if __name__ == '__main__':
+    # development server, use gunicorn (gunicorn.conf.py) in production
+    app = create_app()
+    app.run(debug=app.config['SCHOOL']['app']['debug'], host="0.0.0.0", port=app.config['SCHOOL']['app']['port'])
@@ -0,0 +1,687 @@
+from quart import Blueprint, Quart, Response, current_app, jsonify, request, make_response, stream_with_context
+from werkzeug.local import LocalProxy
+from types import SimpleNamespace
+from collections import Counter
+import asyncio
+import functools
+import json
+import time
+from pymongo import AsyncMongoClient
+from pymongo.errors import PyMongoError
+import redis.asyncio
+from redis.exceptions import RedisError
+
+from app import load_config, BOOTSTRAP_RETRY_INTERVAL
+from utils import dbutils
+from utils import async_dbutils
+from utils import async_stats_utils
+from utils import async_index_utils
+from utils import async_bulk_utils
+from utils import bulk_utils
+from utils import roundtrip_utils
+from utils import entity_cache
+from utils import stats_cache
+from utils import change_stream_utils
+from utils import async_stats_cache
+from utils import logging_utils
+from utils import async_redis_utils
+from utils import listing_utils
+from utils import async_listing_utils
+from utils import export_utils
+from utils import async_export_utils
+from utils import write_behind_utils
+from utils import async_write_behind_utils
+from utils import metrics_utils
+from utils import async_metrics_utils
+from utils import connection_utils
+from utils import profiling_utils
+from utils import async_profiling_utils
+from utils import api_utils
+import logging
+
+# asyncio server mode. exposes the same api as app.py, served by an asgi server:
+#   hypercorn -c python:hypercorn_conf "async_app:create_app()"
+# every worker process runs one event loop with an async mongo client and redis pool,
+# and the db lookups of a request that don't depend on each other run concurrently.
+
+# api routes, registered on the app by create_app
+api = Blueprint('api', __name__)
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+# configuration and clients of the current app, the clients are opened when the app starts serving
+config = LocalProxy(lambda: current_app.config['SCHOOL'])
+mongo_client = LocalProxy(lambda: current_app.extensions['school_mongo'])
+redis_client = LocalProxy(lambda: current_app.extensions['school_redis'])
+
+
+async def json_body():
+    """
+    the parsed json body, wrapped so the dbutils unpack functions can read it.
+    """
+    return SimpleNamespace(json=await request.get_json())
+
+
+async def bootstrap(mongo: AsyncMongoClient, r: redis.asyncio.Redis):
+    """
+    see app.bootstrap, runs as a background task of the event loop.
+    """
+    while True:
+        try:
+            await async_index_utils.ensure_indexes(mongo)
+            await async_redis_utils.setup_caching_struct(r, await async_stats_utils.get_all_averages(mongo))
+            logger.info("bootstrapped db indexes and caches.")
+            return
+        except (PyMongoError, RedisError) as e:
+            logger.info("bootstrap failed, retrying in %s seconds. error: %s", BOOTSTRAP_RETRY_INTERVAL, e)
+            await asyncio.sleep(BOOTSTRAP_RETRY_INTERVAL)
+
+
+def create_app(config_path: str = 'config.yml'):
+    app = Quart(__name__)
+    app.config['SCHOOL'] = load_config(config_path)
+    logging_utils.configure(**app.config['SCHOOL']['logging'])
+    entity_cache.configure(**app.config['SCHOOL']['entity_cache'])
+    stats_cache.configure(**app.config['SCHOOL']['stats_cache'])
+    change_stream_utils.configure(app.config['SCHOOL']['change_streams']['enabled'])
+    profiling_utils.configure(**app.config['SCHOOL']['profiling'])
+    if profiling_utils.enabled():
+        profiling_utils.instrument(async_dbutils, async_stats_utils, async_redis_utils)
+    app.register_blueprint(api)
+    return app
+
+
+@api.before_app_serving
+async def open_clients():
+    # the clients belong to the event loop of this worker, and connect lazily
+    app_config = current_app.config['SCHOOL']
+    current_app.extensions['school_mongo'] = AsyncMongoClient(
+        connect=False, event_listeners=connection_utils.mongo_listeners(app_config), **app_config['mongo'])
+    if app_config['metrics']['enabled']:
+        current_app.extensions['school_redis'] = async_metrics_utils.TimedRedis(
+            connection_pool=async_metrics_utils.TrackedConnectionPool(**app_config['redis']))
+    else:
+        current_app.extensions['school_redis'] = redis.asyncio.Redis(
+            connection_pool=redis.asyncio.BlockingConnectionPool(**app_config['redis']))
+    current_app.add_background_task(bootstrap, current_app.extensions['school_mongo'], current_app.extensions['school_redis'])
+    if stats_cache.enabled():
+        current_app.add_background_task(async_stats_cache.listen, current_app.extensions['school_redis'])
+    if app_config['warmer']['enabled']:
+        current_app.add_background_task(warm_caches)
+
+
+@api.after_app_serving
+async def close_clients():
+    await current_app.extensions.pop('school_mongo').close()
+    await current_app.extensions.pop('school_redis').aclose()
+
+
+@api.before_app_request
+async def count_round_trips():
+    roundtrip_utils.start_counting()
+    entity_cache.start_request()
+    if config['metrics']['enabled']:
+        metrics_utils.start_request()
+    if profiling_utils.enabled():
+        profiling_utils.start_request(request.headers, request.args)
+
+
+@api.after_app_request
+async def report_round_trips(response):
+    round_trips = roundtrip_utils.round_trips()
+    response.headers[roundtrip_utils.ROUND_TRIPS_HEADER] = str(round_trips)
+    logger.info("%s %s status: %s, db round trips: %s", request.method, request.path, response.status_code, round_trips)
+    if config['metrics']['enabled']:
+        metrics_utils.observe_request(request.url_rule, request.method, response.status_code)
+    if profiling_utils.enabled():
+        await report_profile(response)
+    return response
+
+
+async def report_profile(response):
+    """
+    see app.report_profile.
+    """
+    profile = profiling_utils.finish_request()
+    if profile is None:
+        return
+    if profile.traced:
+        response.headers[profiling_utils.SERVER_TIMING_HEADER] = profiling_utils.server_timing(profile)
+    if profiling_utils.is_slow(profile):
+        async_profiling_utils.queue_slow_request(profile, request.method, request.path, response.status_code, mongo_client)
+    return
+
+
+async def respond(result: tuple):
+    """
+    see app.respond.
+    """
+    body, status = result
+    return await make_response(jsonify(body), status)
+
+
+@api.route('/healthz', methods=['GET'])
+async def liveness():
+    return await make_response(jsonify({'status': 'ok'}), 200)
+
+
+@api.route('/', methods=['GET'])
+@api.route('/readyz', methods=['GET'])
+async def readiness():
+    async def ping(coroutine):
+        try:
+            await coroutine
+            return 'on'
+        except (PyMongoError, RedisError):
+            return 'error'
+
+    mongo_status, redis_status = await asyncio.gather(ping(mongo_client.admin.command('ping')), ping(redis_client.ping()))
+    status = {'mongo': mongo_status, 'redis': redis_status}
+    ready = all(v == 'on' for v in status.values())
+    return await make_response(jsonify(status), 200 if ready else 503)
+
+
+@api.route('/students', methods=['POST'])
+async def create_student():
+    # unpack student params from request
+    id_num, first_name, last_name, email = dbutils.unpack_student_create_params(await json_body())
+
+    # validate params
+    is_valid = dbutils.validate_student_creation_params(id_num, first_name, last_name, email)
+    if not is_valid:
+        return await respond(api_utils.invalid_student())
+
+    # create the student
+    new_student = await async_dbutils.create_student(id_num, first_name, last_name, email, mongo_client)
+    if new_student is not None:
+        logger.info("creating student: %s.", id_num)
+    return await respond(api_utils.student_created(id_num, new_student))
+
+
+@api.route('/students', methods=['GET'])
+async def get_student():
+    if 'ids' in request.args:
+        ids = dbutils.unpack_id_list(request.args['ids'], config['multi_get']['max_ids'])
+        return await batch_response(ids, lambda ids: async_dbutils.get_students(ids, mongo_client, redis_client))
+
+    id_num = request.args.get('id_number', None)
+    if id_num is None:
+        return await list_response('students')
+    id_num = api_utils.unpack_url_id(id_num)
+    if id_num is None:
+        return await respond(api_utils.invalid_url_id('id_number'))
+
+    requested_student = await async_dbutils.get_student(id_num, mongo_client, redis_client)
+    return await respond(api_utils.student_found(id_num, requested_student))
+
+
+async def batch_response(ids, get_many):
+    """
+    see app.batch_response, get_many is a coroutine function.
+    """
+    if ids is None:
+        return await respond(api_utils.invalid_ids(config['multi_get']['max_ids']))
+    return await respond((api_utils.batch_results(ids, await get_many(ids)), 200))
+
+
+async def list_response(collection: str):
+    """
+    see app.list_response.
+    """
+    params = listing_utils.unpack_listing_params(collection, request.args, **config['listing'])
+    if params is None:
+        return await respond(api_utils.invalid_listing(collection))
+    return await respond((await async_listing_utils.list_page(collection, **params, client=mongo_client), 200))
+
+
+@api.route('/students', methods=['PUT'])
+async def update_student():
+    id_num, new_params = dbutils.unpack_student_modify_params(await json_body())
+
+    is_valid = await async_dbutils.validate_student_modification_params(id_num, new_params, mongo_client)
+    if not is_valid:
+        return await respond(api_utils.invalid_student())
+
+    updated_student = await async_dbutils.update_student(id_num, new_params, mongo_client, redis_client, config['cascade']['transactions'])
+    if updated_student:
+        if not change_stream_utils.enabled():
+            await async_redis_utils.invalidate_dependents(redis_client, students=[id_num, updated_student['id_number']])
+        logger.info("updating student: %s, invalidating dependent caches.", id_num)
+    return await respond(api_utils.student_updated(id_num, updated_student))
+
+
+@api.route('/students', methods=['DELETE'])
+async def delete_student():
+    ids = api_utils.unpack_ids(await request.get_json(), 'id_number')
+    if ids is None:
+        return await respond(api_utils.student_id_not_given())
+    id_num, = ids
+
+    deleted = await async_dbutils.delete_student(id_num, mongo_client, redis_client, config['cascade']['transactions'])
+    if deleted:
+        if not change_stream_utils.enabled():
+            await async_redis_utils.invalidate_dependents(redis_client, students=[id_num])
+        logger.info("deleting student: %s, invalidating dependent caches.", id_num)
+    return await respond(api_utils.student_deleted(id_num, deleted))
+
+
+@api.route('/courses', methods=['POST'])
+async def create_course():
+    course_id, name, students = dbutils.unpack_course_creation_params(await json_body())
+
+    is_valid = await async_dbutils.validate_course_creation_params(course_id, name, students, mongo_client)
+    if not is_valid:
+        return await respond(api_utils.invalid_course())
+
+    new_course = await async_dbutils.create_course(course_id, name, students, mongo_client)
+    if new_course is not None:
+        logger.info("created new course: %s", new_course['course_id'])
+    return await respond(api_utils.course_created(new_course))
+
+
+@api.route('/courses', methods=['GET'])
+async def get_course():
+    if 'ids' in request.args:
+        ids = dbutils.unpack_id_list(request.args['ids'], config['multi_get']['max_ids'])
+        return await batch_response(ids, lambda ids: async_dbutils.get_courses(ids, mongo_client, redis_client))
+
+    course_id = request.args.get('course_id', None)
+    if course_id is None:
+        return await list_response('courses')
+    course_id = api_utils.unpack_url_id(course_id)
+    if course_id is None:
+        return await respond(api_utils.invalid_url_id('course_id'))
+
+    page = api_utils.unpack_students_page(request.args, **config['enrollment'])
+    if page is None:
+        return await respond(api_utils.invalid_students_page())
+
+    # the course and its page of students are read concurrently
+    requested_course, students = await asyncio.gather(
+        async_dbutils.get_course(course_id, mongo_client, redis_client),
+        async_dbutils.get_course_students(course_id, mongo_client, page[0], page[1] + 1))
+    return await respond(api_utils.course_found(course_id, requested_course, students, page[1]))
+
+
+@api.route('/courses', methods=['PUT'])
+async def update_course():
+    course_id, new_params = dbutils.unpack_course_modification_params(await json_body())
+
+    is_valid = await async_dbutils.validate_course_modification_params(course_id, new_params, mongo_client)
+    if not is_valid:
+        return await respond(api_utils.invalid_course())
+
+    updated_course = await async_dbutils.update_course(course_id, new_params, mongo_client, redis_client, config['cascade']['transactions'])
+    if updated_course:
+        if not change_stream_utils.enabled():
+            await async_redis_utils.invalidate_dependents(redis_client, courses=[course_id])
+        logger.info("updating course: %s, invalidating dependent caches.", course_id)
+    return await respond(api_utils.course_updated(course_id, updated_course))
+
+
+@api.route('/courses', methods=['DELETE'])
+async def delete_course():
+    ids = api_utils.unpack_ids(await request.get_json(), 'course_id')
+    if ids is None:
+        return await respond(api_utils.course_id_not_given())
+    course_id, = ids
+
+    deleted = await async_dbutils.delete_course(course_id, mongo_client, redis_client, config['cascade']['transactions'])
+    if deleted:
+        if not change_stream_utils.enabled():
+            await async_redis_utils.invalidate_dependents(redis_client, courses=[course_id])
+        logger.info("deleting course: %s, invalidating dependent caches.", course_id)
+    return await respond(api_utils.course_deleted(course_id, deleted))
+
+
+@api.route('/courses/<int:course_id>/students', methods=['POST'])
+async def enroll_student(course_id):
+    student_id = dbutils.unpack_enrollment_params(await json_body())
+    if not await async_dbutils.validate_enrollment_params(course_id, student_id, mongo_client):
+        return await respond(api_utils.invalid_enrollment())
+
+    enrolled = await async_dbutils.enroll_student(course_id, student_id, mongo_client)
+    if enrolled:
+        if not change_stream_utils.enabled():
+            await async_redis_utils.invalidate_dependents(redis_client, courses=[course_id])
+        logger.info("enrolled student: %s in course: %s, invalidating dependent caches.", student_id, course_id)
+    return await respond(api_utils.student_enrolled(course_id, student_id, enrolled))
+
+
+@api.route('/courses/<int:course_id>/students', methods=['DELETE'])
+async def unenroll_student(course_id):
+    student_id = dbutils.unpack_enrollment_params(await json_body())
+    if not isinstance(student_id, int):
+        return await respond(api_utils.student_id_not_given())
+
+    unenrolled = await async_dbutils.unenroll_student(course_id, student_id, mongo_client, redis_client,
+                                                      config['cascade']['transactions'])
+    if unenrolled:
+        if not change_stream_utils.enabled():
+            await async_redis_utils.invalidate_dependents(redis_client, courses=[course_id])
+        logger.info("unenrolled student: %s from course: %s, invalidating dependent caches.", student_id, course_id)
+    return await respond(api_utils.student_unenrolled(course_id, student_id, unenrolled))
+
+
+@api.route('/grades', methods=['POST'])
+async def create_grade():
+    student_id, course_id, grade = dbutils.unpack_grade_creation_params(await json_body())
+
+    is_valid = await async_dbutils.validate_grade_creation_params(student_id, course_id, grade, mongo_client)
+    if not is_valid:
+        return await respond(api_utils.invalid_grade())
+
+    if config['write_behind']['enabled']:
+        grade_doc = {'student_id': student_id, 'course_id': course_id, 'grade': grade}
+        ticket = await async_write_behind_utils.enqueue_grade(grade_doc, redis_client, config['write_behind']['ticket_ttl'])
+        return await respond(api_utils.grade_queued(ticket, write_behind_utils.QUEUED))
+
+    new_grade = await async_dbutils.create_grade(student_id, course_id, grade, mongo_client, redis_client, config['cascade']['transactions'])
+    if new_grade is not None:
+        logger.info("new grade was created, sid: %s, cid: %s.", student_id, course_id)
+    return await respond(api_utils.grade_created(student_id, course_id, new_grade))
+
+
+@api.route('/grades/tickets/<ticket>', methods=['GET'])
+async def get_grade_ticket(ticket):
+    return await respond(api_utils.ticket_found(ticket, await async_write_behind_utils.get_ticket(ticket, redis_client)))
+
+
+@api.route('/grades', methods=['GET'])
+async def get_grade():
+    if 'pairs' in request.args:
+        pairs = dbutils.unpack_grade_pairs(request.args['pairs'], config['multi_get']['max_ids'])
+        return await batch_response(pairs, lambda pairs: async_dbutils.get_grades(pairs, mongo_client, redis_client))
+
+    course_id = request.args.get('course_id', None)
+    student_id = request.args.get('student_id', None)
+    if course_id is None or student_id is None:
+        return await list_response('grades')
+    course_id, student_id = api_utils.unpack_url_id(course_id), api_utils.unpack_url_id(student_id)
+    if course_id is None or student_id is None:
+        return await respond(api_utils.invalid_url_id('course_id or student_id'))
+
+    requested_grade = await async_dbutils.get_grade(student_id, course_id, mongo_client, redis_client)
+    return await respond(api_utils.grade_found(student_id, course_id, requested_grade))
+
+
+@api.route('/grades', methods=['PUT'])
+async def update_grade():
+    current_sid, current_cid, new_params = dbutils.unpack_grade_modification_params(await json_body())
+
+    is_valid = await async_dbutils.validate_grade_modification_params(current_sid, current_cid, new_params, mongo_client)
+    if not is_valid:
+        return await respond(api_utils.invalid_grade_update())
+
+    updated_grade = await async_dbutils.update_grade(current_sid, current_cid, new_params, mongo_client, redis_client, config['cascade']['transactions'])
+    if updated_grade:
+        logger.info("updating grade. sid: %s, cid: %s", updated_grade['student_id'], updated_grade['course_id'])
+    return await respond(api_utils.grade_updated(current_sid, current_cid, updated_grade))
+
+
+@api.route('/grades', methods=['DELETE'])
+async def delete_grade():
+    ids = api_utils.unpack_ids(await request.get_json(), 'student_id', 'course_id')
+    if ids is None:
+        return await respond(api_utils.grade_ids_not_given())
+    student_id, course_id = ids
+
+    deleted = await async_dbutils.delete_grade(student_id, course_id, mongo_client, redis_client, config['cascade']['transactions'])
+    if deleted:
+        logger.info("deleting grade, sid: %s, cid: %s.", student_id, course_id)
+    return await respond(api_utils.grade_deleted(student_id, course_id, deleted))
+
+
+async def bulk_response(insert_chunk):
+    """
+    see app.bulk_response, insert_chunk is a coroutine function.
+    """
+    chunk_size = config['bulk']['chunk_size']
+    if request.mimetype == bulk_utils.NDJSON:
+        @stream_with_context
+        async def generate():
+            counts, index = Counter(), 0
+            async for chunk in async_bulk_utils.chunks(async_bulk_utils.ndjson_items(request.body), chunk_size):
+                for result in await insert_chunk(chunk):
+                    counts[result['status']] += 1
+                    yield json.dumps({'index': index, **result}) + '\n'
+                    index += 1
+            yield json.dumps({'summary': counts}) + '\n'
+        return Response(generate(), mimetype=bulk_utils.NDJSON)
+
+    items = await request.get_json(silent=True)
+    if not isinstance(items, list):
+        return await respond(api_utils.invalid_bulk())
+    results = [result for chunk in bulk_utils.chunks(items, chunk_size) for result in await insert_chunk(chunk)]
+    return await respond((api_utils.bulk_results(results), 200))
+
+
+@api.route('/students/bulk', methods=['POST'])
+async def create_students():
+    return await bulk_response(lambda chunk: async_bulk_utils.insert_students(chunk, mongo_client))
+
+
+@api.route('/courses/bulk', methods=['POST'])
+async def create_courses():
+    return await bulk_response(lambda chunk: async_bulk_utils.insert_courses(chunk, mongo_client))
+
+
+@api.route('/grades/bulk', methods=['POST'])
+async def create_grades():
+    return await bulk_response(lambda chunk: async_bulk_utils.insert_grades(chunk, mongo_client, redis_client))
+
+
+@api.route('/export/<collection>', methods=['GET'])
+async def export_collection(collection):
+    """
+    see app.export_collection.
+    """
+    params = export_utils.unpack_export_params(collection, request.args)
+    if params is None:
+        return await respond(api_utils.invalid_export(collection))
+    compress = 'gzip' in request.accept_encodings
+    data = async_export_utils.export(collection, **params, compress=compress, client=mongo_client, **config['export'])
+    return Response(stream_with_context(data), mimetype=export_utils.CONTENT_TYPES[params['fmt']],
+                    headers=api_utils.export_headers(collection, params['fmt'], compress))
+
+
+def cached_stats(view):
+    """
+    see app.cached_stats.
+    """
+    @functools.wraps(view)
+    async def cached_view(**view_args):
+        body = stats_cache.lookup(request.full_path)
+        if body is not None:
+            return Response(body, 200, mimetype='application/json')
+        generation = stats_cache.generation()
+        response = await view(**view_args)
+        if response.status_code == 200 and 'Warning' not in response.headers:
+            stats_cache.store(request.full_path, generation, await response.get_data())
+        return response
+    return cached_view
+
+
+async def stats_response(document, staleness):
+    response = await make_response(jsonify(document), 200)
+    if staleness is not None:
+        response.headers['Warning'] = '110 - "Response is Stale"'
+        response.headers['Age'] = str(int(staleness))
+    return response
+
+
+async def rebuild_lost_leaderboards(get_leader_id):
+    """
+    see app.rebuild_lost_leaderboards.
+    """
+    if await get_leader_id(mongo_client) is None:
+        return False
+    token = await async_redis_utils.acquire_lock('leaderboards', config['cache']['lock_timeout'], redis_client)
+    if token is not None:
+        try:
+            logger.info("leaderboards are missing, rebuilding them.")
+            await async_redis_utils.build_leaderboards(await async_stats_utils.get_all_averages(mongo_client), redis_client)
+        finally:
+            await async_redis_utils.release_lock('leaderboards', token, redis_client)
+    return True
+
+
+async def load_student(student_id):
+    student = await async_dbutils.get_student(student_id, mongo_client, redis_client, local=False)
+    student['_id'] = str(student['_id'])
+    return student
+
+
+async def load_course(course_id):
+    course, students = await asyncio.gather(
+        async_dbutils.get_course(course_id, mongo_client, redis_client, local=False),
+        async_dbutils.get_course_students(course_id, mongo_client, limit=config['enrollment']['page_size'] + 1))
+    course['_id'] = str(course['_id'])
+    return api_utils.add_students_page(course, students, config['enrollment']['page_size'])
+
+
+async def refresh_leaders():
+    """
+    see app.refresh_leaders.
+    """
+    if not await async_redis_utils.claim_refresh(redis_client):
+        return None
+    start = time.perf_counter()
+    lock_timeout = config['cache']['lock_timeout']
+    recomputes = (await async_redis_utils.refresh_best_student(load_student, redis_client, lock_timeout) +
+                  await async_redis_utils.refresh_easiest_course(load_course, redis_client, lock_timeout))
+    await async_redis_utils.record_refresh(recomputes, time.perf_counter() - start, redis_client)
+    return recomputes
+
+
+async def warm_caches():
+    """
+    see app.warm_caches, runs as a background task of the event loop.
+    """
+    seen = None
+    while True:
+        await asyncio.sleep(config['warmer']['window'])
+        generation = stats_cache.generation()
+        if generation is not None and generation == seen:
+            continue
+        try:
+            await refresh_leaders()
+            seen = generation
+        except Exception as e:
+            logger.info("cache refresh failed. error: %s", e)
+
+
+@api.route('/best_student', methods=['GET'])
+@cached_stats
+async def get_best_student():
+    best_student, staleness = await async_redis_utils.get_best_student(load_student, redis_client, **config['cache'])
+    if best_student is None:
+        if not await rebuild_lost_leaderboards(async_stats_utils.get_best_student_id):
+            logger.info("attempting to get best student with no grades saved.")
+            return await respond(api_utils.no_grades())
+        best_student, staleness = await load_student(await async_stats_utils.get_best_student_id(mongo_client)), None
+    return await stats_response(best_student, staleness)
+
+
+@api.route('/easiest_course', methods=['GET'])
+@cached_stats
+async def get_easiest_course():
+    easiest_course, staleness = await async_redis_utils.get_easiest_course(load_course, redis_client, **config['cache'])
+    if easiest_course is None:
+        if not await rebuild_lost_leaderboards(async_stats_utils.get_easiest_course_id):
+            logger.info("attempting to get easiest course with no grades saved.")
+            return await respond(api_utils.no_grades())
+        easiest_course, staleness = await load_course(await async_stats_utils.get_easiest_course_id(mongo_client)), None
+    return await stats_response(easiest_course, staleness)
+
+
+@api.route('/best_students', methods=['GET'])
+@cached_stats
+async def get_best_students():
+    n = api_utils.unpack_leaderboard_size(request.args, **config['leaderboard'])
+    if n is None:
+        return await respond(api_utils.invalid_leaderboard_size(config['leaderboard']['max_size']))
+    return await respond((await async_redis_utils.get_top_students(n, redis_client), 200))
+
+
+@api.route('/easiest_courses', methods=['GET'])
+@cached_stats
+async def get_easiest_courses():
+    n = api_utils.unpack_leaderboard_size(request.args, **config['leaderboard'])
+    if n is None:
+        return await respond(api_utils.invalid_leaderboard_size(config['leaderboard']['max_size']))
+    return await respond((await async_redis_utils.get_top_courses(n, redis_client), 200))
+
+
+@api.route('/students/rank', methods=['GET'])
+@cached_stats
+async def get_student_rank():
+    id_num = request.args.get('id_number', None)
+    if id_num is None:
+        return await respond(api_utils.rank_id_not_given('student'))
+    id_num = api_utils.unpack_url_id(id_num)
+    if id_num is None:
+        return await respond(api_utils.invalid_url_id('id_number'))
+
+    rank = await async_redis_utils.get_student_rank(id_num, redis_client)
+    return await respond(api_utils.rank_found('student_id', 'student', id_num, rank))
+
+
+@api.route('/courses/rank', methods=['GET'])
+@cached_stats
+async def get_course_rank():
+    course_id = request.args.get('course_id', None)
+    if course_id is None:
+        return await respond(api_utils.rank_id_not_given('course'))
+    course_id = api_utils.unpack_url_id(course_id)
+    if course_id is None:
+        return await respond(api_utils.invalid_url_id('course_id'))
+
+    rank = await async_redis_utils.get_course_rank(course_id, redis_client)
+    return await respond(api_utils.rank_found('course_id', 'course', course_id, rank))
+
+
+@api.route('/students/<int:student_id>/transcript', methods=['GET'])
+@cached_stats
+async def get_transcript(student_id):
+    transcript = await async_redis_utils.get_transcript(student_id, lambda: async_dbutils.get_transcript(student_id, mongo_client),
+                                                        redis_client, config['transcript']['ttl'])
+    return await respond(api_utils.transcript_found(student_id, transcript))
+
+
+@api.route('/courses/<int:course_id>/stats', methods=['GET'])
+@cached_stats
+async def get_course_distribution(course_id):
+    settings = config['course_stats']
+
+    async def compute():
+        return await async_stats_utils.get_course_distribution(course_id, settings['percentiles'], settings['histogram_bins'],
+                                                               mongo_client)
+
+    distribution = await async_redis_utils.get_course_distribution(course_id, compute, redis_client, settings['ttl'])
+    return await respond(api_utils.distribution_found(course_id, distribution))
+
+
+@api.route('/cache_stats', methods=['GET'])
+async def get_cache_stats():
+    return await make_response(jsonify({**await async_redis_utils.get_cache_stats(redis_client),
+                                        'local': stats_cache.get_stats()}), 200)
+
+
+@api.route('/metrics', methods=['GET'])
+async def get_metrics():
+    if not config['metrics']['enabled']:
+        return await respond(api_utils.error('metrics are disabled.'))
+    return Response(metrics_utils.render(await async_redis_utils.get_cache_stats(redis_client)), content_type=metrics_utils.CONTENT_TYPE)
+
+
+@api.route('/entity_cache_stats', methods=['GET'])
+async def get_entity_cache_stats():
+    # the counters of the worker process that served the request
+    return await make_response(jsonify(entity_cache.get_stats()), 200)
+
+
+if __name__ == '__main__':
+    app = create_app()
+    app.run(debug=app.config['SCHOOL']['app']['debug'], host="0.0.0.0", port=app.config['SCHOOL']['app']['port'])
@@ -0,0 +1,114 @@
+"""
+compare the enrollment cascades of a student id change and a student deletion
+as per-course loops over embedded students arrays, and as single updates of the
+enrollments collection.
+
+the benchmark creates a student enrolled in many courses with large rosters, in
+the school db of the configured mongo, under ids that are far above any real id,
+and removes everything it created when done. run it against a development db,
+from the src directory:
+
+    python3 -m benchmarks.cascade_benchmark --courses 40 200 1000 --roster 500
+"""
+import argparse
+import statistics
+import sys
+import time
+
+import yaml
+from pymongo import MongoClient
+
+from utils import dbutils
+from utils import roundtrip_utils
+
+# ids used by the benchmark documents
+BASE_ID = 10 ** 12
+
+
+# the per-course loops the cascades were implemented with, over the embedded students arrays
+def legacy_update_all_student_courses(student_id: int, new_id: int, client: MongoClient):
+    num_updated = 0
+    for c in client.school.courses.find({'students': student_id}):
+        current_students = c['students']
+        current_students.pop(current_students.index(student_id))
+        current_students.append(new_id)
+        client.school.courses.update_one({'course_id': c['course_id']}, {'$set': {'students': current_students}})
+        num_updated += 1
+    return num_updated
+
+
+def legacy_delete_student_from_courses(student_id: int, client: MongoClient):
+    num_deleted = 0
+    for c in client.school.courses.find({'students': student_id}):
+        current_students = c['students']
+        current_students.pop(current_students.index(student_id))
+        client.school.courses.update_one({'course_id': c['course_id']}, {'$set': {'students': current_students}})
+        num_deleted += 1
+    return num_deleted
+
+
+def setup_courses(num_courses: int, roster: int, client: MongoClient):
+    student_id = BASE_ID
+    others = list(range(BASE_ID + 1, BASE_ID + roster))
+    client.school.courses.insert_many([{'course_id': BASE_ID + i, 'name': f'benchmark {i}', 'students': [student_id] + others}
+                                       for i in range(num_courses)])
+    client.school.enrollments.insert_many([{'course_id': BASE_ID + i, 'student_id': s}
+                                           for i in range(num_courses) for s in [student_id] + others])
+    return student_id
+
+
+def cleanup(client: MongoClient):
+    client.school.courses.delete_many({'course_id': {'$gte': BASE_ID}})
+    client.school.enrollments.delete_many({'course_id': {'$gte': BASE_ID}})
+
+
+def measure(cascade, num_courses: int, roster: int, repeat: int, client: MongoClient):
+    """
+    run cascade(student_id) over freshly created courses repeat times, returns the
+    round trips of a run and the median latency in milliseconds.
+    """
+    latencies, round_trips = [], 0
+    for _ in range(repeat):
+        student_id = setup_courses(num_courses, roster, client)
+        roundtrip_utils.start_counting()
+        start = time.perf_counter()
+        modified = cascade(student_id)
+        latencies.append((time.perf_counter() - start) * 1000)
+        round_trips = roundtrip_utils.round_trips()
+        cleanup(client)
+        assert modified == num_courses, f"cascade modified {modified} courses out of {num_courses}"
+    return round_trips, statistics.median(latencies)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='benchmark the enrollment cascades.')
+    parser.add_argument('--config', default='config.yml', help='path to the configuration file.')
+    parser.add_argument('--courses', type=int, nargs='+', default=[40, 200, 1000], help='courses the student is enrolled in.')
+    parser.add_argument('--roster', type=int, default=500, help='students enrolled in every course.')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement, the median latency is reported.')
+    args = parser.parse_args(argv)
+
+    config = yaml.load(open(args.config), Loader=yaml.Loader)
+    client = MongoClient(event_listeners=[roundtrip_utils.listener], **config['mongo'])
+    cascades = [
+        ('update id, per course', lambda sid: legacy_update_all_student_courses(sid, sid - 1, client)),
+        ('update id, enrollments', lambda sid: dbutils.update_all_student_courses(sid, sid - 1, client)),
+        ('delete, per course', lambda sid: legacy_delete_student_from_courses(sid, client)),
+        ('delete, enrollments', lambda sid: dbutils.delete_student_from_courses(sid, client)),
+    ]
+
+    print(f"roster size: {args.roster}, runs: {args.repeat}")
+    print(f"{'cascade':<28}{'courses':>10}{'round trips':>14}{'median ms':>12}")
+    try:
+        for num_courses in args.courses:
+            for name, cascade in cascades:
+                round_trips, latency = measure(cascade, num_courses, args.roster, args.repeat, client)
+                print(f"{name:<28}{num_courses:>10}{round_trips:>14}{latency:>12.1f}")
+    finally:
+        cleanup(client)
+        client.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,471 @@
+"""
+load test of the api: a mixed workload of reads and writes over the students, courses
+and grades routes and the best student and easiest course statistics, reporting the
+throughput, the p50/p95/p99 latency and the db round trips per request of every
+endpoint, saved as json so runs of different versions can be compared.
+
+the requests are sent to an app created in the benchmark process (through the flask
+test client, so the http server isn't measured), or with --url to a running server.
+the db is the configured mongo and redis, or with --local-servers a throwaway mongod and
+redis-server started on free local ports with their data in memory (tmpfs), and
+removed when done. only real servers are supported: the in-memory fakes of mongo don't
+implement the bulk writes, sessions and aggregation stages the api relies on. the
+benchmark seeds students, courses, enrollments and grades under ids far above any real
+id, and deletes them through the api when done unless it runs against local servers.
+run it from the src directory:
+
+    python3 -m benchmarks.load_benchmark --local-servers --requests 20000 --concurrency 8 --read-ratio 0.9 --output run.json
+    python3 -m benchmarks.load_benchmark --local-servers --compare run.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import redis
+import yaml
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from redis.exceptions import RedisError
+
+from utils import roundtrip_utils
+
+# ids used by the benchmark documents
+BASE_ID = 10 ** 12
+
+# seconds to wait for the local servers to answer a ping
+LOCAL_SERVER_TIMEOUT = 30
+
+# the percentiles reported per endpoint
+PERCENTILES = (0.5, 0.95, 0.99)
+
+# relative slowdown of an endpoint's p95 latency or throughput reported as a regression by --compare
+REGRESSION_THRESHOLD = 0.1
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class LocalServers:
+    """
+    a mongod and a redis-server on free local ports, with their data in a temporary
+    directory in memory when /dev/shm exists and without redis persistence.
+    """
+
+    def __init__(self, mongod: str, redis_server: str):
+        self.mongod = mongod
+        self.redis_server = redis_server
+        self.mongo_port = _free_port()
+        self.redis_port = _free_port()
+        self.processes = []
+        self.data_dir = None
+
+    def __enter__(self):
+        self.data_dir = tempfile.mkdtemp(prefix='school-benchmark-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+        self.processes.append(subprocess.Popen([self.mongod, '--port', str(self.mongo_port), '--bind_ip', '127.0.0.1',
+                                                '--dbpath', self.data_dir, '--quiet'], stdout=subprocess.DEVNULL))
+        self.processes.append(subprocess.Popen([self.redis_server, '--port', str(self.redis_port), '--bind', '127.0.0.1',
+                                                '--save', '', '--appendonly', 'no'], stdout=subprocess.DEVNULL))
+        self._wait()
+        return self
+
+    def _wait(self):
+        deadline = time.monotonic() + LOCAL_SERVER_TIMEOUT
+        mongo = MongoClient(port=self.mongo_port, serverSelectionTimeoutMS=500)
+        r = redis.Redis(port=self.redis_port)
+        try:
+            while True:
+                try:
+                    mongo.admin.command('ping')
+                    r.ping()
+                    return
+                except (PyMongoError, RedisError):
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.2)
+        finally:
+            mongo.close()
+            r.close()
+
+    def apply(self, config: dict):
+        """
+        point the mongo and redis sections of a config at the local servers.
+        """
+        config['mongo'] = {'host': '127.0.0.1', 'port': self.mongo_port, 'maxPoolSize': config['mongo'].get('maxPoolSize', 100)}
+        config['redis'] = {**config['redis'], 'host': '127.0.0.1', 'port': self.redis_port}
+        return config
+
+    def __exit__(self, *exc):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+
+class _NoLocalServers:
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+class AppClient:
+    """
+    sends requests to an app created in this process, every thread with its own test client.
+    """
+
+    def __init__(self, config_path: str):
+        from app import create_app
+        self.app = create_app(config_path)
+        self._local = threading.local()
+
+    def request(self, method: str, path: str, body=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body)
+        return response.status_code, int(response.headers.get(roundtrip_utils.ROUND_TRIPS_HEADER, 0))
+
+
+class HttpClient:
+    """
+    sends requests to a running server.
+    """
+
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+
+    def request(self, method: str, path: str, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.url + path, data=data, method=method,
+                                         headers={'Content-Type': 'application/json'} if data else {})
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                status, headers = response.status, response.headers
+        except urllib.error.HTTPError as e:
+            status, headers = e.code, e.headers
+        return status, int(headers.get(roundtrip_utils.ROUND_TRIPS_HEADER, 0))
+
+
+class Workload:
+    """
+    the ids of the benchmark documents, and the requests of the read and write operations
+    over them. the pools of ids are shared by the threads, an operation takes the ids it
+    deletes out of their pool.
+    """
+
+    def __init__(self, students: int, courses: int, roster: int, graded: float, seed: int):
+        rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.students = [BASE_ID + i for i in range(students)]
+        self.courses = {BASE_ID + i: rng.sample(self.students, min(roster, students)) for i in range(courses)}
+        self.course_ids = list(self.courses)
+        pairs = [(s, c) for c, roster_ids in self.courses.items() for s in roster_ids]
+        rng.shuffle(pairs)
+        split = int(len(pairs) * graded)
+        self.graded, self.ungraded = pairs[:split], pairs[split:]
+        # ids of the documents created by the run, which its deletes remove
+        self.next_id = BASE_ID + max(students, courses)
+        self.created_students, self.created_courses = [], []
+        self.reads = [self.get_student, self.get_course, self.get_grade, self.best_student, self.easiest_course]
+        self.writes = [self.create_student, self.update_student, self.delete_student, self.create_course,
+                       self.update_course, self.delete_course, self.create_grade, self.update_grade, self.delete_grade]
+
+    def seed(self, client, chunk_size: int):
+        """
+        create the seeded documents with the bulk endpoints.
+        """
+        students = [_student(s) for s in self.students]
+        courses = [{'course_id': c, 'name': f'course {c}', 'students': roster} for c, roster in self.courses.items()]
+        grades = [{'student_id': s, 'course_id': c, 'grade': 60 + (s + c) % 41} for s, c in self.graded]
+        for path, items in (('/students/bulk', students), ('/courses/bulk', courses), ('/grades/bulk', grades)):
+            for i in range(0, len(items), chunk_size):
+                status, _ = client.request('POST', path, items[i:i + chunk_size])
+                if status != 200:
+                    raise RuntimeError(f"seeding {path} failed with status {status}")
+        return
+
+    def cleanup(self, client):
+        """
+        delete the benchmark documents through the api, so the aggregates and caches follow.
+        """
+        for course_id in self.course_ids + self.created_courses:
+            client.request('DELETE', '/courses', {'course_id': course_id})
+        for student_id in self.students + self.created_students:
+            client.request('DELETE', '/students', {'id_number': student_id})
+        return
+
+    def _new_id(self):
+        with self.lock:
+            self.next_id += 1
+            return self.next_id
+
+    def _take(self, pool: list, rng: random.Random):
+        with self.lock:
+            if len(pool) == 0:
+                return None
+            i = rng.randrange(len(pool))
+            pool[i], pool[-1] = pool[-1], pool[i]
+            return pool.pop()
+
+    def _put(self, pool: list, item):
+        with self.lock:
+            pool.append(item)
+
+    def _pick(self, pool: list, rng: random.Random):
+        with self.lock:
+            return rng.choice(pool) if len(pool) > 0 else None
+
+    # reads
+    def get_student(self, rng):
+        return 'GET', f'/students?id_number={rng.choice(self.students)}', None
+
+    def get_course(self, rng):
+        return 'GET', f'/courses?course_id={rng.choice(self.course_ids)}', None
+
+    def get_grade(self, rng):
+        pair = self._pick(self.graded, rng) or self._pick(self.ungraded, rng)
+        return 'GET', f'/grades?student_id={pair[0]}&course_id={pair[1]}', None
+
+    def best_student(self, rng):
+        return 'GET', '/best_student', None
+
+    def easiest_course(self, rng):
+        return 'GET', '/easiest_course', None
+
+    # writes
+    def create_student(self, rng):
+        student_id = self._new_id()
+        self._put(self.created_students, student_id)
+        return 'POST', '/students', _student(student_id)
+
+    def update_student(self, rng):
+        return 'PUT', '/students', {'current_id': rng.choice(self.students), 'new': {'first_name': f'first {rng.randrange(10 ** 6)}'}}
+
+    def delete_student(self, rng):
+        student_id = self._take(self.created_students, rng)
+        return 'DELETE', '/students', {'id_number': student_id if student_id is not None else self._new_id()}
+
+    def create_course(self, rng):
+        course_id = self._new_id()
+        self._put(self.created_courses, course_id)
+        return 'POST', '/courses', {'course_id': course_id, 'name': f'course {course_id}', 'students': rng.sample(self.students, 5)}
+
+    def update_course(self, rng):
+        return 'PUT', '/courses', {'current_id': rng.choice(self.course_ids), 'new': {'name': f'course {rng.randrange(10 ** 6)}'}}
+
+    def delete_course(self, rng):
+        course_id = self._take(self.created_courses, rng)
+        return 'DELETE', '/courses', {'course_id': course_id if course_id is not None else self._new_id()}
+
+    # an enrollment is either graded or ungraded, a grade write that has no enrollment to
+    # work on turns into the other kind of write
+    def create_grade(self, rng):
+        pair = self._take(self.ungraded, rng)
+        if pair is None:
+            return self.update_grade(rng)
+        self._put(self.graded, pair)
+        return 'POST', '/grades', {'student_id': pair[0], 'course_id': pair[1], 'grade': rng.randrange(40, 101)}
+
+    def update_grade(self, rng):
+        pair = self._pick(self.graded, rng)
+        if pair is None:
+            return self.create_grade(rng)
+        return 'PUT', '/grades', {'current_sid': pair[0], 'current_cid': pair[1], 'new': {'grade': rng.randrange(40, 101)}}
+
+    def delete_grade(self, rng):
+        pair = self._take(self.graded, rng)
+        if pair is None:
+            return self.create_grade(rng)
+        self._put(self.ungraded, pair)
+        return 'DELETE', '/grades', {'student_id': pair[0], 'course_id': pair[1]}
+
+    def next_request(self, rng: random.Random, read_ratio: float):
+        operations = self.reads if rng.random() < read_ratio else self.writes
+        return rng.choice(operations)(rng)
+
+
+def _student(student_id: int):
+    return {'id_number': student_id, 'first_name': 'first', 'last_name': 'last', 'email': f'{student_id}@benchmark.test'}
+
+
+def _endpoint(method: str, path: str):
+    return f"{method} {path.split('?', 1)[0]}"
+
+
+def run(workload: Workload, client, requests: int, concurrency: int, read_ratio: float, seed: int):
+    """
+    send the requests from concurrency threads, returns the samples of every endpoint,
+    (latency seconds, round trips, status) tuples, and the wall time of the run.
+    """
+    samples = {}
+    samples_lock = threading.Lock()
+
+    def worker(index: int, count: int):
+        rng = random.Random(seed + index + 1)
+        local = {}
+        for _ in range(count):
+            method, path, body = workload.next_request(rng, read_ratio)
+            start = time.perf_counter()
+            status, round_trips = client.request(method, path, body)
+            local.setdefault(_endpoint(method, path), []).append((time.perf_counter() - start, round_trips, status))
+        with samples_lock:
+            for endpoint, endpoint_samples in local.items():
+                samples.setdefault(endpoint, []).extend(endpoint_samples)
+
+    counts = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+    threads = [threading.Thread(target=worker, args=(i, count)) for i, count in enumerate(counts)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - start
+
+
+def _percentile(values: list, q: float):
+    # nearest rank over sorted values
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def summarize(samples: list, wall: float):
+    latencies = sorted(s[0] for s in samples)
+    summary = {'requests': len(samples),
+               'throughput': len(samples) / wall,
+               'mean_ms': 1000 * sum(latencies) / len(latencies),
+               'round_trips': sum(s[1] for s in samples) / len(samples),
+               'errors': sum(1 for s in samples if s[2] >= 500),
+               'not_found': sum(1 for s in samples if 400 <= s[2] < 500)}
+    for q in PERCENTILES:
+        summary[f'p{int(q * 100)}_ms'] = 1000 * _percentile(latencies, q)
+    return summary
+
+
+def report(samples: dict, wall: float):
+    endpoints = {endpoint: summarize(endpoint_samples, wall) for endpoint, endpoint_samples in sorted(samples.items())}
+    total = summarize([s for endpoint_samples in samples.values() for s in endpoint_samples], wall)
+    return {'endpoints': endpoints, 'total': total}
+
+
+def print_report(results: dict):
+    print(f"{'endpoint':<22}{'requests':>10}{'req/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'round trips':>13}{'4xx':>7}{'5xx':>7}")
+    rows = list(results['endpoints'].items()) + [('total', results['total'])]
+    for endpoint, s in rows:
+        print(f"{endpoint:<22}{s['requests']:>10}{s['throughput']:>10.1f}{s['p50_ms']:>9.2f}{s['p95_ms']:>9.2f}"
+              f"{s['p99_ms']:>9.2f}{s['round_trips']:>13.2f}{s['not_found']:>7}{s['errors']:>7}")
+
+
+def compare(results: dict, baseline: dict):
+    """
+    print the change of the p95 latency and the throughput of every endpoint from a
+    baseline run, returns the endpoints that regressed by more than REGRESSION_THRESHOLD.
+    """
+    regressions = []
+    print(f"{'endpoint':<22}{'p95 ms':>18}{'req/s':>20}")
+    rows = list(results['endpoints'].items()) + [('total', results['total'])]
+    for endpoint, s in rows:
+        base = baseline['endpoints'].get(endpoint) if endpoint != 'total' else baseline['total']
+        if base is None:
+            continue
+        p95_change = s['p95_ms'] / base['p95_ms'] - 1
+        throughput_change = s['throughput'] / base['throughput'] - 1
+        flag = ''
+        if p95_change > REGRESSION_THRESHOLD or throughput_change < -REGRESSION_THRESHOLD:
+            regressions.append(endpoint)
+            flag = '  regressed'
+        print(f"{endpoint:<22}{base['p95_ms']:>8.2f} {s['p95_ms']:>8.2f}{base['throughput']:>10.1f} {s['throughput']:>9.1f}{flag}")
+    return regressions
+
+
+def _version():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(args, config_path: str):
+    client = HttpClient(args.url) if args.url else AppClient(config_path)
+    workload = Workload(args.students, args.courses, args.roster, args.graded, args.seed)
+    workload.seed(client, args.seed_chunk)
+    # let the bootstrap of the app finish building the leaderboards before measuring
+    time.sleep(args.settle)
+    try:
+        samples, wall = run(workload, client, args.requests, args.concurrency, args.read_ratio, args.seed)
+    finally:
+        if not args.local_servers:
+            workload.cleanup(client)
+    return report(samples, wall)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='load test the api with a mixed workload.')
+    parser.add_argument('--config', default='config.yml', help='path to the configuration file.')
+    parser.add_argument('--url', help='base url of a running server, the app is created in process by default.')
+    parser.add_argument('--local-servers', action='store_true', help='run against a throwaway local mongod and redis-server.')
+    parser.add_argument('--mongod', default='mongod', help='mongod binary of the local servers.')
+    parser.add_argument('--redis-server', default='redis-server', help='redis-server binary of the local servers.')
+    parser.add_argument('--requests', type=int, default=10000, help='requests to send.')
+    parser.add_argument('--concurrency', type=int, default=8, help='threads sending requests.')
+    parser.add_argument('--read-ratio', type=float, default=0.9, help='fraction of the requests that are reads.')
+    parser.add_argument('--students', type=int, default=2000, help='seeded students.')
+    parser.add_argument('--courses', type=int, default=100, help='seeded courses.')
+    parser.add_argument('--roster', type=int, default=50, help='students enrolled in every seeded course.')
+    parser.add_argument('--graded', type=float, default=0.5, help='fraction of the seeded enrollments with a grade.')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the workload.')
+    parser.add_argument('--seed-chunk', type=int, default=1000, help='items per seeding bulk request.')
+    parser.add_argument('--settle', type=float, default=1, help='seconds to wait between seeding and measuring.')
+    parser.add_argument('--output', help='file to save the results to, as json.')
+    parser.add_argument('--compare', help='results of a previous run to compare to.')
+    args = parser.parse_args(argv)
+    if args.url and args.local_servers:
+        parser.error('--local-servers runs the app in process, it can\'t be used with --url.')
+
+    config = yaml.load(open(args.config), Loader=yaml.Loader)
+    with (LocalServers(args.mongod, args.redis_server) if args.local_servers else _NoLocalServers()) as local_servers:
+        if local_servers is not None:
+            config_file = tempfile.NamedTemporaryFile('w', suffix='.yml', delete=False)
+            yaml.safe_dump(local_servers.apply(config), config_file)
+            config_file.close()
+            config_path = config_file.name
+        else:
+            config_path = args.config
+        try:
+            results = benchmark(args, config_path)
+        finally:
+            if local_servers is not None:
+                os.unlink(config_path)
+
+    results['version'] = _version()
+    results['time'] = time.time()
+    results['settings'] = {k: v for k, v in vars(args).items() if k not in ('output', 'compare')}
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,37 @@
+# gunicorn settings, driven by the server section of config.yml.
+# run from the src directory: gunicorn -c gunicorn.conf.py "app:create_app()"
+import os
+import shutil
+import yaml
+
+config = yaml.load(open('config.yml'), Loader=yaml.Loader)
+
+bind = f"0.0.0.0:{config['app']['port']}"
+workers = config['server']['workers']
+threads = config['server']['threads']
+worker_class = 'gthread'
+
+# the app is created in every worker after the fork, so no client is shared between workers
+preload_app = False
+
+# the workers write their metrics to files in this directory, read by the scrapes (see metrics_utils).
+# it is set before any worker imports prometheus_client.
+if config['metrics']['enabled']:
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = config['metrics']['multiproc_dir']
+
+
+def on_starting(server):
+    # empty the log of the previous run, before any worker opens it
+    if config['server']['truncate_log']:
+        open(config['logging']['file'], 'w').close()
+    # drop the metrics of the previous run
+    if config['metrics']['enabled']:
+        shutil.rmtree(config['metrics']['multiproc_dir'], ignore_errors=True)
+        os.makedirs(config['metrics']['multiproc_dir'])
+
+
+def child_exit(server, worker):
+    # the connection pool gauges of a dead worker stop counting
+    if config['metrics']['enabled']:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,21 @@
+# hypercorn settings for the asyncio server mode, driven by the server section of config.yml.
+# run from the src directory: hypercorn -c python:hypercorn_conf "async_app:create_app()"
+import os
+import shutil
+import yaml
+
+config = yaml.load(open('config.yml'), Loader=yaml.Loader)
+
+bind = [f"0.0.0.0:{config['app']['port']}"]
+workers = config['server']['workers']
+
+# empty the log of the previous run, before any worker opens it
+if config['server']['truncate_log']:
+    open(config['logging']['file'], 'w').close()
+
+# the workers write their metrics to files in this directory, read by the scrapes (see metrics_utils).
+# the directory is emptied here, as this module is only run by the parent process.
+if config['metrics']['enabled']:
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = config['metrics']['multiproc_dir']
+    shutil.rmtree(config['metrics']['multiproc_dir'], ignore_errors=True)
+    os.makedirs(config['metrics']['multiproc_dir'])
@@ -0,0 +1,137 @@
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+
+import redis
+import yaml
+from pymongo import MongoClient
+
+from utils import logging_utils
+from utils import stats_utils
+from utils import redis_utils
+from utils import connection_utils
+from utils import index_utils
+from utils import entity_cache
+from utils import change_stream_utils
+from utils import migration_utils
+from utils import export_utils
+from utils import write_behind_utils
+
+
+def rebuild_stats(client: MongoClient, r: redis.Redis, args):
+    counts = stats_utils.rebuild_grade_stats(client)
+    index_utils.ensure_indexes(client, [stats_utils.STUDENT_STATS, stats_utils.COURSE_STATS])
+    redis_utils.build_leaderboards(stats_utils.get_all_averages(client), r)
+    print(json.dumps(counts))
+    return 0
+
+
+def check_stats(client: MongoClient, r: redis.Redis, args):
+    report = stats_utils.check_grade_stats(client)
+    print(json.dumps(report, indent=2))
+    consistent = all(len(ids) == 0 for collection in report.values() for ids in collection.values())
+    return 0 if consistent else 1
+
+
+def ensure_indexes(client: MongoClient, r: redis.Redis, args):
+    errors = index_utils.ensure_indexes(client)
+    print(json.dumps(errors, indent=2))
+    return 0 if len(errors) == 0 else 1
+
+
+def check_indexes(client: MongoClient, r: redis.Redis, args):
+    report = index_utils.check_indexes(client)
+    print(json.dumps(report, indent=2))
+    matching = all(len(names) == 0 for collection in report.values() for names in collection.values())
+    return 0 if matching else 1
+
+
+def migrate_enrollments(client: MongoClient, r: redis.Redis, args):
+    counts = migration_utils.migrate_enrollments(client, args.batch_size)
+    print(json.dumps(counts))
+    return 0
+
+
+def export(client: MongoClient, r: redis.Redis, args):
+    params = export_utils.unpack_export_params(args.collection, vars(args))
+    if params is None:
+        print(f"invalid export of {args.collection}.", file=sys.stderr)
+        return 1
+    config = yaml.load(open(args.config), Loader=yaml.Loader)
+    output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for data in export_utils.export(args.collection, **params, compress=args.gzip, client=client, **config['export']):
+            output.write(data)
+    finally:
+        if args.output:
+            output.close()
+    return 0
+
+
+def consume_changes(client: MongoClient, r: redis.Redis, args):
+    # runs until interrupted, a single consumer should run per deployment
+    config = yaml.load(open(args.config), Loader=yaml.Loader)
+    entity_cache.configure(**config['entity_cache'])
+    settings = {k: v for k, v in config['change_streams'].items() if k != 'enabled'}
+    change_stream_utils.enable_images(client)
+    change_stream_utils.consume(client, r, **settings)
+    return 0
+
+
+def drain_grades(client: MongoClient, r: redis.Redis, args):
+    # runs until interrupted, every worker is a consumer of the group, any number can run per deployment
+    config = yaml.load(open(args.config), Loader=yaml.Loader)
+    entity_cache.configure(**config['entity_cache'])
+    change_stream_utils.configure(config['change_streams']['enabled'])
+    settings = {k: v for k, v in config['write_behind'].items() if k != 'enabled'}
+    consumer = args.consumer or f"{socket.gethostname()}-{os.getpid()}"
+    workers = [threading.Thread(target=write_behind_utils.consume, args=(client, r, f"{consumer}-{i}"), kwargs=settings, daemon=True)
+               for i in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='school system maintenance commands.')
+    parser.add_argument('--config', default='config.yml', help='path to the configuration file.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('rebuild-stats', help='recompute the grade aggregates and leaderboards from scratch.').set_defaults(func=rebuild_stats)
+    commands.add_parser('check-stats', help='compare the grade aggregates to a full aggregation.').set_defaults(func=check_stats)
+    commands.add_parser('ensure-indexes', help='create the missing db indexes.').set_defaults(func=ensure_indexes)
+    commands.add_parser('check-indexes', help='compare the db indexes to the declared ones.').set_defaults(func=check_indexes)
+    migrate = commands.add_parser('migrate-enrollments', help='move the embedded course students to the enrollments collection.')
+    migrate.add_argument('--batch-size', type=int, default=1000, help='number of courses migrated at a time.')
+    migrate.set_defaults(func=migrate_enrollments)
+    exporter = commands.add_parser('export', help='stream a collection as ndjson or csv.')
+    exporter.add_argument('collection', choices=sorted(export_utils.FIELDS), help='collection to export.')
+    exporter.add_argument('--format', choices=sorted(export_utils.CONTENT_TYPES), default=export_utils.NDJSON)
+    exporter.add_argument('--course-id', type=int, help='export only the documents of this course.')
+    exporter.add_argument('--student-id', type=int, help='export only the documents of this student.')
+    exporter.add_argument('--gzip', action='store_true', help='gzip the output.')
+    exporter.add_argument('--output', help='file to write to, stdout by default.')
+    exporter.set_defaults(func=export)
+    commands.add_parser('consume-changes', help='maintain the aggregates and caches from the db change streams.').set_defaults(func=consume_changes)
+    drainer = commands.add_parser('drain-grades', help='insert the grades queued in write-behind mode.')
+    drainer.add_argument('--workers', type=int, default=1, help='number of consumers to run.')
+    drainer.add_argument('--consumer', help='name prefix of the consumers, the host and pid by default.')
+    drainer.set_defaults(func=drain_grades)
+    args = parser.parse_args(argv)
+
+    config = yaml.load(open(args.config), Loader=yaml.Loader)
+    logging_utils.configure(**config['logging'])
+    client = connection_utils.get_mongo_client(config)
+    r = connection_utils.get_redis_client(config)
+    try:
+        return args.func(client, r, args)
+    finally:
+        connection_utils.close_clients()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+import os
+
+import mongomock
+import mongomock.aggregate
+import mongomock.collection
+import fakeredis
+import pytest
+import yaml
+
+import app
+from utils import logging_utils
+from utils import connection_utils
+from utils import entity_cache
+from utils import stats_cache
+from utils import change_stream_utils
+
+# the tests run against mongomock and fakeredis, run them from the src directory:
+#     python3 -m pytest -q
+
+
+def _without_sort(add):
+    # pymongo 4.x passes the sort of an update to the bulk builder, which mongomock doesn't take
+    def wrapper(self, *args, sort=None, **kwargs):
+        return add(self, *args, **kwargs)
+    return wrapper
+
+
+def _union_with(in_collection, database, options):
+    return list(in_collection) + list(database[options['coll']].aggregate(options.get('pipeline', [])))
+
+
+@pytest.fixture(autouse=True, scope='session')
+def test_logging(tmp_path_factory):
+    # keep the records of the tests out of the log of the app
+    logging_utils.configure(file=str(tmp_path_factory.mktemp('logs') / 'school.log'))
+
+
+@pytest.fixture(autouse=True)
+def mongomock_support(monkeypatch):
+    # the stage and the bulk arguments of the school db that mongomock lacks
+    builder = mongomock.collection.BulkOperationBuilder
+    monkeypatch.setattr(builder, 'add_update', _without_sort(builder.add_update))
+    monkeypatch.setattr(builder, 'add_replace', _without_sort(builder.add_replace))
+    monkeypatch.setitem(mongomock.aggregate._PIPELINE_HANDLERS, '$unionWith', _union_with)
+
+
+def configure_modes(entity_caching: bool = False, change_streams: bool = False):
+    entity_cache.configure(entity_caching, max_entries=1000, ttl=60, redis_ttl=300, tombstone_ttl=5)
+    stats_cache.configure(False, max_entries=100, ttl=60)
+    change_stream_utils.configure(change_streams)
+
+
+@pytest.fixture(autouse=True)
+def default_modes():
+    # the modes are per process module state, every test starts and leaves them at the defaults
+    configure_modes()
+    yield
+    configure_modes()
+
+
+@pytest.fixture
+def client():
+    return mongomock.MongoClient()
+
+
+@pytest.fixture
+def r():
+    return fakeredis.FakeRedis()
+
+
+@pytest.fixture
+def config(tmp_path):
+    """
+    the config of the app under test: the background threads, the process caches, the
+    metrics and the profiling are off, and it logs to a temporary file.
+    """
+    config = app.load_config(os.path.join(os.path.dirname(app.__file__), 'config.yml'))
+    config['logging']['file'] = str(tmp_path / 'school.log')
+    for section in ('entity_cache', 'stats_cache', 'warmer', 'metrics', 'profiling'):
+        config[section]['enabled'] = False
+    return config
+
+
+@pytest.fixture
+def api(config, client, r, tmp_path, monkeypatch):
+    """
+    a test client of the sync app over the mongomock and fakeredis clients, bootstrapped
+    before the first request.
+    """
+    path = tmp_path / 'config.yml'
+    path.write_text(yaml.safe_dump(config))
+    monkeypatch.setattr(connection_utils, 'get_mongo_client', lambda config: client)
+    monkeypatch.setattr(connection_utils, 'get_redis_client', lambda config: r)
+    bootstrap = app.bootstrap
+    monkeypatch.setattr(app, 'bootstrap', lambda config: None)
+    flask_app = app.create_app(str(path))
+    bootstrap(flask_app.config['SCHOOL'])
+    return flask_app.test_client()
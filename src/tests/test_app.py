@@ -0,0 +1,29 @@
+import pytest
+
+
+def _student(id_num):
+    return {'id_number': id_num, 'first_name': 'first', 'last_name': 'last', 'email': f'{id_num}@school.test'}
+
+
+def test_created_documents_are_served(api):
+    assert api.post('/students', json=_student(1)).json == {'new_student_id': 1}
+    assert api.post('/courses', json={'course_id': 10, 'name': 'course', 'students': [1]}).json == {'new_course_id': 10}
+    assert api.get('/students?id_number=1').json['email'] == '1@school.test'
+    assert api.get('/courses?course_id=10').json['students'] == [1]
+
+
+def test_every_response_reports_its_round_trips(api):
+    response = api.get('/students?id_number=1')
+    assert int(response.headers['X-DB-Round-Trips']) >= 0
+
+
+@pytest.mark.parametrize('url', ['/students?id_number=x', '/courses?course_id=1.5', '/grades?student_id=a&course_id=1',
+                                 '/grades?student_id=1&course_id=', '/students/rank?id_number=x', '/courses/rank?course_id=x'])
+def test_ids_in_the_url_that_arent_integers_are_invalid(api, url):
+    response = api.get(url)
+    assert response.status_code == 404 and response.json['error'].startswith('invalid')
+
+
+def test_ids_in_the_body_must_be_new(api):
+    api.post('/students', json=_student(1))
+    assert api.post('/students', json=_student(1)).json == {'error': 'given id for student already exists.'}
@@ -0,0 +1,54 @@
+import asyncio
+
+import fakeredis
+
+from utils import api_utils
+from utils import redis_utils
+from utils import async_redis_utils
+
+
+def _run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_both_modes_read_the_same_leaderboards():
+    server = fakeredis.FakeServer()
+    r, ar = fakeredis.FakeRedis(server=server), fakeredis.FakeAsyncRedis(server=server)
+    redis_utils.build_leaderboards({'students': {1: 70, 2: 90, 3: 90}, 'courses': {}}, r)
+    _run(async_redis_utils.update_leaderboards({4: 95, 1: None}, {}, ar))
+    assert _run(async_redis_utils.get_top_students(3, ar)) == redis_utils.get_top_students(3, r)
+    assert _run(async_redis_utils.get_student_rank(3, ar)) == {'average': 90, 'rank': 2, 'out_of': 3}
+
+
+def test_async_leader_caches_single_flight():
+    ar = fakeredis.FakeAsyncRedis()
+    calls = []
+
+    async def recompute(id_num):
+        calls.append(id_num)
+        return {'id_number': id_num}
+
+    async def main():
+        await async_redis_utils.build_leaderboards({'students': {5: 80}, 'courses': {}}, ar)
+        first = await async_redis_utils.get_best_student(recompute, ar, max_staleness=5, lock_timeout=1)
+        second = await async_redis_utils.get_best_student(recompute, ar, max_staleness=5, lock_timeout=1)
+        return first, second
+
+    assert _run(main()) == (({'id_number': 5}, None), ({'id_number': 5}, None))
+    assert calls == [5]
+
+
+def test_responses_are_shaped_once_for_both_modes():
+    assert api_utils.student_found(1, None) == ({'error': 'student with given id: 1 was not found.'}, 404)
+    assert api_utils.student_updated(1, False) == api_utils.invalid_student()
+    assert api_utils.grade_queued('1-0', 'queued') == ({'ticket': '1-0', 'status': 'queued'}, 202)
+    assert api_utils.rank_found('course_id', 'course', 3, {'rank': 1}) == ({'course_id': 3, 'rank': 1}, 200)
+
+
+def test_url_params_are_parsed_once_for_both_modes():
+    assert api_utils.unpack_url_id('12') == 12
+    assert api_utils.unpack_url_id('1e3') is None
+    assert api_utils.unpack_students_page({'students_after': '4', 'students_limit': '2'}, 50, 100) == (4, 2)
+    assert api_utils.unpack_students_page({'students_limit': '101'}, 50, 100) is None
+    assert api_utils.unpack_leaderboard_size({}, 10, 100) == 10
+    assert api_utils.unpack_leaderboard_size({'n': '0'}, 10, 100) is None
@@ -0,0 +1,48 @@
+import json
+
+from utils import bulk_utils
+from utils import redis_utils
+
+
+def _student(id_num):
+    return {'id_number': id_num, 'first_name': 'first', 'last_name': 'last', 'email': f'{id_num}@school.test'}
+
+
+def _statuses(response):
+    return [result['status'] for result in response.json['results']]
+
+
+def test_a_bad_item_doesnt_stop_the_batch(api):
+    api.post('/students', json=_student(2))
+    response = api.post('/students/bulk', json=[_student(1), _student(2), {'id_number': 'x'}, _student(1), _student(3)])
+    assert _statuses(response) == ['created', 'duplicate', 'invalid', 'duplicate', 'created']
+    assert response.json['summary'] == {'created': 2, 'duplicate': 2, 'invalid': 1}
+
+
+def test_courses_and_grades_are_checked_against_the_db(api):
+    api.post('/students/bulk', json=[_student(1), _student(2)])
+    courses = [{'course_id': 10, 'name': 'course', 'students': [1, 2]}, {'course_id': 11, 'name': 'course', 'students': [9]}]
+    assert _statuses(api.post('/courses/bulk', json=courses)) == ['created', 'invalid']
+    grades = [{'student_id': 1, 'course_id': 10, 'grade': 80}, {'student_id': 2, 'course_id': 10, 'grade': 90},
+              {'student_id': 1, 'course_id': 11, 'grade': 70}, {'student_id': 1, 'course_id': 10, 'grade': 60}]
+    assert _statuses(api.post('/grades/bulk', json=grades)) == ['created', 'created', 'invalid', 'duplicate']
+
+
+def test_a_grade_batch_reaches_the_aggregates_and_leaderboards(api, r):
+    api.post('/students/bulk', json=[_student(1), _student(2)])
+    api.post('/courses/bulk', json=[{'course_id': 10, 'name': 'course', 'students': [1, 2]}])
+    api.post('/grades/bulk', json=[{'student_id': 1, 'course_id': 10, 'grade': 80}, {'student_id': 2, 'course_id': 10, 'grade': 90}])
+    assert [s['student_id'] for s in redis_utils.get_top_students(2, r)] == [2, 1]
+    assert redis_utils.get_course_rank(10, r)['average'] == 85
+
+
+def test_ndjson_batches_stream_a_result_per_line(api):
+    body = '\n'.join(json.dumps(item) for item in (_student(1), _student(1))) + '\nnot json\n'
+    response = api.post('/students/bulk', data=body, content_type=bulk_utils.NDJSON)
+    *results, summary = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [(result['index'], result['status']) for result in results] == [(0, 'created'), (1, 'duplicate'), (2, 'invalid')]
+    assert summary == {'summary': {'created': 1, 'duplicate': 1, 'invalid': 1}}
+
+
+def test_a_body_that_isnt_a_batch_is_invalid(api):
+    assert api.post('/students/bulk', json={'id_number': 1}).status_code == 404
@@ -0,0 +1,85 @@
+import pytest
+
+from utils import dbutils
+from utils import stats_utils
+from utils import redis_utils
+
+
+def _setup(client, r, grades):
+    """
+    create the students and courses of the given (student_id, course_id, grade) triples and their grades.
+    """
+    for sid in sorted({g[0] for g in grades}):
+        dbutils.create_student(sid, 'first', 'last', f'{sid}@school.test', client)
+    for cid in sorted({g[1] for g in grades}):
+        dbutils.create_course(cid, 'course', sorted({g[0] for g in grades if g[1] == cid}), client)
+    for sid, cid, grade in grades:
+        dbutils.create_grade(sid, cid, grade, client, r)
+
+
+def test_deleting_a_course_removes_its_grades_in_batches(client, r, monkeypatch):
+    monkeypatch.setattr(dbutils, 'DELETE_BATCH_SIZE', 3)
+    _setup(client, r, [(sid, 10, 50 + sid) for sid in range(1, 8)] + [(1, 11, 90)])
+    batches = []
+    remove = stats_utils.remove_grades_from_stats
+
+    def remove_grades_from_stats(grades, *args, **kwargs):
+        batches.append(len(grades))
+        return remove(grades, *args, **kwargs)
+    monkeypatch.setattr(stats_utils, 'remove_grades_from_stats', remove_grades_from_stats)
+
+    assert dbutils.delete_course(10, client, r)
+    assert batches == [3, 3, 1]
+    assert client.school.grades.count_documents({}) == 1
+    assert client.school.enrollments.count_documents({'course_id': 10}) == 0
+    assert redis_utils.get_course_rank(10, r) is None
+    assert [s['student_id'] for s in redis_utils.get_top_students(10, r)] == [1]
+    assert redis_utils.get_student_rank(1, r)['average'] == 90
+
+
+def test_leaderboards_are_refreshed_after_the_cascade(client, r, monkeypatch):
+    _setup(client, r, [(1, 10, 80), (1, 11, 60), (2, 10, 70)])
+    remaining = []
+    refresh = stats_utils.refresh_leaderboards
+
+    def refresh_leaderboards(students, courses, *args):
+        remaining.append(client.school.grades.count_documents({'student_id': 1}))
+        return refresh(students, courses, *args)
+    monkeypatch.setattr(stats_utils, 'refresh_leaderboards', refresh_leaderboards)
+
+    assert dbutils.delete_student(1, client, r)
+    # refreshed once, from the committed aggregates of every grade the cascade deleted
+    assert remaining == [0]
+    assert redis_utils.get_student_rank(1, r) is None
+    assert redis_utils.get_course_rank(10, r)['average'] == 70
+    assert redis_utils.get_course_rank(11, r) is None
+
+
+def test_renaming_a_student_moves_grades_and_leaderboard_entry(client, r):
+    _setup(client, r, [(1, 10, 80), (2, 10, 70)])
+    assert dbutils.update_student(1, {'id_number': 5}, client, r)['id_number'] == 5
+    assert client.school.grades.count_documents({'student_id': 5}) == 1
+    assert client.school.enrollments.count_documents({'student_id': 5}) == 1
+    assert redis_utils.get_student_rank(1, r) is None
+    assert redis_utils.get_student_rank(5, r) == {'average': 80, 'rank': 1, 'out_of': 2}
+
+
+def test_removing_students_from_a_course_deletes_their_grades(client, r):
+    _setup(client, r, [(1, 10, 80), (2, 10, 60), (3, 10, 100)])
+    dbutils.update_course(10, {'students': [1, 2]}, client, r)
+    assert sorted(client.school.grades.distinct('student_id')) == [1, 2]
+    assert redis_utils.get_course_rank(10, r)['average'] == 70
+    assert redis_utils.get_student_rank(3, r) is None
+
+
+def test_a_failed_cascade_leaves_redis_untouched(client, r, monkeypatch):
+    _setup(client, r, [(1, 10, 80), (2, 10, 70)])
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('write failed')
+    monkeypatch.setattr(stats_utils, 'rename_course_stats', fail)
+
+    with pytest.raises(RuntimeError):
+        dbutils.update_course(10, {'course_id': 20}, client, r)
+    assert redis_utils.get_course_rank(10, r)['average'] == 75
+    assert redis_utils.get_course_rank(20, r) is None
@@ -0,0 +1,99 @@
+import pymongo.errors
+import pytest
+
+from utils import change_stream_utils
+from utils import dbutils
+from utils import stats_utils
+from utils import redis_utils
+
+
+def _event(op: str, coll: str, before: dict = None, after: dict = None):
+    event = {'_id': {'_data': op}, 'operationType': op, 'ns': {'db': 'school', 'coll': coll}}
+    if before is not None:
+        event['fullDocumentBeforeChange'] = before
+    if after is not None:
+        event['fullDocument'] = after
+    return event
+
+
+def _grade(student_id, course_id, grade):
+    return {'student_id': student_id, 'course_id': course_id, 'grade': grade}
+
+
+def _consume(events, client, r):
+    effects = change_stream_utils.apply_events(events, client)
+    change_stream_utils.update_caches(events, effects, client, r)
+    return effects
+
+
+class Stream:
+    """
+    a change stream returning the given events, then None.
+    """
+
+    def __init__(self, events):
+        self.events = list(events)
+        self.alive = True
+
+    def try_next(self):
+        return self.events.pop(0) if self.events else None
+
+
+def test_grade_events_maintain_the_aggregates_and_leaderboards(client, r):
+    effects = _consume([_event('insert', 'grades', after=_grade(1, 10, 80)),
+                        _event('insert', 'grades', after=_grade(2, 10, 60)),
+                        _event('update', 'grades', before=_grade(2, 10, 60), after=_grade(2, 10, 100)),
+                        _event('delete', 'grades', before=_grade(1, 10, 80))], client, r)
+    assert (effects.students, effects.courses) == ({1, 2}, {10})
+    assert stats_utils.get_averages(stats_utils.STUDENT_STATS, [1, 2], client) == {1: None, 2: 100}
+    assert redis_utils.get_student_rank(1, r) is None
+    assert redis_utils.get_course_rank(10, r)['average'] == 100
+
+
+def test_leaderboards_are_refreshed_once_per_batch(client, r, monkeypatch):
+    refreshes = []
+    monkeypatch.setattr(stats_utils, 'refresh_leaderboards', lambda students, courses, *args: refreshes.append((sorted(students), sorted(courses))))
+    _consume([_event('insert', 'grades', after=_grade(sid, 10, 70)) for sid in (1, 2, 3)], client, r)
+    assert refreshes == [([1, 2, 3], [10])]
+
+
+def test_events_that_dont_change_aggregates_are_skipped(client, r):
+    unchanged = _event('update', 'grades', before=_grade(1, 10, 80), after=_grade(1, 10, 80))
+    without_image = _event('delete', 'grades')
+    effects = _consume([unchanged, without_image, _event('drop', 'grades')], client, r)
+    assert (effects.students, effects.courses) == (set(), set())
+    assert client.school[stats_utils.STUDENT_STATS].count_documents({}) == 0
+
+
+def test_entity_events_invalidate_their_dependents(client, r, monkeypatch):
+    invalidated = []
+    monkeypatch.setattr(redis_utils, 'invalidate_dependents', lambda r, students, courses: invalidated.append((students, courses)))
+    _consume([_event('update', 'students', before={'id_number': 1}, after={'id_number': 2}),
+              _event('insert', 'courses', after={'course_id': 11}),
+              _event('delete', 'enrollments', before={'course_id': 10, 'student_id': 1})], client, r)
+    assert [(sorted(students), courses) for students, courses in invalidated] == [([1, 2], [10])]
+
+
+def test_batches_fill_up_to_their_size():
+    stream = Stream(range(5))
+    assert change_stream_utils.next_batch(stream, 2, 0.01) == [0, 1]
+    assert change_stream_utils.next_batch(stream, 10, 0.01) == [2, 3, 4]
+    assert change_stream_utils.next_batch(stream, 10, 0.01) == []
+
+
+def test_a_moved_resume_token_is_detected(client):
+    change_stream_utils.save_token(None, 'a', client)
+    assert change_stream_utils.load_token(client) == 'a'
+    change_stream_utils.save_token('a', 'b', client)
+    with pytest.raises(pymongo.errors.DuplicateKeyError):
+        change_stream_utils.save_token('a', 'c', client)
+    assert change_stream_utils.load_token(client) == 'b'
+
+
+def test_writes_leave_the_aggregates_to_the_consumer(client, r):
+    change_stream_utils.configure(True)
+    dbutils.create_student(1, 'first', 'last', '1@school.test', client)
+    dbutils.create_course(10, 'course', [1], client)
+    dbutils.create_grade(1, 10, 90, client, r)
+    assert client.school[stats_utils.STUDENT_STATS].count_documents({}) == 0
+    assert redis_utils.get_student_rank(1, r) is None
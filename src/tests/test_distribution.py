@@ -0,0 +1,58 @@
+from utils import stats_utils
+from utils import redis_utils
+
+BINS = [0, 50, 100]
+
+
+def _histogram_result(client, course_id: int):
+    """
+    the result of the distribution aggregation with a made up summary. mongomock runs
+    the histogram stages, but not $median and $percentile.
+    """
+    pipeline = stats_utils._distribution_pipeline(course_id, [0.5], BINS)
+    histogram = list(client.school.grades.aggregate(pipeline[:2] + pipeline[2]['$facet']['histogram']))
+    summary = {'count': 0, 'mean': 0, 'median': 0, 'std': 0, 'min': 0, 'max': 0, 'percentiles': [0]}
+    return {'summary': [summary], 'histogram': histogram}
+
+
+def _counts(distribution):
+    return [(bucket['from'], bucket['to'], bucket['count']) for bucket in distribution['histogram']]
+
+
+def test_grades_on_a_bound_fall_in_the_bucket_it_starts(client):
+    client.school.grades.insert_many([{'course_id': 10, 'grade': g} for g in (0, 49.9, 50, 99, 100)])
+    distribution = stats_utils.format_distribution(10, _histogram_result(client, 10), [0.5], BINS)
+    assert _counts(distribution) == [(None, 0, 0), (0, 50, 2), (50, 100, 2), (100, None, 1)]
+
+
+def test_the_open_ended_buckets_take_the_grades_outside_the_bins(client):
+    client.school.grades.insert_many([{'course_id': 10, 'grade': g} for g in (-5, -0.1, 100, 250)])
+    distribution = stats_utils.format_distribution(10, _histogram_result(client, 10), [0.5], BINS)
+    assert _counts(distribution) == [(None, 0, 2), (0, 50, 0), (50, 100, 0), (100, None, 2)]
+
+
+def test_every_bucket_is_listed(client):
+    client.school.grades.insert_one({'course_id': 10, 'grade': 70})
+    distribution = stats_utils.format_distribution(10, _histogram_result(client, 10), [0.5], BINS)
+    assert _counts(distribution) == [(None, 0, 0), (0, 50, 0), (50, 100, 1), (100, None, 0)]
+
+
+def test_a_course_without_grades_has_no_distribution():
+    assert stats_utils.format_distribution(10, None, [0.5], BINS) is None
+    assert stats_utils.format_distribution(10, {'summary': [], 'histogram': []}, [0.5], BINS) is None
+
+
+def test_distributions_are_recomputed_after_grades_change(r):
+    computed = []
+
+    def compute():
+        computed.append(1)
+        return {'course_id': 10, 'count': len(computed)}
+
+    assert redis_utils.get_course_distribution(10, compute, r, 60)['count'] == 1
+    assert redis_utils.get_course_distribution(10, compute, r, 60)['count'] == 1
+    redis_utils.update_leaderboards({}, {10: 80}, r)
+    assert redis_utils.get_course_distribution(10, compute, r, 60)['count'] == 2
+    # another course's grades leave it cached
+    redis_utils.update_leaderboards({}, {11: 80}, r)
+    assert redis_utils.get_course_distribution(10, compute, r, 60)['count'] == 2
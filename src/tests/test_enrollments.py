@@ -0,0 +1,65 @@
+from utils import migration_utils
+from utils import redis_utils
+
+
+def _student(api, id_num):
+    api.post('/students', json={'id_number': id_num, 'first_name': 'first', 'last_name': 'last', 'email': f'{id_num}@school.test'})
+
+
+def test_students_are_enrolled_one_at_a_time(api, client):
+    for sid in (1, 2):
+        _student(api, sid)
+    api.post('/courses', json={'course_id': 10, 'name': 'course', 'students': [1]})
+    assert api.post('/courses/10/students', json={'student_id': 2}).json == {'course_id': 10, 'enrolled_student_id': 2}
+    assert api.post('/courses/10/students', json={'student_id': 2}).status_code == 404
+    assert api.post('/courses/10/students', json={'student_id': 9}).status_code == 404
+    assert api.post('/courses/11/students', json={'student_id': 1}).status_code == 404
+    assert sorted(client.school.enrollments.distinct('student_id', {'course_id': 10})) == [1, 2]
+
+
+def test_unenrolling_deletes_the_grade(api, client, r):
+    for sid in (1, 2):
+        _student(api, sid)
+    api.post('/courses', json={'course_id': 10, 'name': 'course', 'students': [1, 2]})
+    api.post('/grades', json={'student_id': 1, 'course_id': 10, 'grade': 60})
+    api.post('/grades', json={'student_id': 2, 'course_id': 10, 'grade': 80})
+
+    assert api.delete('/courses/10/students', json={'student_id': 1}).status_code == 200
+    assert api.delete('/courses/10/students', json={'student_id': 1}).status_code == 404
+    assert client.school.grades.count_documents({'student_id': 1}) == 0
+    assert redis_utils.get_student_rank(1, r) is None
+    assert redis_utils.get_course_rank(10, r)['average'] == 80
+
+
+def test_course_students_are_paged(api):
+    for sid in range(1, 6):
+        _student(api, sid)
+    api.post('/courses', json={'course_id': 10, 'name': 'course', 'students': [5, 3, 1, 4, 2]})
+
+    first = api.get('/courses?course_id=10&students_limit=2').json
+    assert (first['students'], first['next_students_after']) == ([1, 2], 2)
+    second = api.get('/courses?course_id=10&students_limit=2&students_after=2').json
+    assert (second['students'], second['next_students_after']) == ([3, 4], 4)
+    last = api.get('/courses?course_id=10&students_limit=2&students_after=4').json
+    assert (last['students'], last['next_students_after']) == ([5], None)
+    # a last page that is full has no cursor either
+    full = api.get('/courses?course_id=10&students_limit=5').json
+    assert (len(full['students']), full['next_students_after']) == (5, None)
+
+
+def test_invalid_students_pages_are_rejected(api):
+    api.post('/courses', json={'course_id': 10, 'name': 'course', 'students': []})
+    assert api.get('/courses?course_id=10&students_limit=0').status_code == 404
+    assert api.get('/courses?course_id=10&students_limit=1001').status_code == 404
+    assert api.get('/courses?course_id=10&students_after=x').status_code == 404
+
+
+def test_embedded_students_are_migrated(client):
+    client.school.courses.insert_many([{'course_id': 10, 'name': 'course', 'students': [1, 2, 2]},
+                                       {'course_id': 11, 'name': 'course', 'students': []},
+                                       {'course_id': 12, 'name': 'course'}])
+    assert migration_utils.migrate_enrollments(client, batch_size=1) == {'courses': 2, 'enrollments': 2}
+    assert sorted((e['course_id'], e['student_id']) for e in client.school.enrollments.find()) == [(10, 1), (10, 2)]
+    assert client.school.courses.count_documents({'students': {'$exists': True}}) == 0
+    # running it again migrates nothing
+    assert migration_utils.migrate_enrollments(client) == {'courses': 0, 'enrollments': 0}
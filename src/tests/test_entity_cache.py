@@ -0,0 +1,109 @@
+import time
+
+import pytest
+
+from utils import dbutils
+from utils import entity_cache
+
+
+@pytest.fixture
+def cache():
+    entity_cache.configure(True, max_entries=1000, ttl=60, redis_ttl=300, tombstone_ttl=5)
+    entity_cache.start_request()
+
+
+class Loader:
+    """
+    a load function returning the current document, counting its calls.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return dict(self.document) if self.document is not None else None
+
+
+def test_documents_are_read_through_once(cache, r):
+    load = Loader({'id_number': 1, 'first_name': 'a'})
+    key = entity_cache.student_key(1)
+    first = entity_cache.get(key, load, r)
+    first['first_name'] = 'changed'
+    assert entity_cache.get(key, load, r) == {'id_number': 1, 'first_name': 'a'}
+    assert load.calls == 1
+    # another worker finds it in redis
+    entity_cache.configure(True, max_entries=1000, ttl=60, redis_ttl=300, tombstone_ttl=5)
+    entity_cache.start_request()
+    assert entity_cache.get(key, load, r)['first_name'] == 'a'
+    assert load.calls == 1
+
+
+def test_missing_documents_arent_cached(cache, r):
+    load = Loader(None)
+    assert entity_cache.get(entity_cache.student_key(1), load, r) is None
+    assert entity_cache.get(entity_cache.student_key(1), load, r) is None
+    assert load.calls == 2
+
+
+def test_stale_reader_cant_refill_over_a_tombstone(cache, r):
+    key = entity_cache.student_key(1)
+    load = Loader({'id_number': 1, 'first_name': 'old'})
+
+    def stale_load():
+        # the write commits and invalidates while the reader is still loading the old document
+        document = load()
+        load.document = {'id_number': 1, 'first_name': 'new'}
+        entity_cache.invalidate([key], r)
+        return document
+
+    assert entity_cache.get(key, stale_load, r)['first_name'] == 'old'
+    assert r.get(key) == entity_cache.TOMBSTONE.encode()
+    assert 0 < r.ttl(key) <= 5
+    entity_cache.start_request()
+    assert entity_cache.get(key, load, r, local=False)['first_name'] == 'new'
+    # once the tombstone expires the next reader stores the document again
+    r.delete(key)
+    entity_cache.start_request()
+    entity_cache.get(key, load, r, local=False)
+    assert entity_cache.deserialize(r.get(key))['first_name'] == 'new'
+
+
+def test_batch_lookups_keep_the_order_of_the_ids(cache, r):
+    loaded = []
+
+    def load(ids):
+        loaded.append(ids)
+        return {i: {'id_number': i} for i in ids if i != 3}
+
+    assert entity_cache.get_many([2, 1, 3, 2], entity_cache.student_key, load, r) == \
+        [{'id_number': 2}, {'id_number': 1}, None, {'id_number': 2}]
+    entity_cache.get_many([1, 3, 4], entity_cache.student_key, load, r)
+    assert loaded == [[2, 1, 3], [3, 4]]
+
+
+def test_lru_evicts_the_least_recent_and_expires():
+    lru = entity_cache.LRUCache(2, 60)
+    lru.set('a', '1')
+    lru.set('b', '2')
+    lru.get('a')
+    lru.set('c', '3')
+    assert (lru.get('a'), lru.get('b'), lru.get('c')) == ('1', None, '3')
+    assert lru.counters['evictions'] == 1
+
+    lru = entity_cache.LRUCache(2, 0.01)
+    lru.set('a', '1')
+    time.sleep(0.02)
+    assert lru.get('a') is None
+    assert lru.counters['expirations'] == 1
+
+
+def test_writes_invalidate_the_cached_documents(cache, client, r):
+    dbutils.create_student(1, 'first', 'last', '1@school.test', client)
+    assert dbutils.get_student(1, client, r)['first_name'] == 'first'
+    dbutils.update_student(1, {'first_name': 'changed'}, client, r)
+    assert dbutils.get_student(1, client, r)['first_name'] == 'changed'
+    dbutils.delete_student(1, client, r)
+    entity_cache.start_request()
+    assert dbutils.get_student(1, client, r, local=False) is None
@@ -0,0 +1,47 @@
+import csv
+import gzip
+import io
+import json
+
+from utils import export_utils
+
+
+def _grades(client, n=5):
+    client.school.grades.insert_many([{'course_id': 10 + sid % 2, 'student_id': sid, 'grade': 50 + sid} for sid in range(n)])
+
+
+def test_documents_are_exported_a_batch_at_a_time(client):
+    _grades(client)
+    chunks = list(export_utils.export('grades', {}, export_utils.NDJSON, False, client, batch_size=2))
+    # the (empty) start, three batches and the (empty) finish
+    assert len(chunks) == 5
+    rows = [json.loads(line) for line in b''.join(chunks).decode().splitlines()]
+    assert rows == [{'course_id': 10 + sid % 2, 'student_id': sid, 'grade': 50 + sid} for sid in range(5)]
+
+
+def test_csv_exports_start_with_the_header(client):
+    _grades(client, 2)
+    data = b''.join(export_utils.export('grades', {'course_id': 11}, export_utils.CSV, False, client)).decode()
+    assert list(csv.reader(io.StringIO(data))) == [['course_id', 'student_id', 'grade'], ['11', '1', '51']]
+
+
+def test_compressed_exports_are_one_gzip_stream(client):
+    _grades(client)
+    chunks = list(export_utils.export('grades', {}, export_utils.NDJSON, True, client, batch_size=2))
+    plain = b''.join(export_utils.export('grades', {}, export_utils.NDJSON, False, client, batch_size=2))
+    assert gzip.decompress(b''.join(chunks)) == plain
+
+
+def test_exports_are_streamed_with_their_headers(api, client):
+    _grades(client)
+    response = api.get('/export/grades?format=csv&student_id=3', headers={'Accept-Encoding': 'gzip'})
+    assert response.is_streamed
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=grades.csv'
+    assert response.mimetype == 'text/csv'
+    assert gzip.decompress(response.get_data()).decode().splitlines() == ['course_id,student_id,grade', '11,3,53']
+
+
+def test_invalid_exports_are_rejected(api):
+    for query in ('/export/passwords', '/export/grades?format=xml', '/export/grades?course_id=x'):
+        assert api.get(query).status_code == 404
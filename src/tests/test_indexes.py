@@ -0,0 +1,59 @@
+from utils import dbutils
+from utils import index_utils
+
+
+def _student(id_num):
+    return {'id_number': id_num, 'first_name': 'first', 'last_name': 'last', 'email': f'{id_num}@school.test'}
+
+
+def test_ensured_indexes_match_their_declaration(client):
+    assert index_utils.ensure_indexes(client) == {}
+    assert index_utils.ensure_indexes(client) == {}
+    report = index_utils.check_indexes(client)
+    assert all(v == [] for name in report for v in report[name].values())
+
+
+def test_missing_indexes_are_reported(client):
+    index_utils.ensure_indexes(client, ['students'])
+    report = index_utils.check_indexes(client)
+    assert report['students']['missing'] == [] and report['courses']['missing'] == ['course_id_1']
+
+
+def test_a_unique_index_over_duplicates_is_reported_without_failing_the_others(client):
+    client.school.courses.insert_many([{'course_id': 1}, {'course_id': 1}])
+    errors = index_utils.ensure_indexes(client)
+    assert list(errors) == ['courses']
+    assert index_utils.check_indexes(client)['students']['missing'] == []
+
+
+def test_duplicate_ids_are_rejected_by_the_unique_indexes(client):
+    index_utils.ensure_indexes(client)
+    assert dbutils.create_student(1, 'first', 'last', 'e', client) is not None
+    assert dbutils.create_student(1, 'first', 'last', 'e', client) is None
+    assert dbutils.create_course(10, 'course', [1], client) is not None
+    assert dbutils.create_course(10, 'course', [], client) is None
+
+
+def test_renaming_onto_a_taken_id_is_invalid(api):
+    for id_num in (1, 2):
+        api.post('/students', json=_student(id_num))
+    api.post('/courses', json={'course_id': 10, 'name': 'course', 'students': [1]})
+    api.post('/courses', json={'course_id': 11, 'name': 'course', 'students': [2]})
+
+    response = api.put('/students', json={'current_id': 1, 'new': {'id_number': 2}})
+    assert response.status_code == 404 and response.json['error'].startswith('invalid data')
+    response = api.put('/courses', json={'current_id': 10, 'new': {'course_id': 11}})
+    assert response.status_code == 404 and response.json['error'].startswith('invalid data')
+    assert api.get('/courses?course_id=10').json['students'] == [1]
+
+
+def test_a_rename_racing_onto_a_taken_id_returns_false(client):
+    # past the validation, the unique index catches an id taken in the meantime
+    index_utils.ensure_indexes(client)
+    for id_num in (1, 2):
+        dbutils.create_student(id_num, 'first', 'last', 'e', client)
+    dbutils.create_course(10, 'course', [], client)
+    dbutils.create_course(11, 'course', [], client)
+    assert dbutils.update_student(1, {'id_number': 2}, client) is False
+    assert dbutils.update_course(10, {'course_id': 11}, client) is False
+    assert dbutils.get_student(1, client)['id_number'] == 1
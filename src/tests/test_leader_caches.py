@@ -0,0 +1,109 @@
+from utils import redis_utils
+
+
+def _student(id_num):
+    return {'id_number': id_num, 'first_name': 'first', 'last_name': 'last', 'email': f'{id_num}@school.test'}
+
+
+def _cached_best_student(r):
+    redis_utils.build_leaderboards({'students': {1: 90, 2: 80}, 'courses': {10: 85}}, r)
+    redis_utils.update_best_student_cache(_student(1), r)
+    redis_utils.update_easiest_course_cache({'course_id': 10, 'name': 'course', 'students': [1, 2]}, r)
+
+
+def _leader(r, board=redis_utils.STUDENT_LEADERBOARD, key=redis_utils.BEST_STUDENT_KEY):
+    return redis_utils._get_leader(board, key, r)
+
+
+def test_a_cached_leader_is_a_hit(r):
+    _cached_best_student(r)
+    assert _leader(r) == (1, _student(1), None)
+
+
+def test_only_the_dependents_of_a_change_are_invalidated(r):
+    _cached_best_student(r)
+    assert redis_utils.invalidate_dependents(r, students=[3], courses=[11]) == 0
+    assert _leader(r)[2] is None
+
+    # student 2 is listed in the easiest course, not the best student
+    assert redis_utils.invalidate_dependents(r, students=[2]) == 1
+    assert _leader(r)[2] is None
+    leader, document, stale_since = _leader(r, redis_utils.COURSE_LEADERBOARD, redis_utils.EASIEST_COURSE_KEY)
+    assert (leader, document['course_id']) == (10, 10) and stale_since is not None
+
+
+def test_an_invalidated_entry_is_only_counted_once(r):
+    _cached_best_student(r)
+    assert redis_utils.invalidate_dependents(r, students=[1]) == 2
+    assert redis_utils.invalidate_dependents(r, students=[1]) == 0
+
+
+def test_a_new_leader_makes_the_entry_stale(r):
+    _cached_best_student(r)
+    redis_utils.update_leaderboards({2: 95}, {}, r)
+    leader, document, stale_since = _leader(r)
+    assert (leader, document) == (2, _student(1)) and stale_since is not None
+
+
+def test_reads_are_counted_per_result(r):
+    _cached_best_student(r)
+    _leader(r)
+    redis_utils.invalidate_dependents(r, students=[1])
+    _leader(r)
+    stats = redis_utils.get_cache_stats(r)[redis_utils.BEST_STUDENT_KEY]
+    assert (stats['hits'], stats['stale'], stats['invalidations']) == (1, 1, 1)
+
+
+def _recompute(calls):
+    def recompute(id_num):
+        calls.append(id_num)
+        return _student(id_num)
+    return recompute
+
+
+def test_a_miss_is_recomputed_and_cached(r):
+    redis_utils.build_leaderboards({'students': {1: 90}, 'courses': {}}, r)
+    calls = []
+    assert redis_utils.get_best_student(_recompute(calls), r, max_staleness=5, lock_timeout=1) == (_student(1), None)
+    assert redis_utils.get_best_student(_recompute(calls), r, max_staleness=5, lock_timeout=1) == (_student(1), None)
+    assert calls == [1]
+
+
+def test_a_stale_entry_is_served_while_another_worker_recomputes(r):
+    _cached_best_student(r)
+    redis_utils.update_leaderboards({2: 95}, {}, r)
+    token = redis_utils.acquire_lock(redis_utils.BEST_STUDENT_KEY, 5, r)
+    calls = []
+    document, staleness = redis_utils.get_best_student(_recompute(calls), r, max_staleness=5, lock_timeout=1)
+    assert (document, calls) == (_student(1), []) and 0 <= staleness <= 5
+
+    redis_utils.release_lock(redis_utils.BEST_STUDENT_KEY, token, r)
+    assert redis_utils.get_best_student(_recompute(calls), r, max_staleness=5, lock_timeout=1) == (_student(2), None)
+    assert calls == [2]
+
+
+def test_a_miss_waits_for_the_lock_then_computes_without_caching(r):
+    redis_utils.build_leaderboards({'students': {1: 90}, 'courses': {}}, r)
+    redis_utils.acquire_lock(redis_utils.BEST_STUDENT_KEY, 5, r)
+    calls = []
+    assert redis_utils.get_best_student(_recompute(calls), r, max_staleness=5, lock_timeout=0.1) == (_student(1), None)
+    assert calls == [1]
+    assert _leader(r)[1] is None
+
+
+def test_the_lock_is_only_released_by_its_holder(r):
+    token = redis_utils.acquire_lock('key', 5, r)
+    assert redis_utils.acquire_lock('key', 5, r) is None
+    redis_utils.release_lock('key', 'another token', r)
+    assert redis_utils.acquire_lock('key', 5, r) is None
+    redis_utils.release_lock('key', token, r)
+    assert redis_utils.acquire_lock('key', 5, r) is not None
+
+
+def test_refresh_recomputes_only_stale_leaders(r):
+    _cached_best_student(r)
+    calls = []
+    assert not redis_utils.refresh_best_student(_recompute(calls), r, lock_timeout=1)
+    redis_utils.invalidate_dependents(r, students=[1])
+    assert redis_utils.refresh_best_student(_recompute(calls), r, lock_timeout=1)
+    assert calls == [1] and _leader(r) == (1, _student(1), None)
@@ -0,0 +1,50 @@
+from utils import redis_utils
+
+
+def _board(r, students=None, courses=None):
+    redis_utils.build_leaderboards({'students': students or {}, 'courses': courses or {}}, r)
+
+
+def test_top_is_ordered_by_average(r):
+    _board(r, students={1: 70, 2: 95, 3: 80})
+    top = redis_utils.get_top_students(3, r)
+    assert [(s['student_id'], s['average'], s['rank']) for s in top] == [(2, 95, 1), (3, 80, 2), (1, 70, 3)]
+
+
+def test_ties_list_the_smallest_id_first_and_share_a_rank(r):
+    _board(r, courses={30: 90, 4: 90, 1000: 90, 7: 60})
+    top = redis_utils.get_top_courses(4, r)
+    assert [(c['course_id'], c['rank']) for c in top] == [(4, 1), (30, 1), (1000, 1), (7, 4)]
+    assert redis_utils.get_course_rank(1000, r) == {'average': 90, 'rank': 1, 'out_of': 4}
+    assert redis_utils.get_course_rank(7, r) == {'average': 60, 'rank': 4, 'out_of': 4}
+
+
+def test_the_leader_of_a_tie_is_its_smallest_id(r):
+    _board(r, students={12: 88, 3: 88, 2 ** 40: 88})
+    assert redis_utils._get_leader(redis_utils.STUDENT_LEADERBOARD, redis_utils.BEST_STUDENT_KEY, r)[0] == 3
+
+
+def test_members_round_trip_over_the_id_range(r):
+    for id_num in (0, 1, 10 ** 12, 2 ** 63 - 1, -5):
+        assert redis_utils.member_id(redis_utils.leaderboard_member(id_num)) == id_num
+
+
+def test_updates_move_and_remove_members(r):
+    _board(r, students={1: 70, 2: 80})
+    redis_utils.update_leaderboards({1: 90, 2: None}, {}, r)
+    assert redis_utils.get_top_students(5, r) == [{'student_id': 1, 'average': 90, 'rank': 1}]
+    assert redis_utils.get_student_rank(2, r) is None
+
+
+def test_updates_bump_the_versions_of_the_statistics(r):
+    generation = int(r.get(redis_utils.STATS_GENERATION_KEY) or 0)
+    redis_utils.update_leaderboards({1: 70}, {10: 70}, r)
+    assert int(r.get(redis_utils.STATS_GENERATION_KEY)) == generation + 1
+    assert r.get(redis_utils.distribution_version_key(10)) == b'1'
+    assert r.get(redis_utils.transcript_version_key(1)) == b'1'
+
+
+def test_an_empty_rebuild_clears_the_board(r):
+    _board(r, students={1: 70})
+    _board(r)
+    assert redis_utils.get_top_students(5, r) == []
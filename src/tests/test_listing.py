@@ -0,0 +1,59 @@
+import pytest
+
+from utils import listing_utils
+
+
+def _grades(client):
+    grades = [{'course_id': cid, 'student_id': sid, 'grade': 50 + sid} for cid in (10, 11, 12) for sid in (3, 1, 2)]
+    client.school.grades.insert_many(grades)
+    return grades
+
+
+def _walk(collection, filters, limit, client):
+    """
+    every page of a listing, following the cursors.
+    """
+    pages, after = [], None
+    while True:
+        page = listing_utils.list_page(collection, filters, after, limit, listing_utils.FIELDS[collection], client)
+        pages.append(page['items'])
+        if page['next_after'] is None:
+            return pages
+        after = listing_utils._parse_cursor(page['next_after'])
+
+
+def test_compound_cursors_are_bounded_by_the_first_key():
+    query = listing_utils.listing_query(('course_id', 'student_id'), {}, (11, 2))
+    assert query == {'course_id': {'$gte': 11},
+                     '$or': [{'course_id': {'$gt': 11}}, {'course_id': 11, 'student_id': {'$gt': 2}}]}
+    assert listing_utils.listing_query(('student_id',), {'course_id': 10}, (2,)) == {'course_id': 10, 'student_id': {'$gt': 2}}
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 4, 9])
+def test_pages_list_every_grade_once_in_order(client, limit):
+    _grades(client)
+    pages = _walk('grades', {}, limit, client)
+    listed = [(g['course_id'], g['student_id']) for page in pages for g in page]
+    assert listed == [(cid, sid) for cid in (10, 11, 12) for sid in (1, 2, 3)]
+    # the last page isn't followed by an empty one, even when it is full
+    assert len(pages) == -(-9 // limit)
+
+
+def test_filtered_listings_page_by_the_remaining_key(client):
+    _grades(client)
+    pages = _walk('grades', {'course_id': 11}, 2, client)
+    assert [[g['student_id'] for g in page] for page in pages] == [[1, 2], [3]]
+
+
+def test_listings_project_the_requested_fields(api):
+    for sid in (1, 2, 3):
+        api.post('/students', json={'id_number': sid, 'first_name': 'first', 'last_name': 'last', 'email': f'{sid}@school.test'})
+    page = api.get('/students?limit=2&fields=email').json
+    assert page == {'items': [{'id_number': 1, 'email': '1@school.test'}, {'id_number': 2, 'email': '2@school.test'}],
+                    'next_after': '2'}
+    assert api.get('/students?after=2').json['items'][0]['id_number'] == 3
+
+
+@pytest.mark.parametrize('query', ['after=1', 'after=1,x', 'limit=0', 'limit=1001', 'fields=password', 'course_id=x'])
+def test_invalid_listings_are_rejected(api, query):
+    assert api.get('/grades?' + query).status_code == 404
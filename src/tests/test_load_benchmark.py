@@ -0,0 +1,82 @@
+import random
+
+import pytest
+
+from benchmarks import load_benchmark
+
+
+class RecordingClient:
+    """
+    answers every request with a 200 and one round trip, recording the requests.
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method: str, path: str, body=None):
+        self.requests.append((method, path, body))
+        return 200, 1
+
+
+def _summary(p95_ms, throughput):
+    return {'p95_ms': p95_ms, 'throughput': throughput}
+
+
+def test_percentiles_are_nearest_rank():
+    values = list(range(1, 101))
+    assert [load_benchmark._percentile(values, q) for q in (0.5, 0.95, 0.99, 1)] == [50, 95, 99, 100]
+    assert load_benchmark._percentile([7], 0.99) == 7
+
+
+def test_summaries_split_client_and_server_errors():
+    samples = [(0.001, 2, 200), (0.002, 2, 404), (0.003, 3, 500), (0.004, 1, 200)]
+    summary = load_benchmark.summarize(samples, wall=2)
+    assert (summary['requests'], summary['throughput'], summary['not_found'], summary['errors']) == (4, 2, 1, 1)
+    assert summary['round_trips'] == 2
+    assert summary['p50_ms'] == pytest.approx(2)
+    assert summary['p99_ms'] == pytest.approx(4)
+
+
+def test_regressions_are_reported_past_the_threshold(capsys):
+    baseline = {'endpoints': {'GET /students': _summary(10, 100), 'GET /courses': _summary(10, 100)}, 'total': _summary(10, 100)}
+    results = {'endpoints': {'GET /students': _summary(10.5, 95), 'GET /courses': _summary(12, 100), 'GET /grades': _summary(50, 1)},
+               'total': _summary(10, 80)}
+    assert load_benchmark.compare(results, baseline) == ['GET /courses', 'total']
+    assert 'GET /grades' not in capsys.readouterr().out
+
+
+def test_workloads_are_reproducible():
+    first, second = (load_benchmark.Workload(20, 4, 5, 0.5, seed=7) for _ in range(2))
+    assert first.courses == second.courses
+    rng_first, rng_second = random.Random(1), random.Random(1)
+    assert ([first.next_request(rng_first, 0.5) for _ in range(50)] ==
+            [second.next_request(rng_second, 0.5) for _ in range(50)])
+
+
+def test_grade_writes_keep_every_enrollment_in_one_pool():
+    workload = load_benchmark.Workload(20, 4, 5, 0.5, seed=7)
+    enrollments = sorted(workload.graded + workload.ungraded)
+    rng = random.Random(3)
+    for _ in range(200):
+        rng.choice([workload.create_grade, workload.update_grade, workload.delete_grade])(rng)
+    assert sorted(workload.graded + workload.ungraded) == enrollments
+
+
+def test_every_request_is_sampled_once():
+    workload = load_benchmark.Workload(20, 4, 5, 0.5, seed=7)
+    client = RecordingClient()
+    samples, wall = load_benchmark.run(workload, client, requests=101, concurrency=4, read_ratio=0.9, seed=1)
+    assert len(client.requests) == 101
+    assert sum(len(endpoint_samples) for endpoint_samples in samples.values()) == 101
+    assert all(endpoint.split(' ')[1].startswith('/') and '?' not in endpoint for endpoint in samples)
+    assert load_benchmark.report(samples, wall)['total']['requests'] == 101
+
+
+def test_seeding_posts_the_documents_in_chunks():
+    workload = load_benchmark.Workload(5, 2, 3, 1.0, seed=7)
+    client = RecordingClient()
+    workload.seed(client, chunk_size=2)
+    batches = {}
+    for method, path, body in client.requests:
+        batches.setdefault(path, []).append(len(body))
+    assert batches == {'/students/bulk': [2, 2, 1], '/courses/bulk': [2], '/grades/bulk': [2, 2, 2]}
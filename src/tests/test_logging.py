@@ -0,0 +1,72 @@
+import json
+import logging
+import queue
+
+from utils import logging_utils
+
+
+def _record(msg='value: %s', args=(1,), level=logging.INFO, exc_info=None):
+    return logging.LogRecord('utils.dbutils', level, __file__, 1, msg, args, exc_info)
+
+
+def test_a_full_queue_drops_records_without_blocking():
+    handler = logging_utils.NonBlockingQueueHandler(queue.Queue(2))
+    for _ in range(5):
+        handler.handle(_record())
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
+
+
+def test_mutable_arguments_are_formatted_when_logged():
+    handler = logging_utils.NonBlockingQueueHandler(queue.Queue(10))
+    ids = [1, 2]
+    handler.handle(_record('ids: %s, count: %s', (ids, 2)))
+    handler.handle(_record('count: %s', (2,)))
+    ids.append(3)
+    mutable, immutable = handler.queue.get(), handler.queue.get()
+    assert (mutable.msg, mutable.args) == ('ids: [1, 2], count: 2', None)
+    # the writer formats the message of a record with immutable arguments
+    assert (immutable.msg, immutable.args) == ('count: %s', (2,))
+
+
+def test_exceptions_are_formatted_when_logged():
+    handler = logging_utils.NonBlockingQueueHandler(queue.Queue(10))
+    try:
+        raise ValueError('bad grade')
+    except ValueError as e:
+        handler.handle(_record(exc_info=(type(e), e, e.__traceback__)))
+    record = handler.queue.get()
+    assert record.exc_info is None
+    assert 'ValueError: bad grade' in record.exc_text
+
+
+def test_rate_limits_refill_over_time(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(logging_utils.time, 'monotonic', lambda: now[0])
+    rate_limit = logging_utils.RateLimitFilter(2)
+    assert [rate_limit.filter(_record()) for _ in range(3)] == [True, True, False]
+    assert rate_limit.filter(_record(level=logging.WARNING))
+    now[0] += 0.5
+    assert [rate_limit.filter(_record()) for _ in range(2)] == [True, False]
+
+
+def test_sampling_keeps_warnings():
+    assert not logging_utils.SampleFilter(0).filter(_record())
+    assert logging_utils.SampleFilter(0).filter(_record(level=logging.ERROR))
+    assert logging_utils.SampleFilter(1).filter(_record())
+
+
+def test_json_lines_carry_the_formatted_message():
+    entry = json.loads(logging_utils.JsonFormatter().format(_record('ids: %s', ([1, 2],))))
+    assert (entry['level'], entry['logger'], entry['message']) == ('INFO', 'utils.dbutils', 'ids: [1, 2]')
+
+
+def test_file_loggers_write_bare_messages_to_their_own_file(tmp_path):
+    file = tmp_path / 'slow.log'
+    logger = logging_utils.file_logger('tests.file_logger', str(file))
+    logger.warning('{"ms": 1200}')
+    writer = logging_utils._writers.pop('tests.file_logger')
+    logger.removeHandler(writer.handler)
+    writer.stop()
+    assert file.read_text() == '{"ms": 1200}\n'
+    assert not logger.propagate
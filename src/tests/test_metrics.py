@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+
+import pytest
+from prometheus_client import REGISTRY
+
+from utils import logging_utils
+from utils import metrics_utils
+from utils import redis_utils
+
+
+@pytest.fixture
+def metrics(config, monkeypatch):
+    config['metrics']['enabled'] = True
+    monkeypatch.delenv('PROMETHEUS_MULTIPROC_DIR', raising=False)
+
+
+def _value(name: str, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_requests_are_counted_per_route(metrics, api):
+    before = _value('school_requests_total', route='/students', method='GET', status='200')
+    unmatched = _value('school_requests_total', route=metrics_utils.UNMATCHED, method='GET', status='404')
+    api.get('/students?ids=1,2')
+    api.get('/students?ids=3')
+    api.get('/no/such/route')
+    assert _value('school_requests_total', route='/students', method='GET', status='200') == before + 2
+    assert _value('school_requests_total', route=metrics_utils.UNMATCHED, method='GET', status='404') == unmatched + 1
+
+
+def test_the_scrape_includes_the_cache_counters(metrics, api, r):
+    api.post('/students', json={'id_number': 1, 'first_name': 'first', 'last_name': 'last', 'email': '1@school.test'})
+    redis_utils.update_leaderboards({1: 90}, {}, r)
+    api.get('/best_student')
+    api.get('/best_student')
+    text = api.get('/metrics').get_data(as_text=True)
+    assert 'school_request_seconds_bucket{' in text
+    assert 'school_leader_cache_reads_total{cache="best_student",result="hits"} 1.0' in text
+    assert 'school_leader_cache_hit_ratio{cache="best_student"} 0.5' in text
+    assert 'school_log_records_dropped ' in text
+
+
+def test_dropped_log_records_are_exported(metrics, api, monkeypatch):
+    monkeypatch.setattr(logging_utils, 'dropped', lambda: 7)
+    api.get('/students?ids=1')
+    assert _value('school_log_records_dropped') == 7
+
+
+def test_mongo_commands_are_timed_per_collection():
+    timer = metrics_utils.CommandTimer()
+    before = _value('school_mongo_command_seconds_count', collection='grades', command='find')
+    failures = _value('school_mongo_command_failures_total', collection='grades', command='getMore')
+    timer.started(SimpleNamespace(request_id=1, command_name='find', command={'find': 'grades'}))
+    timer.succeeded(SimpleNamespace(request_id=1, command_name='find', duration_micros=200))
+    timer.started(SimpleNamespace(request_id=2, command_name='getMore', command={'getMore': 1, 'collection': 'grades'}))
+    timer.failed(SimpleNamespace(request_id=2, command_name='getMore', duration_micros=200))
+    assert _value('school_mongo_command_seconds_count', collection='grades', command='find') == before + 1
+    assert _value('school_mongo_command_failures_total', collection='grades', command='getMore') == failures + 1
+
+
+def test_disabled_metrics_arent_served(api):
+    assert api.get('/metrics').status_code == 404
@@ -0,0 +1,56 @@
+import pytest
+
+from utils import dbutils
+from utils import entity_cache
+
+
+def _school(api):
+    for sid in (1, 2, 3):
+        api.post('/students', json={'id_number': sid, 'first_name': 'first', 'last_name': 'last', 'email': f'{sid}@school.test'})
+    api.post('/courses', json={'course_id': 10, 'name': 'course', 'students': [1, 2]})
+    api.post('/grades', json={'student_id': 1, 'course_id': 10, 'grade': 80})
+
+
+def _results(response):
+    return [(result['id'], result['status']) for result in response.json['results']]
+
+
+def test_students_are_returned_in_request_order(api):
+    _school(api)
+    response = api.get('/students?ids=3,9,1,3')
+    assert _results(response) == [(3, 'found'), (9, 'not_found'), (1, 'found'), (3, 'found')]
+    assert [r['document']['id_number'] for r in response.json['results'] if r['status'] == 'found'] == [3, 1, 3]
+    assert response.json['summary'] == {'found': 3, 'not_found': 1}
+
+
+def test_courses_and_grades_are_looked_up_in_batches(api):
+    _school(api)
+    assert _results(api.get('/courses?ids=11,10')) == [(11, 'not_found'), (10, 'found')]
+    response = api.get('/grades?pairs=1:10,2:10')
+    assert _results(response) == [([1, 10], 'found'), ([2, 10], 'not_found')]
+    assert response.json['results'][0]['document']['grade'] == 80
+
+
+@pytest.mark.parametrize('query', ['/students?ids=1,x', '/courses?ids=', '/grades?pairs=1:10:2', '/grades?pairs=1',
+                                   '/students?ids=' + ','.join(str(i) for i in range(101))])
+def test_invalid_batches_are_rejected(api, query):
+    assert api.get(query).status_code == 404
+
+
+def test_only_cache_misses_are_read_from_mongo(client, r, monkeypatch):
+    entity_cache.configure(True, max_entries=1000, ttl=60, redis_ttl=300, tombstone_ttl=5)
+    entity_cache.start_request()
+    for sid in (1, 2, 3):
+        dbutils.create_student(sid, 'first', 'last', f'{sid}@school.test', client)
+    dbutils.get_student(2, client, r)
+
+    queries = []
+    students = client.school.students
+    find = students.find
+
+    def find_students(query, *args, **kwargs):
+        queries.append(query)
+        return find(query, *args, **kwargs)
+    monkeypatch.setattr(students, 'find', find_students)
+    assert [s['id_number'] if s else None for s in dbutils.get_students([1, 2, 3, 4], client, r)] == [1, 2, 3, None]
+    assert queries == [{'id_number': {'$in': [1, 3, 4]}}]
@@ -0,0 +1,81 @@
+import asyncio
+import queue
+import re
+import threading
+
+import pytest
+
+from utils import async_profiling_utils
+from utils import profiling_utils
+
+
+@pytest.fixture
+def reported(monkeypatch):
+    """
+    the slow requests written to the slow log, with the thread that wrote them.
+    """
+    entries = queue.Queue()
+
+    def log_slow_request(profile, method, path, status, plan):
+        entries.put((path, status, plan, threading.current_thread().name))
+    monkeypatch.setattr(profiling_utils, 'log_slow_request', log_slow_request)
+    monkeypatch.setattr(async_profiling_utils, 'log_slow_request', log_slow_request)
+    return entries
+
+
+def _profile(slowest=None):
+    profile = profiling_utils.Profile(traced=False)
+    profile.root.finish()
+    profile.slowest = slowest
+    return profile
+
+
+def test_slow_requests_are_explained_off_the_request_thread(reported, monkeypatch):
+    monkeypatch.setattr(profiling_utils, '_slow_requests', queue.Queue(10))
+    monkeypatch.setattr(profiling_utils, 'explain', lambda profile, client: {'explained_by': threading.current_thread().name})
+    threading.Thread(target=profiling_utils.report_slow_requests, name='test-reporter', daemon=True).start()
+
+    profiling_utils.queue_slow_request(_profile(), 'GET', '/students', 200, None)
+    path, status, plan, thread = reported.get(timeout=5)
+    assert (path, status) == ('/students', 200)
+    assert plan == {'explained_by': 'test-reporter'} and thread == 'test-reporter'
+
+
+def test_slow_requests_are_dropped_when_the_reporter_is_behind(monkeypatch):
+    monkeypatch.setattr(profiling_utils, '_slow_requests', queue.Queue(1))
+    for path in ('/a', '/b'):
+        profiling_utils.queue_slow_request(_profile(), 'GET', path, 200, None)
+    assert profiling_utils._slow_requests.qsize() == 1
+    assert profiling_utils._slow_requests.get()[2] == '/a'
+
+
+def test_async_slow_requests_are_reported_by_tasks(reported, monkeypatch):
+    async def serve():
+        for path in ('/a', '/b'):
+            async_profiling_utils.queue_slow_request(_profile(), 'GET', path, 200, None)
+        await asyncio.gather(*async_profiling_utils._reports)
+
+    monkeypatch.setattr(async_profiling_utils, 'SLOW_QUEUE_SIZE', 1)
+    asyncio.run(serve())
+    assert [reported.get_nowait()[0] for _ in range(reported.qsize())] == ['/a']
+    assert len(async_profiling_utils._reports) == 0
+
+
+def test_the_explained_command_drops_session_fields():
+    command = {'find': 'grades', 'filter': {'course_id': 10}, 'lsid': {'id': 1}, 'txnNumber': 2, '$db': 'school'}
+    database, explained = profiling_utils.explain_command(_profile((0.5, 'school', command)))
+    assert database == 'school'
+    assert explained == {'explain': {'find': 'grades', 'filter': {'course_id': 10}}, 'verbosity': 'queryPlanner'}
+    assert profiling_utils.explain_command(_profile()) is None
+
+
+def test_server_timing_sums_the_calls_of_a_function():
+    profile = profiling_utils.Profile(traced=True)
+    for name in ('dbutils.get_student', 'dbutils.get_student', 'redis_utils.get_student_rank'):
+        span = profiling_utils.Span(name)
+        span.finish()
+        profile.root.children.append(span)
+    profile.root.finish()
+    header = profiling_utils.server_timing(profile)
+    assert re.findall(r'(?:^|", )([\w.]+);dur=', header) == ['total', 'dbutils.get_student', 'redis_utils.get_student_rank']
+    assert 'dbutils.get_student;' in header and 'desc="calls: 2, round trips: 0"' in header
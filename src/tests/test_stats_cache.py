@@ -0,0 +1,64 @@
+import pytest
+
+from utils import stats_cache
+from utils import redis_utils
+
+
+@pytest.fixture
+def cache():
+    stats_cache.configure(True, max_entries=2, ttl=60)
+    yield
+    stats_cache.set_generation(None)
+
+
+def test_nothing_is_served_before_the_generation_is_known(cache):
+    stats_cache.store('/top', None, b'body')
+    assert stats_cache.lookup('/top') is None
+
+
+def test_responses_are_served_while_their_generation_is_current(cache):
+    stats_cache.set_generation(1)
+    stats_cache.store('/top', 1, b'body')
+    assert stats_cache.lookup('/top') == b'body'
+    stats_cache.set_generation(2)
+    assert stats_cache.lookup('/top') is None
+
+
+def test_a_response_of_an_old_generation_isnt_stored(cache):
+    stats_cache.set_generation(1)
+    computed_in = stats_cache.generation()
+    # the leaderboards changed while the response was computed
+    stats_cache.set_generation(2)
+    stats_cache.store('/top', computed_in, b'old')
+    assert stats_cache.lookup('/top') is None
+
+
+def test_least_recent_responses_are_evicted(cache):
+    stats_cache.set_generation(1)
+    for path in ('/a', '/b', '/c'):
+        stats_cache.store(path, 1, path.encode())
+    assert [stats_cache.lookup(path) for path in ('/a', '/b', '/c')] == [None, b'/b', b'/c']
+    assert stats_cache.get_stats()['counters']['evictions'] == 1
+
+
+def test_leaderboard_updates_publish_the_next_generation(cache, r):
+    pubsub = r.pubsub()
+    pubsub.subscribe(redis_utils.STATS_CHANNEL)
+    assert stats_cache.handle_message(pubsub.get_message(timeout=1))
+    stats_cache.set_generation(int(r.get(redis_utils.STATS_GENERATION_KEY) or 0))
+    stats_cache.store('/top', 0, b'body')
+
+    redis_utils.update_leaderboards({1: 90}, {10: 90}, r)
+    assert not stats_cache.handle_message(pubsub.get_message(timeout=1))
+    assert stats_cache.generation() == 1
+    assert stats_cache.lookup('/top') is None
+    pubsub.close()
+
+
+def test_a_lost_subscription_stops_serving(cache):
+    stats_cache.set_generation(3)
+    stats_cache.store('/top', 3, b'body')
+    disconnects = stats_cache.get_stats()['counters']['disconnects']
+    stats_cache.set_generation(None)
+    assert stats_cache.lookup('/top') is None
+    assert stats_cache.get_stats()['counters']['disconnects'] == disconnects + 1
@@ -0,0 +1,69 @@
+import pytest
+
+from utils import stats_utils
+from utils import redis_utils
+
+
+def _grade(student_id, course_id, grade):
+    return {'student_id': student_id, 'course_id': course_id, 'grade': grade}
+
+
+def test_grade_delta_updates_both_aggregates(client):
+    stats_utils.apply_grade_delta(1, 10, 80, 1, client)
+    student, course = stats_utils.apply_grade_delta(1, 10, 90, 1, client)
+    assert (student['sum'], student['count'], student['avg']) == (170, 2, 85)
+    assert (course['sum'], course['count'], course['avg']) == (170, 2, 85)
+
+
+def test_aggregate_without_grades_is_removed(client):
+    stats_utils.apply_grade_delta(1, 10, 80, 1, client)
+    assert stats_utils.apply_grade_delta(1, 10, -80, -1, client) == (None, None)
+    assert client.school[stats_utils.STUDENT_STATS].count_documents({}) == 0
+    assert client.school[stats_utils.COURSE_STATS].count_documents({}) == 0
+
+
+def test_grade_delta_writes_committed_averages_to_leaderboards(client, r):
+    stats_utils.apply_grade_delta(1, 10, 80, 1, client, r)
+    # another writer's delta landed in mongo without reaching redis yet
+    stats_utils.apply_grade_delta(1, 10, 100, 1, client)
+    stats_utils.apply_grade_delta(1, 11, 90, 1, client, r)
+    assert redis_utils.get_student_rank(1, r)['average'] == 90
+    assert redis_utils.get_course_rank(11, r)['average'] == 90
+
+
+def test_batches_of_grades_match_a_rebuild(client):
+    grades = [_grade(1, 10, 70), _grade(1, 11, 90), _grade(2, 10, 50), _grade(3, 11, 100)]
+    client.school.grades.insert_many([dict(g) for g in grades])
+    assert stats_utils.add_grades_to_stats(grades, client) == ([1, 2, 3], [10, 11])
+    assert stats_utils.get_averages(stats_utils.STUDENT_STATS, [1, 2, 4], client) == {1: 80, 2: 50, 4: None}
+
+    client.school.grades.delete_one({'student_id': 3})
+    stats_utils.remove_grades_from_stats([grades[3]], client)
+    report = stats_utils.check_grade_stats(client)
+    assert all(v == [] for name in report for v in report[name].values())
+
+
+def test_rename_moves_the_aggregate(client):
+    stats_utils.apply_grade_delta(1, 10, 80, 1, client)
+    renamed = stats_utils.rename_student_stats(1, 2, client)
+    assert (renamed['_id'], renamed['avg']) == (2, 80)
+    assert stats_utils.get_averages(stats_utils.STUDENT_STATS, [1, 2], client) == {1: None, 2: 80}
+    assert stats_utils.rename_course_stats(11, 12, client) is None
+
+
+def test_check_reports_drifted_aggregates(client):
+    client.school.grades.insert_one(_grade(1, 10, 80))
+    stats_utils.apply_grade_delta(1, 10, 70, 1, client)
+    stats_utils.apply_grade_delta(2, 10, 70, 1, client)
+    report = stats_utils.check_grade_stats(client)[stats_utils.STUDENT_STATS]
+    assert report == {'missing': [], 'extra': [2], 'mismatched': [1]}
+
+
+@pytest.mark.parametrize('ids', [[1], [1, 2]])
+def test_recompute_repairs_aggregates(client, r, ids):
+    client.school.grades.insert_many([_grade(1, 10, 80), _grade(1, 11, 60)])
+    stats_utils.apply_grade_delta(1, 10, 10, 1, client)
+    stats_utils.apply_grade_delta(2, 10, 10, 1, client)
+    stats_utils.recompute_stats(ids, [], client, r)
+    assert stats_utils.get_averages(stats_utils.STUDENT_STATS, [1], client) == {1: 70}
+    assert redis_utils.get_student_rank(1, r)['average'] == 70
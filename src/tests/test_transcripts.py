@@ -0,0 +1,61 @@
+import pytest
+
+from utils import redis_utils
+
+
+class Transcripts:
+    """
+    computes the transcript of student 1, listing courses 10 and 11, counting its calls.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.during = None
+
+    def __call__(self):
+        self.calls += 1
+        if self.during is not None:
+            self.during()
+            self.during = None
+        return {'id_number': 1, 'courses': [{'course_id': 10, 'grade': 80}, {'course_id': 11, 'grade': 90}],
+                'average': 85, 'computed': self.calls}
+
+
+@pytest.fixture
+def compute():
+    return Transcripts()
+
+
+def _get(compute, r):
+    return redis_utils.get_transcript(1, compute, r, 60)['computed']
+
+
+def test_transcripts_are_cached_until_the_grades_change(compute, r):
+    assert [_get(compute, r), _get(compute, r)] == [1, 1]
+    redis_utils.update_leaderboards({1: 85}, {}, r)
+    assert [_get(compute, r), _get(compute, r)] == [2, 2]
+    # the grades of another student leave it cached
+    redis_utils.update_leaderboards({2: 70}, {}, r)
+    assert _get(compute, r) == 2
+
+
+def test_updating_a_listed_course_invalidates_the_transcript(compute, r):
+    _get(compute, r)
+    redis_utils.invalidate_dependents(r, courses=[12])
+    assert _get(compute, r) == 1
+    redis_utils.invalidate_dependents(r, courses=[11])
+    assert _get(compute, r) == 2
+    redis_utils.invalidate_dependents(r, students=[1])
+    assert _get(compute, r) == 3
+
+
+def test_a_transcript_computed_during_a_write_isnt_cached(compute, r):
+    compute.during = lambda: redis_utils.update_leaderboards({1: 85}, {}, r)
+    assert _get(compute, r) == 1
+    assert _get(compute, r) == 2
+    assert _get(compute, r) == 2
+
+
+def test_a_missing_student_isnt_cached(r):
+    assert redis_utils.get_transcript(1, lambda: None, r, 60) is None
+    assert not r.exists(redis_utils.transcript_key(1))
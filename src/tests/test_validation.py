@@ -0,0 +1,79 @@
+import mongomock.collection
+import pytest
+
+from utils import dbutils
+
+
+@pytest.fixture
+def school(client):
+    for sid in (1, 2, 3):
+        dbutils.create_student(sid, 'first', 'last', f'{sid}@school.test', client)
+    dbutils.create_course(10, 'course', [1, 2], client)
+    dbutils.create_course(11, 'course', [3], client)
+    return client
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    """
+    the collections read by every query sent, the reads mongomock makes to run a
+    query (the $unionWith stages) aren't counted.
+    """
+    names, depth = [], [0]
+    for method in ('find', 'find_one', 'aggregate', 'count_documents', 'distinct'):
+        original = getattr(mongomock.collection.Collection, method)
+
+        def read(self, *args, _original=original, **kwargs):
+            if depth[0] == 0:
+                names.append(self.name)
+            depth[0] += 1
+            try:
+                return _original(self, *args, **kwargs)
+            finally:
+                depth[0] -= 1
+        monkeypatch.setattr(mongomock.collection.Collection, method, read)
+    return names
+
+
+def test_lookup_returns_existing_ids_and_enrollments(school):
+    students, courses = dbutils.lookup_ids([1, 3, 9, None], [10, 11, 12], school, [1, 3])
+    assert students == {1, 3}
+    assert courses == {10: {1}, 11: {3}}
+
+
+def test_grade_creation_is_validated_in_one_query(school, queries):
+    assert dbutils.validate_grade_creation_params(1, 10, 90, school)
+    assert queries == ['students']
+
+
+@pytest.mark.parametrize('student_id, course_id, grade', [
+    (9, 10, 90),    # no such student
+    (1, 12, 90),    # no such course
+    (3, 10, 90),    # not enrolled
+    (1, 10, -1),    # negative grade
+    (1, 10, '90'),  # not a number
+    ('1', 10, 90),  # not an id
+])
+def test_invalid_grades_are_rejected(school, student_id, course_id, grade):
+    assert not dbutils.validate_grade_creation_params(student_id, course_id, grade, school)
+
+
+def test_grade_moves_check_the_new_enrollment_in_one_query(school, queries):
+    assert dbutils.validate_grade_modification_params(1, 10, {'grade': 70, 'student_id': 2}, school)
+    assert not dbutils.validate_grade_modification_params(1, 10, {'grade': 70, 'course_id': 11}, school)
+    assert not dbutils.validate_grade_modification_params(1, 10, {'grade': 70, 'student_id': 9}, school)
+    assert queries == ['students'] * 3
+
+
+def test_course_modification_checks_the_new_id_and_students(school, queries):
+    assert dbutils.validate_course_modification_params(10, {'course_id': 12, 'students': [1, 3]}, school)
+    assert not dbutils.validate_course_modification_params(10, {'course_id': 11}, school)
+    assert not dbutils.validate_course_modification_params(10, {'students': [1, 9]}, school)
+    assert not dbutils.validate_course_modification_params(10, {'students': ['1']}, school)
+    assert queries == ['students'] * 3
+
+
+def test_course_student_lists_must_exist(school):
+    assert dbutils.validate_course_student_list([1, 2, 3], school)
+    assert not dbutils.validate_course_student_list([1, 9], school)
+    assert not dbutils.validate_course_student_list('1,2', school)
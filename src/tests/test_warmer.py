@@ -0,0 +1,51 @@
+import app
+
+from utils import redis_utils
+
+
+def _school(api, grades):
+    for sid in sorted({g[0] for g in grades}):
+        api.post('/students', json={'id_number': sid, 'first_name': 'first', 'last_name': 'last', 'email': f'{sid}@school.test'})
+    for cid in sorted({g[1] for g in grades}):
+        api.post('/courses', json={'course_id': cid, 'name': 'course', 'students': sorted({g[0] for g in grades if g[1] == cid})})
+    for sid, cid, grade in grades:
+        api.post('/grades', json={'student_id': sid, 'course_id': cid, 'grade': grade})
+
+
+def test_a_burst_of_writes_is_coalesced_into_one_refresh(api, r):
+    _school(api, [(1, 10, 80), (2, 10, 90), (2, 11, 70)])
+    warmer = redis_utils.get_cache_stats(r)['warmer']
+    assert warmer['scheduled'] == 1
+    assert warmer['scheduled'] + warmer['coalesced'] == int(r.get(redis_utils.STATS_GENERATION_KEY))
+
+    with api.application.app_context():
+        assert app.refresh_leaders() == 2
+        # nothing is due until the next write
+        assert app.refresh_leaders() is None
+    warmer = redis_utils.get_cache_stats(r)['warmer']
+    assert (warmer['refreshes'], warmer['recomputes']) == (1, 2)
+    assert warmer['mean_refresh_seconds'] is not None
+
+
+def test_readers_find_the_refreshed_leaders(api, r):
+    _school(api, [(1, 10, 80), (2, 10, 90)])
+    with api.application.app_context():
+        app.refresh_leaders()
+    assert api.get('/best_student').json['id_number'] == 2
+    assert api.get('/easiest_course').json['course_id'] == 10
+    stats = redis_utils.get_cache_stats(r)
+    assert stats[redis_utils.BEST_STUDENT_KEY]['hits'] == 1
+    assert stats[redis_utils.EASIEST_COURSE_KEY]['hits'] == 1
+
+
+def test_a_refresh_skips_leaders_that_are_fresh(api, r):
+    _school(api, [(1, 10, 80), (2, 11, 90)])
+    with api.application.app_context():
+        assert app.refresh_leaders() == 2
+        # the best student is listed in the easiest course, both are recomputed
+        api.put('/students', json={'current_id': 2, 'new': {'first_name': 'changed'}})
+        assert app.refresh_leaders() == 2
+        # neither leader depends on the other student
+        api.put('/students', json={'current_id': 1, 'new': {'first_name': 'changed'}})
+        assert app.refresh_leaders() == 0
+    assert api.get('/best_student').json['first_name'] == 'changed'
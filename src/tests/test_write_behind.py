@@ -0,0 +1,77 @@
+import pytest
+
+from utils import bulk_utils
+from utils import dbutils
+from utils import index_utils
+from utils import stats_utils
+from utils import redis_utils
+from utils import write_behind_utils
+
+
+@pytest.fixture
+def write_behind(config):
+    config['write_behind']['enabled'] = True
+
+
+def _school(client):
+    index_utils.ensure_indexes(client)
+    for sid in (1, 2):
+        dbutils.create_student(sid, 'first', 'last', f'{sid}@school.test', client)
+    dbutils.create_course(10, 'course', [1, 2], client)
+
+
+def _read(r, consumer='writer'):
+    write_behind_utils.ensure_group(r)
+    response = r.xreadgroup(write_behind_utils.GROUP, consumer, {write_behind_utils.STREAM: '>'}, count=100)
+    return [entry for _, entries in response or [] for entry in entries]
+
+
+def test_queued_grades_are_inserted_with_their_tickets(client, r):
+    _school(client)
+    tickets = [write_behind_utils.enqueue_grade({'student_id': sid, 'course_id': 10, 'grade': 70 + sid}, r, 60) for sid in (1, 2)]
+    assert write_behind_utils.get_ticket(tickets[0], r) == {'status': write_behind_utils.QUEUED}
+
+    assert write_behind_utils.process(_read(r), client, r, 60) == {'created': 2}
+    assert [write_behind_utils.get_ticket(t, r)['status'] for t in tickets] == ['created', 'created']
+    assert client.school.grades.find_one({'student_id': 1})['_id'] == write_behind_utils.grade_id(tickets[0])
+    assert redis_utils.get_course_rank(10, r)['average'] == 71.5
+    # the batch was acknowledged and removed from the stream
+    assert r.xlen(write_behind_utils.STREAM) == 0
+
+
+def test_a_batch_processed_again_after_a_crash_counts_once(client, r):
+    _school(client)
+    grade = {'student_id': 1, 'course_id': 10, 'grade': 80}
+    ticket = write_behind_utils.enqueue_grade(grade, r, 60)
+    # a consumer inserted the grade and crashed before recording its ticket, the entry is processed again
+    bulk_utils.insert_grades([grade], client, r, [write_behind_utils.grade_id(ticket)])
+    assert write_behind_utils.process(_read(r), client, r, 60) == {'created': 1}
+    assert write_behind_utils.get_ticket(ticket, r)['status'] == 'created'
+    assert client.school.grades.count_documents({}) == 1
+    assert stats_utils.get_averages(stats_utils.COURSE_STATS, [10], client) == {10: 80}
+
+
+def test_a_grade_queued_twice_is_a_duplicate(client, r):
+    _school(client)
+    grade = {'student_id': 1, 'course_id': 10, 'grade': 80}
+    tickets = [write_behind_utils.enqueue_grade(grade, r, 60) for _ in range(2)]
+    assert write_behind_utils.process(_read(r), client, r, 60) == {'created': 1, 'duplicate': 1}
+    assert write_behind_utils.get_ticket(tickets[1], r)['status'] == 'duplicate'
+
+
+def test_grade_ids_keep_the_time_of_their_entry():
+    first, second = write_behind_utils.grade_id('1700000000123-0'), write_behind_utils.grade_id('1700000000123-1')
+    assert first != second
+    assert first.generation_time.timestamp() == 1700000000
+    assert write_behind_utils.grade_id('1700000000123-0') == first
+
+
+def test_grades_are_queued_in_write_behind_mode(write_behind, api, client, r):
+    _school(client)
+    response = api.post('/grades', json={'student_id': 1, 'course_id': 10, 'grade': 80})
+    assert response.status_code == 202
+    ticket = response.json['ticket']
+    assert client.school.grades.count_documents({}) == 0
+    write_behind_utils.process(_read(r), client, r, 60)
+    assert api.get(f'/grades/tickets/{ticket}').json == {'ticket': ticket, 'status': 'created'}
+    assert api.get('/grades/tickets/0-1').status_code == 404
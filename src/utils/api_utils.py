@@ -0,0 +1,285 @@
+from collections import Counter
+
+# request parsing and response shaping shared by app.py and async_app.py. the helpers do no
+# io, they return the params read from a request or the (body, status) of a response, which
+# both server modes only wrap in a json response, so they can't answer a request differently.
+
+
+def error(message: str):
+    return {'error': message}, 404
+
+
+def document(doc: dict, missing: str):
+    """
+    a found document with its _id as a string, the missing error if it wasn't found.
+    """
+    if not doc:
+        return error(missing)
+    doc['_id'] = str(doc['_id'])
+    return doc, 200
+
+
+def unpack_ids(body: dict, *names: str):
+    """
+    read the ids identifying a deleted document from the json body, None if any is missing.
+    """
+    ids = tuple(body.get(name, None) for name in names)
+    return None if None in ids else ids
+
+
+def unpack_url_id(value: str):
+    """
+    read an id given in the url, None if it isn't an integer.
+    """
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def unpack_students_page(args, page_size: int, max_page_size: int):
+    """
+    read the page of course students from the url, the id to list the students after
+    and the page size, bounded by the configured maximum.
+    """
+    try:
+        after = args.get('students_after', None)
+        after = int(after) if after is not None else None
+        limit = int(args.get('students_limit', page_size))
+    except ValueError:
+        return None
+    return (after, limit) if 0 < limit <= max_page_size else None
+
+
+def unpack_leaderboard_size(args, default_size: int, max_size: int):
+    """
+    read the number of requested leaders from the url, bounded by the configured maximum.
+    """
+    try:
+        n = int(args.get('n', default_size))
+    except ValueError:
+        return None
+    return n if 0 < n <= max_size else None
+
+
+def add_students_page(course: dict, students: list, limit: int):
+    """
+    list a page of students in a course document from up to limit + 1 student ids, with
+    the cursor of the next page, None if this is the last one.
+    """
+    course['students'] = students[:limit]
+    course['next_students_after'] = students[limit - 1] if len(students) > limit else None
+    return course
+
+
+def batch_results(ids: list, documents: list):
+    """
+    the results of a batch lookup in the order of the requested ids, with an
+    explicit entry for every id that wasn't found.
+    """
+    results = []
+    for i, (requested, doc) in enumerate(zip(ids, documents)):
+        if doc is None:
+            results.append({'index': i, 'id': requested, 'status': 'not_found'})
+        else:
+            doc['_id'] = str(doc['_id'])
+            results.append({'index': i, 'id': requested, 'status': 'found', 'document': doc})
+    return {'summary': Counter(result['status'] for result in results), 'results': results}
+
+
+def bulk_results(results: list):
+    return {'summary': Counter(result['status'] for result in results),
+            'results': [{'index': i, **result} for i, result in enumerate(results)]}
+
+
+def export_headers(collection: str, fmt: str, compress: bool):
+    headers = {'Content-Disposition': f'attachment; filename={collection}.{fmt}', 'Vary': 'Accept-Encoding'}
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    return headers
+
+
+def invalid_ids(max_ids: int):
+    return error(f'invalid ids were given in url, at most {max_ids} are allowed.')
+
+
+def invalid_listing(collection: str):
+    return error(f'invalid listing of {collection} was given in url.')
+
+
+def invalid_export(collection: str):
+    return error(f'invalid export of {collection} was given in url.')
+
+
+def invalid_url_id(name: str):
+    return error(f'invalid {name} was given in url.')
+
+
+def invalid_students_page():
+    return error('invalid students page was given in url.')
+
+
+def invalid_leaderboard_size(max_size: int):
+    return error(f'n must be between 1 and {max_size}.')
+
+
+def invalid_bulk():
+    return error('a json array or an ndjson body was expected.')
+
+
+def invalid_student():
+    return error('invalid data was given for creating a student.')
+
+
+def invalid_course():
+    return error('invalid data was given for creating a course')
+
+
+def invalid_enrollment():
+    return error('invalid data was given for enrolling a student')
+
+
+def invalid_grade():
+    return error('invalid data was given for creating a grade.')
+
+
+def invalid_grade_update():
+    return error('invalid data was given for updating a grade.')
+
+
+def student_id_not_given():
+    return error('student id was not given')
+
+
+def course_id_not_given():
+    return error('course id was not given')
+
+
+def grade_ids_not_given():
+    return error('student and course ids were not given.')
+
+
+def rank_id_not_given(entity: str):
+    return error(f'{entity} id was not given in url.')
+
+
+def no_grades():
+    return error('no grades are listed in the system.')
+
+
+def student_created(id_num: int, student: dict):
+    if student is None:
+        return error('given id for student already exists.')
+    return {'new_student_id': id_num}, 200
+
+
+def student_found(id_num: int, student: dict):
+    return document(student, f'student with given id: {id_num} was not found.')
+
+
+def student_updated(id_num: int, student: dict):
+    """
+    the updated student, the invalid data error if its new id number is taken (False).
+    """
+    if student is False:
+        return invalid_student()
+    return student_found(id_num, student)
+
+
+def student_deleted(id_num: int, deleted: bool):
+    if not deleted:
+        return error(f'student with given id: {id_num} was not found.')
+    return {'deleted_student_id:': id_num}, 200
+
+
+def course_created(course: dict):
+    if course is None:
+        return error('given id for course already exists')
+    return {'new_course_id': course['course_id']}, 200
+
+
+def course_found(course_id: int, course: dict, students: list = None, limit: int = None):
+    """
+    a found course, listing the given page of its students.
+    """
+    if course and students is not None:
+        add_students_page(course, students, limit)
+    return document(course, f'course with id {course_id} was not found.')
+
+
+def course_updated(course_id: int, course: dict):
+    """
+    the updated course, the invalid data error if its new id is taken (False).
+    """
+    if course is False:
+        return invalid_course()
+    return course_found(course_id, course)
+
+
+def course_deleted(course_id: int, deleted: bool):
+    if not deleted:
+        return error(f'course with id {course_id} was not found.')
+    return {'deleted_course_id': course_id}, 200
+
+
+def student_enrolled(course_id: int, student_id: int, enrolled: bool):
+    if not enrolled:
+        return error(f'student {student_id} is already enrolled in course {course_id}.')
+    return {'course_id': course_id, 'enrolled_student_id': student_id}, 200
+
+
+def student_unenrolled(course_id: int, student_id: int, unenrolled: bool):
+    if not unenrolled:
+        return error(f'student {student_id} is not enrolled in course {course_id}.')
+    return {'course_id': course_id, 'unenrolled_student_id': student_id}, 200
+
+
+def grade_created(student_id: int, course_id: int, grade: dict):
+    if grade is None:
+        return error('given id for grade already exists.')
+    return {'new_grade_student_id': student_id, 'new_grade_course_id': course_id}, 200
+
+
+def grade_queued(ticket: str, status: str):
+    return {'ticket': ticket, 'status': status}, 202
+
+
+def ticket_found(ticket: str, status: dict):
+    if status is None:
+        return error(f'ticket {ticket} was not found.')
+    return {'ticket': ticket, **status}, 200
+
+
+def grade_found(student_id: int, course_id: int, grade: dict):
+    return document(grade, f'grade with student id {student_id} and course id {course_id} was not found.')
+
+
+def grade_updated(student_id: int, course_id: int, grade: dict):
+    return document(grade, f'grade with sid: {student_id} and cid: {course_id} was not found.')
+
+
+def grade_deleted(student_id: int, course_id: int, deleted: bool):
+    if not deleted:
+        return error(f'grade with sid: {student_id} and cid: {course_id} was not found.')
+    return {'deleted_grade_sid': student_id, 'deleted_grade_cid': course_id}, 200
+
+
+def rank_found(name: str, entity: str, id_num: int, rank: dict):
+    """
+    the rank of a student or course, named by its id field.
+    """
+    if rank is None:
+        return error(f'{entity} with id: {id_num} has no grades.')
+    return {name: id_num, **rank}, 200
+
+
+def transcript_found(student_id: int, transcript: dict):
+    if transcript is None:
+        return error(f'student with given id: {student_id} was not found.')
+    return transcript, 200
+
+
+def distribution_found(course_id: int, distribution: dict):
+    if distribution is None:
+        return error(f'course with id: {course_id} has no grades.')
+    return distribution, 200
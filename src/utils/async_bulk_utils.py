@@ -0,0 +1,86 @@
+import asyncio
+
+from pymongo import AsyncMongoClient
+from pymongo.errors import BulkWriteError
+from redis.asyncio import Redis
+from utils.logging_utils import logging
+from utils import async_stats_utils
+from utils import change_stream_utils
+from utils import async_dbutils
+from utils.bulk_utils import (check_students, check_courses, check_grades, referenced_students, referenced_ids,
+                              record_inserts, parse_ndjson, course_documents, created_enrollments, build_rosters)
+
+# asyncio versions of the bulk_utils io functions, the validation is shared with bulk_utils.
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+
+async def ndjson_items(body):
+    """
+    parse a streamed ndjson request body, see bulk_utils.parse_ndjson.
+    """
+    buffer = b''
+    async for data in body:
+        *lines, buffer = (buffer + data).split(b'\n')
+        for item in parse_ndjson(lines):
+            yield item
+    for item in parse_ndjson([buffer]):
+        yield item
+
+
+async def chunks(items, size: int):
+    chunk = []
+    async for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+async def _insert_many(collection, docs: dict, results: list):
+    if len(docs) == 0:
+        return []
+    try:
+        await collection.insert_many(list(docs.values()), ordered=False)
+        write_errors = []
+    except BulkWriteError as e:
+        write_errors = e.details['writeErrors']
+    return record_inserts(docs, write_errors, results)
+
+
+async def insert_students(items: list, client: AsyncMongoClient):
+    results, docs = check_students(items)
+    inserted = await _insert_many(client.school.students, docs, results)
+    logger.info("bulk inserted students. given: %s, created: %s", len(items), len(inserted))
+    return results
+
+
+async def insert_courses(items: list, client: AsyncMongoClient):
+    student_ids = referenced_students(items)
+    existing = {d['id_number'] async for d in client.school.students.find({'id_number': {'$in': student_ids}}, {'id_number': 1})}
+    results, docs = check_courses(items, existing)
+    inserted = await _insert_many(client.school.courses, course_documents(docs), results)
+    enrolled = await async_dbutils.insert_enrollments(created_enrollments(docs, results), client)
+    logger.info("bulk inserted courses. given: %s, created: %s, enrollments: %s", len(items), len(inserted), enrolled)
+    return results
+
+
+async def insert_grades(items: list, client: AsyncMongoClient, r: Redis = None):
+    """
+    see bulk_utils.insert_grades, the students, courses and enrollments are looked up concurrently.
+    """
+    student_ids, course_ids = referenced_ids(items)
+    students, courses, enrollments = await asyncio.gather(
+        client.school.students.find({'id_number': {'$in': student_ids}}, {'id_number': 1}).to_list(None),
+        client.school.courses.find({'course_id': {'$in': course_ids}}, {'course_id': 1}).to_list(None),
+        client.school.enrollments.find({'course_id': {'$in': course_ids}, 'student_id': {'$in': student_ids}},
+                                       {'course_id': 1, 'student_id': 1}).to_list(None))
+    results, docs = check_grades(items, {d['id_number'] for d in students}, build_rosters(courses, enrollments))
+    inserted = await _insert_many(client.school.grades, docs, results)
+    if len(inserted) > 0 and not change_stream_utils.enabled():
+        await async_stats_utils.add_grades_to_stats(inserted, client, r)
+    logger.info("bulk inserted grades. given: %s, created: %s", len(items), len(inserted))
+    return results
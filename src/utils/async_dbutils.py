@@ -0,0 +1,596 @@
+from pymongo import AsyncMongoClient
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from pymongo.asynchronous.client_session import AsyncClientSession
+from redis.asyncio import Redis
+from utils.logging_utils import logging
+from utils import async_stats_utils
+from utils import async_entity_cache
+from utils import entity_cache
+from utils import change_stream_utils
+from utils.async_stats_utils import concurrently
+from utils.dbutils import (_ids_pipeline, _collect_ids, _ids_to_lookup, _all_students_exist, _is_valid_grade,
+                           check_grade_dependents, enrollment_docs, _grade_pairs_query, _transcript_pipeline,
+                           DUPLICATE_KEY, DELETE_BATCH_SIZE, CascadeEffects)
+
+# asyncio versions of the dbutils functions that do db io, for the asyncio server mode
+# (async_app.py). they keep the semantics of their dbutils counterparts, but lookups
+# that don't depend on each other are issued concurrently. the unpacking and the pure
+# type validation functions of dbutils are used as is.
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+
+# validation utility functions
+async def validate_student_modification_params(curr_id, mod_params, client: AsyncMongoClient):
+    if len(mod_params) == 0:  # there most be some new param to update
+        return False
+    elif not isinstance(curr_id, int):  # current id must be an integer
+        return False
+
+    # check the modification params types, if params isn't given, ignore.
+    id_val = isinstance(mod_params.get('id_number', 0), int)
+    fn_val = isinstance(mod_params.get('first_name', ''), str)
+    ln_val = isinstance(mod_params.get('last_name', ''), str)
+    em_val = isinstance(mod_params.get('email', ''), str)
+    if not (id_val and fn_val and ln_val and em_val):
+        return False
+
+    # if new id is given, make sure it is not in use
+    id_used = False
+    if 'id_number' in mod_params and mod_params['id_number'] != curr_id:
+        id_used = await client.school.students.find_one({'id_number': mod_params['id_number']}, {'_id': 1}) is not None
+
+    return not id_used
+
+
+async def lookup_ids(student_ids: list, course_ids: list, client: AsyncMongoClient, enrolled: list = ()):
+    """
+    see dbutils.lookup_ids.
+    """
+    student_ids, course_ids, enrolled = _ids_to_lookup(student_ids, course_ids, enrolled)
+    if len(student_ids) == 0 and len(course_ids) == 0:
+        return set(), {}
+    cursor = await client.school.students.aggregate(_ids_pipeline(student_ids, course_ids, enrolled))
+    return _collect_ids(await cursor.to_list(None))
+
+
+async def validate_course_student_list(student_ids, client: AsyncMongoClient):
+    """
+    checks if all the given student ids exist in the database.
+    """
+    if not isinstance(student_ids, list) or not all(isinstance(s, int) for s in student_ids):
+        return False
+    existing_students, _ = await lookup_ids(student_ids, [], client)
+    return _all_students_exist(student_ids, existing_students)
+
+
+async def validate_course_creation_params(course_id, name, students, client: AsyncMongoClient):
+    val_cid = isinstance(course_id, int)
+    val_name = isinstance(name, str)
+    val_students = val_cid and val_name and await validate_course_student_list(students, client)
+    logger.info("course validation. cid: %s, name: %s, val_students: %s", val_cid, val_name, val_students)
+    return val_cid and val_name and val_students
+
+
+async def validate_course_modification_params(curr_id, mod_params, client: AsyncMongoClient):
+    """
+    see dbutils.validate_course_modification_params.
+    """
+    if not isinstance(curr_id, int):
+        return False
+    if 'name' in mod_params and not isinstance(mod_params['name'], str):
+        return False
+
+    new_cid = mod_params.get('course_id', None)
+    if new_cid is not None and not isinstance(new_cid, int):
+        return False
+    students = mod_params.get('students', None)
+    if isinstance(students, list) and not all(isinstance(s, int) for s in students):
+        return False
+    students = students if isinstance(students, list) else []
+
+    existing_students, existing_courses = await lookup_ids(students, [new_cid], client)
+    if new_cid in existing_courses:
+        return False
+    return _all_students_exist(students, existing_students)
+
+
+async def validate_enrollment_params(course_id, student_id, client: AsyncMongoClient):
+    """
+    see dbutils.validate_enrollment_params.
+    """
+    if not isinstance(course_id, int) or not isinstance(student_id, int):
+        logger.info("attempted to enroll with invalid ids. sid: %s, cid: %s", student_id, course_id)
+        return False
+    existing_students, existing_courses = await lookup_ids([student_id], [course_id], client)
+    valid = student_id in existing_students and course_id in existing_courses
+    logger.info("enrollment validation. sid: %s, cid: %s, valid: %s", student_id, course_id, valid)
+    return valid
+
+
+async def validate_grade_creation_params(student_id, course_id, grade, client: AsyncMongoClient):
+    """
+    see dbutils.validate_grade_creation_params.
+    """
+    if not isinstance(student_id, int) or not isinstance(course_id, int):
+        logger.info("attempted to create grade with invalid ids. sid: %s, cid: %s", student_id, course_id)
+        return False
+    if not _is_valid_grade(grade):
+        return False
+
+    existing_students, existing_courses = await lookup_ids([student_id], [course_id], client, [student_id])
+    return check_grade_dependents([student_id], [course_id], student_id, course_id, existing_students, existing_courses)
+
+
+async def validate_grade_modification_params(student_id: int, course_id: int, mod_params: dict, client: AsyncMongoClient):
+    """
+    see dbutils.validate_grade_modification_params.
+    """
+    new_sid = mod_params.get('student_id', None)
+    new_cid = mod_params.get('course_id', None)
+    if not all(isinstance(i, int) for i in (student_id, course_id, new_sid or 0, new_cid or 0)):
+        logger.info("attempted to modify grade with invalid ids. sid: %s, cid: %s, new sid: %s, new cid: %s",
+                    student_id, course_id, new_sid, new_cid)
+        return False
+
+    new_grade = mod_params.get('grade', None)
+    if not new_grade:
+        logger.info("attempted to modify grade with invalid value. grade: %s", new_grade)
+        return False
+    if not _is_valid_grade(new_grade):
+        return False
+
+    target_sid, target_cid = new_sid or student_id, new_cid or course_id
+    existing_students, existing_courses = await lookup_ids([student_id, new_sid], [course_id, new_cid], client, [target_sid])
+    return check_grade_dependents([student_id, new_sid], [course_id, new_cid], target_sid, target_cid,
+                                  existing_students, existing_courses)
+
+
+# creation functions
+async def create_student(id_num: int, first_name: str, last_name: str, email: str, client: AsyncMongoClient):
+    student_object = {'id_number': id_num, 'first_name': first_name, 'last_name': last_name, 'email': email}
+    try:
+        _id = (await client.school.students.insert_one(student_object)).inserted_id
+    except DuplicateKeyError:
+        logger.info("attempted to create existing student with id: %s.", id_num)
+        return None
+    student_object['_id'] = str(_id)
+    logger.info("writing new student to db. id: %s, _id: %s", id_num, _id)
+    return student_object
+
+
+async def create_course(course_id: int, name: str, students: list, client: AsyncMongoClient):
+    new_course = {'course_id': course_id, 'name': name}
+    try:
+        _id = (await client.school.courses.insert_one(new_course)).inserted_id
+    except DuplicateKeyError:
+        logger.info("attempted to create existing course. id: %s", course_id)
+        return None
+    await insert_enrollments(enrollment_docs(course_id, students), client)
+    new_course['_id'] = str(_id)
+    logger.info("writing new course to db. id: %s, _id: %s, students: %s", course_id, _id, len(students))
+    return {**new_course, 'students': students}
+
+
+async def insert_enrollments(enrollments: list, client: AsyncMongoClient, session: AsyncClientSession = None):
+    """
+    see dbutils.insert_enrollments.
+    """
+    if len(enrollments) == 0:
+        return 0
+    try:
+        return len((await client.school.enrollments.insert_many(enrollments, ordered=False, session=session)).inserted_ids)
+    except BulkWriteError as e:
+        if any(error['code'] != DUPLICATE_KEY for error in e.details['writeErrors']):
+            raise
+        return e.details['nInserted']
+
+
+async def enroll_student(course_id: int, student_id: int, client: AsyncMongoClient):
+    try:
+        await client.school.enrollments.insert_one({'course_id': course_id, 'student_id': student_id})
+    except DuplicateKeyError:
+        logger.info("attempted to enroll student who is enrolled already. sid: %s, cid: %s", student_id, course_id)
+        return False
+    logger.info("enrolled student. sid: %s, cid: %s", student_id, course_id)
+    return True
+
+
+async def _apply_grade_delta(student_id: int, course_id: int, grade_sum, grade_count: int, client: AsyncMongoClient, r: Redis,
+                             effects: CascadeEffects, session: AsyncClientSession = None):
+    """
+    see dbutils._apply_grade_delta.
+    """
+    if change_stream_utils.enabled():
+        return
+    if session is None:
+        await async_stats_utils.apply_grade_delta(student_id, course_id, grade_sum, grade_count, client, r)
+        return
+    await async_stats_utils.apply_grade_delta(student_id, course_id, grade_sum, grade_count, client, session=session)
+    effects.students.add(student_id)
+    effects.courses.add(course_id)
+    return
+
+
+async def create_grade(student_id: int, course_id: int, grade: int, client: AsyncMongoClient, r: Redis = None, atomic: bool = False):
+    async def write(session, effects):
+        new_grade = {'course_id': course_id, 'student_id': student_id, 'grade': grade}
+        new_grade['_id'] = (await client.school.grades.insert_one(new_grade, session=session)).inserted_id
+        await _apply_grade_delta(student_id, course_id, grade, 1, client, r, effects, session)
+        return new_grade
+
+    try:
+        new_grade = await _transaction(write, client, r, atomic)
+    except DuplicateKeyError:
+        logger.info("attempted to create existing grade. sid: %s, cid: %s", student_id, course_id)
+        return None
+    new_grade['_id'] = str(new_grade['_id'])
+    logger.info("created new grade. sid: %s, cid: %s, grade: %s", student_id, course_id, grade)
+    return new_grade
+
+
+async def _apply_effects(effects: CascadeEffects, client: AsyncMongoClient, r: Redis = None):
+    if r is not None and (len(effects.students) > 0 or len(effects.courses) > 0):
+        await async_stats_utils.refresh_leaderboards(list(effects.students), list(effects.courses), client, r)
+    await async_entity_cache.invalidate(effects.cache_keys, r)
+    return
+
+
+async def _transaction(write, client: AsyncMongoClient, r: Redis = None, atomic: bool = False):
+    """
+    see dbutils._transaction, write is a coroutine function.
+    """
+    async def attempt(session):
+        effects = CascadeEffects()
+        return await write(session, effects), effects
+
+    if not atomic:
+        result, effects = await attempt(None)
+    else:
+        async with client.start_session() as session:
+            result, effects = await session.with_transaction(attempt)
+    await _apply_effects(effects, client, r)
+    return result
+
+
+async def _cached_ids(collection, field: str, query: dict, session: AsyncClientSession = None):
+    """
+    see dbutils._cached_ids.
+    """
+    if not entity_cache.enabled():
+        return []
+    return await collection.distinct(field, query, session=session)
+
+
+# update functions
+async def update_student(id_num: int, new_params: dict, client: AsyncMongoClient, r: Redis = None, atomic: bool = False):
+    async def write(session, effects):
+        required_student = await client.school.students.find_one_and_update({'id_number': id_num}, {'$set': new_params}, session=session)
+        if required_student is None:
+            logger.info("attempted to update non-existing student. id: %s", id_num)
+            return None
+
+        # update course enrollment and grades with new id if necessary, they don't depend on each other
+        new_id = new_params.get('id_number', id_num)
+        if new_id != id_num:
+            mod_courses, mod_grades = await concurrently(
+                session,
+                update_all_student_courses(id_num, new_id, client, session),
+                update_all_student_grades(id_num, new_id, client, effects, session))
+            logger.info("updating student id from %s to %s. mod courses: %s, mod grades: %s", id_num, new_id, mod_courses, mod_grades)
+        effects.cache_keys += [entity_cache.student_key(id_num), entity_cache.student_key(new_id)]
+        logger.info("updated existing student: %s", id_num)
+        return {**required_student, **new_params}
+
+    try:
+        return await _transaction(write, client, r, atomic)
+    except DuplicateKeyError:
+        logger.info("attempted to update student to an existing id. id: %s, new id: %s", id_num, new_params.get('id_number'))
+        return False
+
+
+async def update_course(course_id: int, new_params: dict, client: AsyncMongoClient, r: Redis = None, atomic: bool = False):
+    """
+    see dbutils.update_course.
+    """
+    course_params = {k: v for k, v in new_params.items() if k != 'students'}
+
+    async def write(session, effects):
+        courses = client.school.courses
+        if len(course_params) > 0:
+            required_course = await courses.find_one_and_update({'course_id': course_id}, {'$set': course_params}, session=session)
+        else:
+            required_course = await courses.find_one({'course_id': course_id}, session=session)
+        if required_course is None:
+            logger.info("attempted to update non-existing course. cid: %s", course_id)
+            return None
+
+        # enrollments are replaced before they and the grades are moved to a new course id
+        num_removed = 0
+        if 'students' in new_params:
+            num_removed = await set_course_students(course_id, new_params['students'], client, effects, session)
+
+        num_modified_grades = 0
+        new_id = new_params.get('course_id', course_id)
+        if new_id != course_id:
+            await client.school.enrollments.update_many({'course_id': course_id}, {'$set': {'course_id': new_id}}, session=session)
+            num_modified_grades = await update_all_course_grades(course_id, new_id, client, effects, session)
+        effects.cache_keys += [entity_cache.course_key(course_id), entity_cache.course_key(new_id)]
+        logger.info("updated course. cid: %s, students removed from course: %s, grades modified: %s", course_id, num_removed, num_modified_grades)
+        return {**required_course, **new_params}
+
+    try:
+        return await _transaction(write, client, r, atomic)
+    except DuplicateKeyError:
+        logger.info("attempted to update course to an existing id. cid: %s, new id: %s", course_id, new_params.get('course_id'))
+        return False
+
+
+async def set_course_students(course_id: int, student_ids: list, client: AsyncMongoClient, effects: CascadeEffects, session: AsyncClientSession = None):
+    """
+    see dbutils.set_course_students.
+    """
+    enrollments = client.school.enrollments
+    removed = await enrollments.distinct('student_id', {'course_id': course_id, 'student_id': {'$nin': student_ids}}, session=session)
+    if len(removed) > 0:
+        await enrollments.delete_many({'course_id': course_id, 'student_id': {'$in': removed}}, session=session)
+        num_grades_deleted = await delete_students_grades_from_course(removed, course_id, client, effects, session)
+        logger.info("removing grades for students in course: %s, num_deleted: %s", course_id, num_grades_deleted)
+    await insert_enrollments(enrollment_docs(course_id, student_ids), client, session)
+    return len(removed)
+
+
+async def update_grade(student_id: int, course_id: int, new_params: dict, client: AsyncMongoClient, r: Redis = None, atomic: bool = False):
+    """
+    see dbutils.update_grade.
+    """
+    async def write(session, effects):
+        grade_filter = {'course_id': course_id, 'student_id': student_id}
+        required_grade = await client.school.grades.find_one_and_update(grade_filter, {'$set': new_params}, session=session)
+        if required_grade is None:
+            logger.info("attempted to update non-existing grade. sid: %s, cid: %s", student_id, course_id)
+            return None
+        new_grade = {**required_grade, **new_params}
+
+        # keep the running aggregates in line with the new grade
+        new_sid, new_cid = new_grade['student_id'], new_grade['course_id']
+        if new_sid == student_id and new_cid == course_id:
+            if new_grade['grade'] != required_grade['grade']:
+                await _apply_grade_delta(student_id, course_id, new_grade['grade'] - required_grade['grade'], 0, client, r, effects, session)
+        else:
+            await _apply_grade_delta(student_id, course_id, -required_grade['grade'], -1, client, r, effects, session)
+            await _apply_grade_delta(new_sid, new_cid, new_grade['grade'], 1, client, r, effects, session)
+        effects.cache_keys += [entity_cache.grade_key(student_id, course_id), entity_cache.grade_key(new_sid, new_cid)]
+        logger.info("updating grade. sid: %s, cid: %s", student_id, course_id)
+        return new_grade
+
+    # the unique (course_id, student_id) index keeps a grade from being moved onto an existing one
+    try:
+        return await _transaction(write, client, r, atomic)
+    except DuplicateKeyError:
+        logger.info("attempted to move grade onto an existing grade. sid: %s, cid: %s, new sid: %s, new cid: %s", student_id, course_id,
+                    new_params.get('student_id', student_id), new_params.get('course_id', course_id))
+        return None
+
+
+async def update_all_student_courses(student_id: int, new_id: int, client: AsyncMongoClient, session: AsyncClientSession = None):
+    """
+    see dbutils.update_all_student_courses.
+    """
+    result = await client.school.enrollments.update_many({'student_id': student_id},
+                                                         {'$set': {'student_id': new_id}},
+                                                         session=session)
+    return result.modified_count
+
+
+async def update_all_student_grades(student_id: int, new_id: int, client: AsyncMongoClient, effects: CascadeEffects, session: AsyncClientSession = None):
+    course_ids = await _cached_ids(client.school.grades, 'course_id', {'student_id': student_id}, session)
+    result = await client.school.grades.update_many({'student_id': student_id}, {'$set': {'student_id': new_id}}, session=session)
+    if not change_stream_utils.enabled():
+        await async_stats_utils.rename_student_stats(student_id, new_id, client, session=session)
+        effects.students.update((student_id, new_id))
+    effects.cache_keys += [entity_cache.grade_key(s, c) for c in course_ids for s in (student_id, new_id)]
+    return result.modified_count
+
+
+async def update_all_course_grades(course_id: int, new_id: int, client: AsyncMongoClient, effects: CascadeEffects, session: AsyncClientSession = None):
+    student_ids = await _cached_ids(client.school.grades, 'student_id', {'course_id': course_id}, session)
+    result = await client.school.grades.update_many({'course_id': course_id}, {'$set': {'course_id': new_id}}, session=session)
+    if not change_stream_utils.enabled():
+        await async_stats_utils.rename_course_stats(course_id, new_id, client, session=session)
+        effects.courses.update((course_id, new_id))
+    effects.cache_keys += [entity_cache.grade_key(s, c) for s in student_ids for c in (course_id, new_id)]
+    return result.modified_count
+
+
+# getter function
+async def get_student(id_num: int, client: AsyncMongoClient, r: Redis = None, local: bool = True):
+    logger.info("getting student with id: %s", id_num)
+    return await async_entity_cache.get(entity_cache.student_key(id_num),
+                                        lambda: client.school.students.find_one({'id_number': id_num}), r, local)
+
+
+async def get_course(course_id: int, client: AsyncMongoClient, r: Redis = None, local: bool = True):
+    logger.info("getting course id: %s", course_id)
+    return await async_entity_cache.get(entity_cache.course_key(course_id),
+                                        lambda: client.school.courses.find_one({'course_id': course_id}), r, local)
+
+
+async def get_students(id_nums: list, client: AsyncMongoClient, r: Redis = None):
+    """
+    see dbutils.get_students.
+    """
+    async def load(missing):
+        return {s['id_number']: s async for s in client.school.students.find({'id_number': {'$in': missing}})}
+
+    logger.info("getting students. num ids: %s", len(id_nums))
+    return await async_entity_cache.get_many(id_nums, entity_cache.student_key, load, r)
+
+
+async def get_courses(course_ids: list, client: AsyncMongoClient, r: Redis = None):
+    """
+    see dbutils.get_courses.
+    """
+    async def load(missing):
+        return {c['course_id']: c async for c in client.school.courses.find({'course_id': {'$in': missing}})}
+
+    logger.info("getting courses. num ids: %s", len(course_ids))
+    return await async_entity_cache.get_many(course_ids, entity_cache.course_key, load, r)
+
+
+async def get_grades(pairs: list, client: AsyncMongoClient, r: Redis = None):
+    """
+    see dbutils.get_grades.
+    """
+    async def load(missing):
+        return {(g['student_id'], g['course_id']): g async for g in client.school.grades.find(_grade_pairs_query(missing))}
+
+    logger.info("getting grades. num pairs: %s", len(pairs))
+    return await async_entity_cache.get_many(pairs, lambda p: entity_cache.grade_key(*p), load, r)
+
+
+async def get_transcript(student_id: int, client: AsyncMongoClient):
+    """
+    see dbutils.get_transcript.
+    """
+    cursor = await client.school.students.aggregate(_transcript_pipeline(student_id))
+    transcript = next(iter(await cursor.to_list(None)), None)
+    logger.info("getting transcript. sid: %s, found: %s", student_id, transcript is not None)
+    return transcript
+
+
+async def get_course_students(course_id: int, client: AsyncMongoClient, after: int = None, limit: int = 100):
+    """
+    see dbutils.get_course_students.
+    """
+    query = {'course_id': course_id}
+    if after is not None:
+        query['student_id'] = {'$gt': after}
+    enrollments = client.school.enrollments.find(query, {'_id': 0, 'student_id': 1}).sort('student_id', 1).limit(limit)
+    student_ids = [e['student_id'] for e in await enrollments.to_list(None)]
+    logger.info("getting course students. cid: %s, after: %s, num: %s", course_id, after, len(student_ids))
+    return student_ids
+
+
+async def get_grade(student_id: int, course_id: int, client: AsyncMongoClient, r: Redis = None, local: bool = True):
+    logger.info("getting grade. sid: %s, cid: %s", student_id, course_id)
+    return await async_entity_cache.get(entity_cache.grade_key(student_id, course_id),
+                                        lambda: client.school.grades.find_one({'course_id': course_id, 'student_id': student_id}), r, local)
+
+
+# deletion functions
+async def delete_student(id_num: int, client: AsyncMongoClient, r: Redis = None, atomic: bool = False):
+    """
+    delete a student, his enrollment and his grades. the enrollment and the grades
+    are deleted concurrently.
+    """
+    async def write(session, effects):
+        if await client.school.students.find_one_and_delete({'id_number': id_num}, {'_id': 1}, session=session) is None:
+            logger.info("attempted to delete non-existing student. id: %s", id_num)
+            return False
+
+        num_courses_removed, num_grades_removed = await concurrently(
+            session,
+            delete_student_from_courses(id_num, client, session),
+            delete_all_student_grades(id_num, client, effects, session))
+        effects.cache_keys.append(entity_cache.student_key(id_num))
+        logger.info("deleting existing student. id: %s, mod courses: %s, del grades: %s", id_num, num_courses_removed, num_grades_removed)
+        return True
+
+    return await _transaction(write, client, r, atomic)
+
+
+async def delete_course(course_id: int, client: AsyncMongoClient, r: Redis = None, atomic: bool = False):
+    async def write(session, effects):
+        if await client.school.courses.find_one_and_delete({'course_id': course_id}, {'_id': 1}, session=session) is None:
+            logger.info("attempted to delete non-existing course. cid: %s", course_id)
+            return False
+
+        await client.school.enrollments.delete_many({'course_id': course_id}, session=session)
+        deleted_grades = await delete_all_course_grades(course_id, client, effects, session)
+        effects.cache_keys.append(entity_cache.course_key(course_id))
+        logger.info("deleted course. cid: %s, num grades deleted: %s", course_id, deleted_grades)
+        return True
+
+    return await _transaction(write, client, r, atomic)
+
+
+async def unenroll_student(course_id: int, student_id: int, client: AsyncMongoClient, r: Redis = None, atomic: bool = False):
+    """
+    see dbutils.unenroll_student.
+    """
+    async def write(session, effects):
+        enrollment = {'course_id': course_id, 'student_id': student_id}
+        if (await client.school.enrollments.delete_one(enrollment, session=session)).deleted_count == 0:
+            logger.info("attempted to unenroll student who isn't enrolled. sid: %s, cid: %s", student_id, course_id)
+            return False
+        num_grades_deleted = await delete_students_grades_from_course([student_id], course_id, client, effects, session)
+        logger.info("unenrolled student. sid: %s, cid: %s, del grades: %s", student_id, course_id, num_grades_deleted)
+        return True
+
+    return await _transaction(write, client, r, atomic)
+
+
+async def delete_grade(student_id: int, course_id: int, client: AsyncMongoClient, r: Redis = None, atomic: bool = False):
+    async def write(session, effects):
+        grade_filter = {'course_id': course_id, 'student_id': student_id}
+        required_grade = await client.school.grades.find_one_and_delete(grade_filter, {'grade': 1}, session=session)
+        if required_grade is None:
+            logger.info("attempted to delete non-existing grade. sid: %s, cid: %s", student_id, course_id)
+            return False
+        await _apply_grade_delta(student_id, course_id, -required_grade['grade'], -1, client, r, effects, session)
+        effects.cache_keys.append(entity_cache.grade_key(student_id, course_id))
+        logger.info("deleting grade. sid: %s, cid: %s", student_id, course_id)
+        return True
+
+    return await _transaction(write, client, r, atomic)
+
+
+async def delete_all_course_grades(course_id: int, client: AsyncMongoClient, effects: CascadeEffects, session: AsyncClientSession = None):
+    deleted_count = await _delete_grades({'course_id': {'$eq': course_id}}, client, effects, session)
+    logger.info("deleting all grade for course: %s, num_deleted: %s", course_id, deleted_count)
+    return deleted_count
+
+
+async def delete_all_student_grades(student_id: int, client: AsyncMongoClient, effects: CascadeEffects, session: AsyncClientSession = None):
+    deleted_count = await _delete_grades({'student_id': {'$eq': student_id}}, client, effects, session)
+    logger.info("deleting all grades for student: %s, num_deleted: %s", student_id, deleted_count)
+    return deleted_count
+
+
+async def delete_student_from_courses(student_id: int, client: AsyncMongoClient, session: AsyncClientSession = None):
+    """
+    see dbutils.delete_student_from_courses.
+    """
+    result = await client.school.enrollments.delete_many({'student_id': student_id}, session=session)
+    return result.deleted_count
+
+
+async def delete_students_grades_from_course(student_ids: list, course_id: int, client: AsyncMongoClient, effects: CascadeEffects, session: AsyncClientSession = None):
+    return await _delete_grades({'course_id': {'$eq': course_id}, 'student_id': {'$in': student_ids}}, client, effects, session)
+
+
+async def _delete_grades(grade_filter: dict, client: AsyncMongoClient, effects: CascadeEffects, session: AsyncClientSession = None):
+    """
+    see dbutils._delete_grades.
+    """
+    cursor = client.school.grades.find(grade_filter, {'student_id': 1, 'course_id': 1, 'grade': 1},
+                                       batch_size=DELETE_BATCH_SIZE, session=session)
+    deleted_count = 0
+    while True:
+        grades = await cursor.to_list(DELETE_BATCH_SIZE)
+        if len(grades) == 0:
+            return deleted_count
+        deleted_count += await _delete_grade_batch(grades, client, effects, session)
+
+
+async def _delete_grade_batch(grades: list, client: AsyncMongoClient, effects: CascadeEffects, session: AsyncClientSession = None):
+    result = await client.school.grades.delete_many({'_id': {'$in': [g['_id'] for g in grades]}}, session=session)
+    if not change_stream_utils.enabled():
+        students, courses = await async_stats_utils.remove_grades_from_stats(grades, client, session=session)
+        effects.students.update(students)
+        effects.courses.update(courses)
+    if entity_cache.enabled():
+        effects.cache_keys += [entity_cache.grade_key(g['student_id'], g['course_id']) for g in grades]
+    return result.deleted_count
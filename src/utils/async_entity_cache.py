@@ -0,0 +1,90 @@
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from utils import entity_cache
+from utils.entity_cache import (lookup_cached, remember, forget, serialize, deserialize, from_redis, count_redis_lookup,
+                                count_redis_error, TOMBSTONE)
+
+# asyncio versions of the entity_cache functions that talk to redis. the memo, the
+# process lru and the counters are shared with entity_cache.
+
+
+async def get(key: str, load, r: Redis = None, local: bool = True):
+    """
+    see entity_cache.get, load is a coroutine function.
+    """
+    if not entity_cache.enabled():
+        return await load()
+
+    value = lookup_cached(key, local)
+    if value is None and r is not None:
+        try:
+            value = from_redis(await r.get(key))
+            count_redis_lookup(value)
+        except RedisError as e:
+            count_redis_error(e)
+    if value is None:
+        document = await load()
+        if document is None:
+            return None
+        value = serialize(document)
+        if r is not None:
+            try:
+                await r.set(key, value, ex=entity_cache.redis_ttl(), nx=True)
+            except RedisError as e:
+                count_redis_error(e)
+    remember(key, value)
+    return deserialize(value)
+
+
+async def get_many(ids: list, key, load, r: Redis = None, local: bool = True):
+    """
+    see entity_cache.get_many, load is a coroutine function.
+    """
+    unique = list(dict.fromkeys(ids))
+    if not entity_cache.enabled():
+        documents = await load(unique)
+        return [documents.get(i) for i in ids]
+
+    values = {i: lookup_cached(key(i), local) for i in unique}
+    missing = [i for i in unique if values[i] is None]
+    if len(missing) > 0 and r is not None:
+        try:
+            for i, value in zip(missing, await r.mget([key(i) for i in missing])):
+                values[i] = from_redis(value)
+                count_redis_lookup(values[i])
+        except RedisError as e:
+            count_redis_error(e)
+    missing = [i for i in unique if values[i] is None]
+    if len(missing) > 0:
+        loaded = {i: serialize(document) for i, document in (await load(missing)).items()}
+        if len(loaded) > 0 and r is not None:
+            try:
+                pipe = r.pipeline(transaction=False)
+                for i, value in loaded.items():
+                    pipe.set(key(i), value, ex=entity_cache.redis_ttl(), nx=True)
+                await pipe.execute()
+            except RedisError as e:
+                count_redis_error(e)
+        values.update(loaded)
+    for i in unique:
+        if values[i] is not None:
+            remember(key(i), values[i])
+    return [deserialize(values[i]) if values[i] is not None else None for i in ids]
+
+
+async def invalidate(keys: list, r: Redis = None):
+    """
+    see entity_cache.invalidate.
+    """
+    if not entity_cache.enabled() or len(keys) == 0:
+        return
+    forget(keys)
+    if r is not None:
+        try:
+            pipe = r.pipeline(transaction=False)
+            for key in keys:
+                pipe.set(key, TOMBSTONE, ex=entity_cache.tombstone_ttl())
+            await pipe.execute()
+        except RedisError as e:
+            count_redis_error(e)
+    return
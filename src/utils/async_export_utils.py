@@ -0,0 +1,24 @@
+from pymongo import AsyncMongoClient
+from utils.logging_utils import logging
+from utils import async_bulk_utils
+from utils.export_utils import FIELDS, ExportWriter, export_cursor
+
+# asyncio version of export_utils.export, the serialization is shared with export_utils.
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+
+async def export(collection: str, filters: dict, fmt: str, compress: bool, client: AsyncMongoClient, batch_size: int = 1000):
+    """
+    see export_utils.export.
+    """
+    fields = FIELDS[collection]
+    writer = ExportWriter(fields, fmt, compress)
+    yield writer.start()
+    exported = 0
+    async for batch in async_bulk_utils.chunks(export_cursor(client.school[collection], filters, fields, batch_size), batch_size):
+        exported += len(batch)
+        yield writer.write(batch)
+    yield writer.finish()
+    logger.info("exported %s. filters: %s, format: %s, compressed: %s, documents: %s", collection, filters, fmt, compress, exported)
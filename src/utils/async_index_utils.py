@@ -0,0 +1,25 @@
+from pymongo import AsyncMongoClient
+from pymongo.errors import OperationFailure
+from utils.logging_utils import logging
+from utils.index_utils import INDEXES
+
+# asyncio version of index_utils.ensure_indexes, run when the async app starts serving.
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+
+async def ensure_indexes(client: AsyncMongoClient, collections: list = None):
+    """
+    see index_utils.ensure_indexes.
+    """
+    errors = {}
+    for name in collections or INDEXES:
+        for index in INDEXES[name]:
+            try:
+                await client.school[name].create_indexes([index])
+            except OperationFailure as e:
+                errors.setdefault(name, {})[index.document['name']] = str(e)
+                logger.error("failed to create index: %s on %s. error: %s", index.document['name'], name, e)
+    logger.info("ensured indexes. collections: %s, failed: %s", list(collections or INDEXES), errors)
+    return errors
@@ -0,0 +1,20 @@
+from pymongo import AsyncMongoClient
+from utils.logging_utils import logging
+from utils.listing_utils import sort_keys, listing_query, listing_projection, listing_page
+
+# asyncio version of listing_utils.list_page, the parsing and the queries are shared with listing_utils.
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+
+async def list_page(collection: str, filters: dict, after: tuple, limit: int, fields: tuple, client: AsyncMongoClient):
+    """
+    see listing_utils.list_page.
+    """
+    keys = sort_keys(collection, filters)
+    cursor = (client.school[collection].find(listing_query(keys, filters, after), listing_projection(keys, fields))
+              .sort([(k, 1) for k in keys]).limit(limit + 1))
+    page = listing_page(await cursor.to_list(None), keys, limit)
+    logger.info("listing %s. filters: %s, after: %s, listed: %s", collection, filters, after, len(page['items']))
+    return page
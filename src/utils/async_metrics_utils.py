@@ -0,0 +1,52 @@
+import time
+
+import redis.asyncio
+from redis.asyncio.client import Pipeline
+from utils.metrics_utils import REDIS_SECONDS, POOL_IN_USE, POOL_MAX, _command_name, _pipeline_name
+
+# asyncio versions of the instrumented redis client and pool of metrics_utils, the metrics are shared with metrics_utils.
+
+
+class TimedPipeline(Pipeline):
+
+    async def execute(self, raise_on_error: bool = True):
+        start = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            REDIS_SECONDS.labels(_pipeline_name(self.is_transaction)).observe(time.perf_counter() - start)
+
+
+class TimedRedis(redis.asyncio.Redis):
+    """
+    see metrics_utils.TimedRedis.
+    """
+
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            REDIS_SECONDS.labels(_command_name(args)).observe(time.perf_counter() - start)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None):
+        return TimedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class TrackedConnectionPool(redis.asyncio.BlockingConnectionPool):
+    """
+    see metrics_utils.TrackedConnectionPool.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        POOL_MAX.labels('redis').inc(self.max_connections)
+
+    async def get_connection(self, *args, **kwargs):
+        connection = await super().get_connection(*args, **kwargs)
+        POOL_IN_USE.labels('redis').inc()
+        return connection
+
+    async def release(self, connection):
+        POOL_IN_USE.labels('redis').dec()
+        return await super().release(connection)
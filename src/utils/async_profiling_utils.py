@@ -0,0 +1,47 @@
+import asyncio
+
+from pymongo import AsyncMongoClient
+from pymongo.errors import PyMongoError
+from utils.logging_utils import logging
+from utils.profiling_utils import Profile, SLOW_QUEUE_SIZE, explain_command, log_slow_request
+
+# asyncio versions of the profiling_utils explain and slow request reporter, the profiles are
+# shared with profiling_utils. a slow request is reported by a task of its own, after the response.
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+# the reporting tasks in flight, referenced until they finish
+_reports = set()
+
+
+async def explain(profile: Profile, client: AsyncMongoClient):
+    """
+    see profiling_utils.explain.
+    """
+    explained = explain_command(profile)
+    if explained is None:
+        return None
+    database, command = explained
+    try:
+        return (await client[database].command(command)).get('queryPlanner')
+    except PyMongoError as e:
+        return {'error': str(e)}
+
+
+async def _report(profile: Profile, method: str, path: str, status: int, client: AsyncMongoClient):
+    log_slow_request(profile, method, path, status, await explain(profile, client))
+    return
+
+
+def queue_slow_request(profile: Profile, method: str, path: str, status: int, client: AsyncMongoClient):
+    """
+    see profiling_utils.queue_slow_request, the request is reported by a task.
+    """
+    if len(_reports) >= SLOW_QUEUE_SIZE:
+        logger.info("too many slow requests are being reported, dropped a slow request. path: %s", path)
+        return
+    task = asyncio.get_running_loop().create_task(_report(profile, method, path, status, client))
+    _reports.add(task)
+    task.add_done_callback(_reports.discard)
+    return
@@ -0,0 +1,269 @@
+from utils import logging_utils
+import asyncio
+import logging
+import json
+import time
+import uuid
+
+from redis.asyncio import Redis
+from utils.redis_utils import (STUDENT_LEADERBOARD, COURSE_LEADERBOARD, BEST_STUDENT_KEY, EASIEST_COURSE_KEY,
+                               CACHE_KEYS, CACHE_STATS_PREFIX, LOCK_PREFIX, LOCK_POLL_INTERVAL, SET_ENTRY_SCRIPT,
+                               INVALIDATE_DEPENDENTS_SCRIPT, INVALIDATE_ENTRIES_SCRIPT, GET_LEADER_SCRIPT,
+                               RELEASE_LOCK_SCRIPT, RANK_SCRIPT, BUMP_GENERATION_SCRIPT, REFRESH_SCHEDULED_KEY,
+                               WARMER_STATS_KEY, dependency_keys, format_cache_stats, distribution_key,
+                               distribution_version_key, cached_distribution, transcript_key, transcript_version_key,
+                               cached_transcript, SET_VERSIONED_ENTRY_SCRIPT, rank_top, leaderboard_member, member_id,
+                               leaderboard_scores)
+
+# asyncio versions of the redis_utils functions used on the request path. the keys and
+# scripts are shared with redis_utils, so both server modes can run against one redis.
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+
+async def setup_caching_struct(r: Redis, stats: dict = None):
+    await invalidate_all_caches(r)
+    if stats is not None and not await r.exists(STUDENT_LEADERBOARD, COURSE_LEADERBOARD):
+        await build_leaderboards(stats, r)
+    return
+
+
+async def build_leaderboards(stats: dict, r: Redis):
+    pipe = r.pipeline(transaction=True)
+    for key, scores in ((STUDENT_LEADERBOARD, stats['students']), (COURSE_LEADERBOARD, stats['courses'])):
+        tmp_key = f"{key}:rebuild"
+        pipe.delete(tmp_key)
+        if len(scores) > 0:
+            pipe.zadd(tmp_key, leaderboard_scores(scores))
+            pipe.rename(tmp_key, key)
+        else:
+            pipe.delete(key)
+    await pipe.execute()
+    await invalidate_all_caches(r)
+    logger.info("built leaderboards. students: %s, courses: %s", len(stats['students']), len(stats['courses']))
+    return
+
+
+async def update_leaderboards(student_scores: dict, course_scores: dict, r: Redis):
+    pipe = r.pipeline(transaction=False)
+    for key, scores in ((STUDENT_LEADERBOARD, student_scores), (COURSE_LEADERBOARD, course_scores)):
+        updated = {k: v for k, v in scores.items() if v is not None}
+        removed = [leaderboard_member(k) for k, v in scores.items() if v is None]
+        if len(updated) > 0:
+            pipe.zadd(key, leaderboard_scores(updated))
+        if len(removed) > 0:
+            pipe.zrem(key, *removed)
+    for course_id in course_scores:
+        pipe.incr(distribution_version_key(course_id))
+    for student_id in student_scores:
+        pipe.incr(transcript_version_key(student_id))
+    pipe.eval(BUMP_GENERATION_SCRIPT, 0)
+    await pipe.execute()
+    return
+
+
+async def _top(key: str, n: int, r: Redis):
+    return rank_top(await r.zrevrange(key, 0, n - 1, withscores=True))
+
+
+async def get_top_students(n: int, r: Redis):
+    return [{'student_id': sid, 'average': avg, 'rank': rank} for sid, avg, rank in await _top(STUDENT_LEADERBOARD, n, r)]
+
+
+async def get_top_courses(n: int, r: Redis):
+    return [{'course_id': cid, 'average': avg, 'rank': rank} for cid, avg, rank in await _top(COURSE_LEADERBOARD, n, r)]
+
+
+async def _rank(key: str, member: int, r: Redis):
+    result = await r.eval(RANK_SCRIPT, 1, key, leaderboard_member(member))
+    if result is None:
+        return None
+    score, rank, size = result
+    return {'average': float(score), 'rank': int(rank), 'out_of': int(size)}
+
+
+async def get_student_rank(student_id: int, r: Redis):
+    return await _rank(STUDENT_LEADERBOARD, student_id, r)
+
+
+async def get_course_rank(course_id: int, r: Redis):
+    return await _rank(COURSE_LEADERBOARD, course_id, r)
+
+
+async def _get_leader(board_key: str, cache_key: str, r: Redis, count: bool = True):
+    result = await r.eval(GET_LEADER_SCRIPT, 2, board_key, cache_key, time.time(), int(count))
+    if len(result) == 0:
+        return None, None, None
+    leader_id = member_id(result[0])
+    document = json.loads(result[1]) if len(result) > 1 else None
+    stale_since = float(result[2]) if len(result) > 2 else None
+    return leader_id, document, stale_since
+
+
+async def acquire_lock(name: str, timeout: float, r: Redis):
+    token = uuid.uuid4().hex
+    if await r.set(LOCK_PREFIX + name, token, nx=True, px=int(timeout * 1000)):
+        return token
+    return None
+
+
+async def release_lock(name: str, token: str, r: Redis):
+    await r.eval(RELEASE_LOCK_SCRIPT, 1, LOCK_PREFIX + name, token)
+    return
+
+
+async def _get_or_recompute(board_key: str, cache_key: str, recompute, update_cache, r: Redis, max_staleness: float, lock_timeout: float):
+    """
+    see redis_utils._get_or_recompute, recompute is a coroutine function.
+    """
+    leader_id, document, stale_since = await _get_leader(board_key, cache_key, r)
+    if leader_id is None or (document is not None and stale_since is None):
+        return document, None
+
+    deadline = time.time() + lock_timeout
+    while True:
+        token = await acquire_lock(cache_key, lock_timeout, r)
+        if token is not None:
+            try:
+                document = await recompute(leader_id)
+                await update_cache(document, r)
+            finally:
+                await release_lock(cache_key, token, r)
+            logger.info("recomputed %s for leader: %s", cache_key, leader_id)
+            return document, None
+
+        # another worker is recomputing, serve the last value while it is recent enough
+        if document is not None and time.time() - stale_since <= max_staleness:
+            return document, time.time() - stale_since
+
+        # nothing to serve, wait for the other worker. if it doesn't finish in time, compute without caching.
+        if time.time() >= deadline:
+            logger.info("timed out waiting for the recompute of %s.", cache_key)
+            return await recompute(leader_id), None
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+        leader_id, document, stale_since = await _get_leader(board_key, cache_key, r)
+        if leader_id is None or (document is not None and stale_since is None):
+            return document, None
+
+
+async def get_best_student(recompute, r: Redis, max_staleness: float, lock_timeout: float):
+    return await _get_or_recompute(STUDENT_LEADERBOARD, BEST_STUDENT_KEY, recompute, update_best_student_cache,
+                                   r, max_staleness, lock_timeout)
+
+
+async def get_easiest_course(recompute, r: Redis, max_staleness: float, lock_timeout: float):
+    return await _get_or_recompute(COURSE_LEADERBOARD, EASIEST_COURSE_KEY, recompute, update_easiest_course_cache,
+                                   r, max_staleness, lock_timeout)
+
+
+async def _refresh(board_key: str, cache_key: str, recompute, update_cache, r: Redis, lock_timeout: float):
+    """
+    see redis_utils._refresh, recompute is a coroutine function.
+    """
+    leader_id, document, stale_since = await _get_leader(board_key, cache_key, r, count=False)
+    if leader_id is None or (document is not None and stale_since is None):
+        return False
+    token = await acquire_lock(cache_key, lock_timeout, r)
+    if token is None:
+        return False
+    try:
+        await update_cache(await recompute(leader_id), r)
+    finally:
+        await release_lock(cache_key, token, r)
+    logger.info("refreshed %s for leader: %s", cache_key, leader_id)
+    return True
+
+
+async def refresh_best_student(recompute, r: Redis, lock_timeout: float):
+    return await _refresh(STUDENT_LEADERBOARD, BEST_STUDENT_KEY, recompute, update_best_student_cache, r, lock_timeout)
+
+
+async def refresh_easiest_course(recompute, r: Redis, lock_timeout: float):
+    return await _refresh(COURSE_LEADERBOARD, EASIEST_COURSE_KEY, recompute, update_easiest_course_cache, r, lock_timeout)
+
+
+async def claim_refresh(r: Redis):
+    return await r.delete(REFRESH_SCHEDULED_KEY) == 1
+
+
+async def record_refresh(recomputes: int, seconds: float, r: Redis):
+    pipe = r.pipeline(transaction=False)
+    pipe.hincrby(WARMER_STATS_KEY, 'refreshes', 1)
+    pipe.hincrby(WARMER_STATS_KEY, 'recomputes', recomputes)
+    pipe.hincrbyfloat(WARMER_STATS_KEY, 'refresh_seconds', seconds)
+    pipe.hset(WARMER_STATS_KEY, 'last_refresh_seconds', seconds)
+    await pipe.execute()
+    return
+
+
+async def _set_entry(cache_key: str, entry_id: int, document: dict, dependencies: list, r: Redis):
+    await r.eval(SET_ENTRY_SCRIPT, 1, cache_key, leaderboard_member(entry_id), json.dumps(document), *dependencies)
+    return
+
+
+async def update_best_student_cache(student: dict, r: Redis):
+    await _set_entry(BEST_STUDENT_KEY, student['id_number'], student,
+                     dependency_keys(students=[student['id_number']]), r)
+    return
+
+
+async def update_easiest_course_cache(course: dict, r: Redis):
+    await _set_entry(EASIEST_COURSE_KEY, course['course_id'], course,
+                     dependency_keys(students=course['students'], courses=[course['course_id']]), r)
+    return
+
+
+async def invalidate_dependents(r: Redis, students: list = (), courses: list = ()):
+    dependencies = dependency_keys(students, courses)
+    if len(dependencies) == 0:
+        return 0
+    expired = await r.eval(INVALIDATE_DEPENDENTS_SCRIPT, len(dependencies), *dependencies, time.time())
+    logger.info("invalidated %s cache entries depending on num students: %s, num courses: %s", expired, len(students), len(courses))
+    return expired
+
+
+async def invalidate_all_caches(r: Redis):
+    await r.eval(INVALIDATE_ENTRIES_SCRIPT, len(CACHE_KEYS), *CACHE_KEYS, time.time())
+    return
+
+
+async def get_cache_stats(r: Redis):
+    pipe = r.pipeline(transaction=False)
+    for key in CACHE_KEYS:
+        pipe.hgetall(CACHE_STATS_PREFIX + key)
+    pipe.hgetall(WARMER_STATS_KEY)
+    return format_cache_stats(await pipe.execute())
+
+
+async def get_course_distribution(course_id: int, compute, r: Redis, ttl: int):
+    """
+    see redis_utils.get_course_distribution, compute is a coroutine function.
+    """
+    version, cached = await r.mget([distribution_version_key(course_id), distribution_key(course_id)])
+    distribution = cached_distribution(version, cached)
+    if distribution is not None:
+        return distribution
+    distribution = await compute()
+    if distribution is not None:
+        await r.set(distribution_key(course_id), json.dumps({'version': int(version or 0), 'distribution': distribution}), ex=ttl)
+    return distribution
+
+
+async def get_transcript(student_id: int, compute, r: Redis, ttl: int):
+    """
+    see redis_utils.get_transcript, compute is a coroutine function.
+    """
+    pipe = r.pipeline(transaction=False)
+    pipe.hmget(transcript_key(student_id), 'document', 'version', 'stale_since')
+    pipe.get(transcript_version_key(student_id))
+    entry, version = await pipe.execute()
+    transcript = cached_transcript(entry, version)
+    if transcript is not None:
+        return transcript
+    transcript = await compute()
+    if transcript is not None:
+        dependencies = dependency_keys(students=[student_id], courses=[c['course_id'] for c in transcript['courses']])
+        await r.eval(SET_VERSIONED_ENTRY_SCRIPT, 2, transcript_key(student_id), transcript_version_key(student_id),
+                     int(version or 0), json.dumps(transcript), ttl, *dependencies)
+    return transcript
@@ -0,0 +1,32 @@
+import asyncio
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from utils.logging_utils import logging
+from utils.redis_utils import STATS_GENERATION_KEY, STATS_CHANNEL
+from utils.stats_cache import RESUBSCRIBE_INTERVAL, handle_message, set_generation
+
+# asyncio version of the stats_cache listener, the cached responses and the generation
+# are shared with stats_cache.
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+
+async def listen(r: Redis):
+    """
+    see stats_cache.listen, run as a background task of every worker.
+    """
+    while True:
+        pubsub = r.pubsub()
+        try:
+            await pubsub.subscribe(STATS_CHANNEL)
+            async for message in pubsub.listen():
+                if handle_message(message):
+                    set_generation(int(await r.get(STATS_GENERATION_KEY) or 0))
+        except RedisError as e:
+            set_generation(None)
+            logger.info("stats cache lost its subscription, retrying in %s seconds. error: %s", RESUBSCRIBE_INTERVAL, e)
+        finally:
+            await pubsub.aclose()
+        await asyncio.sleep(RESUBSCRIBE_INTERVAL)
@@ -0,0 +1,155 @@
+import asyncio
+
+from pymongo import AsyncMongoClient, ReturnDocument, UpdateOne, ASCENDING, DESCENDING
+from pymongo.asynchronous.client_session import AsyncClientSession
+from redis.asyncio import Redis
+from utils.logging_utils import logging
+from utils import async_redis_utils
+from utils.stats_utils import (STUDENT_STATS, COURSE_STATS, _delta_pipeline, _grade_deltas, _distribution_pipeline,
+                               format_distribution)
+
+# asyncio versions of the stats_utils functions used on the request path, see stats_utils
+# for the aggregate documents they maintain.
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+
+async def concurrently(session: AsyncClientSession, *coroutines):
+    """
+    await the coroutines concurrently, or one after the other if they share a session,
+    which can only run one operation at a time.
+    """
+    if session is None:
+        return await asyncio.gather(*coroutines)
+    return [await coroutine for coroutine in coroutines]
+
+
+async def _apply_delta(name: str, key: int, grade_sum, grade_count: int, client: AsyncMongoClient, session: AsyncClientSession = None):
+    collection = client.school[name]
+    doc = await collection.find_one_and_update({'_id': key},
+                                               _delta_pipeline(grade_sum, grade_count),
+                                               upsert=True,
+                                               return_document=ReturnDocument.AFTER,
+                                               session=session)
+    if doc['count'] < 0:
+        logger.warning("aggregate dropped below zero grades, run manage.py rebuild-stats. collection: %s, id: %s, count: %s",
+                       name, key, doc['count'])
+    if doc['count'] <= 0:
+        await collection.delete_one({'_id': key, 'count': {'$lte': 0}}, session=session)
+        return None
+    return doc
+
+
+async def apply_grade_delta(student_id: int, course_id: int, grade_sum, grade_count: int, client: AsyncMongoClient, r: Redis = None,
+                            session: AsyncClientSession = None):
+    """
+    add the given sum and count to the running aggregates of the student and the
+    course, updating both concurrently unless they share a session. see
+    stats_utils.apply_grade_delta.
+    """
+    student_doc, course_doc = await concurrently(session, _apply_delta(STUDENT_STATS, student_id, grade_sum, grade_count, client, session),
+                                                 _apply_delta(COURSE_STATS, course_id, grade_sum, grade_count, client, session))
+    if r is not None:
+        await refresh_leaderboards([student_id], [course_id], client, r, session)
+    logger.info("applied grade delta. sid: %s, cid: %s, sum: %s, count: %s", student_id, course_id, grade_sum, grade_count)
+    return student_doc, course_doc
+
+
+async def get_averages(name: str, ids: list, client: AsyncMongoClient, session: AsyncClientSession = None):
+    found = {d['_id']: d['avg'] async for d in client.school[name].find({'_id': {'$in': ids}}, {'avg': 1}, session=session)}
+    return {i: found.get(i) for i in ids}
+
+
+async def refresh_leaderboards(students: list, courses: list, client: AsyncMongoClient, r: Redis, session: AsyncClientSession = None):
+    """
+    see stats_utils.refresh_leaderboards.
+    """
+    student_scores, course_scores = await concurrently(session, get_averages(STUDENT_STATS, students, client, session),
+                                                       get_averages(COURSE_STATS, courses, client, session))
+    await async_redis_utils.update_leaderboards(student_scores, course_scores, r)
+    return
+
+
+async def get_all_averages(client: AsyncMongoClient):
+    students, courses = await asyncio.gather(client.school[STUDENT_STATS].find({}, {'avg': 1}).to_list(None),
+                                             client.school[COURSE_STATS].find({}, {'avg': 1}).to_list(None))
+    return {'students': {d['_id']: d['avg'] for d in students},
+            'courses': {d['_id']: d['avg'] for d in courses}}
+
+
+async def _apply_deltas(name: str, deltas: dict, sign: int, client: AsyncMongoClient, session: AsyncClientSession = None):
+    if len(deltas) == 0:
+        return
+    collection = client.school[name]
+    requests = [UpdateOne({'_id': k}, _delta_pipeline(s, c), upsert=True) for k, (s, c) in deltas.items()]
+    await collection.bulk_write(requests, ordered=False, session=session)
+    if sign < 0:
+        await collection.delete_many({'_id': {'$in': list(deltas)}, 'count': {'$lte': 0}}, session=session)
+
+
+async def _apply_grades(grades: list, sign: int, client: AsyncMongoClient, r: Redis = None, session: AsyncClientSession = None):
+    student_deltas, course_deltas = _grade_deltas(grades, sign)
+    await concurrently(session, _apply_deltas(STUDENT_STATS, student_deltas, sign, client, session),
+                       _apply_deltas(COURSE_STATS, course_deltas, sign, client, session))
+    if r is not None:
+        await refresh_leaderboards(list(student_deltas), list(course_deltas), client, r, session)
+    return list(student_deltas), list(course_deltas)
+
+
+async def add_grades_to_stats(grades: list, client: AsyncMongoClient, r: Redis = None, session: AsyncClientSession = None):
+    """
+    account for a batch of new grade documents, see stats_utils.add_grades_to_stats.
+    """
+    students, courses = await _apply_grades(grades, 1, client, r, session)
+    logger.info("added %s grades to aggregates. students: %s, courses: %s", len(grades), len(students), len(courses))
+    return students, courses
+
+
+async def remove_grades_from_stats(grades: list, client: AsyncMongoClient, r: Redis = None, session: AsyncClientSession = None):
+    """
+    account for a batch of removed grade documents, see stats_utils.remove_grades_from_stats.
+    """
+    students, courses = await _apply_grades(grades, -1, client, r, session)
+    logger.info("removed %s grades from aggregates. students: %s, courses: %s", len(grades), len(students), len(courses))
+    return students, courses
+
+
+async def _rename_stats(name: str, old_id: int, new_id: int, client: AsyncMongoClient, session: AsyncClientSession = None):
+    collection = client.school[name]
+    old_doc = await collection.find_one_and_delete({'_id': old_id}, session=session)
+    if old_doc is None:
+        return None
+    return await collection.find_one_and_update({'_id': new_id},
+                                                _delta_pipeline(old_doc['sum'], old_doc['count']),
+                                                upsert=True,
+                                                return_document=ReturnDocument.AFTER,
+                                                session=session)
+
+
+async def rename_student_stats(old_id: int, new_id: int, client: AsyncMongoClient, session: AsyncClientSession = None):
+    return await _rename_stats(STUDENT_STATS, old_id, new_id, client, session)
+
+
+async def rename_course_stats(old_id: int, new_id: int, client: AsyncMongoClient, session: AsyncClientSession = None):
+    return await _rename_stats(COURSE_STATS, old_id, new_id, client, session)
+
+
+async def get_easiest_course_id(client: AsyncMongoClient):
+    easiest_course = await client.school[COURSE_STATS].find_one({}, sort=[('avg', DESCENDING), ('_id', ASCENDING)])
+    return easiest_course['_id'] if easiest_course else None
+
+
+async def get_best_student_id(client: AsyncMongoClient):
+    best_student = await client.school[STUDENT_STATS].find_one({}, sort=[('avg', DESCENDING), ('_id', ASCENDING)])
+    return best_student['_id'] if best_student else None
+
+
+async def get_course_distribution(course_id: int, percentiles: list, bins: list, client: AsyncMongoClient):
+    """
+    see stats_utils.get_course_distribution.
+    """
+    cursor = await client.school.grades.aggregate(_distribution_pipeline(course_id, percentiles, bins))
+    result = next(iter(await cursor.to_list(None)), None)
+    logger.info("computed grade distribution. cid: %s", course_id)
+    return format_distribution(course_id, result, percentiles, bins)
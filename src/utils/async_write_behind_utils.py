@@ -0,0 +1,29 @@
+import json
+
+from redis.asyncio import Redis
+from utils.logging_utils import logging
+from utils.write_behind_utils import STREAM, ENQUEUE_SCRIPT, enqueue_args, ticket_key
+
+# asyncio version of the producer side of write_behind_utils, the grades are drained by
+# the consumers of write_behind_utils.
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+
+async def enqueue_grade(grade: dict, r: Redis, ticket_ttl: int):
+    """
+    see write_behind_utils.enqueue_grade.
+    """
+    ticket = await r.eval(ENQUEUE_SCRIPT, 1, STREAM, *enqueue_args(grade, ticket_ttl))
+    ticket = ticket.decode() if isinstance(ticket, bytes) else ticket
+    logger.info("queued grade. sid: %s, cid: %s, ticket: %s", grade['student_id'], grade['course_id'], ticket)
+    return ticket
+
+
+async def get_ticket(ticket: str, r: Redis):
+    """
+    see write_behind_utils.get_ticket.
+    """
+    status = await r.get(ticket_key(ticket))
+    return json.loads(status) if status is not None else None
@@ -0,0 +1,248 @@
+import itertools
+import json
+
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+from redis import Redis
+from utils.logging_utils import logging
+from utils import stats_utils
+from utils import dbutils
+from utils import change_stream_utils
+
+# bulk ingestion of students, courses and grades. a batch is processed in chunks, and
+# every chunk is validated with one $in query per referenced collection and written
+# with one unordered insert_many, so a bad item never stops the rest of the chunk.
+# every function returns one result per item, in the order of the items.
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+# content type of a streamed batch, one json document per line
+NDJSON = 'application/x-ndjson'
+
+# result statuses of a bulk item
+CREATED = 'created'
+INVALID = 'invalid'
+DUPLICATE = 'duplicate'
+FAILED = 'failed'
+
+# mongo error code of a unique index violation
+DUPLICATE_KEY_ERROR = 11000
+
+
+def parse_ndjson(lines):
+    """
+    parse the lines of an ndjson body. blank lines are skipped, and a line that
+    isn't valid json yields None, which is reported as an invalid item.
+    """
+    for line in lines:
+        line = line.strip()
+        if len(line) == 0:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def chunks(items, size: int):
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def _invalid(error: str):
+    return {'status': INVALID, 'error': error}
+
+
+def _student_doc(item):
+    if not isinstance(item, dict):
+        return None
+    doc = {k: item.get(k) for k in ('id_number', 'first_name', 'last_name', 'email')}
+    is_valid = isinstance(doc['id_number'], int) and all(isinstance(doc[k], str) for k in ('first_name', 'last_name', 'email'))
+    return doc if is_valid else None
+
+
+def _course_doc(item):
+    if not isinstance(item, dict):
+        return None
+    doc = {k: item.get(k) for k in ('course_id', 'name', 'students')}
+    is_valid = (isinstance(doc['course_id'], int) and isinstance(doc['name'], str) and
+                isinstance(doc['students'], list) and all(isinstance(s, int) for s in doc['students']))
+    return doc if is_valid else None
+
+
+def _grade_doc(item):
+    if not isinstance(item, dict):
+        return None
+    doc = {k: item.get(k) for k in ('course_id', 'student_id', 'grade')}
+    is_valid = (isinstance(doc['course_id'], int) and isinstance(doc['student_id'], int) and
+                isinstance(doc['grade'], (int, float)) and doc['grade'] >= 0)
+    return doc if is_valid else None
+
+
+def check_students(items: list):
+    """
+    validate the types of a chunk of students. returns the results, with None for
+    the valid items, and the documents to insert keyed by their position.
+    """
+    results, docs = [None] * len(items), {}
+    for i, item in enumerate(items):
+        doc = _student_doc(item)
+        if doc is None:
+            results[i] = _invalid('invalid data was given for creating a student.')
+        else:
+            docs[i] = doc
+    return results, docs
+
+
+def referenced_students(items: list):
+    """
+    the student ids referenced by the valid courses of a chunk.
+    """
+    return list({s for doc in filter(None, map(_course_doc, items)) for s in doc['students']})
+
+
+def check_courses(items: list, existing_students: set):
+    """
+    validate a chunk of courses, given the ids of the referenced students that exist.
+    """
+    results, docs = [None] * len(items), {}
+    for i, item in enumerate(items):
+        doc = _course_doc(item)
+        if doc is None:
+            results[i] = _invalid('invalid data was given for creating a course.')
+        elif not existing_students.issuperset(doc['students']):
+            results[i] = _invalid(f"students do not exist: {sorted(set(doc['students']) - existing_students)}")
+        else:
+            docs[i] = doc
+    return results, docs
+
+
+def course_documents(docs: dict):
+    """
+    the documents to insert for the valid courses of a chunk, without their students,
+    which are inserted as enrollments once the courses are created.
+    """
+    return {i: {'course_id': doc['course_id'], 'name': doc['name']} for i, doc in docs.items()}
+
+
+def created_enrollments(docs: dict, results: list):
+    """
+    the enrollment documents of the courses of a chunk that were created.
+    """
+    return [enrollment for i, doc in docs.items() if results[i]['status'] == CREATED
+            for enrollment in dbutils.enrollment_docs(doc['course_id'], doc['students'])]
+
+
+def referenced_ids(items: list):
+    """
+    the student and course ids referenced by the valid grades of a chunk.
+    """
+    docs = list(filter(None, map(_grade_doc, items)))
+    return list({doc['student_id'] for doc in docs}), list({doc['course_id'] for doc in docs})
+
+
+def build_rosters(courses, enrollments):
+    """
+    the enrolled students of every referenced course that exists, out of the
+    referenced courses and their enrollments of the referenced students.
+    """
+    rosters = {doc['course_id']: set() for doc in courses}
+    for enrollment in enrollments:
+        if enrollment['course_id'] in rosters:
+            rosters[enrollment['course_id']].add(enrollment['student_id'])
+    return rosters
+
+
+def check_grades(items: list, existing_students: set, rosters: dict):
+    """
+    validate a chunk of grades, given the ids of the referenced students that exist
+    and the enrolled students of every referenced course that exists.
+    """
+    results, docs = [None] * len(items), {}
+    for i, item in enumerate(items):
+        doc = _grade_doc(item)
+        if doc is None:
+            results[i] = _invalid('invalid data was given for creating a grade.')
+        elif doc['student_id'] not in existing_students:
+            results[i] = _invalid(f"student does not exist: {doc['student_id']}")
+        elif doc['course_id'] not in rosters:
+            results[i] = _invalid(f"course does not exist: {doc['course_id']}")
+        elif doc['student_id'] not in rosters[doc['course_id']]:
+            results[i] = _invalid(f"student {doc['student_id']} is not enrolled in course {doc['course_id']}")
+        else:
+            docs[i] = doc
+    return results, docs
+
+
+def record_inserts(docs: dict, write_errors: list, results: list):
+    """
+    fill in the results of the inserted documents out of the write errors of an
+    unordered insert_many over docs. returns the documents that were inserted.
+    """
+    positions = list(docs)
+    failed = {e['index']: e for e in write_errors}
+    inserted = []
+    for i, position in enumerate(positions):
+        if i not in failed:
+            results[position] = {'status': CREATED}
+            inserted.append(docs[position])
+        elif failed[i]['code'] == DUPLICATE_KEY_ERROR:
+            results[position] = {'status': DUPLICATE, 'error': 'given id already exists.'}
+        else:
+            results[position] = {'status': FAILED, 'error': failed[i]['errmsg']}
+    return inserted
+
+
+def _insert_many(collection, docs: dict, results: list):
+    if len(docs) == 0:
+        return []
+    try:
+        collection.insert_many(list(docs.values()), ordered=False)
+        write_errors = []
+    except BulkWriteError as e:
+        write_errors = e.details['writeErrors']
+    return record_inserts(docs, write_errors, results)
+
+
+def insert_students(items: list, client: MongoClient):
+    results, docs = check_students(items)
+    inserted = _insert_many(client.school.students, docs, results)
+    logger.info("bulk inserted students. given: %s, created: %s", len(items), len(inserted))
+    return results
+
+
+def insert_courses(items: list, client: MongoClient):
+    student_ids = referenced_students(items)
+    existing = {d['id_number'] for d in client.school.students.find({'id_number': {'$in': student_ids}}, {'id_number': 1})}
+    results, docs = check_courses(items, existing)
+    inserted = _insert_many(client.school.courses, course_documents(docs), results)
+    enrolled = dbutils.insert_enrollments(created_enrollments(docs, results), client)
+    logger.info("bulk inserted courses. given: %s, created: %s, enrollments: %s", len(items), len(inserted), enrolled)
+    return results
+
+
+def insert_grades(items: list, client: MongoClient, r: Redis = None, ids: list = None):
+    """
+    insert a chunk of grades, and account for the created ones in the aggregates
+    and leaderboards with one bulk write per aggregate collection. ids, if given,
+    are the _ids of the documents of the items.
+    """
+    student_ids, course_ids = referenced_ids(items)
+    existing = {d['id_number'] for d in client.school.students.find({'id_number': {'$in': student_ids}}, {'id_number': 1})}
+    rosters = build_rosters(client.school.courses.find({'course_id': {'$in': course_ids}}, {'course_id': 1}),
+                            client.school.enrollments.find({'course_id': {'$in': course_ids}, 'student_id': {'$in': student_ids}},
+                                                           {'course_id': 1, 'student_id': 1}))
+    results, docs = check_grades(items, existing, rosters)
+    if ids is not None:
+        for position, doc in docs.items():
+            doc['_id'] = ids[position]
+    inserted = _insert_many(client.school.grades, docs, results)
+    if len(inserted) > 0 and not change_stream_utils.enabled():
+        stats_utils.add_grades_to_stats(inserted, client, r)
+    logger.info("bulk inserted grades. given: %s, created: %s", len(items), len(inserted))
+    return results
@@ -0,0 +1,250 @@
+import time
+
+from pymongo import MongoClient
+from pymongo.client_session import ClientSession
+from pymongo.errors import DuplicateKeyError
+from redis import Redis
+from utils.logging_utils import logging
+from utils import stats_utils
+from utils import redis_utils
+from utils import entity_cache
+
+# out of band maintenance of the grade aggregates, leaderboards and cached statistics.
+# when enabled, the request path only writes the entities, and a consumer (manage.py
+# consume-changes) follows a change stream over the school db and applies the aggregate
+# deltas and invalidations of every write, including writes made outside the api. events
+# are applied in batches: the aggregate writes of a batch are made in a transaction together
+# with saving the resume token of its last event, so after a restart the consumer continues
+# right after the last batch it applied. the leaderboards and caches are updated from the
+# committed aggregates once per batch, after the transaction commits. change streams and
+# transactions require mongo to run as a replica set.
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+# collections whose changes are consumed
+WATCHED = ('grades', 'students', 'courses', 'enrollments')
+
+# collection holding the resume token of the consumer, in the document with id STREAM_NAME
+TOKENS = 'change_stream_tokens'
+STREAM_NAME = 'school'
+
+# the change stream over the watched collections
+PIPELINE = [{'$match': {'ns.coll': {'$in': list(WATCHED)}}}]
+
+_enabled = False
+
+
+def configure(enabled: bool):
+    """
+    set if the aggregates and caches are maintained by the change stream consumer. the
+    request path skips maintaining them while it is.
+    """
+    global _enabled
+    _enabled = enabled
+    logger.info("configured change streams. enabled: %s", enabled)
+    return
+
+
+def enabled():
+    return _enabled
+
+
+def enable_images(client: MongoClient):
+    """
+    record the pre and post images of the watched collections, the deltas of updated
+    and deleted grades are computed from them.
+    """
+    for name in WATCHED:
+        client.school.command('collMod', name, changeStreamPreAndPostImages={'enabled': True})
+    return
+
+
+def load_token(client: MongoClient):
+    doc = client.school[TOKENS].find_one({'_id': STREAM_NAME})
+    return doc['token'] if doc else None
+
+
+def save_token(previous, token, client: MongoClient, session: ClientSession = None):
+    """
+    replace the saved resume token, failing with a DuplicateKeyError if another
+    consumer moved it since previous was loaded.
+    """
+    client.school[TOKENS].update_one({'_id': STREAM_NAME, 'token': previous}, {'$set': {'token': token}},
+                                     upsert=True, session=session)
+    return
+
+
+def _ids(field: str, *documents):
+    return list({d[field] for d in documents if d is not None})
+
+
+def _missing_image(event: dict):
+    logger.info("change event without a document image, the aggregates may be off until "
+                "manage.py rebuild-stats runs. op: %s, ns: %s", event['operationType'], event['ns'])
+
+
+def apply_grade_event(event: dict, client: MongoClient, session: ClientSession = None):
+    """
+    account for an inserted, updated or deleted grade in the aggregates. returns the
+    ids of the students and courses whose aggregates changed.
+    """
+    op, before, after = event['operationType'], event.get('fullDocumentBeforeChange'), event.get('fullDocument')
+    if (op != 'insert' and before is None) or (op != 'delete' and after is None):
+        _missing_image(event)
+        return [], []
+    fields = ('student_id', 'course_id', 'grade')
+    if op in ('update', 'replace') and all(before.get(f) == after.get(f) for f in fields):
+        return [], []
+    if before is not None:
+        stats_utils.remove_grades_from_stats([before], client, session=session)
+    if after is not None:
+        stats_utils.add_grades_to_stats([after], client, session=session)
+    return _ids('student_id', before, after), _ids('course_id', before, after)
+
+
+class ChangeEffects:
+    """
+    the redis updates due after a batch of events: the students and courses whose
+    aggregates changed, the students and courses whose cached statistics are stale,
+    and the keys of the cached documents the events made stale.
+    """
+
+    def __init__(self):
+        self.students = set()
+        self.courses = set()
+        self.dependent_students = set()
+        self.dependent_courses = set()
+        self.cache_keys = []
+
+
+def record_grade_event(event: dict, effects: ChangeEffects):
+    """
+    invalidate the cached grade documents of the event.
+    """
+    before, after = event.get('fullDocumentBeforeChange'), event.get('fullDocument')
+    effects.cache_keys.extend(entity_cache.grade_key(g['student_id'], g['course_id']) for g in (before, after) if g)
+    return
+
+
+def record_entity_event(event: dict, effects: ChangeEffects):
+    """
+    invalidate the cached statistics and documents of an updated or deleted student
+    or course. creating one invalidates nothing.
+    """
+    before, after = event.get('fullDocumentBeforeChange'), event.get('fullDocument')
+    if event['operationType'] == 'insert':
+        return
+    if before is None:
+        _missing_image(event)
+    if event['ns']['coll'] == 'students':
+        ids = _ids('id_number', before, after)
+        effects.dependent_students.update(ids)
+        effects.cache_keys.extend(entity_cache.student_key(i) for i in ids)
+    else:
+        ids = _ids('course_id', before, after)
+        effects.dependent_courses.update(ids)
+        effects.cache_keys.extend(entity_cache.course_key(i) for i in ids)
+    return
+
+
+def record_enrollment_event(event: dict, effects: ChangeEffects):
+    """
+    invalidate the cached statistics of a course whose students changed.
+    """
+    before, after = event.get('fullDocumentBeforeChange'), event.get('fullDocument')
+    if event['operationType'] != 'insert' and before is None:
+        _missing_image(event)
+    effects.dependent_courses.update(_ids('course_id', before, after))
+    return
+
+
+def _applied(event: dict):
+    return event['operationType'] in ('insert', 'update', 'replace', 'delete')
+
+
+def apply_events(events: list, client: MongoClient, session: ClientSession = None):
+    """
+    make the mongo writes of a batch of events in order, returns the effects of the
+    batch with the students and courses whose aggregates changed.
+    """
+    effects = ChangeEffects()
+    for event in events:
+        if _applied(event) and event['ns']['coll'] == 'grades':
+            students, courses = apply_grade_event(event, client, session)
+            effects.students.update(students)
+            effects.courses.update(courses)
+    return effects
+
+
+def update_caches(events: list, effects: ChangeEffects, client: MongoClient, r: Redis):
+    """
+    make the redis updates of a batch of events once its mongo writes committed, with
+    one leaderboard refresh and one invalidation for the whole batch.
+    """
+    for event in events:
+        if not _applied(event):
+            continue
+        if event['ns']['coll'] == 'grades':
+            record_grade_event(event, effects)
+        elif event['ns']['coll'] == 'enrollments':
+            record_enrollment_event(event, effects)
+        else:
+            record_entity_event(event, effects)
+    if len(effects.students) > 0 or len(effects.courses) > 0:
+        stats_utils.refresh_leaderboards(list(effects.students), list(effects.courses), client, r)
+    redis_utils.invalidate_dependents(r, students=list(effects.dependent_students), courses=list(effects.dependent_courses))
+    entity_cache.invalidate(effects.cache_keys, r)
+    return
+
+
+def next_batch(stream, batch_size: int, max_wait: float):
+    """
+    read up to batch_size events from the stream, waiting at most max_wait seconds
+    after the first one for the batch to fill. empty if no event came in the stream's
+    await time.
+    """
+    events = []
+    deadline = None
+    while len(events) < batch_size and stream.alive:
+        event = stream.try_next()
+        if event is not None:
+            events.append(event)
+            deadline = deadline or time.monotonic() + max_wait
+        elif deadline is None or time.monotonic() >= deadline:
+            break
+    return events
+
+
+def consume(client: MongoClient, r: Redis, batch_size: int, max_wait: float):
+    """
+    follow the change stream from the saved resume token (or from now if there is
+    none), a batch of up to batch_size events at a time. the mongo writes of a batch
+    are made in one transaction with the resume token of its last event, then redis
+    is updated once from the committed aggregates. the redis updates don't depend on
+    the events being applied once: after a crash between the commit and the redis
+    updates, the caches are off until the next event of the same students and courses.
+    runs until interrupted.
+    """
+    while True:
+        token = load_token(client)
+        logger.info("consuming changes. resuming: %s", token is not None)
+        try:
+            with client.school.watch(PIPELINE, full_document='whenAvailable', full_document_before_change='whenAvailable',
+                                     start_after=token, max_await_time_ms=int(max_wait * 1000)) as stream:
+                while stream.alive:
+                    events = next_batch(stream, batch_size, max_wait)
+                    if len(events) == 0:
+                        continue
+
+                    def write(session, events=events, previous=token):
+                        effects = apply_events(events, client, session)
+                        save_token(previous, events[-1]['_id'], client, session)
+                        return effects
+
+                    with client.start_session() as session:
+                        effects = session.with_transaction(write)
+                    update_caches(events, effects, client, r)
+                    token = events[-1]['_id']
+        except DuplicateKeyError:
+            logger.info("another consumer moved the resume token, resuming from it.")
@@ -0,0 +1,72 @@
+from utils import logging_utils
+import logging
+import os
+import threading
+
+import redis
+from pymongo import MongoClient
+from utils import roundtrip_utils
+from utils import metrics_utils
+from utils import profiling_utils
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+# clients of the current process. they are created lazily and keyed by pid, so a
+# worker forked from a process that already created clients never shares their sockets.
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _get_client(name: str, factory):
+    key = (os.getpid(), name)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = factory()
+                _clients[key] = client
+                logger.info("created %s client for process: %s", name, os.getpid())
+    return client
+
+
+def mongo_listeners(config: dict):
+    listeners = [roundtrip_utils.listener]
+    if config['metrics']['enabled']:
+        listeners += metrics_utils.mongo_listeners(config['mongo'])
+    if config['profiling']['enabled']:
+        listeners.append(profiling_utils.listener)
+    return listeners
+
+
+def get_mongo_client(config: dict) -> MongoClient:
+    """
+    the mongo client of this process. it connects in the background, so creating
+    it never blocks on mongo being reachable. the pool size and timeouts are taken
+    from the mongo section of the config. its commands are counted per request by
+    roundtrip_utils, and timed by metrics_utils if metrics are enabled.
+    """
+    return _get_client('mongo', lambda: MongoClient(connect=False, event_listeners=mongo_listeners(config), **config['mongo']))
+
+
+def get_redis_client(config: dict) -> redis.Redis:
+    """
+    the redis client of this process, backed by a blocking connection pool shared
+    by the threads of the process. connections are opened on first use. if metrics
+    are enabled its commands are timed and its pool usage is tracked.
+    """
+    if config['metrics']['enabled']:
+        return _get_client('redis', lambda: metrics_utils.TimedRedis(connection_pool=metrics_utils.TrackedConnectionPool(**config['redis'])))
+    return _get_client('redis', lambda: redis.Redis(connection_pool=redis.BlockingConnectionPool(**config['redis'])))
+
+
+def close_clients():
+    """
+    close the clients created by this process.
+    """
+    pid = os.getpid()
+    with _clients_lock:
+        for key in [k for k in _clients if k[0] == pid]:
+            _clients.pop(key).close()
+    return
@@ -1,9 +1,23 @@
+import itertools
+
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from pymongo.client_session import ClientSession
+from redis import Redis
 from utils.logging_utils import logging
+from utils import stats_utils
+from utils import entity_cache
+from utils import change_stream_utils
 
 # instantiate logger
 logger = logging.getLogger(__name__)
 
+# mongo's error code of a unique index violation
+DUPLICATE_KEY = 11000
+
+# grades read, deleted and removed from the aggregates at a time by the cascades
+DELETE_BATCH_SIZE = 1000
+
 
 # unpacking utility functions
 def unpack_student_create_params(request):
@@ -12,7 +26,7 @@ def unpack_student_create_params(request):
     last_name = request.json.get('last_name', None)
     email = request.json.get('email', None)
 
-    logger.info(f"unpacking student params. id: {id_num}, fname: {first_name}, lname: {last_name}, email: {email}")
+    logger.info("unpacking student params. id: %s, fname: %s, lname: %s, email: %s", id_num, first_name, last_name, email)
     return id_num, first_name, last_name, email
 
 
@@ -34,7 +48,8 @@ def unpack_course_creation_params(request):
     course_id = request.json.get('course_id', None)
     name = request.json.get('name', None)
     students = request.json.get('students', None)
-    logger.info(f"unpacking course params. cid: {course_id}, name: {name}, students: {str(students)}")
+    logger.info("unpacking course params. cid: %s, name: %s, num students: %s", course_id, name,
+                len(students) if isinstance(students, list) else students)
     return course_id, name, students
 
 
@@ -51,6 +66,15 @@ def unpack_course_modification_params(request):
     return current_id, {k: v for k, v in mod_params.items() if v}
 
 
+def unpack_enrollment_params(request):
+    """
+    extract the student to enroll or unenroll from request body.
+    """
+    student_id = request.json.get('student_id', None)
+    logger.info("unpacking enrollment params. sid: %s", student_id)
+    return student_id
+
+
 def unpack_grade_creation_params(request):
     """
     unpack params from request body
@@ -58,7 +82,7 @@ def unpack_grade_creation_params(request):
     grade = request.json.get('grade', None)
     student_id = request.json.get('student_id', None)
     course_id = request.json.get('course_id', None)
-    logger.info(f"unpacking grade params. sid: {student_id}, cid: {course_id}, grade: {grade}")
+    logger.info("unpacking grade params. sid: %s, cid: %s, grade: %s", student_id, course_id, grade)
     return student_id, course_id, grade
 
 
@@ -73,6 +97,30 @@ def unpack_grade_modification_params(request):
     return current_student_id, current_course_id, {k: v for k, v in mod_params.items() if v}
 
 
+def unpack_id_list(value: str, max_ids: int):
+    """
+    parse the comma separated ids of a batch lookup. returns None if an id isn't
+    an integer or there are more than max_ids.
+    """
+    try:
+        ids = [int(i) for i in value.split(',')]
+    except ValueError:
+        return None
+    return ids if len(ids) <= max_ids else None
+
+
+def unpack_grade_pairs(value: str, max_ids: int):
+    """
+    parse the comma separated student_id:course_id pairs of a batch grade lookup.
+    returns None if a pair is invalid or there are more than max_ids.
+    """
+    try:
+        pairs = [tuple(int(i) for i in pair.split(':')) for pair in value.split(',')]
+    except ValueError:
+        return None
+    return pairs if all(len(p) == 2 for p in pairs) and len(pairs) <= max_ids else None
+
+
 # validation utility functions
 def validate_student_creation_params(id_num: int, first_name: str, last_name: str, email: str):
     """
@@ -87,7 +135,7 @@ def validate_student_creation_params(id_num: int, first_name: str, last_name: st
     val_fn = isinstance(first_name, str)
     val_ln = isinstance(last_name, str)
     val_em = isinstance(email, str)
-    logger.info(f"validation: id: {val_id}, fn: {val_fn}, ln: {val_ln}, em: {val_em}")
+    logger.info("validation: id: %s, fn: %s, ln: %s, em: %s", val_id, val_fn, val_ln, val_em)
     return val_id and val_fn and val_ln and val_em
 
 
@@ -102,13 +150,64 @@ def validate_student_modification_params(curr_id, mod_params, client):
     fn_val = isinstance(mod_params.get('first_name', ''), str)
     ln_val = isinstance(mod_params.get('last_name', ''), str)
     em_val = isinstance(mod_params.get('email', ''), str)
+    if not (id_val and fn_val and ln_val and em_val):
+        return False
 
     # if new id is given, make sure it is not in use
     id_used = False
     if 'id_number' in mod_params and mod_params['id_number'] != curr_id:
-        id_used = client.school.students.find({'id_number': mod_params['id_number']}).count() > 0
+        id_used = client.school.students.find_one({'id_number': mod_params['id_number']}, {'_id': 1}) is not None
+
+    return not id_used
+
+
+def _ids_pipeline(student_ids: list, course_ids: list, enrolled: list):
+    """
+    aggregation over the students collection, returning the given student ids that
+    exist, followed by the given courses that exist, followed by the enrollments of
+    the ids out of enrolled in the given courses. only ids are projected.
+    """
+    return [{'$match': {'id_number': {'$in': student_ids}}},
+            {'$project': {'_id': 0, 'student_id': '$id_number'}},
+            {'$unionWith': {'coll': 'courses',
+                            'pipeline': [{'$match': {'course_id': {'$in': course_ids}}},
+                                         {'$project': {'_id': 0, 'course_id': 1}}]}},
+            {'$unionWith': {'coll': 'enrollments',
+                            'pipeline': [{'$match': {'course_id': {'$in': course_ids}, 'student_id': {'$in': enrolled}}},
+                                         {'$project': {'_id': 0, 'enrolled_course_id': '$course_id',
+                                                       'enrolled_student_id': '$student_id'}}]}}]
+
 
-    return id_val and fn_val and ln_val and em_val and not id_used
+def _collect_ids(docs):
+    existing_students, existing_courses, enrollments = set(), {}, []
+    for doc in docs:
+        if 'student_id' in doc:
+            existing_students.add(doc['student_id'])
+        elif 'course_id' in doc:
+            existing_courses[doc['course_id']] = set()
+        else:
+            enrollments.append((doc['enrolled_course_id'], doc['enrolled_student_id']))
+    for course_id, student_id in enrollments:
+        if course_id in existing_courses:
+            existing_courses[course_id].add(student_id)
+    return existing_students, existing_courses
+
+
+def _ids_to_lookup(*ids):
+    return [list({i for i in group if i is not None}) for group in ids]
+
+
+def lookup_ids(student_ids: list, course_ids: list, client: MongoClient, enrolled: list = ()):
+    """
+    the existence and enrollment checks of a write, in a single round trip. returns
+    the set of given student ids that exist, and a dict mapping every given course
+    id that exists to the set of ids out of enrolled that are enrolled in it. None
+    ids are ignored.
+    """
+    student_ids, course_ids, enrolled = _ids_to_lookup(student_ids, course_ids, enrolled)
+    if len(student_ids) == 0 and len(course_ids) == 0:
+        return set(), {}
+    return _collect_ids(client.school.students.aggregate(_ids_pipeline(student_ids, course_ids, enrolled)))
 
 
 def validate_course_student_list(student_ids, client):
@@ -118,19 +217,22 @@ def validate_course_student_list(student_ids, client):
     :param client: connected pymong client
     :return: true if all students exist, false otherwise
     """
-    # make sure a list was given
-    if not isinstance(student_ids, list):
+    # make sure a list of ids was given
+    if not isinstance(student_ids, list) or not all(isinstance(s, int) for s in student_ids):
         return False
 
     # make sure students are in db
-    db = client.school
-    collection = db.students
-    existing_students = collection.find({'id_number': {'$in': student_ids}})
-    if existing_students.count() == len(student_ids):
-        logger.info(f"course validation passed. given students: {str(student_ids)}, existing: {str(list(existing_students))}")
+    existing_students, _ = lookup_ids(student_ids, [], client)
+    return _all_students_exist(student_ids, existing_students)
+
+
+def _all_students_exist(student_ids: list, existing_students: set):
+    missing = set(student_ids).difference(existing_students)
+    if len(missing) == 0:
+        logger.info("course validation passed. num students: %s", len(student_ids))
         return True
     else:
-        logger.info(f"course validation fail. given students: {str(student_ids)}, existing: {str(list(existing_students))}")
+        logger.info("course validation fail. num students: %s, num missing: %s", len(student_ids), len(missing))
         return False
 
 
@@ -140,275 +242,430 @@ def validate_course_creation_params(course_id, name, students, client: MongoClie
     """
     val_cid = isinstance(course_id, int)
     val_name = isinstance(name, str)
-    val_students = validate_course_student_list(students, client)
-    logger.info(f"course validation. cid: {val_cid}, name: {val_name}, val_students: {val_students}")
+    val_students = val_cid and val_name and validate_course_student_list(students, client)
+    logger.info("course validation. cid: %s, name: %s, val_students: %s", val_cid, val_name, val_students)
     return val_cid and val_name and val_students
 
 
 def validate_course_modification_params(curr_id, mod_params, client: MongoClient):
     """
     make sure that the new cours_id doesn't exist, that all enrolled students
-    exist already, and that name is a valid string.
+    exist already, and that name is a valid string. the db checks are done in
+    a single query.
     """
+    # check current id validity and name
+    if not isinstance(curr_id, int):
+        return False
+    if 'name' in mod_params and not isinstance(mod_params['name'], str):
+        return False
+
+    new_cid = mod_params.get('course_id', None)
+    if new_cid is not None and not isinstance(new_cid, int):
+        return False
+    students = mod_params.get('students', None)
+    if isinstance(students, list) and not all(isinstance(s, int) for s in students):
+        return False
+    students = students if isinstance(students, list) else []
+
+    existing_students, existing_courses = lookup_ids(students, [new_cid], client)
+
     # make sure new id doesn't exist already
-    if 'course_id' in mod_params:
-        existing_new_id = client.school.courses.find({'course_id': mod_params['course_id']}).count() > 0
-        if existing_new_id:
-            return False
+    if new_cid in existing_courses:
+        return False
 
     # make sure all new students exist
-    if 'students' in mod_params and isinstance(mod_params['students'], list):
-        students_val = validate_course_student_list(mod_params['students'], client)
-        if not students_val:
-            return False
+    return _all_students_exist(students, existing_students)
 
-    # check name
-    if 'name' in mod_params and not isinstance(mod_params['name'], str):
+
+def validate_enrollment_params(course_id, student_id, client: MongoClient):
+    """
+    make sure the student and the course of an enrollment exist, in a single query.
+    """
+    if not isinstance(course_id, int) or not isinstance(student_id, int):
+        logger.info("attempted to enroll with invalid ids. sid: %s, cid: %s", student_id, course_id)
         return False
+    existing_students, existing_courses = lookup_ids([student_id], [course_id], client)
+    valid = student_id in existing_students and course_id in existing_courses
+    logger.info("enrollment validation. sid: %s, cid: %s, valid: %s", student_id, course_id, valid)
+    return valid
 
-    # check current id validity
-    valid_curr_id = isinstance(curr_id, int)
-    return valid_curr_id
 
+def _is_valid_grade(grade):
+    is_numeric = isinstance(grade, int) or isinstance(grade, float)
+    is_positive = grade >= 0 if is_numeric else False
+    logger.info("validating grade. numeric: %s, positive: %s", is_numeric, is_positive)
+    return is_numeric and is_positive
 
-def validate_grade_creation_params(student_id, course_id, grade, client: MongoClient):
+
+def check_grade_dependents(student_ids: list, course_ids: list, student_id, course_id, existing_students: set, existing_courses: dict):
     """
-    checks if the student and course paired with the grade exist, and if
-    grade is a valid numeric value.
+    checks the results of lookup_ids for a grade write: all the given students and
+    courses exist, and the student the grade ends up with is enrolled in the course
+    it ends up in.
     """
-    # make sure student exists
-    existing_student = get_student(student_id, client)
-    if existing_student is None:
-        logger.info(f"attempted to create grade with non-existing student. sid: {student_id}")
+    for sid in student_ids:
+        if sid is not None and sid not in existing_students:
+            logger.info("attempted to write grade with non-existing student. sid: %s", sid)
+            return False
+    for cid in course_ids:
+        if cid is not None and cid not in existing_courses:
+            logger.info("attempted to write grade with non-existing course. cid: %s", cid)
+            return False
+    if student_id not in existing_courses[course_id]:
+        logger.info("attempted to write grade for student who is not enrolled in the course. sid: %s, cid: %s", student_id, course_id)
         return False
+    return True
 
-    # make sure course exists
-    existing_course = get_course(course_id, client)
-    if existing_course is None:
-        logger.info(f"attempted to create grade with non-existing course. cid: {course_id}")
-        return False
 
-    # make sure student is enrolled in the course
-    enrolled_in = client.school.courses.find_one({'course_id': {'$eq': course_id}, 'students': student_id})
-    if not enrolled_in:
-        logger.info(f"attempted to add grade for student who is not enrolled in the course.")
+def validate_grade_creation_params(student_id, course_id, grade, client: MongoClient):
+    """
+    checks if the student and course paired with the grade exist, and if
+    grade is a valid numeric value. the student, course and enrollment are
+    checked in a single query.
+    """
+    if not isinstance(student_id, int) or not isinstance(course_id, int):
+        logger.info("attempted to create grade with invalid ids. sid: %s, cid: %s", student_id, course_id)
         return False
 
     # make sure grade is a non negative number
-    is_numeric = isinstance(grade, int) or isinstance(grade, float)
-    is_positive = grade >= 0 if is_numeric else False
-    logger.info(f"validating grade. numeric: {is_numeric}, positive: {is_positive}, dependents: ok")
-    return is_positive
+    if not _is_valid_grade(grade):
+        return False
+
+    # make sure student and course exist, and that the student is enrolled in the course
+    existing_students, existing_courses = lookup_ids([student_id], [course_id], client, [student_id])
+    return check_grade_dependents([student_id], [course_id], student_id, course_id, existing_students, existing_courses)
 
 
 def validate_grade_modification_params(student_id: int, course_id: int, mod_params: dict, client: MongoClient):
     """
     checks if given modification of a grade is valid with respect to existing students,
-    courses and enrollment.
+    courses and enrollment. the current and new students and courses are checked in a
+    single query.
     """
-    # make sure current student exists
-    existing_student = get_student(student_id, client)
-    if existing_student is None:
-        logger.info(f"attempted to modify grade of non-existing student. sid: {student_id}")
-        return False
-
-    # make sure new student id exists
     new_sid = mod_params.get('student_id', None)
-    if new_sid:
-        new_existing = get_student(new_sid, client)
-        if new_existing is None:
-            logger.info(f"attempted to modify grade to non-existing sudent: sid: {new_sid}")
-            return False
-
-    # make sure current course exists
-    existing_course = get_course(course_id, client)
-    if existing_course is None:
-        logger.info(f"attempted to create grade with non-existing course. cid: {course_id}")
-        return False
-
-    # make sure new course exists and enrollment is sufficient
     new_cid = mod_params.get('course_id', None)
-    if new_cid:
-        new_existing = get_course(new_cid, client)
-        if new_existing is None:
-            logger.info(f"attempted to modify grade to non existing course. cid: {new_cid}")
-            return False
-        # make sure the new student id is enrolled in new course
-        elif new_sid not in new_existing['students']:
-            logger.info(f"attempted to modify grade to student who isn't enrolled in course. sid: {new_sid}, cid: {new_cid}")
-            return False
-        # make sure current student id is enrolled
-        elif student_id not in new_existing['students']:
-            logger.info(f"attempted to modify grade to coure where the student is not enrolled. sid: {student_id}, cid: {new_cid}")
+    if not all(isinstance(i, int) for i in (student_id, course_id, new_sid or 0, new_cid or 0)):
+        logger.info("attempted to modify grade with invalid ids. sid: %s, cid: %s, new sid: %s, new cid: %s",
+                    student_id, course_id, new_sid, new_cid)
+        return False
 
     # make sure grade is a non negative number
     new_grade = mod_params.get('grade', None)
-    if new_grade:
-        is_numeric = isinstance(new_grade, int) or isinstance(new_grade, float)
-        is_positive = new_grade >= 0 if is_numeric else False
-        logger.info(f"validating grade. numeric: {is_numeric}, positive: {is_positive}, dependents: ok")
-        return is_numeric and is_positive
-    else:
-        logger.info(f"attempted to modify grade with invalid value. grade: {new_grade}")
+    if not new_grade:
+        logger.info("attempted to modify grade with invalid value. grade: %s", new_grade)
         return False
+    if not _is_valid_grade(new_grade):
+        return False
+
+    # make sure the students and courses exist, and that the student the grade is moved to is enrolled in its course
+    target_sid, target_cid = new_sid or student_id, new_cid or course_id
+    existing_students, existing_courses = lookup_ids([student_id, new_sid], [course_id, new_cid], client, [target_sid])
+    return check_grade_dependents([student_id, new_sid], [course_id, new_cid], target_sid, target_cid,
+                                  existing_students, existing_courses)
 
 
 # creation functions
 def create_student(id_num: int, first_name: str, last_name: str, email: str, client: MongoClient):
     """
     creates a student document and adds it to the student collection.
-    assumes given parameters are valid. checks if given id exists in the
-    collection. returns the new student if created, None if not.
+    assumes given parameters are valid. the unique index on id_number (see
+    index_utils) rejects an id that is already in use. returns the new student
+    if created, None if not.
     """
-    existing_student = get_student(id_num, client)
-
-    # if id is allready in use, return None
-    if existing_student:
-        logger.info(f"attempted to create existing student with id: {id_num}.")
-        return None
-
-    # otherwise, write to the db
     student_object = {'id_number': id_num, 'first_name': first_name, 'last_name': last_name, 'email': email}
-    _id = client.school.students.insert_one(student_object).inserted_id
+    try:
+        _id = client.school.students.insert_one(student_object).inserted_id
+    except DuplicateKeyError:
+        logger.info("attempted to create existing student with id: %s.", id_num)
+        return None
 
     # add the unique id to the object and return
     student_object['_id'] = str(_id)
-    logger.info(f'writing new student to db. id: {id_num}, _id: {str(_id)}')
+    logger.info("writing new student to db. id: %s, _id: %s", id_num, _id)
     return student_object
 
 
 def create_course(course_id: int, name: str, students: list, client: MongoClient):
     """
-    add a course document with given params to the database.
+    add a course document with given params to the database, and enroll the given
+    students in it. returns None if the course id is already in use.
     """
-    existing_course = get_course(course_id, client)
-    if existing_course:
-        logger.info(f"attempted to create existing course. id: {course_id}")
+    new_course = {'course_id': course_id, 'name': name}
+    try:
+        _id = client.school.courses.insert_one(new_course).inserted_id
+    except DuplicateKeyError:
+        logger.info("attempted to create existing course. id: %s", course_id)
         return None
-
-    # create new course
-    new_course = {'course_id': course_id, 'name': name, 'students': students}
-    _id = client.school.courses.insert_one(new_course).inserted_id
+    insert_enrollments(enrollment_docs(course_id, students), client)
     new_course['_id'] = str(_id)
-    logger.info(f'writing new course to db. id: {course_id}, _id: {str(_id)}')
-    return new_course
+    logger.info("writing new course to db. id: %s, _id: %s, students: %s", course_id, _id, len(students))
+    return {**new_course, 'students': students}
+
+
+def enrollment_docs(course_id: int, student_ids: list):
+    return [{'course_id': course_id, 'student_id': s} for s in dict.fromkeys(student_ids)]
 
 
-def create_grade(student_id: int, course_id: int, grade: int, client: MongoClient):
+def insert_enrollments(enrollments: list, client: MongoClient, session: ClientSession = None):
     """
-    add a grade to the database, returns None if it already exists.
+    insert enrollment documents, skipping the ones that exist already (the unique
+    (course_id, student_id) index rejects them). returns the number inserted.
     """
-    # if grade exists, don't overide
-    existing_grade = get_grade(student_id, course_id, client)
-    if existing_grade:
-        logger.info(f"attempted to create existing grade. sid: {student_id}, cid: {course_id}")
-        return None
+    if len(enrollments) == 0:
+        return 0
+    try:
+        return len(client.school.enrollments.insert_many(enrollments, ordered=False, session=session).inserted_ids)
+    except BulkWriteError as e:
+        if any(error['code'] != DUPLICATE_KEY for error in e.details['writeErrors']):
+            raise
+        return e.details['nInserted']
 
-    # create new grade
-    new_grade = {'course_id': course_id, 'student_id': student_id, 'grade': grade}
-    _id = client.school.grades.insert_one(new_grade).inserted_id
-    new_grade['_id'] = str(_id)
-    logger.info(f"created new grade. sid: {student_id}, cid: {course_id}, grade: {grade}")
-    return new_grade
+
+def _apply_grade_delta(student_id: int, course_id: int, grade_sum, grade_count: int, client: MongoClient, r: Redis,
+                       effects, session: ClientSession = None):
+    """
+    add a grade delta to the aggregates, unless the change stream consumer does. in a
+    transaction the leaderboards are refreshed once it commits (see _transaction),
+    otherwise right away.
+    """
+    if change_stream_utils.enabled():
+        return
+    if session is None:
+        stats_utils.apply_grade_delta(student_id, course_id, grade_sum, grade_count, client, r)
+        return
+    stats_utils.apply_grade_delta(student_id, course_id, grade_sum, grade_count, client, session=session)
+    effects.students.add(student_id)
+    effects.courses.add(course_id)
+    return
 
 
-# update functions
-def update_student(id_num: int, new_params: dict, client: MongoClient):
+def create_grade(student_id: int, course_id: int, grade: int, client: MongoClient, r: Redis = None, atomic: bool = False):
     """
-    update the student with the given id numbers with the given params. returns
-    updated student if exists, None otherwise.
+    add a grade to the database, returns None if it already exists. if atomic, the
+    grade and its aggregates are written in one transaction.
     """
-    required_student = get_student(id_num, client)
-    # if student doesn't exist, no update
-    if required_student is None:
-        logger.info(f"attempted to update non-existing student. id: {id_num}")
+    def write(session, effects):
+        new_grade = {'course_id': course_id, 'student_id': student_id, 'grade': grade}
+        new_grade['_id'] = client.school.grades.insert_one(new_grade, session=session).inserted_id
+        _apply_grade_delta(student_id, course_id, grade, 1, client, r, effects, session)
+        return new_grade
+
+    # the unique (course_id, student_id) index keeps an existing grade from being overridden
+    try:
+        new_grade = _transaction(write, client, r, atomic)
+    except DuplicateKeyError:
+        logger.info("attempted to create existing grade. sid: %s, cid: %s", student_id, course_id)
         return None
+    new_grade['_id'] = str(new_grade['_id'])
+    logger.info("created new grade. sid: %s, cid: %s, grade: %s", student_id, course_id, grade)
+    return new_grade
 
-    # update the student with the new values
-    student_filter = {'id_number': id_num}
-    new_values = {"$set": {**required_student, **new_params}}
-    client.school.students.update_one(student_filter, new_values)
-    new_student = {k: v for k, v in new_values['$set'].items()}
 
-    # update course enrollment and grades with new id if necessary
-    if 'id_number' in new_params and new_params['id_number'] != id_num:
-        mod_courses = update_all_student_courses(id_num, new_params['id_number'], client)
-        mod_grades = update_all_student_grades(id_num, new_params['id_number'], client)
-        logger.info(f"updating student id from {id_num} to {new_params['id_number']}. mod courses: {mod_courses}, mod grades: {mod_grades}")
-    logger.info(f"updated existing student: {id_num}")
-    return new_student
+def enroll_student(course_id: int, student_id: int, client: MongoClient):
+    """
+    enroll a student in a course, returns False if he is enrolled already.
+    assumes both exist.
+    """
+    try:
+        client.school.enrollments.insert_one({'course_id': course_id, 'student_id': student_id})
+    except DuplicateKeyError:
+        logger.info("attempted to enroll student who is enrolled already. sid: %s, cid: %s", student_id, course_id)
+        return False
+    logger.info("enrolled student. sid: %s, cid: %s", student_id, course_id)
+    return True
 
 
-def update_course(course_id: int, new_params: dict, client: MongoClient):
+class CascadeEffects:
     """
-    update the course with given id with the given params, overwrite existing
-    values.
+    the redis updates due after a cascade of writes: the students and courses whose
+    aggregates changed, and the keys of the cached documents it made stale.
     """
-    required_course = get_course(course_id, client)
-    if required_course is None:
-        logger.info(f"attempted to update non-existing course. cid: {course_id}")
-        return None
 
-    # update course with new params
-    course_filter = {'course_id': course_id}
-    new_values = {"$set": {**required_course, **new_params}}
-    client.school.courses.update_one(course_filter, new_values)
-    new_course = {k: v for k, v in new_values['$set'].items()}
+    def __init__(self):
+        self.students = set()
+        self.courses = set()
+        self.cache_keys = []
 
-    # check if students were removed from the course and delete their grades if necessary
-    removed_students = set(required_course['students']).difference(set(new_params['students']))
-    if len(removed_students) > 0:
-        num_grades_deleted = delete_students_grades_from_course(list(removed_students), course_id, client)
-        logger.info(f"removing grades for students in course: {course_id}, num_deleted: {num_grades_deleted}")
 
-    # check if course id was changed, and update grades if it was
-    num_modified_grades = 0
-    if course_id != new_params['course_id']:
-        num_modified_grades = update_all_course_grades(course_id, new_params['course_id'], client)
-    logger.info(f"updated course. cid: {course_id}, students removed from course: {len(removed_students)}, grades modified: {num_modified_grades}")
-    return new_course
+def _apply_effects(effects: CascadeEffects, client: MongoClient, r: Redis = None):
+    if r is not None and (len(effects.students) > 0 or len(effects.courses) > 0):
+        stats_utils.refresh_leaderboards(list(effects.students), list(effects.courses), client, r)
+    entity_cache.invalidate(effects.cache_keys, r)
+    return
 
 
-def update_grade(student_id: int, course_id: int, new_params: dict, client: MongoClient):
+def _transaction(write, client: MongoClient, r: Redis = None, atomic: bool = False):
     """
-    update the value of a given grade
+    run write(session, effects), a cascade of writes recording the redis updates it
+    makes due in effects. if atomic, the writes run in a single multi-document
+    transaction (mongo has to run as a replica set), retried as a whole on transient
+    errors. otherwise write is called with no session. the leaderboards are updated
+    from the committed aggregates and the cached documents are invalidated only once
+    the writes are done, so neither an aborted attempt nor a reader that refills the
+    cache from the previous document leaves redis out of line with mongo.
     """
-    required_grade = get_grade(student_id, course_id, client)
-    if required_grade is None:
-        logger.info(f"attempted to update non-existing grade. sid: {student_id}, cid: {course_id}")
-        return None
+    def attempt(session):
+        effects = CascadeEffects()
+        return write(session, effects), effects
 
-    grade_filter = {'course_id': course_id, 'student_id': student_id}
-    new_values = {"$set": {**required_grade, **new_params}}
-    client.school.grades.update_one(grade_filter, new_values)
-    new_grade = {k: v for k, v in new_values['$set'].items()}
-    logger.info(f"updating grade. sid: {student_id}, cid: {course_id}")
-    return new_grade
+    if not atomic:
+        result, effects = attempt(None)
+    else:
+        with client.start_session() as session:
+            result, effects = session.with_transaction(attempt)
+    _apply_effects(effects, client, r)
+    return result
 
 
-def update_all_student_courses(student_id: int, new_id: int, client: MongoClient):
+def _cached_ids(collection, field: str, query: dict, session: ClientSession = None):
     """
-    replace the old student id with the new one in all courses
-    where the old student id is enrolled.
+    the values of field in the documents matching query, read before a cascade so
+    the cached copies it makes stale can be invalidated. nothing is read while the
+    entity cache is disabled.
     """
-    db = client.school
-    collection = db.courses
-    students_courses = collection.find({'students': student_id})
-    num_updated = 0
-    for c in students_courses:
-        # replace used
-        current_students = c['students']
-        # remove current id
-        current_students.pop(current_students.index(student_id))
-        # add new id
-        current_students.append(new_id)
-        # update course document
-        client.school.courses.update_one({'course_id': c['course_id']}, {'$set': {'students': current_students}})
-        num_updated += 1
-    return num_updated
-
-
-def update_all_student_grades(student_id: int, new_id: int, client: MongoClient):
+    if not entity_cache.enabled():
+        return []
+    return collection.distinct(field, query, session=session)
+
+
+# update functions
+def update_student(id_num: int, new_params: dict, client: MongoClient, r: Redis = None, atomic: bool = False):
+    """
+    update the student with the given id numbers with the given params. returns
+    updated student if exists, None otherwise, and False if the new id number is
+    taken by another student. a changed id number is cascaded to the enrollments
+    and grades of the student.
+    """
+    def write(session, effects):
+        # update the student with the new values, getting the previous ones in the same round trip
+        required_student = client.school.students.find_one_and_update({'id_number': id_num}, {'$set': new_params}, session=session)
+        # if student doesn't exist, no update
+        if required_student is None:
+            logger.info("attempted to update non-existing student. id: %s", id_num)
+            return None
+
+        # update course enrollment and grades with new id if necessary
+        new_id = new_params.get('id_number', id_num)
+        if new_id != id_num:
+            mod_courses = update_all_student_courses(id_num, new_id, client, session)
+            mod_grades = update_all_student_grades(id_num, new_id, client, effects, session)
+            logger.info("updating student id from %s to %s. mod courses: %s, mod grades: %s", id_num, new_id, mod_courses, mod_grades)
+        effects.cache_keys += [entity_cache.student_key(id_num), entity_cache.student_key(new_id)]
+        logger.info("updated existing student: %s", id_num)
+        return {**required_student, **new_params}
+
+    # the unique id_number index rejects a rename racing another one to the same id
+    try:
+        return _transaction(write, client, r, atomic)
+    except DuplicateKeyError:
+        logger.info("attempted to update student to an existing id. id: %s, new id: %s", id_num, new_params.get('id_number'))
+        return False
+
+
+def update_course(course_id: int, new_params: dict, client: MongoClient, r: Redis = None, atomic: bool = False):
+    """
+    update the course with given id with the given params, overwrite existing
+    values. a given students list replaces the enrollments of the course. returns
+    None if the course doesn't exist, and False if the new id is taken by another course.
+    """
+    course_params = {k: v for k, v in new_params.items() if k != 'students'}
+
+    def write(session, effects):
+        courses = client.school.courses
+        if len(course_params) > 0:
+            required_course = courses.find_one_and_update({'course_id': course_id}, {'$set': course_params}, session=session)
+        else:
+            required_course = courses.find_one({'course_id': course_id}, session=session)
+        if required_course is None:
+            logger.info("attempted to update non-existing course. cid: %s", course_id)
+            return None
+
+        # replace the enrollments, deleting the grades of the students that were removed
+        num_removed = 0
+        if 'students' in new_params:
+            num_removed = set_course_students(course_id, new_params['students'], client, effects, session)
+
+        # check if course id was changed, and update enrollments and grades if it was
+        num_modified_grades = 0
+        new_id = new_params.get('course_id', course_id)
+        if new_id != course_id:
+            client.school.enrollments.update_many({'course_id': course_id}, {'$set': {'course_id': new_id}}, session=session)
+            num_modified_grades = update_all_course_grades(course_id, new_id, client, effects, session)
+        effects.cache_keys += [entity_cache.course_key(course_id), entity_cache.course_key(new_id)]
+        logger.info("updated course. cid: %s, students removed from course: %s, grades modified: %s", course_id, num_removed, num_modified_grades)
+        return {**required_course, **new_params}
+
+    # the unique course_id index rejects a rename racing another one to the same id
+    try:
+        return _transaction(write, client, r, atomic)
+    except DuplicateKeyError:
+        logger.info("attempted to update course to an existing id. cid: %s, new id: %s", course_id, new_params.get('course_id'))
+        return False
+
+
+def set_course_students(course_id: int, student_ids: list, client: MongoClient, effects: CascadeEffects, session: ClientSession = None):
+    """
+    replace the enrollments of a course with the given students, only the difference
+    is written. the grades of the students that were removed are deleted. returns
+    the number of students removed.
+    """
+    enrollments = client.school.enrollments
+    removed = enrollments.distinct('student_id', {'course_id': course_id, 'student_id': {'$nin': student_ids}}, session=session)
+    if len(removed) > 0:
+        enrollments.delete_many({'course_id': course_id, 'student_id': {'$in': removed}}, session=session)
+        num_grades_deleted = delete_students_grades_from_course(removed, course_id, client, effects, session)
+        logger.info("removing grades for students in course: %s, num_deleted: %s", course_id, num_grades_deleted)
+    insert_enrollments(enrollment_docs(course_id, student_ids), client, session)
+    return len(removed)
+
+
+def update_grade(student_id: int, course_id: int, new_params: dict, client: MongoClient, r: Redis = None, atomic: bool = False):
+    """
+    update the value of a given grade. returns None if it doesn't exist, or if it
+    would be moved onto the student and course of an existing grade. if atomic, the
+    grade and its aggregates are written in one transaction.
+    """
+    def write(session, effects):
+        grade_filter = {'course_id': course_id, 'student_id': student_id}
+        required_grade = client.school.grades.find_one_and_update(grade_filter, {'$set': new_params}, session=session)
+        if required_grade is None:
+            logger.info("attempted to update non-existing grade. sid: %s, cid: %s", student_id, course_id)
+            return None
+        new_grade = {**required_grade, **new_params}
+
+        # keep the running aggregates in line with the new grade
+        new_sid, new_cid = new_grade['student_id'], new_grade['course_id']
+        if new_sid == student_id and new_cid == course_id:
+            if new_grade['grade'] != required_grade['grade']:
+                _apply_grade_delta(student_id, course_id, new_grade['grade'] - required_grade['grade'], 0, client, r, effects, session)
+        else:
+            _apply_grade_delta(student_id, course_id, -required_grade['grade'], -1, client, r, effects, session)
+            _apply_grade_delta(new_sid, new_cid, new_grade['grade'], 1, client, r, effects, session)
+        effects.cache_keys += [entity_cache.grade_key(student_id, course_id), entity_cache.grade_key(new_sid, new_cid)]
+        logger.info("updating grade. sid: %s, cid: %s", student_id, course_id)
+        return new_grade
+
+    # the unique (course_id, student_id) index keeps a grade from being moved onto an existing one
+    try:
+        return _transaction(write, client, r, atomic)
+    except DuplicateKeyError:
+        logger.info("attempted to move grade onto an existing grade. sid: %s, cid: %s, new sid: %s, new cid: %s", student_id, course_id,
+                    new_params.get('student_id', student_id), new_params.get('course_id', course_id))
+        return None
+
+
+def update_all_student_courses(student_id: int, new_id: int, client: MongoClient, session: ClientSession = None):
+    """
+    replace the old student id with the new one in all the enrollments
+    of the student, in a single update.
+    """
+    result = client.school.enrollments.update_many({'student_id': student_id},
+                                                   {'$set': {'student_id': new_id}},
+                                                   session=session)
+    return result.modified_count
+
+
+def update_all_student_grades(student_id: int, new_id: int, client: MongoClient, effects: CascadeEffects, session: ClientSession = None):
     """
     replace the old student id with the new one in all the grade listings
     return the number of grades changed.
@@ -416,155 +673,282 @@ def update_all_student_grades(student_id: int, new_id: int, client: MongoClient)
     db = client.school
     collection = db.grades
     grade_filter = {'student_id': student_id}
-    result = collection.update_many(grade_filter, {'$set': {'student_id': new_id}})
+    course_ids = _cached_ids(collection, 'course_id', grade_filter, session)
+    result = collection.update_many(grade_filter, {'$set': {'student_id': new_id}}, session=session)
+    if not change_stream_utils.enabled():
+        stats_utils.rename_student_stats(student_id, new_id, client, session=session)
+        effects.students.update((student_id, new_id))
+    effects.cache_keys += [entity_cache.grade_key(s, c) for c in course_ids for s in (student_id, new_id)]
     return result.modified_count
 
 
-def update_all_course_grades(course_id: int, new_id: int,  client: MongoClient):
+def update_all_course_grades(course_id: int, new_id: int, client: MongoClient, effects: CascadeEffects, session: ClientSession = None):
     """
     update the course id in all relevant grades with the new id.
     """
     db = client.school
     collection = db.grades
     grade_filter = {'course_id': course_id}
-    result = collection.update_many(grade_filter, {'$set': {'course_id': new_id}})
+    student_ids = _cached_ids(collection, 'student_id', grade_filter, session)
+    result = collection.update_many(grade_filter, {'$set': {'course_id': new_id}}, session=session)
+    if not change_stream_utils.enabled():
+        stats_utils.rename_course_stats(course_id, new_id, client, session=session)
+        effects.courses.update((course_id, new_id))
+    effects.cache_keys += [entity_cache.grade_key(s, c) for s in student_ids for c in (course_id, new_id)]
     return result.modified_count
 
 
 # getter function
-def get_student(id_num: int, client: MongoClient):
+def get_student(id_num: int, client: MongoClient, r: Redis = None, local: bool = True):
     """
     get the student with the given id from the db, return None
-    if it doesn't exist.
+    if it doesn't exist. read through the entity cache.
     """
-    db = client.school
-    collection = db.students
-    required_student = collection.find_one({'id_number': id_num})
-    logger.info(f"getting student with id: {id_num}")
+    collection = client.school.students
+    required_student = entity_cache.get(entity_cache.student_key(id_num),
+                                        lambda: collection.find_one({'id_number': id_num}), r, local)
+    logger.info("getting student with id: %s", id_num)
     return required_student
 
 
-def get_course(course_id: int, client: MongoClient):
+def get_course(course_id: int, client: MongoClient, r: Redis = None, local: bool = True):
+    """
+    get course document object of given course id, read through the entity cache.
+    """
+    logger.info("getting course id: %s", course_id)
+    return entity_cache.get(entity_cache.course_key(course_id),
+                            lambda: client.school.courses.find_one({'course_id': course_id}), r, local)
+
+
+def get_students(id_nums: list, client: MongoClient, r: Redis = None):
+    """
+    get the students with the given ids, in their order, None for the ones that
+    don't exist. the cache misses are read in a single $in query.
+    """
+    def load(missing):
+        return {s['id_number']: s for s in client.school.students.find({'id_number': {'$in': missing}})}
+
+    logger.info("getting students. num ids: %s", len(id_nums))
+    return entity_cache.get_many(id_nums, entity_cache.student_key, load, r)
+
+
+def get_courses(course_ids: list, client: MongoClient, r: Redis = None):
+    """
+    get the courses with the given ids, in their order, None for the ones that
+    don't exist. the cache misses are read in a single $in query.
+    """
+    def load(missing):
+        return {c['course_id']: c for c in client.school.courses.find({'course_id': {'$in': missing}})}
+
+    logger.info("getting courses. num ids: %s", len(course_ids))
+    return entity_cache.get_many(course_ids, entity_cache.course_key, load, r)
+
+
+def _grade_pairs_query(pairs: list):
+    return {'$or': [{'course_id': course_id, 'student_id': student_id} for student_id, course_id in pairs]}
+
+
+def get_grades(pairs: list, client: MongoClient, r: Redis = None):
     """
-    get course document object of given course id
+    get the grades of the given (student_id, course_id) pairs, in their order, None
+    for the ones that don't exist. the cache misses are read in a single query.
     """
-    logger.info(f"getting course id: {course_id}")
-    return client.school.courses.find_one({'course_id': course_id})
+    def load(missing):
+        return {(g['student_id'], g['course_id']): g for g in client.school.grades.find(_grade_pairs_query(missing))}
+
+    logger.info("getting grades. num pairs: %s", len(pairs))
+    return entity_cache.get_many(pairs, lambda p: entity_cache.grade_key(*p), load, r)
 
 
-def get_grade(student_id: int, course_id: int, client: MongoClient):
+def _transcript_pipeline(student_id: int):
     """
-    get the document of a given grade from db
+    the student with his grades, each joined with the name of its course, and his
+    average. grades are looked up on the (student_id, course_id) index and courses on
+    the course_id one.
     """
-    logger.info(f"getting grade. sid: {student_id}, cid: {course_id}")
-    return client.school.grades.find_one({'course_id': course_id, 'student_id': student_id})
+    courses = [{'$lookup': {'from': 'courses', 'localField': 'course_id', 'foreignField': 'course_id', 'as': 'course'}},
+               {'$project': {'_id': 0, 'course_id': 1, 'grade': 1, 'name': {'$first': '$course.name'}}},
+               {'$sort': {'course_id': 1}}]
+    return [{'$match': {'id_number': student_id}},
+            {'$lookup': {'from': 'grades', 'localField': 'id_number', 'foreignField': 'student_id', 'as': 'courses',
+                         'pipeline': courses}},
+            {'$project': {'_id': 0, 'id_number': 1, 'first_name': 1, 'last_name': 1, 'courses': 1,
+                          'average': {'$avg': '$courses.grade'}}}]
+
+
+def get_transcript(student_id: int, client: MongoClient):
+    """
+    the transcript of a student: every course he has a grade in with its name and
+    grade, and his average, in a single aggregation. None if he doesn't exist.
+    """
+    transcript = next(client.school.students.aggregate(_transcript_pipeline(student_id)), None)
+    logger.info("getting transcript. sid: %s, found: %s", student_id, transcript is not None)
+    return transcript
+
+
+def get_course_students(course_id: int, client: MongoClient, after: int = None, limit: int = 100):
+    """
+    a page of the ids of the students enrolled in a course, in ascending order,
+    starting after the given id. served by the (course_id, student_id) index.
+    """
+    query = {'course_id': course_id}
+    if after is not None:
+        query['student_id'] = {'$gt': after}
+    enrollments = client.school.enrollments.find(query, {'_id': 0, 'student_id': 1}).sort('student_id', 1).limit(limit)
+    student_ids = [e['student_id'] for e in enrollments]
+    logger.info("getting course students. cid: %s, after: %s, num: %s", course_id, after, len(student_ids))
+    return student_ids
+
+
+def get_grade(student_id: int, course_id: int, client: MongoClient, r: Redis = None, local: bool = True):
+    """
+    get the document of a given grade from db, read through the entity cache.
+    """
+    logger.info("getting grade. sid: %s, cid: %s", student_id, course_id)
+    return entity_cache.get(entity_cache.grade_key(student_id, course_id),
+                            lambda: client.school.grades.find_one({'course_id': course_id, 'student_id': student_id}), r, local)
 
 
 # deletion functions
-def delete_student(id_num: int, client: MongoClient):
+def delete_student(id_num: int, client: MongoClient, r: Redis = None, atomic: bool = False):
     """
     delete a student with the given id. delete the students grades
     and remove him from any courses he is enrolled in.
     """
-    # check if student exists
-    required_student = get_student(id_num, client)
-    if required_student is None:
-        logger.info(f"attempted to delete non-existing student. id: {id_num}")
-        return False
+    def write(session, effects):
+        # delete the student, if he exists
+        if client.school.students.find_one_and_delete({'id_number': id_num}, {'_id': 1}, session=session) is None:
+            logger.info("attempted to delete non-existing student. id: %s", id_num)
+            return False
 
-    # delete the student
-    client.school.students.delete_one({'id_number': id_num})
+        # delete the student from courses he is enrolled in
+        num_courses_removed = delete_student_from_courses(id_num, client, session)
 
-    # delete the student from courses he is enrolled in
-    num_courses_removed = delete_student_from_courses(id_num, client)
+        # delete the grade that are registered for the student
+        num_grades_removed = delete_all_student_grades(id_num, client, effects, session)
+        effects.cache_keys.append(entity_cache.student_key(id_num))
+        logger.info("deleting existing student. id: %s, mod courses: %s, del grades: %s", id_num, num_courses_removed, num_grades_removed)
+        return True
 
-    # delete the grade that are registered for the student
-    num_grades_removed = delete_all_student_grades(id_num, client)
-    logger.info(f"deleting existing student. id: {id_num}, mod courses: {num_courses_removed}, del grades: {num_grades_removed}")
-    return True
+    return _transaction(write, client, r, atomic)
 
 
-def delete_course(course_id: int, client: MongoClient):
+def delete_course(course_id: int, client: MongoClient, r: Redis = None, atomic: bool = False):
     """
     delete from the db the course with given id.
     """
-    required_course = get_course(course_id, client)
-    if required_course is None:
-        logger.info(f"attempted to delete non-existing course. cid: {course_id}")
-        return False
+    def write(session, effects):
+        if client.school.courses.find_one_and_delete({'course_id': course_id}, {'_id': 1}, session=session) is None:
+            logger.info("attempted to delete non-existing course. cid: %s", course_id)
+            return False
 
-    # delete the course
-    client.school.courses.delete_one({'course_id': course_id})
-    # delete grades associated with the course
-    deleted_grades = delete_all_course_grades(course_id, client)
-    logger.info(f"deleted course. cid: {course_id}, num grades deleted: {deleted_grades}")
-    return True
+        # delete the enrollments and grades associated with the course
+        client.school.enrollments.delete_many({'course_id': course_id}, session=session)
+        deleted_grades = delete_all_course_grades(course_id, client, effects, session)
+        effects.cache_keys.append(entity_cache.course_key(course_id))
+        logger.info("deleted course. cid: %s, num grades deleted: %s", course_id, deleted_grades)
+        return True
+
+    return _transaction(write, client, r, atomic)
 
 
-def delete_grade(student_id: int, course_id: int, client: MongoClient):
+def unenroll_student(course_id: int, student_id: int, client: MongoClient, r: Redis = None, atomic: bool = False):
     """
-    delete the document of a given grade from db
+    remove a student from a course and delete his grade in it. returns False if
+    he isn't enrolled.
     """
-    required_grade = get_grade(student_id, course_id, client)
-    if required_grade:
-        client.school.grades.delete_one({'course_id': course_id, 'student_id': student_id})
-        logger.info(f"deleting grade. sid: {student_id}, cid: {course_id}")
+    def write(session, effects):
+        enrollment = {'course_id': course_id, 'student_id': student_id}
+        if client.school.enrollments.delete_one(enrollment, session=session).deleted_count == 0:
+            logger.info("attempted to unenroll student who isn't enrolled. sid: %s, cid: %s", student_id, course_id)
+            return False
+        num_grades_deleted = delete_students_grades_from_course([student_id], course_id, client, effects, session)
+        logger.info("unenrolled student. sid: %s, cid: %s, del grades: %s", student_id, course_id, num_grades_deleted)
         return True
-    else:
-        logger.info(f"attempted to delete non-existing grade. sid: {student_id}, cid: {course_id}")
-        return False
+
+    return _transaction(write, client, r, atomic)
+
+
+def delete_grade(student_id: int, course_id: int, client: MongoClient, r: Redis = None, atomic: bool = False):
+    """
+    delete the document of a given grade from db. if atomic, the grade and its
+    aggregates are written in one transaction.
+    """
+    def write(session, effects):
+        # the deleted grade is read back from mongo, never from the entity cache
+        grade_filter = {'course_id': course_id, 'student_id': student_id}
+        required_grade = client.school.grades.find_one_and_delete(grade_filter, {'grade': 1}, session=session)
+        if required_grade is None:
+            logger.info("attempted to delete non-existing grade. sid: %s, cid: %s", student_id, course_id)
+            return False
+        _apply_grade_delta(student_id, course_id, -required_grade['grade'], -1, client, r, effects, session)
+        effects.cache_keys.append(entity_cache.grade_key(student_id, course_id))
+        logger.info("deleting grade. sid: %s, cid: %s", student_id, course_id)
+        return True
+
+    return _transaction(write, client, r, atomic)
 
 
-def delete_all_course_grades(course_id: int, client: MongoClient):
+def delete_all_course_grades(course_id: int, client: MongoClient, effects: CascadeEffects, session: ClientSession = None):
     """
     delete all listed grades with given course id, return number of
     documents that were deleted.
     """
-    db = client.school
-    collection = db.grades
-    result = collection.delete_many({'course_id': {'$eq': course_id}})
-    logger.info(f"deleting all grade for course: {course_id}, num_deleted: {result.deleted_count}")
-    return result.deleted_count
+    deleted_count = _delete_grades({'course_id': {'$eq': course_id}}, client, effects, session)
+    logger.info("deleting all grade for course: %s, num_deleted: %s", course_id, deleted_count)
+    return deleted_count
 
 
-def delete_all_student_grades(student_id: int, client: MongoClient):
+def delete_all_student_grades(student_id: int, client: MongoClient, effects: CascadeEffects, session: ClientSession = None):
     """
     delete all grades associated with a given student id, return number
     of documents that were deleted.
     """
-    db = client.school
-    collection = db.grades
-    result = collection.delete_many({'student_id': {'$eq': student_id}})
-    logger.info(f"deleting all grades for student: {student_id}, num_deleted: {result.deleted_count}")
-    return result.deleted_count
+    deleted_count = _delete_grades({'student_id': {'$eq': student_id}}, client, effects, session)
+    logger.info("deleting all grades for student: %s, num_deleted: %s", student_id, deleted_count)
+    return deleted_count
 
 
-def delete_student_from_courses(student_id: int, client: MongoClient):
+def delete_student_from_courses(student_id: int, client: MongoClient, session: ClientSession = None):
     """
-    remove the student from any course that he is in.
+    remove the student from any course that he is in, in a single delete.
     """
-    db = client.school
-    collection = db.courses
-    students_courses = collection.find({'students': student_id})
-    num_deleted = 0
-    for c in students_courses:
-        # replace used
-        current_students = c['students']
-        # remove current id
-        current_students.pop(current_students.index(student_id))
-        # update course document
-        client.school.courses.update_one({'course_id': c['course_id']}, {'$set': {'students': current_students}})
-        num_deleted += 1
-    return num_deleted
-
-
-def delete_students_grades_from_course(student_ids: list, course_id: int, client: MongoClient):
+    result = client.school.enrollments.delete_many({'student_id': student_id}, session=session)
+    return result.deleted_count
+
+
+def delete_students_grades_from_course(student_ids: list, course_id: int, client: MongoClient, effects: CascadeEffects, session: ClientSession = None):
     """
     remove the the grades of the given students in the given course. return the number
     of grades that were deleted.
     """
-    db = client.school
-    collection = db.grades
-    result = collection.delete_many({'course_id': {'$eq': course_id}, 'student_id': {'$in': student_ids}})
-    return result.deleted_count
+    return _delete_grades({'course_id': {'$eq': course_id}, 'student_id': {'$in': student_ids}}, client, effects, session)
 
+
+def _delete_grades(grade_filter: dict, client: MongoClient, effects: CascadeEffects, session: ClientSession = None):
+    """
+    delete the grades matching the filter and remove them from the running
+    aggregates, DELETE_BATCH_SIZE grades at a time, so a cascade never holds all
+    the grades of a course or student in memory or in one command. only the
+    grades that were read are deleted, so a grade written concurrently is never
+    dropped without being accounted for.
+    """
+    cursor = client.school.grades.find(grade_filter, {'student_id': 1, 'course_id': 1, 'grade': 1},
+                                       batch_size=DELETE_BATCH_SIZE, session=session)
+    deleted_count = 0
+    while True:
+        grades = list(itertools.islice(cursor, DELETE_BATCH_SIZE))
+        if len(grades) == 0:
+            return deleted_count
+        deleted_count += _delete_grade_batch(grades, client, effects, session)
+
+
+def _delete_grade_batch(grades: list, client: MongoClient, effects: CascadeEffects, session: ClientSession = None):
+    result = client.school.grades.delete_many({'_id': {'$in': [g['_id'] for g in grades]}}, session=session)
+    if not change_stream_utils.enabled():
+        students, courses = stats_utils.remove_grades_from_stats(grades, client, session=session)
+        effects.students.update(students)
+        effects.courses.update(courses)
+    if entity_cache.enabled():
+        effects.cache_keys += [entity_cache.grade_key(g['student_id'], g['course_id']) for g in grades]
+    return result.deleted_count
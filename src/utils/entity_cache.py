@@ -0,0 +1,318 @@
+from collections import OrderedDict
+from contextvars import ContextVar
+import os
+import threading
+import time
+
+from bson import json_util
+from redis import Redis
+from redis.exceptions import RedisError
+from utils.logging_utils import logging
+
+# read-through cache of student, course and grade documents. a lookup goes through
+# three levels before reaching mongo:
+#   - the memo of the current request, so a request never fetches a document twice.
+#   - an lru of the worker process, with a short ttl. it is only invalidated by writes
+#     of the same process, so other workers may serve a document for up to its ttl
+#     after it changed.
+#   - redis, shared by all workers, invalidated by every write.
+# documents are cached as extended json, every lookup returns a fresh copy with the
+# same types mongo returns. missing documents aren't cached. invalidating a key replaces
+# its redis value with a short lived tombstone, and a document read from mongo is only
+# stored if its key is empty (SET NX), so a reader that loaded a document before a
+# write can't store it over the write's invalidation.
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+# kinds of cached entities, and the prefix of their redis keys
+STUDENT = 'student'
+COURSE = 'course'
+GRADE = 'grade'
+ENTITY_PREFIX = 'entity:'
+
+# redis value of an invalidated key, until it expires nothing is stored under the key
+TOMBSTONE = '-'
+
+_memo = ContextVar('entity_memo', default=None)
+
+
+class LRUCache:
+    """
+    a thread safe lru of serialized values whose entries expire after ttl seconds.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.counters['expirations'] += 1
+                self.counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters['hits'] += 1
+            return value
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def delete(self, keys: list):
+        with self._lock:
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.counters['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _EntityCache:
+    """
+    the configuration and counters of the entity cache of this process.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.redis_ttl = 0
+        self.tombstone_ttl = 0
+        self.local = LRUCache(0, 0)
+        self.counters = {'memo_hits': 0, 'redis_hits': 0, 'redis_misses': 0, 'redis_errors': 0}
+
+
+_cache = _EntityCache()
+
+
+def configure(enabled: bool, max_entries: int, ttl: float, redis_ttl: int, tombstone_ttl: int):
+    """
+    set up the entity cache of this process, it is disabled until configured.
+    """
+    _cache.enabled = enabled
+    _cache.redis_ttl = redis_ttl
+    _cache.tombstone_ttl = tombstone_ttl
+    _cache.local = LRUCache(max_entries, ttl)
+    logger.info("configured entity cache. enabled: %s, max entries: %s, ttl: %s, redis ttl: %s, tombstone ttl: %s",
+                enabled, max_entries, ttl, redis_ttl, tombstone_ttl)
+    return
+
+
+def enabled():
+    return _cache.enabled
+
+
+def redis_ttl():
+    return _cache.redis_ttl
+
+
+def tombstone_ttl():
+    return _cache.tombstone_ttl
+
+
+def start_request():
+    """
+    start the memo of the current request (or task).
+    """
+    _memo.set({})
+
+
+def entity_key(kind: str, *ids):
+    return ENTITY_PREFIX + kind + ':' + ':'.join(str(i) for i in ids)
+
+
+def student_key(id_num: int):
+    return entity_key(STUDENT, id_num)
+
+
+def course_key(course_id: int):
+    return entity_key(COURSE, course_id)
+
+
+def grade_key(student_id: int, course_id: int):
+    return entity_key(GRADE, student_id, course_id)
+
+
+def lookup_cached(key: str, local: bool = True):
+    """
+    the serialized document of key from the request memo or the process lru, None
+    if neither has it.
+    """
+    memo = _memo.get()
+    if memo is not None and key in memo:
+        _cache.counters['memo_hits'] += 1
+        return memo[key]
+    return _cache.local.get(key) if local else None
+
+
+def remember(key: str, value: str):
+    """
+    keep a serialized document in the request memo and the process lru.
+    """
+    memo = _memo.get()
+    if memo is not None:
+        memo[key] = value
+    _cache.local.set(key, value)
+
+
+def from_redis(value):
+    """
+    the serialized document of a redis value, None for a missing or invalidated key.
+    """
+    if value is None or value in (TOMBSTONE, TOMBSTONE.encode()):
+        return None
+    return value
+
+
+def count_redis_lookup(value):
+    _cache.counters['redis_hits' if value is not None else 'redis_misses'] += 1
+
+
+def count_redis_error(error: RedisError):
+    _cache.counters['redis_errors'] += 1
+    logger.info("entity cache redis error. error: %s", error)
+
+
+def forget(keys: list):
+    """
+    drop keys from the request memo and the process lru.
+    """
+    memo = _memo.get()
+    if memo is not None:
+        for key in keys:
+            memo.pop(key, None)
+    _cache.local.delete(keys)
+
+
+def serialize(document: dict):
+    return json_util.dumps(document)
+
+
+def deserialize(value):
+    return json_util.loads(value)
+
+
+def get(key: str, load, r: Redis = None, local: bool = True):
+    """
+    the document of key, read through the cache levels. load() reads it from mongo.
+    pass local=False where a document from another worker's recent write must be
+    seen, e.g. when it is stored in another cache. a redis failure falls back to mongo.
+    """
+    if not _cache.enabled:
+        return load()
+
+    value = lookup_cached(key, local)
+    if value is None and r is not None:
+        try:
+            value = from_redis(r.get(key))
+            count_redis_lookup(value)
+        except RedisError as e:
+            count_redis_error(e)
+    if value is None:
+        document = load()
+        if document is None:
+            return None
+        value = serialize(document)
+        if r is not None:
+            try:
+                r.set(key, value, ex=_cache.redis_ttl, nx=True)
+            except RedisError as e:
+                count_redis_error(e)
+    remember(key, value)
+    return deserialize(value)
+
+
+def get_many(ids: list, key, load, r: Redis = None, local: bool = True):
+    """
+    the documents of the given ids, in their order, None for the ones that don't
+    exist. key(id) is the cache key of an id, and load(ids) reads the documents of
+    the ids missing from every cache level from mongo in one query, returning them
+    keyed by id. redis is read with a single mget and written with a single pipeline.
+    """
+    unique = list(dict.fromkeys(ids))
+    if not _cache.enabled:
+        documents = load(unique)
+        return [documents.get(i) for i in ids]
+
+    values = {i: lookup_cached(key(i), local) for i in unique}
+    missing = [i for i in unique if values[i] is None]
+    if len(missing) > 0 and r is not None:
+        try:
+            for i, value in zip(missing, r.mget([key(i) for i in missing])):
+                values[i] = from_redis(value)
+                count_redis_lookup(values[i])
+        except RedisError as e:
+            count_redis_error(e)
+    missing = [i for i in unique if values[i] is None]
+    if len(missing) > 0:
+        loaded = {i: serialize(document) for i, document in load(missing).items()}
+        if len(loaded) > 0 and r is not None:
+            try:
+                pipe = r.pipeline(transaction=False)
+                for i, value in loaded.items():
+                    pipe.set(key(i), value, ex=_cache.redis_ttl, nx=True)
+                pipe.execute()
+            except RedisError as e:
+                count_redis_error(e)
+        values.update(loaded)
+    for i in unique:
+        if values[i] is not None:
+            remember(key(i), values[i])
+    return [deserialize(values[i]) if values[i] is not None else None for i in ids]
+
+
+def invalidate(keys: list, r: Redis = None):
+    """
+    drop the given keys from all the cache levels, called after every write. their
+    redis values are replaced with tombstones in one round trip. if redis fails, its
+    copies are served until they expire.
+    """
+    if not _cache.enabled or len(keys) == 0:
+        return
+    forget(keys)
+    if r is not None:
+        try:
+            pipe = r.pipeline(transaction=False)
+            for key in keys:
+                pipe.set(key, TOMBSTONE, ex=_cache.tombstone_ttl)
+            pipe.execute()
+        except RedisError as e:
+            count_redis_error(e)
+    return
+
+
+def get_stats():
+    """
+    the counters of this process, with the hit ratio of every level.
+    """
+    local = _cache.local.counters
+    counters = {**_cache.counters, **{f"local_{k}": v for k, v in local.items()}}
+
+    def ratio(hits, misses):
+        return hits / (hits + misses) if hits + misses > 0 else None
+
+    return {'pid': os.getpid(),
+            'enabled': _cache.enabled,
+            'local_size': len(_cache.local),
+            'local_max_entries': _cache.local.max_entries,
+            'local_hit_ratio': ratio(local['hits'], local['misses']),
+            'redis_hit_ratio': ratio(counters['redis_hits'], counters['redis_misses']),
+            'counters': counters}
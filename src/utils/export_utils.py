@@ -0,0 +1,103 @@
+import csv
+import io
+import json
+import zlib
+
+from pymongo import MongoClient
+from utils.logging_utils import logging
+from utils import bulk_utils
+from utils import listing_utils
+
+# streaming export of whole collections as ndjson or csv. documents are read with a
+# server side cursor a batch at a time, and every batch is serialized (and gzipped, if
+# asked) and handed to the response before the next one is read, so memory stays flat
+# however large the collection is.
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+# export formats and their content types
+NDJSON = 'ndjson'
+CSV = 'csv'
+CONTENT_TYPES = {NDJSON: bulk_utils.NDJSON, CSV: 'text/csv'}
+
+# the exported fields of every collection, enrollments are the course rosters
+FIELDS = {**listing_utils.FIELDS, 'enrollments': ('course_id', 'student_id')}
+
+# the integer fields an export can be filtered by
+FILTERS = {**listing_utils.FILTERS, 'enrollments': ('course_id', 'student_id')}
+
+
+def unpack_export_params(collection: str, args):
+    """
+    read the format and filters of an export from the url (or the cli arguments).
+    returns None if the collection, format or a filter is invalid.
+    """
+    if collection not in FIELDS:
+        return None
+    fmt = args.get('format', NDJSON)
+    if fmt not in CONTENT_TYPES:
+        return None
+    try:
+        filters = {f: int(args[f]) for f in FILTERS[collection] if args.get(f) is not None}
+    except ValueError:
+        return None
+    return {'fmt': fmt, 'filters': filters}
+
+
+class ExportWriter:
+    """
+    serializes batches of exported documents to ndjson or csv lines, gzipped on the
+    fly if compress. every call returns the bytes to send next, possibly empty.
+    """
+
+    def __init__(self, fields: tuple, fmt: str, compress: bool):
+        self.fields = fields
+        self.fmt = fmt
+        # wbits=31 writes a gzip container, not a raw zlib stream
+        self._compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def _output(self, data: bytes):
+        return self._compressor.compress(data) if self._compressor is not None else data
+
+    def _csv_rows(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode()
+
+    def start(self):
+        return self._output(self._csv_rows([self.fields])) if self.fmt == CSV else b''
+
+    def write(self, documents: list):
+        if self.fmt == CSV:
+            data = self._csv_rows([d.get(f, '') for f in self.fields] for d in documents)
+        else:
+            data = ''.join(json.dumps(d) + '\n' for d in documents).encode()
+        return self._output(data)
+
+    def finish(self):
+        return self._compressor.flush() if self._compressor is not None else b''
+
+
+def export_cursor(collection, filters: dict, fields: tuple, batch_size: int):
+    """
+    the cursor of an export, it fetches batch_size documents per round trip. the
+    documents are read in natural order, the export doesn't pay for a sort.
+    """
+    return collection.find(filters, {'_id': 0, **{f: 1 for f in fields}}, batch_size=batch_size)
+
+
+def export(collection: str, filters: dict, fmt: str, compress: bool, client: MongoClient, batch_size: int = 1000):
+    """
+    generate the serialized documents of a collection matching the filters, a
+    batch at a time.
+    """
+    fields = FIELDS[collection]
+    writer = ExportWriter(fields, fmt, compress)
+    yield writer.start()
+    exported = 0
+    for batch in bulk_utils.chunks(export_cursor(client.school[collection], filters, fields, batch_size), batch_size):
+        exported += len(batch)
+        yield writer.write(batch)
+    yield writer.finish()
+    logger.info("exported %s. filters: %s, format: %s, compressed: %s, documents: %s", collection, filters, fmt, compress, exported)
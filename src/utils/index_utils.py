@@ -0,0 +1,67 @@
+from pymongo import MongoClient, IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from utils.logging_utils import logging
+from utils.stats_utils import STUDENT_STATS, COURSE_STATS
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+# the indexes every collection of the school db is expected to have, besides _id.
+# the unique ones enforce the ids the app looks documents up by, so the create
+# functions rely on duplicate key errors instead of checking for an existing document.
+INDEXES = {
+    'students': [IndexModel([('id_number', ASCENDING)], unique=True)],
+    'courses': [IndexModel([('course_id', ASCENDING)], unique=True)],
+    'enrollments': [IndexModel([('course_id', ASCENDING), ('student_id', ASCENDING)], unique=True),
+                    IndexModel([('student_id', ASCENDING), ('course_id', ASCENDING)])],
+    'grades': [IndexModel([('course_id', ASCENDING), ('student_id', ASCENDING)], unique=True),
+               IndexModel([('student_id', ASCENDING), ('course_id', ASCENDING)])],
+    STUDENT_STATS: [IndexModel([('avg', DESCENDING), ('_id', ASCENDING)])],
+    COURSE_STATS: [IndexModel([('avg', DESCENDING), ('_id', ASCENDING)])],
+}
+
+
+def _spec(index: dict):
+    """
+    the part of an index description that has to match its declaration. declared
+    keys are a mapping, index_information lists them as (field, direction) pairs.
+    """
+    keys = index['key'].items() if isinstance(index['key'], dict) else index['key']
+    return [(field, direction) for field, direction in keys], bool(index.get('unique', False))
+
+
+def ensure_indexes(client: MongoClient, collections: list = None):
+    """
+    create the declared indexes of the given collections (all by default). creating
+    an existing index is a no-op, so this is safe to run at every startup. an index
+    that can't be built, e.g. a unique one over duplicate data, is logged and reported
+    without failing the others. returns {collection: {index name: error}}.
+    """
+    errors = {}
+    for name in collections or INDEXES:
+        for index in INDEXES[name]:
+            try:
+                client.school[name].create_indexes([index])
+            except OperationFailure as e:
+                errors.setdefault(name, {})[index.document['name']] = str(e)
+                logger.error("failed to create index: %s on %s. error: %s", index.document['name'], name, e)
+    logger.info("ensured indexes. collections: %s, failed: %s", list(collections or INDEXES), errors)
+    return errors
+
+
+def check_indexes(client: MongoClient):
+    """
+    compare the existing indexes to the declared ones. returns a dict of missing,
+    mismatched (same name, different keys or uniqueness) and extra index names per
+    collection, all empty if they match.
+    """
+    report = {}
+    for name, declared in INDEXES.items():
+        existing = client.school[name].index_information()
+        existing.pop('_id_', None)
+        declared = {index.document['name']: index.document for index in declared}
+        report[name] = {'missing': sorted(set(declared) - set(existing)),
+                        'mismatched': sorted(n for n in set(declared) & set(existing)
+                                             if _spec(declared[n]) != _spec(existing[n])),
+                        'extra': sorted(set(existing) - set(declared))}
+    return report
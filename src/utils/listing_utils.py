@@ -0,0 +1,118 @@
+from pymongo import MongoClient
+from utils.logging_utils import logging
+
+# keyset (cursor) pagination of the students, courses and grades collections. a page is
+# read with a range query over the sort keys of the listing, after the sort key values of
+# the last document of the previous page. the query is served by an index starting with
+# the filtered fields followed by the sort keys (see index_utils), so fetching a page costs
+# the same however deep it is. a page is read with one document more than its size, to
+# tell if another page follows. the cursor of the next page is the sort key values of the
+# last listed document, joined by commas, and is only given when another page follows.
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+# the fields of the listed documents, any subset of them can be projected
+FIELDS = {
+    'students': ('id_number', 'first_name', 'last_name', 'email'),
+    'courses': ('course_id', 'name'),
+    'grades': ('course_id', 'student_id', 'grade'),
+}
+
+# the unique key of every collection, the listings are sorted by it
+SORT_KEYS = {
+    'students': ('id_number',),
+    'courses': ('course_id',),
+    'grades': ('course_id', 'student_id'),
+}
+
+# the integer fields a listing can be filtered by
+FILTERS = {
+    'students': (),
+    'courses': (),
+    'grades': ('course_id', 'student_id'),
+}
+
+
+def sort_keys(collection: str, filters: dict):
+    """
+    the keys a listing is sorted and paged by, the unique key of the collection
+    without the fields it is filtered by.
+    """
+    return tuple(k for k in SORT_KEYS[collection] if k not in filters)
+
+
+def _parse_cursor(after: str):
+    return tuple(int(v) for v in after.split(','))
+
+
+def unpack_listing_params(collection: str, args, page_size: int, max_page_size: int):
+    """
+    read the filters, cursor, page size and projected fields of a listing from the
+    url. returns None if any of them is invalid.
+    """
+    try:
+        filters = {f: int(args[f]) for f in FILTERS[collection] if f in args}
+        after = args.get('after', None)
+        after = _parse_cursor(after) if after is not None else None
+        limit = int(args.get('limit', page_size))
+    except ValueError:
+        return None
+    fields = args.get('fields', None)
+    fields = tuple(fields.split(',')) if fields else FIELDS[collection]
+
+    if after is not None and len(after) != len(sort_keys(collection, filters)):
+        return None
+    if not 0 < limit <= max_page_size or not set(fields).issubset(FIELDS[collection]):
+        return None
+    return {'filters': filters, 'after': after, 'limit': limit, 'fields': fields}
+
+
+def listing_query(keys: tuple, filters: dict, after: tuple = None):
+    """
+    the filter of the documents after the cursor, in the order of keys. with compound
+    keys the alternatives are bounded by the first key, so the index scan starts at
+    the cursor instead of the start of the index.
+    """
+    if after is None:
+        return dict(filters)
+    clauses = []
+    for i, key in enumerate(keys):
+        clause = dict(zip(keys[:i], after[:i]))
+        clause[key] = {'$gt': after[i]}
+        clauses.append(clause)
+    if len(clauses) == 1:
+        return {**filters, **clauses[0]}
+    return {**filters, keys[0]: {'$gte': after[0]}, '$or': clauses}
+
+
+def listing_projection(keys: tuple, fields: tuple):
+    """
+    read only the requested fields, and the sort keys the next cursor is made of.
+    """
+    return {'_id': 0, **{f: 1 for f in fields + keys}}
+
+
+def listing_page(documents: list, keys: tuple, limit: int):
+    """
+    the response of a page from up to limit + 1 documents, with the cursor of the next
+    page, None if this is the last one.
+    """
+    next_after = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_after = ','.join(str(documents[-1][k]) for k in keys)
+    return {'items': documents, 'next_after': next_after}
+
+
+def list_page(collection: str, filters: dict, after: tuple, limit: int, fields: tuple, client: MongoClient):
+    """
+    a page of the documents of a collection matching the filters, sorted by its
+    unique key, starting after the given cursor.
+    """
+    keys = sort_keys(collection, filters)
+    cursor = (client.school[collection].find(listing_query(keys, filters, after), listing_projection(keys, fields))
+              .sort([(k, 1) for k in keys]).limit(limit + 1))
+    page = listing_page(list(cursor), keys, limit)
+    logger.info("listing %s. filters: %s, after: %s, listed: %s", collection, filters, after, len(page['items']))
+    return page
@@ -1,11 +1,196 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
+import random
+import time
+
+# logging pipeline of every process. a record is handed to a bounded queue on the thread that
+# logs it, and written to file by a background listener thread, so log io never blocks a request:
+# a record that doesn't fit in the queue is dropped and counted instead of waited for. messages
+# use lazy % formatting, so a record below the level of its logger is never created, and the
+# message of a queued record is formatted by the writer. the level of every module, the output
+# format (text or json lines) and the rate limits and sampling of the hot path modules are read
+# from the logging section of config.yml, see configure.
 
 level_numeric = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50}
-logging.basicConfig(filename="logs/school.log",
-                    filemode='w',
-                    level=level_numeric['INFO'],
-                    format='%(name)s-%(levelname)s-%(asctime)s: %(message)s'
-                    )
+
+TEXT_FORMAT = '%(name)s-%(levelname)s-%(asctime)s: %(message)s'
+TEXT = 'text'
+JSON = 'json'
+
+# arguments that can't change between logging a record and writing it
+IMMUTABLE = (str, int, float, bool, bytes, type(None))
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    formats a record as a json line.
+    """
+
+    def format(self, record):
+        entry = {'time': self.formatTime(record), 'level': record.levelname, 'logger': record.name,
+                 'message': record.getMessage()}
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    queues records for the listener without ever waiting for room in the queue.
+    """
+
+    def __init__(self, records: queue.Queue):
+        super().__init__(records)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # the writer formats the message, unless an argument may change before it is written
+        args = record.args or ()
+        if isinstance(args, dict) or not all(isinstance(arg, IMMUTABLE) for arg in args):
+            record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    lets through up to rate records below WARNING per second, in bursts of up to rate.
+    it takes no lock, so concurrent threads may let a few more through.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class SampleFilter(logging.Filter):
+    """
+    lets through a random fraction of the records below WARNING.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class _Writer:
+    """
+    a queue handler and the listener writing its records with a file handler.
+    """
+
+    def __init__(self, file: str, formatter: logging.Formatter, queue_size: int):
+        # every process appends to the shared file, it is only truncated by the server (server.truncate_log in config.yml)
+        self.file_handler = logging.FileHandler(file, mode='a')
+        self.file_handler.setFormatter(formatter)
+        self.handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+        self.listener = logging.handlers.QueueListener(self.handler.queue, self.file_handler)
+        self.listener.start()
+
+    def stop(self):
+        # writes the queued records before returning
+        self.listener.stop()
+        self.file_handler.close()
+
+
+# the writer of the root logger, and of the loggers with their own file
+_root_writer = None
+_writers = {}
+
+# the filters added by configure, removed when configuring again
+_filters = []
+
+
+def _replace_writer(logger: logging.Logger, writer: _Writer, previous: _Writer):
+    if previous is not None:
+        logger.removeHandler(previous.handler)
+        previous.stop()
+    logger.addHandler(writer.handler)
+    return writer
+
+
+def configure(level: str = 'INFO', format: str = TEXT, file: str = 'logs/school.log', queue_size: int = 10000,
+              levels: dict = None, rate_limits: dict = None, sample_rates: dict = None):
+    """
+    set up the logging of this process. levels maps module (logger) names to their level,
+    rate_limits and sample_rates map them to the records per second and the fraction of
+    records below WARNING they write.
+    """
+    global _root_writer
+    root = logging.getLogger()
+    formatter = JsonFormatter() if format == JSON else logging.Formatter(TEXT_FORMAT)
+    _root_writer = _replace_writer(root, _Writer(file, formatter, queue_size), _root_writer)
+    root.setLevel(level_numeric[level])
+
+    for logger, log_filter in _filters:
+        logger.removeFilter(log_filter)
+    _filters.clear()
+    for name, module_level in (levels or {}).items():
+        logging.getLogger(name).setLevel(level_numeric[module_level])
+    for name, rate in (rate_limits or {}).items():
+        _filters.append((logging.getLogger(name), RateLimitFilter(rate)))
+    for name, rate in (sample_rates or {}).items():
+        _filters.append((logging.getLogger(name), SampleFilter(rate)))
+    for logger, log_filter in _filters:
+        logger.addFilter(log_filter)
+    logging.getLogger(__name__).info("configured logging. level: %s, format: %s, file: %s", level, format, file)
+    return
+
+
+def file_logger(name: str, file: str, queue_size: int = 10000):
+    """
+    a logger writing the bare messages of its records to a file of its own, through its
+    own queue, and not to the log of the process.
+    """
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    _writers[name] = _replace_writer(logger, _Writer(file, logging.Formatter('%(message)s'), queue_size), _writers.get(name))
+    return logger
+
+
+def dropped():
+    """
+    the number of records dropped because a queue was full, exported by the metrics
+    of the api (see metrics_utils).
+    """
+    writers = [_root_writer, *_writers.values()]
+    return sum(writer.handler.dropped for writer in writers if writer is not None)
+
+
+@atexit.register
+def _stop():
+    for writer in [_root_writer, *_writers.values()]:
+        if writer is not None:
+            writer.stop()
+
+
+# until the config is read, log at INFO to the default file
+configure()
 logger = logging.getLogger(__name__)
 logger.info('initializing basic logger.')
-
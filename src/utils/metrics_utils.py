@@ -0,0 +1,233 @@
+import os
+import time
+from contextvars import ContextVar
+
+import redis
+from redis.client import Pipeline
+from pymongo import monitoring
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST,
+                               generate_latest, multiprocess)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from utils import logging_utils
+
+# prometheus metrics of the api: request counts and latencies per route, mongo command
+# latencies per collection and command (from the pymongo command listener), redis command
+# latencies (from the instrumented client below), connection pool usage, the log records
+# dropped by the logging queues, and the hit ratios of the best student and easiest course caches. observing a metric is a few in-memory
+# updates, nothing is sent anywhere on the request path. with several worker processes,
+# PROMETHEUS_MULTIPROC_DIR is set by the server config (see gunicorn.conf.py) and every
+# process writes its metrics to files in it, which a scrape served by any worker sums up.
+# the cache counters already live in redis and are read when scraped.
+
+# content type of the metrics endpoint
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# latency buckets in seconds, commands are expected to take well under a millisecond
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+# label of the requests that matched no route, so unknown urls don't add label values
+UNMATCHED = 'unmatched'
+
+REQUESTS = Counter('school_requests_total', 'requests served, per route.', ['route', 'method', 'status'])
+REQUEST_SECONDS = Histogram('school_request_seconds', 'latency of the requests, per route.', ['route', 'method'],
+                            buckets=LATENCY_BUCKETS)
+MONGO_SECONDS = Histogram('school_mongo_command_seconds', 'latency of the mongo commands.', ['collection', 'command'],
+                          buckets=LATENCY_BUCKETS)
+MONGO_FAILURES = Counter('school_mongo_command_failures_total', 'failed mongo commands.', ['collection', 'command'])
+REDIS_SECONDS = Histogram('school_redis_command_seconds', 'latency of the redis commands, a pipeline counts as one.',
+                          ['command'], buckets=LATENCY_BUCKETS)
+POOL_IN_USE = Gauge('school_pool_connections_in_use', 'connections checked out of the pools.', ['pool'],
+                    multiprocess_mode='livesum')
+POOL_MAX = Gauge('school_pool_connections_max', 'maximal size of the pools.', ['pool'], multiprocess_mode='livesum')
+LOG_DROPPED = Gauge('school_log_records_dropped', 'log records dropped because a logging queue was full.',
+                    multiprocess_mode='livesum')
+
+# start time of the current request
+_request_start = ContextVar('request_start', default=None)
+
+
+def start_request():
+    _request_start.set(time.perf_counter())
+
+
+def observe_request(url_rule, method: str, status: int):
+    """
+    account for a served request, url_rule is the matched rule of the request.
+    """
+    start = _request_start.get()
+    route = url_rule.rule if url_rule is not None else UNMATCHED
+    REQUESTS.labels(route, method, status).inc()
+    LOG_DROPPED.set(logging_utils.dropped())
+    if start is not None:
+        REQUEST_SECONDS.labels(route, method).observe(time.perf_counter() - start)
+    return
+
+
+def _collection(event: monitoring.CommandStartedEvent):
+    # the collection of most commands is the value of the command name, getMore names it apart
+    collection = event.command.get('collection') if event.command_name == 'getMore' else event.command.get(event.command_name)
+    return collection if isinstance(collection, str) else ''
+
+
+class CommandTimer(monitoring.CommandListener):
+    """
+    times the mongo commands, per collection and command.
+    """
+
+    def __init__(self):
+        # collection of every command in flight, keyed by its request id
+        self._collections = {}
+
+    def started(self, event):
+        self._collections[event.request_id] = _collection(event)
+
+    def succeeded(self, event):
+        collection = self._collections.pop(event.request_id, '')
+        MONGO_SECONDS.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self._collections.pop(event.request_id, '')
+        MONGO_SECONDS.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+        MONGO_FAILURES.labels(collection, event.command_name).inc()
+
+
+class PoolTracker(monitoring.ConnectionPoolListener):
+    """
+    tracks the connections checked out of the mongo pools of the process.
+    """
+
+    def connection_checked_out(self, event):
+        POOL_IN_USE.labels('mongo').inc()
+
+    def connection_checked_in(self, event):
+        POOL_IN_USE.labels('mongo').dec()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+
+def mongo_listeners(mongo_config: dict):
+    """
+    the listeners a mongo client is created with, given its config.
+    """
+    POOL_MAX.labels('mongo').inc(mongo_config.get('maxPoolSize', 100))
+    return [CommandTimer(), PoolTracker()]
+
+
+def _command_name(args):
+    name = args[0]
+    return name.decode() if isinstance(name, bytes) else str(name)
+
+
+def _pipeline_name(transaction: bool):
+    return 'MULTI' if transaction else 'PIPELINE'
+
+
+class TimedPipeline(Pipeline):
+
+    def execute(self, raise_on_error: bool = True):
+        start = time.perf_counter()
+        try:
+            return super().execute(raise_on_error)
+        finally:
+            REDIS_SECONDS.labels(_pipeline_name(self.transaction)).observe(time.perf_counter() - start)
+
+
+class TimedRedis(redis.Redis):
+    """
+    redis client timing every command, and every pipeline as a whole.
+    """
+
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            REDIS_SECONDS.labels(_command_name(args)).observe(time.perf_counter() - start)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return TimedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class TrackedConnectionPool(redis.BlockingConnectionPool):
+    """
+    redis connection pool tracking its checked out connections.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        POOL_MAX.labels('redis').inc(self.max_connections)
+
+    def get_connection(self, *args, **kwargs):
+        connection = super().get_connection(*args, **kwargs)
+        POOL_IN_USE.labels('redis').inc()
+        return connection
+
+    def release(self, connection):
+        POOL_IN_USE.labels('redis').dec()
+        return super().release(connection)
+
+
+def cache_metrics(cache_stats: dict):
+    """
+    the metric families of the best student and easiest course caches, out of
+    their counters (see redis_utils.get_cache_stats).
+    """
+    reads = CounterMetricFamily('school_leader_cache_reads', 'reads of the leader caches, per result.', labels=['cache', 'result'])
+    ratios = GaugeMetricFamily('school_leader_cache_hit_ratio', 'hit ratio of the leader caches.', labels=['cache'])
+    for cache, stats in cache_stats.items():
+        if cache == 'warmer':
+            continue
+        for result in ('hits', 'misses', 'stale'):
+            reads.add_metric([cache, result], stats[result])
+        if stats['hit_ratio'] is not None:
+            ratios.add_metric([cache], stats['hit_ratio'])
+    return [reads, ratios]
+
+
+class _Families:
+
+    def __init__(self, families: list):
+        self.families = families
+
+    def collect(self):
+        return self.families
+
+
+def render(cache_stats: dict):
+    """
+    the metrics of all the worker processes and the cache counters, in the
+    prometheus text format.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    caches = CollectorRegistry()
+    caches.register(_Families(cache_metrics(cache_stats)))
+    return generate_latest(registry) + generate_latest(caches)
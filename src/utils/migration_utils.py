@@ -0,0 +1,40 @@
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure
+from utils.logging_utils import logging
+from utils import dbutils
+from utils import bulk_utils
+from utils import index_utils
+
+# one off migrations of the school db, run with manage.py while the api is stopped.
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+# the index over the embedded students arrays, replaced by the enrollments indexes
+EMBEDDED_STUDENTS_INDEX = 'students_1'
+
+
+def migrate_enrollments(client: MongoClient, batch_size: int = 1000):
+    """
+    move the embedded students arrays of the courses to the enrollments collection.
+    the courses are migrated in batches, the enrollments of a batch are inserted
+    before the arrays are removed, so the migration can be interrupted and run
+    again. returns the number of courses and enrollments migrated.
+    """
+    index_utils.ensure_indexes(client, ['enrollments'])
+    courses = client.school.courses
+    migrated = {'courses': 0, 'enrollments': 0}
+    pending = courses.find({'students': {'$exists': True}}, {'course_id': 1, 'students': 1}, batch_size=batch_size)
+    for batch in bulk_utils.chunks(pending, batch_size):
+        enrollments = [e for course in batch for e in dbutils.enrollment_docs(course['course_id'], course['students'])]
+        migrated['enrollments'] += dbutils.insert_enrollments(enrollments, client)
+        courses.update_many({'_id': {'$in': [course['_id'] for course in batch]}}, {'$unset': {'students': ''}})
+        migrated['courses'] += len(batch)
+        logger.info("migrated enrollments of courses. batch: %s, migrated: %s", len(batch), migrated)
+
+    # the students arrays are gone, and so is the need for their index
+    try:
+        courses.drop_index(EMBEDDED_STUDENTS_INDEX)
+    except OperationFailure:
+        pass
+    return migrated
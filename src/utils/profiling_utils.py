@@ -0,0 +1,296 @@
+import functools
+import inspect
+import json
+import queue
+import random
+import time
+from contextvars import ContextVar
+
+from pymongo import MongoClient, monitoring
+from pymongo.errors import PyMongoError
+from utils.logging_utils import logging
+from utils import logging_utils
+from utils import roundtrip_utils
+
+# per-request profiling. the public functions of the instrumented modules (dbutils, stats_utils,
+# redis_utils and their asyncio versions) are wrapped, and a traced request records a tree of
+# spans of their calls, with the duration and the db round trips of every call. a request is
+# traced if it asks for it (the PROFILE_HEADER header or the profile query flag), or is sampled.
+# the spans of a traced request are summarized in its Server-Timing header. every request
+# remembers the slowest of its explainable mongo commands, and a request slower than the
+# configured threshold is written to the slow log as a json line, with its span tree if it
+# was traced and the explain output of its slowest command. the explain and the write are
+# made by a reporter off the request path, so a slow request isn't made slower by them. the
+# wrappers of a request that isn't traced cost a context variable lookup.
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+# the slow requests, one json document per line, written to the configured slow log
+SLOW_LOGGER = 'slow_requests'
+slow_logger = logging.getLogger(SLOW_LOGGER)
+
+# header (or query flag) asking to trace a request, and the header of its summary
+PROFILE_HEADER = 'X-Profile'
+PROFILE_FLAG = 'profile'
+SERVER_TIMING_HEADER = 'Server-Timing'
+
+# commands the explain command accepts, and the fields of a command that explain rejects
+EXPLAINABLE = ('find', 'aggregate', 'count', 'distinct', 'update', 'delete', 'findAndModify')
+SESSION_FIELDS = ('lsid', 'txnNumber', 'startTransaction', 'autocommit', 'readConcern', 'writeConcern')
+
+# marks the wrapped functions, so a module is only instrumented once
+_WRAPPED = '__profiled__'
+
+# slow requests waiting for the reporter, the slow requests that don't fit are dropped
+SLOW_QUEUE_SIZE = 100
+_slow_requests = queue.Queue(SLOW_QUEUE_SIZE)
+
+
+class _Settings:
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 0.0
+        self.slow_threshold = None
+
+
+_settings = _Settings()
+
+
+class Span:
+    __slots__ = ('name', 'start', 'seconds', 'round_trips', 'children')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.round_trips = roundtrip_utils.round_trips()
+        self.children = []
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.start
+        self.round_trips = roundtrip_utils.round_trips() - self.round_trips
+
+    def to_dict(self):
+        return {'name': self.name, 'ms': round(self.seconds * 1000, 3), 'round_trips': self.round_trips,
+                'children': [child.to_dict() for child in self.children]}
+
+
+class Profile:
+    """
+    the profile of a request: its root span, and the slowest of its explainable commands.
+    """
+
+    def __init__(self, traced: bool):
+        self.traced = traced
+        self.root = Span('request')
+        # the explainable commands in flight, keyed by their request id
+        self.commands = {}
+        # (seconds, database, command) of the slowest explainable command
+        self.slowest = None
+
+
+_profile = ContextVar('profile', default=None)
+_span = ContextVar('profile_span', default=None)
+
+
+def configure(enabled: bool, sample_rate: float, slow_threshold: float, slow_log: str):
+    """
+    set up the profiling of this process and its slow log.
+    """
+    _settings.enabled = enabled
+    _settings.sample_rate = sample_rate
+    _settings.slow_threshold = slow_threshold
+    if enabled:
+        logging_utils.file_logger(SLOW_LOGGER, slow_log)
+    logger.info("configured profiling. enabled: %s, sample rate: %s, slow threshold: %s", enabled, sample_rate, slow_threshold)
+    return
+
+
+def enabled():
+    return _settings.enabled
+
+
+def _enter(name: str):
+    span = Span(name)
+    _span.get().children.append(span)
+    return span, _span.set(span)
+
+
+def _exit(span: Span, token):
+    span.finish()
+    _span.reset(token)
+
+
+def _traced():
+    profile = _profile.get()
+    return profile is not None and profile.traced
+
+
+def _wrap(function, name: str):
+    if inspect.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            if not _traced():
+                return await function(*args, **kwargs)
+            span, token = _enter(name)
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                _exit(span, token)
+    else:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _traced():
+                return function(*args, **kwargs)
+            span, token = _enter(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _exit(span, token)
+    setattr(wrapper, _WRAPPED, True)
+    return wrapper
+
+
+def instrument(*modules):
+    """
+    wrap the public functions defined in the given modules. calls made through the
+    module, including the calls between its own functions, are recorded as spans.
+    """
+    for module in modules:
+        short_name = module.__name__.rsplit('.', 1)[-1]
+        for name, function in vars(module).items():
+            if (not inspect.isfunction(function) or name.startswith('_') or function.__module__ != module.__name__
+                    or getattr(function, _WRAPPED, False)):
+                continue
+            setattr(module, name, _wrap(function, f"{short_name}.{name}"))
+    return
+
+
+def start_request(headers, args):
+    """
+    start the profile of the current request, traced if it asks for it or is sampled.
+    """
+    traced = (headers.get(PROFILE_HEADER) == '1' or args.get(PROFILE_FLAG) == '1'
+              or random.random() < _settings.sample_rate)
+    profile = Profile(traced)
+    _profile.set(profile)
+    _span.set(profile.root)
+    return
+
+
+def finish_request():
+    """
+    finish the profile of the current request, None if it wasn't started.
+    """
+    profile = _profile.get()
+    if profile is not None and profile.root.seconds is None:
+        profile.root.finish()
+    return profile
+
+
+def is_slow(profile: Profile):
+    return profile.root.seconds >= _settings.slow_threshold
+
+
+def server_timing(profile: Profile):
+    """
+    the Server-Timing header of a traced request: the total, and the time and round
+    trips of its top level calls, summed by function.
+    """
+    totals = {}
+    for span in profile.root.children:
+        seconds, round_trips, calls = totals.get(span.name, (0, 0, 0))
+        totals[span.name] = (seconds + span.seconds, round_trips + span.round_trips, calls + 1)
+    entries = [f'total;dur={profile.root.seconds * 1000:.3f};desc="round trips: {profile.root.round_trips}"']
+    for name, (seconds, round_trips, calls) in totals.items():
+        entries.append(f'{name};dur={seconds * 1000:.3f};desc="calls: {calls}, round trips: {round_trips}"')
+    return ', '.join(entries)
+
+
+def explain_command(profile: Profile):
+    """
+    the database and the explain command of the slowest explainable command of the
+    request, None if it sent none.
+    """
+    if profile.slowest is None:
+        return None
+    _, database, command = profile.slowest
+    command = {k: v for k, v in command.items() if not k.startswith('$') and k not in SESSION_FIELDS}
+    return database, {'explain': command, 'verbosity': 'queryPlanner'}
+
+
+def explain(profile: Profile, client: MongoClient):
+    """
+    the query plan of the slowest explainable command of the request.
+    """
+    explained = explain_command(profile)
+    if explained is None:
+        return None
+    database, command = explained
+    try:
+        return client[database].command(command).get('queryPlanner')
+    except PyMongoError as e:
+        return {'error': str(e)}
+
+
+def log_slow_request(profile: Profile, method: str, path: str, status: int, plan):
+    slowest = profile.slowest
+    entry = {'time': time.time(), 'method': method, 'path': path, 'status': status,
+             'ms': round(profile.root.seconds * 1000, 3), 'round_trips': profile.root.round_trips,
+             'slowest_command': {'ms': round(slowest[0] * 1000, 3), 'database': slowest[1], 'command': slowest[2]} if slowest else None,
+             'plan': plan,
+             'spans': [span.to_dict() for span in profile.root.children] if profile.traced else None}
+    slow_logger.warning(json.dumps(entry, default=str))
+    return
+
+
+def queue_slow_request(profile: Profile, method: str, path: str, status: int, client: MongoClient):
+    """
+    hand a slow request to the reporter thread, dropping it if the reporter is behind.
+    """
+    try:
+        _slow_requests.put_nowait((profile, method, path, status, client))
+    except queue.Full:
+        logger.info("slow request queue is full, dropped a slow request. path: %s", path)
+    return
+
+
+def report_slow_requests():
+    """
+    explain the queued slow requests and write them to the slow log, runs until the
+    process exits.
+    """
+    while True:
+        profile, method, path, status, client = _slow_requests.get()
+        log_slow_request(profile, method, path, status, explain(profile, client))
+
+
+class SlowestCommandListener(monitoring.CommandListener):
+    """
+    remembers the slowest explainable command of the current request.
+    """
+
+    def started(self, event):
+        profile = _profile.get()
+        if profile is not None and event.command_name in EXPLAINABLE:
+            profile.commands[event.request_id] = (event.database_name, dict(event.command))
+
+    def succeeded(self, event):
+        profile = _profile.get()
+        if profile is None:
+            return
+        command = profile.commands.pop(event.request_id, None)
+        seconds = event.duration_micros / 1e6
+        if command is not None and (profile.slowest is None or seconds > profile.slowest[0]):
+            profile.slowest = (seconds, *command)
+
+    def failed(self, event):
+        profile = _profile.get()
+        if profile is not None:
+            profile.commands.pop(event.request_id, None)
+
+
+# registered on the mongo clients of the app if profiling is enabled, see connection_utils
+listener = SlowestCommandListener()
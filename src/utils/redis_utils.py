@@ -2,68 +2,634 @@ from utils import logging_utils
 import logging
 from redis import Redis
 import json
+import time
+import uuid
 
 # instantiate logger
 logger = logging.getLogger(__name__)
 
+# sorted sets of averages, member is the encoded student / course id (see leaderboard_member)
+# and score is the average. boards of plain ids under the former keys are ignored, and the
+# boards are built again under these keys when a worker starts.
+STUDENT_LEADERBOARD = "leaderboard:v2:students"
+COURSE_LEADERBOARD = "leaderboard:v2:courses"
 
-def setup_caching_struct(r: Redis):
-    # create hash for best student
-    ret1 = r.hset("best_student", "valid", 0)
-    logger.info(f"created hash for best student. num items written: {ret1}")
+# redis lists members of equal score in reverse lexicographic order. a member is the zero
+# padded MEMBER_BASE - id, so among tied averages the smallest id comes first, the way the
+# mongo queries of the leaders break ties (see stats_utils.get_best_student_id), and a
+# plain ZREVRANGE reads the leaders. covers the signed 64 bit ids mongo can store.
+MEMBER_BASE = 2 ** 63 - 1
+MEMBER_WIDTH = 20
 
-    # create hash for easiest course
-    ret2 = r.hset("easiest_course", "valid", 0)
-    logger.info(f"created hash for easiest course. num items written: {ret2}")
+# cached documents of the current leaders, hashes of the leader (as a leaderboard member),
+# its document and the dependency sets it is registered in.
+BEST_STUDENT_KEY = "best_student"
+EASIEST_COURSE_KEY = "easiest_course"
+CACHE_KEYS = (BEST_STUDENT_KEY, EASIEST_COURSE_KEY)
+
+# hit / miss / invalidation counters of a cache key are kept in the hash CACHE_STATS_PREFIX + key
+CACHE_STATS_PREFIX = "cache_stats:"
+
+# sets of the cache keys whose value depends on a given student / course
+DEPENDENCY_PREFIX = "deps:"
+
+# generation of the statistics, incremented and published on STATS_CHANNEL whenever the
+# leaderboards or the cached leaders change. workers cache statistics responses for as
+# long as the generation doesn't change (see stats_cache).
+STATS_GENERATION_KEY = "stats:generation"
+STATS_CHANNEL = "stats:invalidations"
+
+# set while a background refresh of the cached leaders is due, a change while it is set is
+# coalesced into the same refresh. the warmer counters are kept in the hash WARMER_STATS_KEY.
+REFRESH_SCHEDULED_KEY = "warmer:scheduled"
+WARMER_STATS_KEY = "warmer:stats"
+
+# cached grade distribution of a course, tagged with the version of the course grades it
+# was computed from. the version of every course whose grades change is incremented
+# together with the leaderboards, so a distribution is only recomputed after a change.
+COURSE_DISTRIBUTION_PREFIX = "course_distribution:"
+
+# cached transcript of a student, a hash of the transcript document, the version of the
+# student grades it was computed from (incremented with the leaderboards, like the course
+# distribution versions) and the dependency sets of the student and the listed courses.
+TRANSCRIPT_PREFIX = "transcript:"
+
+# bumps the generation and schedules a refresh of the cached leaders.
+_BUMP_GENERATION_LUA = """
+local function bump_generation()
+    local generation = redis.call('INCR', '""" + STATS_GENERATION_KEY + """')
+    redis.call('PUBLISH', '""" + STATS_CHANNEL + """', generation)
+    if redis.call('SET', '""" + REFRESH_SCHEDULED_KEY + """', generation, 'NX') then
+        redis.call('HINCRBY', '""" + WARMER_STATS_KEY + """', 'scheduled', 1)
+    else
+        redis.call('HINCRBY', '""" + WARMER_STATS_KEY + """', 'coalesced', 1)
+    end
+    return generation
+end
+"""
+
+# returns the new statistics generation.
+BUMP_GENERATION_SCRIPT = _BUMP_GENERATION_LUA + """
+return bump_generation()
+"""
+
+# marks a cache entry stale and removes its registrations in dependency sets. the
+# document is kept so it can be served while it is recomputed. counts an invalidation
+# if the entry was fresh.
+_EXPIRE_ENTRY_LUA = """
+local function expire_entry(key, now)
+    local deps = redis.call('HGET', key, 'deps')
+    if not deps then
+        return 0
+    end
+    for dep in string.gmatch(deps, '[^ ]+') do
+        redis.call('SREM', dep, key)
+    end
+    redis.call('HDEL', key, 'deps')
+    redis.call('HSETNX', key, 'stale_since', now)
+    redis.call('HINCRBY', '""" + CACHE_STATS_PREFIX + """' .. key, 'invalidations', 1)
+    return 1
+end
+"""
+
+# KEYS: entry key. ARGV: id, serialized document, dependency set keys.
+SET_ENTRY_SCRIPT = """
+local old = redis.call('HGET', KEYS[1], 'deps')
+if old then
+    for dep in string.gmatch(old, '[^ ]+') do
+        redis.call('SREM', dep, KEYS[1])
+    end
+end
+redis.call('DEL', KEYS[1])
+for i = 3, #ARGV do
+    redis.call('SADD', ARGV[i], KEYS[1])
+end
+redis.call('HSET', KEYS[1], 'id', ARGV[1], 'document', ARGV[2], 'deps', table.concat(ARGV, ' ', 3))
+redis.call('HINCRBY', '""" + CACHE_STATS_PREFIX + """' .. KEYS[1], 'recomputes', 1)
+"""
+
+# KEYS: entry key, version key. ARGV: version, serialized document, ttl, dependency set keys.
+# caches a document computed from the given version, unless the version moved on since.
+# returns 1 if it was cached.
+SET_VERSIONED_ENTRY_SCRIPT = """
+if tonumber(redis.call('GET', KEYS[2]) or '0') ~= tonumber(ARGV[1]) then
+    return 0
+end
+local old = redis.call('HGET', KEYS[1], 'deps')
+if old then
+    for dep in string.gmatch(old, '[^ ]+') do
+        redis.call('SREM', dep, KEYS[1])
+    end
+end
+redis.call('DEL', KEYS[1])
+for i = 4, #ARGV do
+    redis.call('SADD', ARGV[i], KEYS[1])
+end
+redis.call('HSET', KEYS[1], 'version', ARGV[1], 'document', ARGV[2], 'deps', table.concat(ARGV, ' ', 4))
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+# KEYS: dependency set keys. ARGV: now. expires every entry registered in them and bumps
+# the statistics generation, returns the number expired.
+INVALIDATE_DEPENDENTS_SCRIPT = _EXPIRE_ENTRY_LUA + _BUMP_GENERATION_LUA + """
+local expired = 0
+for _, dep in ipairs(KEYS) do
+    for _, key in ipairs(redis.call('SMEMBERS', dep)) do
+        expired = expired + expire_entry(key, ARGV[1])
+    end
+end
+bump_generation()
+return expired
+"""
+
+# KEYS: entry keys. ARGV: now. expires them and bumps the statistics generation, returns
+# the number expired.
+INVALIDATE_ENTRIES_SCRIPT = _EXPIRE_ENTRY_LUA + _BUMP_GENERATION_LUA + """
+local expired = 0
+for _, key in ipairs(KEYS) do
+    expired = expired + expire_entry(key, ARGV[1])
+end
+bump_generation()
+return expired
+"""
+
+# KEYS: leaderboard, entry key. ARGV: now, count. returns {} if the board is empty, {leader}
+# if nothing is cached, {leader, document} on a hit and {leader, document, stale_since}
+# if the entry was invalidated or is of a previous leader, counting the result unless
+# count is '0'. the leader and the id of the entry are leaderboard members.
+GET_LEADER_SCRIPT = """
+local leader = redis.call('ZREVRANGE', KEYS[1], 0, 0)[1]
+local stats = '""" + CACHE_STATS_PREFIX + """' .. KEYS[2]
+local increment = ARGV[2] == '0' and 0 or 1
+local entry = redis.call('HMGET', KEYS[2], 'id', 'document', 'stale_since')
+if not leader or not entry[2] then
+    redis.call('HINCRBY', stats, 'misses', increment)
+    if not leader then
+        return {}
+    end
+    return {leader}
+end
+if entry[1] == leader and not entry[3] then
+    redis.call('HINCRBY', stats, 'hits', increment)
+    return {leader, entry[2]}
+end
+if not entry[3] then
+    entry[3] = ARGV[1]
+    redis.call('HSET', KEYS[2], 'stale_since', ARGV[1])
+end
+redis.call('HINCRBY', stats, 'stale', increment)
+return {leader, entry[2], entry[3]}
+"""
+
+# KEYS: lock key. ARGV: token. releases the lock only if it is still held by the token.
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# prefix of the single flight locks guarding the recompute of a cache key
+LOCK_PREFIX = "lock:"
+
+# seconds between checks for a value recomputed by another worker
+LOCK_POLL_INTERVAL = 0.05
+
+# returns [score, rank, size] of a member, rank counts members with a strictly higher
+# score so tied members share a rank.
+RANK_SCRIPT = """
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not score then
+    return nil
+end
+local higher = redis.call('ZCOUNT', KEYS[1], '(' .. score, '+inf')
+return {score, higher + 1, redis.call('ZCARD', KEYS[1])}
+"""
+
+
+def leaderboard_member(id_num: int):
+    return str(MEMBER_BASE - id_num).zfill(MEMBER_WIDTH)
+
+
+def member_id(member):
+    return MEMBER_BASE - int(member)
+
+
+def leaderboard_scores(scores: dict):
+    """
+    the members and scores to add to a leaderboard for a dict of id -> average.
+    """
+    return {leaderboard_member(k): v for k, v in scores.items()}
+
+
+def setup_caching_struct(r: Redis, stats: dict = None):
+    """
+    invalidate the cached leader documents, and build the leaderboards from the given
+    aggregates (see build_leaderboards) if they don't exist yet.
+    """
+    invalidate_all_caches(r)
+    if stats is not None and not r.exists(STUDENT_LEADERBOARD, COURSE_LEADERBOARD):
+        build_leaderboards(stats, r)
     return
 
 
-def update_best_student_cache(student: dict, r: Redis):
-    student['valid'] = 1
-    r.hmset("best_student", {k: v for k, v in student.items() if k != '_id'})
+def build_leaderboards(stats: dict, r: Redis):
+    """
+    replace both leaderboards with the given averages. stats maps 'students' and
+    'courses' to dicts of id -> average. the boards are built under temporary keys
+    and renamed, so readers never see a partial board.
+    """
+    pipe = r.pipeline(transaction=True)
+    for key, scores in ((STUDENT_LEADERBOARD, stats['students']), (COURSE_LEADERBOARD, stats['courses'])):
+        tmp_key = f"{key}:rebuild"
+        pipe.delete(tmp_key)
+        if len(scores) > 0:
+            pipe.zadd(tmp_key, leaderboard_scores(scores))
+            pipe.rename(tmp_key, key)
+        else:
+            pipe.delete(key)
+    pipe.execute()
+    invalidate_all_caches(r)
+    logger.info("built leaderboards. students: %s, courses: %s", len(stats['students']), len(stats['courses']))
     return
 
 
-def update_easiest_course_cache(course: dict, r: Redis):
-    course['valid'] = 1
-    course['students'] = json.dumps(course['students'])
-    r.hmset("easiest_course", {k: v for k, v in course.items() if k != '_id'})
+def update_leaderboards(student_scores: dict, course_scores: dict, r: Redis):
+    """
+    set the averages of the given students and courses in the leaderboards and bump
+    the statistics generation, the distribution versions of the courses and the
+    transcript versions of the students, in one round trip. an average of None removes the member (no grades are left).
+    """
+    pipe = r.pipeline(transaction=False)
+    for key, scores in ((STUDENT_LEADERBOARD, student_scores), (COURSE_LEADERBOARD, course_scores)):
+        updated = {k: v for k, v in scores.items() if v is not None}
+        removed = [leaderboard_member(k) for k, v in scores.items() if v is None]
+        if len(updated) > 0:
+            pipe.zadd(key, leaderboard_scores(updated))
+        if len(removed) > 0:
+            pipe.zrem(key, *removed)
+    for course_id in course_scores:
+        pipe.incr(distribution_version_key(course_id))
+    for student_id in student_scores:
+        pipe.incr(transcript_version_key(student_id))
+    pipe.eval(BUMP_GENERATION_SCRIPT, 0)
+    pipe.execute()
+    return
+
+
+def rank_top(entries: list):
+    """
+    (id, average, rank) tuples of the (member, score) pairs read from the top of a
+    leaderboard. tied members share the rank of the first of them.
+    """
+    top = []
+    for i, (member, score) in enumerate(entries):
+        rank = top[-1][2] if i > 0 and score == top[-1][1] else i + 1
+        top.append((member_id(member), score, rank))
+    return top
+
+
+def _top(key: str, n: int, r: Redis):
+    """
+    the n highest members of a leaderboard as (id, average, rank) tuples.
+    """
+    return rank_top(r.zrevrange(key, 0, n - 1, withscores=True))
+
+
+def get_top_students(n: int, r: Redis):
+    return [{'student_id': sid, 'average': avg, 'rank': rank} for sid, avg, rank in _top(STUDENT_LEADERBOARD, n, r)]
+
+
+def get_top_courses(n: int, r: Redis):
+    return [{'course_id': cid, 'average': avg, 'rank': rank} for cid, avg, rank in _top(COURSE_LEADERBOARD, n, r)]
+
+
+def _rank(key: str, member: int, r: Redis):
+    result = r.eval(RANK_SCRIPT, 1, key, leaderboard_member(member))
+    if result is None:
+        return None
+    score, rank, size = result
+    return {'average': float(score), 'rank': int(rank), 'out_of': int(size)}
+
+
+def get_student_rank(student_id: int, r: Redis):
+    """
+    average and rank of a student, None if he has no grades.
+    """
+    return _rank(STUDENT_LEADERBOARD, student_id, r)
+
+
+def get_course_rank(course_id: int, r: Redis):
+    """
+    average and rank of a course, None if it has no grades.
+    """
+    return _rank(COURSE_LEADERBOARD, course_id, r)
+
+
+def _get_leader(board_key: str, cache_key: str, r: Redis, count: bool = True):
+    """
+    returns the id of the current leader of the board (None if the board is empty),
+    its cached document (None if nothing is cached) and the time the document went
+    stale (None if it is fresh). the read is counted in the cache stats if count.
+    """
+    result = r.eval(GET_LEADER_SCRIPT, 2, board_key, cache_key, time.time(), int(count))
+    if len(result) == 0:
+        return None, None, None
+    leader_id = member_id(result[0])
+    document = json.loads(result[1]) if len(result) > 1 else None
+    stale_since = float(result[2]) if len(result) > 2 else None
+    return leader_id, document, stale_since
+
+
+def acquire_lock(name: str, timeout: float, r: Redis):
+    """
+    try to take the single flight lock of name, held for at most timeout seconds.
+    returns the lock token, or None if another worker holds it.
+    """
+    token = uuid.uuid4().hex
+    if r.set(LOCK_PREFIX + name, token, nx=True, px=int(timeout * 1000)):
+        return token
+    return None
+
+
+def release_lock(name: str, token: str, r: Redis):
+    r.eval(RELEASE_LOCK_SCRIPT, 1, LOCK_PREFIX + name, token)
     return
 
 
-def invalidate_best_student_cache(r: Redis):
-    r.hset("best_student", "valid", 0)
+def _get_or_recompute(board_key: str, cache_key: str, recompute, update_cache, r: Redis, max_staleness: float, lock_timeout: float):
+    """
+    serve the cached document of a board leader. on a miss only the worker holding
+    the lock of the key recomputes it; the others serve the stale document if it is
+    at most max_staleness seconds old, or wait for the recompute up to lock_timeout.
+    returns the document (None if the board is empty) and its staleness in seconds
+    (None if fresh).
+    """
+    leader_id, document, stale_since = _get_leader(board_key, cache_key, r)
+    if leader_id is None or (document is not None and stale_since is None):
+        return document, None
+
+    deadline = time.time() + lock_timeout
+    while True:
+        token = acquire_lock(cache_key, lock_timeout, r)
+        if token is not None:
+            try:
+                document = recompute(leader_id)
+                update_cache(document, r)
+            finally:
+                release_lock(cache_key, token, r)
+            logger.info("recomputed %s for leader: %s", cache_key, leader_id)
+            return document, None
+
+        # another worker is recomputing, serve the last value while it is recent enough
+        if document is not None and time.time() - stale_since <= max_staleness:
+            return document, time.time() - stale_since
+
+        # nothing to serve, wait for the other worker. if it doesn't finish in time, compute without caching.
+        if time.time() >= deadline:
+            logger.info("timed out waiting for the recompute of %s.", cache_key)
+            return recompute(leader_id), None
+        time.sleep(LOCK_POLL_INTERVAL)
+        leader_id, document, stale_since = _get_leader(board_key, cache_key, r)
+        if leader_id is None or (document is not None and stale_since is None):
+            return document, None
+
+
+def get_best_student(recompute, r: Redis, max_staleness: float, lock_timeout: float):
+    """
+    the document of the best student, see _get_or_recompute. recompute is called
+    with the id of the best student and returns his document.
+    """
+    return _get_or_recompute(STUDENT_LEADERBOARD, BEST_STUDENT_KEY, recompute, update_best_student_cache,
+                             r, max_staleness, lock_timeout)
+
+
+def get_easiest_course(recompute, r: Redis, max_staleness: float, lock_timeout: float):
+    """
+    the document of the easiest course, see _get_or_recompute. recompute is called
+    with the id of the easiest course and returns its document.
+    """
+    return _get_or_recompute(COURSE_LEADERBOARD, EASIEST_COURSE_KEY, recompute, update_easiest_course_cache,
+                             r, max_staleness, lock_timeout)
+
+
+def _refresh(board_key: str, cache_key: str, recompute, update_cache, r: Redis, lock_timeout: float):
+    """
+    recompute the cached document of a board leader if it is stale or missing, unless
+    a reader is already recomputing it. returns True if it was recomputed.
+    """
+    leader_id, document, stale_since = _get_leader(board_key, cache_key, r, count=False)
+    if leader_id is None or (document is not None and stale_since is None):
+        return False
+    token = acquire_lock(cache_key, lock_timeout, r)
+    if token is None:
+        return False
+    try:
+        update_cache(recompute(leader_id), r)
+    finally:
+        release_lock(cache_key, token, r)
+    logger.info("refreshed %s for leader: %s", cache_key, leader_id)
+    return True
+
+
+def refresh_best_student(recompute, r: Redis, lock_timeout: float):
+    return _refresh(STUDENT_LEADERBOARD, BEST_STUDENT_KEY, recompute, update_best_student_cache, r, lock_timeout)
+
+
+def refresh_easiest_course(recompute, r: Redis, lock_timeout: float):
+    return _refresh(COURSE_LEADERBOARD, EASIEST_COURSE_KEY, recompute, update_easiest_course_cache, r, lock_timeout)
+
+
+def claim_refresh(r: Redis):
+    """
+    take the scheduled refresh of the cached leaders, True for exactly one caller
+    per scheduled refresh.
+    """
+    return r.delete(REFRESH_SCHEDULED_KEY) == 1
+
+
+def record_refresh(recomputes: int, seconds: float, r: Redis):
+    """
+    count a refresh run by the warmer, the number of leaders it recomputed and its duration.
+    """
+    pipe = r.pipeline(transaction=False)
+    pipe.hincrby(WARMER_STATS_KEY, 'refreshes', 1)
+    pipe.hincrby(WARMER_STATS_KEY, 'recomputes', recomputes)
+    pipe.hincrbyfloat(WARMER_STATS_KEY, 'refresh_seconds', seconds)
+    pipe.hset(WARMER_STATS_KEY, 'last_refresh_seconds', seconds)
+    pipe.execute()
+    return
+
+
+def dependency_keys(students: list = (), courses: list = ()):
+    return [f"{DEPENDENCY_PREFIX}student:{s}" for s in students] + [f"{DEPENDENCY_PREFIX}course:{c}" for c in courses]
+
+
+def _set_entry(cache_key: str, entry_id: int, document: dict, dependencies: list, r: Redis):
+    r.eval(SET_ENTRY_SCRIPT, 1, cache_key, leaderboard_member(entry_id), json.dumps(document), *dependencies)
+    return
+
+
+def update_best_student_cache(student: dict, r: Redis):
+    """
+    cache the document of the best student, it depends only on that student.
+    """
+    _set_entry(BEST_STUDENT_KEY, student['id_number'], student,
+               dependency_keys(students=[student['id_number']]), r)
     return
 
 
-def invalidate_easiest_course_cache(r: Redis):
-    r.hset("easiest_course", "valid", 0)
+def update_easiest_course_cache(course: dict, r: Redis):
+    """
+    cache the document of the easiest course, it depends on the course and the
+    students listed in it.
+    """
+    _set_entry(EASIEST_COURSE_KEY, course['course_id'], course,
+               dependency_keys(students=course['students'], courses=[course['course_id']]), r)
     return
 
 
+def invalidate_dependents(r: Redis, students: list = (), courses: list = ()):
+    """
+    expire only the cached entries that depend on the given students or courses.
+    changes to grades don't need to invalidate anything, the leaderboards are
+    patched in place and a cached leader is only served while it leads.
+    """
+    dependencies = dependency_keys(students, courses)
+    if len(dependencies) == 0:
+        return 0
+    expired = r.eval(INVALIDATE_DEPENDENTS_SCRIPT, len(dependencies), *dependencies, time.time())
+    logger.info("invalidated %s cache entries depending on num students: %s, num courses: %s", expired, len(students), len(courses))
+    return expired
+
+
 def invalidate_all_caches(r: Redis):
-    invalidate_best_student_cache(r)
-    invalidate_easiest_course_cache(r)
+    r.eval(INVALIDATE_ENTRIES_SCRIPT, len(CACHE_KEYS), *CACHE_KEYS, time.time())
     return
 
 
-def get_best_student_from_cache(r: Redis):
-    cached_student = r.hgetall("best_student")
-    is_valid = int(cached_student[b'valid'].decode('utf-8'))
-    if is_valid:
-        decode_student = {k.decode('utf-8'): v.decode('utf-8') for k,v in cached_student.items()}
-        decode_student.pop("valid")
-        return decode_student
-    else:
+def distribution_key(course_id: int):
+    return f"{COURSE_DISTRIBUTION_PREFIX}{course_id}"
+
+
+def distribution_version_key(course_id: int):
+    return f"{COURSE_DISTRIBUTION_PREFIX}{course_id}:version"
+
+
+def cached_distribution(version, cached):
+    """
+    the cached distribution if it was computed from the current version of the
+    course grades, None otherwise.
+    """
+    if cached is None:
         return None
+    entry = json.loads(cached)
+    return entry['distribution'] if entry['version'] == int(version or 0) else None
+
+
+def get_course_distribution(course_id: int, compute, r: Redis, ttl: int):
+    """
+    the grade distribution of a course, recomputed by compute() only if the grades
+    of the course changed since it was cached. the version is read before computing,
+    so a distribution computed while a grade was written is tagged with the previous
+    version and never served. a course without grades isn't cached.
+    """
+    version, cached = r.mget([distribution_version_key(course_id), distribution_key(course_id)])
+    distribution = cached_distribution(version, cached)
+    if distribution is not None:
+        return distribution
+    distribution = compute()
+    if distribution is not None:
+        r.set(distribution_key(course_id), json.dumps({'version': int(version or 0), 'distribution': distribution}), ex=ttl)
+    return distribution
+
+
+def transcript_key(student_id: int):
+    return f"{TRANSCRIPT_PREFIX}{student_id}"
+
+
+def transcript_version_key(student_id: int):
+    return f"{TRANSCRIPT_PREFIX}{student_id}:version"
+
+
+def cached_transcript(entry: list, version):
+    """
+    the cached transcript out of its hash fields (document, version, stale_since), if
+    it wasn't invalidated and was computed from the current version of the grades.
+    """
+    document, cached_version, stale_since = entry
+    if document is None or stale_since is not None or int(cached_version) != int(version or 0):
+        return None
+    return json.loads(document)
+
+
+def cache_transcript(student_id: int, transcript: dict, version, r: Redis, ttl: int):
+    """
+    cache a transcript computed from the given version of the student grades, it
+    depends on the student and the courses it lists.
+    """
+    dependencies = dependency_keys(students=[student_id], courses=[c['course_id'] for c in transcript['courses']])
+    return r.eval(SET_VERSIONED_ENTRY_SCRIPT, 2, transcript_key(student_id), transcript_version_key(student_id),
+                  int(version or 0), json.dumps(transcript), ttl, *dependencies)
+
+
+def get_transcript(student_id: int, compute, r: Redis, ttl: int):
+    """
+    the transcript of a student, recomputed by compute() only if his grades changed
+    since it was cached, or the student or one of the listed courses was updated (see
+    invalidate_dependents). a transcript computed while a grade of the student was
+    written isn't cached. None if the student doesn't exist.
+    """
+    pipe = r.pipeline(transaction=False)
+    pipe.hmget(transcript_key(student_id), 'document', 'version', 'stale_since')
+    pipe.get(transcript_version_key(student_id))
+    entry, version = pipe.execute()
+    transcript = cached_transcript(entry, version)
+    if transcript is not None:
+        return transcript
+    transcript = compute()
+    if transcript is not None:
+        cache_transcript(student_id, transcript, version, r, ttl)
+    return transcript
+
+
+def get_cache_stats(r: Redis):
+    """
+    hit, miss, stale read, invalidation and recompute counters of every cache key.
+    """
+    pipe = r.pipeline(transaction=False)
+    for key in CACHE_KEYS:
+        pipe.hgetall(CACHE_STATS_PREFIX + key)
+    pipe.hgetall(WARMER_STATS_KEY)
+    return format_cache_stats(pipe.execute())
+
+
+def format_warmer_stats(counters: dict):
+    counters = {k.decode('utf-8'): float(v) for k, v in counters.items()}
+    refreshes = int(counters.get('refreshes', 0))
+    return {'scheduled': int(counters.get('scheduled', 0)),
+            'coalesced': int(counters.get('coalesced', 0)),
+            'refreshes': refreshes,
+            'recomputes': int(counters.get('recomputes', 0)),
+            'last_refresh_seconds': counters.get('last_refresh_seconds'),
+            'mean_refresh_seconds': counters.get('refresh_seconds', 0) / refreshes if refreshes > 0 else None}
 
 
-def get_easiest_course_from_cache(r: Redis):
-    cached_course = r.hgetall("easiest_course")
-    is_valid = int(cached_course[b'valid'].decode('utf-8'))
-    if is_valid:
-        decode_course = {k.decode('utf-8'): v.decode('utf-8') for k, v in cached_course.items() if k.decode('utf-8') != 'valid'}
-        decode_course['students'] = json.loads(decode_course['students'])
-        return decode_course
-    else:
-        return None
\ No newline at end of file
+def format_cache_stats(raw_counters: list):
+    """
+    build the cache stats of CACHE_KEYS and of the warmer out of their raw counter
+    hashes, in the order of CACHE_KEYS followed by the warmer.
+    """
+    stats = {'warmer': format_warmer_stats(raw_counters[len(CACHE_KEYS)])}
+    for key, counters in zip(CACHE_KEYS, raw_counters):
+        counters = {k.decode('utf-8'): int(v) for k, v in counters.items()}
+        hits, misses, stale = counters.get('hits', 0), counters.get('misses', 0), counters.get('stale', 0)
+        reads = hits + misses + stale
+        stats[key] = {'hits': hits,
+                      'misses': misses,
+                      'stale': stale,
+                      'invalidations': counters.get('invalidations', 0),
+                      'recomputes': counters.get('recomputes', 0),
+                      'hit_ratio': hits / reads if reads > 0 else None}
+    return stats
@@ -0,0 +1,44 @@
+from contextvars import ContextVar
+
+from pymongo import monitoring
+
+# counts the commands every request sends to mongo, each command being one round trip.
+# the count lives in a context variable, so concurrent requests (threads of a worker,
+# or tasks of the asyncio server) are counted separately. commands sent outside of a
+# request, e.g. by the bootstrap, aren't counted.
+
+# header reporting the round trips of a request
+ROUND_TRIPS_HEADER = 'X-DB-Round-Trips'
+
+_round_trips = ContextVar('mongo_round_trips', default=None)
+
+
+class RoundTripListener(monitoring.CommandListener):
+
+    def started(self, event):
+        counter = _round_trips.get()
+        if counter is not None:
+            counter[0] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# registered on the mongo clients of the app, see connection_utils
+listener = RoundTripListener()
+
+
+def start_counting():
+    """
+    start counting the round trips of the current request (or task). the counter is
+    shared by the tasks it spawns, so concurrent lookups of a request add up.
+    """
+    _round_trips.set([0])
+
+
+def round_trips():
+    counter = _round_trips.get()
+    return counter[0] if counter is not None else 0
@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+
+from redis import Redis
+from redis.exceptions import RedisError
+from utils.logging_utils import logging
+from utils.entity_cache import LRUCache
+from utils.redis_utils import STATS_GENERATION_KEY, STATS_CHANNEL
+
+# in-process cache of the serialized responses of the statistics endpoints. every change
+# to the leaderboards or to a cached leader bumps the statistics generation in redis and
+# publishes it (see redis_utils). a listener in every worker process follows the published
+# generation, and a response is only served while the generation it was computed in is
+# current, so a cached response costs no network hop. nothing is served while the listener
+# isn't subscribed, and ttl bounds the staleness if a publish is lost.
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+# seconds to wait before subscribing again after a redis error
+RESUBSCRIBE_INTERVAL = 1
+
+
+class _StatsCache:
+    """
+    the configuration, current generation and counters of the stats cache of this process.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.generation = None
+        self.responses = LRUCache(0, 0)
+        self.lock = threading.Lock()
+        self.counters = {'generations': 0, 'disconnects': 0}
+
+
+_cache = _StatsCache()
+
+
+def configure(enabled: bool, max_entries: int, ttl: float):
+    """
+    set up the stats cache of this process. it serves nothing until a listener
+    subscribed to the generation channel.
+    """
+    _cache.enabled = enabled
+    _cache.responses = LRUCache(max_entries, ttl)
+    logger.info("configured stats cache. enabled: %s, max entries: %s, ttl: %s", enabled, max_entries, ttl)
+    return
+
+
+def enabled():
+    return _cache.enabled
+
+
+def generation():
+    """
+    the current statistics generation, None if it isn't known.
+    """
+    return _cache.generation
+
+
+def set_generation(value):
+    """
+    switch to a new generation, dropping the responses of the previous one. None
+    means the generation isn't followed anymore.
+    """
+    with _cache.lock:
+        if value == _cache.generation:
+            return
+        _cache.generation = value
+        _cache.responses.clear()
+        _cache.counters['generations' if value is not None else 'disconnects'] += 1
+    return
+
+
+def handle_message(message: dict):
+    """
+    apply a message of the generation channel. returns True if it is the confirmation
+    of the subscription, after which the current generation has to be read from redis.
+    """
+    if message['type'] == 'subscribe':
+        return True
+    if message['type'] == 'message':
+        set_generation(int(message['data']))
+    return False
+
+
+def lookup(key: str):
+    """
+    the cached response body of key, None if it isn't of the current generation.
+    """
+    current = _cache.generation
+    if current is None:
+        return None
+    entry = _cache.responses.get(key)
+    if entry is None or entry[0] != current:
+        return None
+    return entry[1]
+
+
+def store(key: str, computed_in, body: bytes):
+    """
+    cache a response body computed in the given generation, unless the generation
+    changed in the meantime.
+    """
+    if computed_in is not None and computed_in == _cache.generation:
+        _cache.responses.set(key, (computed_in, body))
+    return
+
+
+def listen(r: Redis):
+    """
+    follow the published statistics generation, run by a daemon thread of every
+    worker process. subscribes again after a redis error.
+    """
+    while True:
+        pubsub = r.pubsub()
+        try:
+            pubsub.subscribe(STATS_CHANNEL)
+            for message in pubsub.listen():
+                if handle_message(message):
+                    # later bumps are received, earlier ones are covered by the current generation
+                    set_generation(int(r.get(STATS_GENERATION_KEY) or 0))
+        except RedisError as e:
+            set_generation(None)
+            logger.info("stats cache lost its subscription, retrying in %s seconds. error: %s", RESUBSCRIBE_INTERVAL, e)
+        finally:
+            pubsub.close()
+        time.sleep(RESUBSCRIBE_INTERVAL)
+
+
+def get_stats():
+    """
+    the counters of the stats cache of this process.
+    """
+    counters = {**_cache.counters, **_cache.responses.counters}
+    reads = counters['hits'] + counters['misses']
+    return {'pid': os.getpid(),
+            'enabled': _cache.enabled,
+            'generation': _cache.generation,
+            'size': len(_cache.responses),
+            'hit_ratio': counters['hits'] / reads if reads > 0 else None,
+            'counters': counters}
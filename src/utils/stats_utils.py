@@ -1,26 +1,245 @@
-from pymongo import MongoClient
+from collections import defaultdict
+
+from pymongo import MongoClient, ReturnDocument, UpdateOne, ReplaceOne, DeleteOne, ASCENDING, DESCENDING
+from pymongo.client_session import ClientSession
+from redis import Redis
 from utils.logging_utils import logging
+from utils import redis_utils
 
 # instantiate logger
 logger = logging.getLogger(__name__)
 
+# collections holding the running grade aggregates, keyed by student / course id
+STUDENT_STATS = 'student_stats'
+COURSE_STATS = 'course_stats'
+
+# relative tolerance used when comparing running averages to recomputed ones
+AVG_TOLERANCE = 1e-9
+
+
+def _delta_pipeline(grade_sum, grade_count):
+    """
+    update pipeline adding the given sum and count to an aggregate document
+    and recomputing its average in the same atomic server side operation.
+    """
+    return [{'$set': {'sum': {'$add': [{'$ifNull': ['$sum', 0]}, grade_sum]},
+                      'count': {'$add': [{'$ifNull': ['$count', 0]}, grade_count]}}},
+            {'$set': {'avg': {'$cond': [{'$gt': ['$count', 0]},
+                                        {'$divide': ['$sum', '$count']},
+                                        None]}}}]
+
+
+def _average_pipeline(field: str):
+    """
+    the full aggregation computing the average grade of every value of field.
+    """
+    return [{"$group": {"_id": f"${field}", "avg": {"$avg": "$grade"}}}]
+
+
+def apply_grade_delta(student_id: int, course_id: int, grade_sum, grade_count: int, client: MongoClient, r: Redis = None,
+                      session: ClientSession = None):
+    """
+    add the given sum and count to the running aggregates of the student and
+    the course. aggregates that drop to zero grades are removed. if a redis
+    client is given, the averages are read again after both writes and written
+    to the leaderboards, so a concurrent write of the same student or course that
+    reaches redis first can't be overwritten by an older average. returns
+    the updated student and course aggregate documents (None if removed).
+    the aggregates are written apart from the grade, so unless the caller runs
+    them in one transaction with it (given its session), a crash in between
+    leaves them off until manage.py rebuild-stats runs.
+    """
+    updated = []
+    for name, key in ((STUDENT_STATS, student_id), (COURSE_STATS, course_id)):
+        collection = client.school[name]
+        doc = collection.find_one_and_update({'_id': key},
+                                             _delta_pipeline(grade_sum, grade_count),
+                                             upsert=True,
+                                             return_document=ReturnDocument.AFTER,
+                                             session=session)
+        if doc['count'] < 0:
+            logger.warning("aggregate dropped below zero grades, run manage.py rebuild-stats. collection: %s, id: %s, count: %s",
+                           name, key, doc['count'])
+        if doc['count'] <= 0:
+            collection.delete_one({'_id': key, 'count': {'$lte': 0}}, session=session)
+            doc = None
+        updated.append(doc)
+    if r is not None:
+        refresh_leaderboards([student_id], [course_id], client, r, session)
+    logger.info("applied grade delta. sid: %s, cid: %s, sum: %s, count: %s", student_id, course_id, grade_sum, grade_count)
+    return updated[0], updated[1]
+
+
+def get_averages(name: str, ids: list, client: MongoClient, session: ClientSession = None):
+    """
+    current averages of the given ids in an aggregate collection, None for ids
+    that have no grades.
+    """
+    found = {d['_id']: d['avg'] for d in client.school[name].find({'_id': {'$in': ids}}, {'avg': 1}, session=session)}
+    return {i: found.get(i) for i in ids}
+
+
+def refresh_leaderboards(students: list, courses: list, client: MongoClient, r: Redis, session: ClientSession = None):
+    """
+    write the current averages of the given students and courses to the leaderboards.
+    """
+    redis_utils.update_leaderboards(get_averages(STUDENT_STATS, students, client, session),
+                                    get_averages(COURSE_STATS, courses, client, session),
+                                    r)
+    return
+
+
+def get_all_averages(client: MongoClient):
+    """
+    averages of every student and course that has grades, as used to build the leaderboards.
+    """
+    return {'students': {d['_id']: d['avg'] for d in client.school[STUDENT_STATS].find({}, {'avg': 1})},
+            'courses': {d['_id']: d['avg'] for d in client.school[COURSE_STATS].find({}, {'avg': 1})}}
+
+
+def _grade_deltas(grades: list, sign: int):
+    """
+    the sum and count to add to the aggregate of every student and course of the
+    given grade documents, negated for removed grades (sign -1).
+    """
+    student_deltas = defaultdict(lambda: [0, 0])
+    course_deltas = defaultdict(lambda: [0, 0])
+    for g in grades:
+        for deltas, key in ((student_deltas, g['student_id']), (course_deltas, g['course_id'])):
+            deltas[key][0] += sign * g['grade']
+            deltas[key][1] += sign
+    return student_deltas, course_deltas
+
+
+def _apply_grades(grades: list, sign: int, client: MongoClient, r: Redis = None, session: ClientSession = None):
+    student_deltas, course_deltas = _grade_deltas(grades, sign)
+    for name, deltas in ((STUDENT_STATS, student_deltas), (COURSE_STATS, course_deltas)):
+        if len(deltas) == 0:
+            continue
+        collection = client.school[name]
+        requests = [UpdateOne({'_id': k}, _delta_pipeline(s, c), upsert=True) for k, (s, c) in deltas.items()]
+        collection.bulk_write(requests, ordered=False, session=session)
+        if sign < 0:
+            collection.delete_many({'_id': {'$in': list(deltas)}, 'count': {'$lte': 0}}, session=session)
+    if r is not None:
+        refresh_leaderboards(list(student_deltas), list(course_deltas), client, r, session)
+    return list(student_deltas), list(course_deltas)
+
+
+def add_grades_to_stats(grades: list, client: MongoClient, r: Redis = None, session: ClientSession = None):
+    """
+    account for a batch of new grade documents in the aggregates, using one bulk
+    write per aggregate collection. returns the touched student and course ids.
+    """
+    students, courses = _apply_grades(grades, 1, client, r, session)
+    logger.info("added %s grades to aggregates. students: %s, courses: %s", len(grades), len(students), len(courses))
+    return students, courses
+
+
+def remove_grades_from_stats(grades: list, client: MongoClient, r: Redis = None, session: ClientSession = None):
+    """
+    account for a batch of removed grade documents in the aggregates, see add_grades_to_stats.
+    """
+    students, courses = _apply_grades(grades, -1, client, r, session)
+    logger.info("removed %s grades from aggregates. students: %s, courses: %s", len(grades), len(students), len(courses))
+    return students, courses
+
+
+def _rename_stats(name: str, old_id: int, new_id: int, client: MongoClient, session: ClientSession = None):
+    collection = client.school[name]
+    old_doc = collection.find_one_and_delete({'_id': old_id}, session=session)
+    if old_doc is None:
+        return None
+    return collection.find_one_and_update({'_id': new_id},
+                                          _delta_pipeline(old_doc['sum'], old_doc['count']),
+                                          upsert=True,
+                                          return_document=ReturnDocument.AFTER,
+                                          session=session)
+
+
+def rename_student_stats(old_id: int, new_id: int, client: MongoClient, session: ClientSession = None):
+    """
+    move the aggregate of a student whose id number changed to the new id. the
+    leaderboards are updated by the caller once the rename is committed.
+    """
+    return _rename_stats(STUDENT_STATS, old_id, new_id, client, session)
+
+
+def rename_course_stats(old_id: int, new_id: int, client: MongoClient, session: ClientSession = None):
+    """
+    move the aggregate of a course whose id changed to the new id, see rename_student_stats.
+    """
+    return _rename_stats(COURSE_STATS, old_id, new_id, client, session)
+
+
+def rebuild_grade_stats(client: MongoClient):
+    """
+    recompute the student and course aggregates from scratch out of the grades
+    collection. each aggregate collection is replaced atomically by $out, which
+    keeps the indexes of an existing collection (see index_utils.ensure_indexes).
+    """
+    for name, field in ((STUDENT_STATS, 'student_id'), (COURSE_STATS, 'course_id')):
+        pipeline = [{"$group": {"_id": f"${field}", "sum": {"$sum": "$grade"}, "count": {"$sum": 1}}},
+                    {"$set": {"avg": {"$divide": ["$sum", "$count"]}}},
+                    {"$out": name}]
+        client.school.grades.aggregate(pipeline)
+    counts = {name: client.school[name].estimated_document_count() for name in (STUDENT_STATS, COURSE_STATS)}
+    logger.info("rebuilt grade aggregates. %s", counts)
+    return counts
+
+
+def recompute_stats(students: list, courses: list, client: MongoClient, r: Redis = None):
+    """
+    recompute the aggregates of the given students and courses out of their grades,
+    and write them to the leaderboards if a redis client is given. unlike applying a
+    delta, it leaves them right whether or not the delta was applied already.
+    """
+    for name, field, ids in ((STUDENT_STATS, 'student_id', students), (COURSE_STATS, 'course_id', courses)):
+        if len(ids) == 0:
+            continue
+        pipeline = [{'$match': {field: {'$in': ids}}},
+                    {'$group': {'_id': f'${field}', 'sum': {'$sum': '$grade'}, 'count': {'$sum': 1}}}]
+        totals = {d['_id']: d for d in client.school.grades.aggregate(pipeline)}
+        requests = [ReplaceOne({'_id': k}, {'sum': d['sum'], 'count': d['count'], 'avg': d['sum'] / d['count']}, upsert=True)
+                    for k, d in totals.items()]
+        requests += [DeleteOne({'_id': k}) for k in ids if k not in totals]
+        client.school[name].bulk_write(requests, ordered=False)
+    if r is not None:
+        refresh_leaderboards(students, courses, client, r)
+    logger.info("recomputed grade aggregates. students: %s, courses: %s", len(students), len(courses))
+    return
+
+
+def check_grade_stats(client: MongoClient):
+    """
+    compare the running aggregates against the full aggregation pipeline over
+    the grades collection. returns a dict of missing, extra and mismatched ids
+    for students and courses, all empty if the aggregates are consistent.
+    """
+    report = {}
+    for name, field in ((STUDENT_STATS, 'student_id'), (COURSE_STATS, 'course_id')):
+        expected = {d['_id']: d['avg'] for d in client.school.grades.aggregate(_average_pipeline(field))}
+        actual = {d['_id']: d['avg'] for d in client.school[name].find({}, {'avg': 1})}
+        mismatched = [k for k in expected.keys() & actual.keys()
+                      if abs(expected[k] - actual[k]) > AVG_TOLERANCE * max(1, abs(expected[k]))]
+        report[name] = {'missing': sorted(expected.keys() - actual.keys()),
+                        'extra': sorted(actual.keys() - expected.keys()),
+                        'mismatched': sorted(mismatched)}
+    logger.info("checked grade aggregates. %s", report)
+    return report
+
 
 def get_easiest_course_id(client: MongoClient):
     """
     returns the course_id of the course with the highest average
     of all the courses in the db.
     """
-    group = {"$group": {"_id": "$course_id", "avg": {"$avg": "$grade"}}}
-    sort = {"$sort": {"avg": -1}}
-    agg_pipe = [group, sort]
-    agg_result = client.school.grades.aggregate(agg_pipe)
-    try:
-        easiest_course = agg_result.next()
-        logger.info(f"returning easiest course: {easiest_course}")
-        return easiest_course['_id']
-    except StopIteration:  # no grades are listed
-        logger.info(f"query for easiest course returned no results.")
+    easiest_course = client.school[COURSE_STATS].find_one({}, sort=[('avg', DESCENDING), ('_id', ASCENDING)])
+    if easiest_course is None:  # no grades are listed
+        logger.info("query for easiest course returned no results.")
         return None
+    logger.info("returning easiest course: %s", easiest_course['_id'])
+    return easiest_course['_id']
 
 
 def get_best_student_id(client: MongoClient):
@@ -29,18 +248,58 @@ def get_best_student_id(client: MongoClient):
     average in the school. if no grades are listed, will return
     None.
     """
-    aggregation_pipeline = [{"$group":
-                                 {"_id": "$student_id", "avg":
-                                     {"$avg": "$grade"}
-                                  }
-                             },
-                            {"$sort":
-                                 {"avg": -1}
-                             }
-                            ]
-    agg_result = client.school.grades.aggregate(aggregation_pipeline)
-    try:
-        best_student = agg_result.next()
-        return best_student['_id']
-    except StopIteration:  # no grades are listed
+    best_student = client.school[STUDENT_STATS].find_one({}, sort=[('avg', DESCENDING), ('_id', ASCENDING)])
+    if best_student is None:  # no grades are listed
         return None
+    return best_student['_id']
+
+
+def _distribution_pipeline(course_id: int, percentiles: list, bins: list):
+    """
+    the summary statistics and the histogram of the grades of a course, in a single
+    aggregation over the (course_id, student_id) index. the median and percentiles
+    are approximated by mongo (7.0 and later). grades below the first bin fall in the
+    bucket from -inf, and the ones from the last bin on in the default bucket.
+    """
+    approximate = {'input': '$grade', 'method': 'approximate'}
+    return [{'$match': {'course_id': course_id}},
+            {'$project': {'_id': 0, 'grade': 1}},
+            {'$facet': {'summary': [{'$group': {'_id': None,
+                                                'count': {'$sum': 1},
+                                                'mean': {'$avg': '$grade'},
+                                                'std': {'$stdDevPop': '$grade'},
+                                                'min': {'$min': '$grade'},
+                                                'max': {'$max': '$grade'},
+                                                'median': {'$median': approximate},
+                                                'percentiles': {'$percentile': {**approximate, 'p': percentiles}}}}],
+                        'histogram': [{'$bucket': {'groupBy': '$grade', 'boundaries': [float('-inf'), *bins], 'default': 'above',
+                                                   'output': {'count': {'$sum': 1}}}}]}}]
+
+
+def format_distribution(course_id: int, result: dict, percentiles: list, bins: list):
+    """
+    the grade distribution of a course out of the result of its aggregation, None
+    if it has no grades. the histogram lists every bucket, the first and the last are
+    open ended.
+    """
+    if result is None or len(result['summary']) == 0:
+        return None
+    summary = result['summary'][0]
+    counts = {bucket['_id']: bucket['count'] for bucket in result['histogram']}
+    histogram = [{'from': None, 'to': bins[0], 'count': counts.get(float('-inf'), 0)}]
+    histogram.extend({'from': low, 'to': high, 'count': counts.get(low, 0)} for low, high in zip(bins, bins[1:]))
+    histogram.append({'from': bins[-1], 'to': None, 'count': counts.get('above', 0)})
+    return {'course_id': course_id,
+            **{k: summary[k] for k in ('count', 'mean', 'median', 'std', 'min', 'max')},
+            'percentiles': {str(p): v for p, v in zip(percentiles, summary['percentiles'])},
+            'histogram': histogram}
+
+
+def get_course_distribution(course_id: int, percentiles: list, bins: list, client: MongoClient):
+    """
+    count, mean, median, standard deviation, min, max, percentiles and histogram of
+    the grades of a course. None if it has no grades.
+    """
+    result = next(client.school.grades.aggregate(_distribution_pipeline(course_id, percentiles, bins)), None)
+    logger.info("computed grade distribution. cid: %s", course_id)
+    return format_distribution(course_id, result, percentiles, bins)
@@ -0,0 +1,179 @@
+import json
+import struct
+import time
+
+from bson import ObjectId
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from redis import Redis
+from redis.exceptions import RedisError, ResponseError
+from utils.logging_utils import logging
+from utils import bulk_utils
+from utils import stats_utils
+from utils import change_stream_utils
+
+# write-behind ingestion of grades. in write-behind mode POST /grades validates a grade,
+# appends it to a redis stream and answers right away with a ticket (the stream entry id).
+# consumers (manage.py drain-grades) read the stream in a consumer group a batch at a time,
+# insert every batch with one unordered insert_many and patch the aggregates and the
+# leaderboards once per batch (see bulk_utils.insert_grades), then record the result of
+# every ticket and acknowledge the batch. entries a crashed consumer read but never
+# acknowledged are reclaimed by another consumer once they were pending for claim_idle
+# seconds. the _id of every grade is derived from its entry id, so when an entry whose
+# grade was inserted right before a crash is processed again, the grade is recognized
+# as its own: it is reported as created, and the aggregates of its student and course
+# are recomputed from the grades, as the crash may have come before or after the
+# batch updated them.
+
+# instantiate logger
+logger = logging.getLogger(__name__)
+
+# the stream of queued grades and the consumer group draining it
+STREAM = 'grades:ingest'
+GROUP = 'grade-writers'
+
+# the status of a ticket is kept as json under TICKET_PREFIX + ticket, for ticket_ttl seconds
+TICKET_PREFIX = 'grades:ticket:'
+QUEUED = 'queued'
+
+# seconds to wait before reading again after a redis or mongo error
+RETRY_INTERVAL = 1
+
+# KEYS: stream. ARGV: serialized grade, ticket key prefix, serialized status, ticket ttl.
+# queues a grade and records its ticket as queued, returns the ticket.
+ENQUEUE_SCRIPT = """
+local ticket = redis.call('XADD', KEYS[1], '*', 'grade', ARGV[1])
+redis.call('SET', ARGV[2] .. ticket, ARGV[3], 'EX', ARGV[4])
+return ticket
+"""
+
+
+def enqueue_args(grade: dict, ticket_ttl: int):
+    return [json.dumps(grade), TICKET_PREFIX, json.dumps({'status': QUEUED}), ticket_ttl]
+
+
+def ticket_key(ticket: str):
+    return TICKET_PREFIX + ticket
+
+
+def enqueue_grade(grade: dict, r: Redis, ticket_ttl: int):
+    """
+    queue a validated grade, returns its ticket.
+    """
+    ticket = r.eval(ENQUEUE_SCRIPT, 1, STREAM, *enqueue_args(grade, ticket_ttl))
+    ticket = ticket.decode() if isinstance(ticket, bytes) else ticket
+    logger.info("queued grade. sid: %s, cid: %s, ticket: %s", grade['student_id'], grade['course_id'], ticket)
+    return ticket
+
+
+def get_ticket(ticket: str, r: Redis):
+    """
+    the status of a ticket, None if it doesn't exist or expired.
+    """
+    status = r.get(ticket_key(ticket))
+    return json.loads(status) if status is not None else None
+
+
+def ensure_group(r: Redis):
+    """
+    create the consumer group, reading the stream from its start, if it doesn't exist.
+    """
+    try:
+        r.xgroup_create(STREAM, GROUP, id='0', mkstream=True)
+    except ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+    return
+
+
+def _parse_entry(fields: dict):
+    try:
+        return json.loads(fields.get(b'grade', fields.get('grade')))
+    except (TypeError, ValueError):
+        return None
+
+
+def grade_id(ticket: str):
+    """
+    the _id of the grade of a stream entry. an entry id is its time in milliseconds and
+    a sequence number, which fill the 12 bytes of an object id that keeps that time.
+    """
+    ms, sequence = (int(part) for part in ticket.split('-'))
+    return ObjectId(struct.pack('>IH', ms // 1000, ms % 1000) + sequence.to_bytes(6, 'big'))
+
+
+def _recover_replayed(ids: list, results: list, client: MongoClient, r: Redis):
+    """
+    report the grades that were inserted by an earlier attempt at their entries as
+    created, and recompute the aggregates of their students and courses.
+    """
+    duplicates = {ids[i]: i for i, result in enumerate(results) if result['status'] == bulk_utils.DUPLICATE}
+    if len(duplicates) == 0:
+        return
+    replayed = list(client.school.grades.find({'_id': {'$in': list(duplicates)}}, {'student_id': 1, 'course_id': 1}))
+    if len(replayed) == 0:
+        return
+    for grade in replayed:
+        results[duplicates[grade['_id']]] = {'status': bulk_utils.CREATED}
+    if not change_stream_utils.enabled():
+        stats_utils.recompute_stats(list({g['student_id'] for g in replayed}), list({g['course_id'] for g in replayed}), client, r)
+    logger.info("recovered grades inserted before a crash. num: %s", len(replayed))
+    return
+
+
+def process(entries: list, client: MongoClient, r: Redis, ticket_ttl: int):
+    """
+    insert a batch of stream entries, record the result of every ticket and
+    acknowledge the batch. entries that were deleted while pending are only
+    acknowledged. processing a batch again has the same effect as processing
+    it once. returns the counts of the results.
+    """
+    entries = [(entry_id, fields) for entry_id, fields in entries if fields]
+    if len(entries) == 0:
+        return {}
+    tickets = [entry_id.decode() if isinstance(entry_id, bytes) else entry_id for entry_id, _ in entries]
+    ids = [grade_id(ticket) for ticket in tickets]
+    results = bulk_utils.insert_grades([_parse_entry(fields) for _, fields in entries], client, r, ids)
+    _recover_replayed(ids, results, client, r)
+
+    pipe = r.pipeline(transaction=False)
+    for ticket, result in zip(tickets, results):
+        pipe.set(ticket_key(ticket), json.dumps(result), ex=ticket_ttl)
+    ids = [entry_id for entry_id, _ in entries]
+    pipe.xack(STREAM, GROUP, *ids)
+    pipe.xdel(STREAM, *ids)
+    pipe.execute()
+
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    logger.info("drained grades. batch: %s, results: %s", len(entries), counts)
+    return counts
+
+
+def _claim(r: Redis, consumer: str, batch_size: int, claim_idle: float):
+    """
+    take over entries that were pending for more than claim_idle seconds.
+    """
+    claimed = r.xautoclaim(STREAM, GROUP, consumer, min_idle_time=int(claim_idle * 1000), start_id='0-0', count=batch_size)
+    return claimed[1]
+
+
+def consume(client: MongoClient, r: Redis, consumer: str, batch_size: int, block: float, claim_idle: float, ticket_ttl: int):
+    """
+    drain the stream as the given consumer of the group, runs until interrupted.
+    reclaimed entries are processed before new ones.
+    """
+    ensure_group(r)
+    logger.info("draining grades. consumer: %s", consumer)
+    while True:
+        try:
+            entries = _claim(r, consumer, batch_size, claim_idle)
+            if len(entries) == 0:
+                response = r.xreadgroup(GROUP, consumer, {STREAM: '>'}, count=batch_size, block=int(block * 1000))
+                entries = [entry for _, stream_entries in response or [] for entry in stream_entries]
+            process(entries, client, r, ticket_ttl)
+        except (RedisError, PyMongoError) as e:
+            # the batch stays pending, and is reclaimed once it was idle for claim_idle seconds
+            logger.error("failed to drain grades, retrying in %s seconds. error: %s", RETRY_INTERVAL, e)
+            time.sleep(RETRY_INTERVAL)